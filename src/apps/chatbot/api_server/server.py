@@ -6,24 +6,42 @@ through OpenAI-compatible endpoints, allowing integration with any client
 that supports the OpenAI API format.
 """
 
+import asyncio
 import json
 import logging
 import os
 import sys
 import time
 import uuid
-from collections.abc import AsyncGenerator
+from collections.abc import AsyncGenerator, Mapping
+from datetime import datetime
 from pathlib import Path
 from typing import Any
 
 import uvicorn
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, Header, HTTPException, Request
 from fastapi.responses import StreamingResponse
 from pydantic import BaseModel, Field
 
 from apps.chatbot import ChatBotAgent, ChatBotResponseHandler, ChatBotSimple
+from apps.chatbot.skills.appointments.appointment_tools import get_appointment_manager
+from apps.chatbot.tools.resource_manager import ResourceManager
 from common.utils import get_package_version, tool_setup
 
+# How long the appointment change stream waits for a change before sending a comment,
+# so proxies don't close the idle connection.
+CHANGE_KEEP_ALIVE_INTERVAL = 15.0
+
+
+def _change_json_default(o: Any) -> Any:
+    """Encode datetimes in change events as ISO 8601 strings, which clients can parse easily."""
+    if isinstance(o, datetime):
+        return o.isoformat()
+    if isinstance(o, Mapping):
+        return dict(o)
+    raise TypeError(f"Object of type {type(o).__name__} is not JSON serializable")
+
+
 # Pydantic models for OpenAI-compatible API
 
 
@@ -187,6 +205,7 @@ class APIServer:  # pylint: disable=too-many-instance-attributes,too-few-public-
                     "chat_completions": "/v1/chat/completions",
                     "models": "/v1/models",
                     "health": "/health",
+                    "appointment_changes": "/v1/appointments/changes",
                 },
             }
 
@@ -213,6 +232,29 @@ class APIServer:  # pylint: disable=too-many-instance-attributes,too-few-public-
                 ],
             )
 
+        @self.app.get("/v1/appointments/changes")
+        async def stream_appointment_changes(
+            request: Request,
+            cursor: str = "",
+            follow: bool = True,
+            last_event_id: str = Header(default=""),
+        ):
+            """
+            Stream the changes to the appointments as Server-Sent Events, one per change, with the
+            kind of change ("create", "change", "cancel", or "remove") as the event name and the
+            event's cursor as its id, so a reconnecting client resumes after the last event it
+            received, using the `Last-Event-ID` header. Without a cursor, the stream starts with
+            the next change. A "reset" event means the client must read all the appointments
+            again. With `follow=false`, the stream ends after the changes already made.
+            """
+            if self.logger:
+                self.logger.info("GET /v1/appointments/changes called")
+            return StreamingResponse(
+                self._stream_changes(request, get_appointment_manager(), last_event_id or cursor, follow),
+                media_type="text/event-stream",
+                headers={"Cache-Control": "no-cache"},
+            )
+
         @self.app.post("/v1/chat/completions")
         async def create_chat_completion(request: ChatCompletionRequest):
             """
@@ -347,6 +389,33 @@ class APIServer:  # pylint: disable=too-many-instance-attributes,too-few-public-
         yield f"data: {final_chunk.model_dump_json()}\n\n"
         yield "data: [DONE]\n\n"
 
+    async def _stream_changes(
+        self, request: Request, manager: ResourceManager, cursor: str, follow: bool
+    ) -> AsyncGenerator[str]:
+        """
+        Stream the changes after the cursor as Server-Sent Events. The changes made by other
+        processes sharing the storage are applied before each read, and the stream waits for the
+        next change on the event loop, so idle subscribers don't hold the default executor's threads.
+        """
+        feed = manager.changes
+        if not cursor:
+            cursor = feed.latest_cursor()
+            yield f"id: {cursor}\nevent: ready\ndata: {{}}\n\n"
+        timeout = CHANGE_KEEP_ALIVE_INTERVAL if follow else 0.0
+        while not await request.is_disconnected():
+            await asyncio.to_thread(manager.refresh)
+            events, cursor, reset = await feed.read_async(cursor, timeout=timeout)
+            if reset:
+                yield f"id: {cursor}\nevent: reset\ndata: {{}}\n\n"
+            for event in events:
+                yield f"id: {event.cursor}\nevent: {event.kind}\ndata: {json.dumps(event.to_dict(), default=_change_json_default)}\n\n"
+            if events or reset:
+                continue
+            if not follow:
+                return
+            # No change within the keep-alive interval.
+            yield ": keep-alive\n\n"
+
     def run(self):
         """Run the API server."""
         if self.logger:
@@ -7,11 +7,14 @@ from .appointment_tools import (
     cancel_appointment,
     change_appointment,
     create_appointment,
+    find_available_slots,
+    find_patient_names,
     get_appointment_by_id,
     get_appointment_id_for_name_and_date_time,
     get_appointment_manager,
     get_appointments,
     get_appointments_count,
+    get_providers,
 )
 
 __all__ = [
@@ -19,9 +22,12 @@ __all__ = [
     "cancel_appointment",
     "change_appointment",
     "create_appointment",
+    "find_available_slots",
+    "find_patient_names",
     "get_appointment_by_id",
     "get_appointment_id_for_name_and_date_time",
     "get_appointment_manager",
     "get_appointments",
     "get_appointments_count",
+    "get_providers",
 ]
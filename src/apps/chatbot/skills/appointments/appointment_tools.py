@@ -4,15 +4,16 @@ These tools are used by the Deep Agent's appointment skill.
 """
 
 import logging
+import os
 from collections.abc import MutableMapping, Sequence
-from datetime import datetime
+from datetime import datetime, timedelta
 from pathlib import Path
 from typing import Any
 
 from langchain_core.tools import tool
 
 from apps.chatbot.tools.appointment_manager import AppointmentManager
-from common.date_time_utils import now
+from common.date_time_utils import add_timezone, now
 
 
 class AppointmentManagerTool:  # pylint: disable=too-few-public-methods
@@ -23,6 +24,14 @@ class AppointmentManagerTool:  # pylint: disable=too-few-public-methods
     def_appointments_file = Path("../output/appointments.jsonl")
     def_appointment_manager_logger = logging.getLogger("AppointmentManager")
     def_appointment_manager_logger.setLevel(logging.INFO)
+    # Several processes, e.g., API server workers and the MCP server, may share the file,
+    # so each manager catches up with the others' changes before using its appointments.
+    # File locking isn't supported on Windows.
+    def_storage_options: dict[str, Any] = {"cross_process": os.name == "posix"}  # noqa: RUF012
+    # Restarts, e.g., of the API server, load a snapshot and read just the records written after it.
+    def_snapshot_interval: int = 1000
+    # The providers, e.g., clinicians, with their own calendars. If empty, there is one calendar.
+    def_providers: tuple[str, ...] = ()
     appointment_manager: AppointmentManager
     appointment_manager_initialized: bool = False
 
@@ -62,7 +71,13 @@ def get_appointment_manager(
     if not logger:
         logger = AppointmentManagerTool.def_appointment_manager_logger  # assign the default logger
 
-    AppointmentManagerTool.appointment_manager = AppointmentManager(appointments_file=fp, logger=logger)
+    AppointmentManagerTool.appointment_manager = AppointmentManager(
+        appointments_file=fp,
+        logger=logger,
+        storage_options=AppointmentManagerTool.def_storage_options,
+        snapshot_interval=AppointmentManagerTool.def_snapshot_interval,
+        providers=AppointmentManagerTool.def_providers,
+    )
     logger.info(
         "Created a new AppointmentManager (existing appointment count: %d)",
         AppointmentManagerTool.appointment_manager.get_appointments_count(),
@@ -81,7 +96,14 @@ def get_appointment_manager(
 
 
 @tool
-def create_appointment(patient_name: str, appointment_date_time: str, reason: str) -> tuple[str, str]:
+def create_appointment(  # pylint: disable=too-many-arguments,too-many-positional-arguments
+    patient_name: str,
+    appointment_date_time: str,
+    reason: str,
+    idempotency_key: str = "",
+    duration_minutes: int = 0,
+    provider: str = "",
+) -> tuple[str, str]:
     """
     Create a new appointment for a patient.
 
@@ -89,6 +111,12 @@ def create_appointment(patient_name: str, appointment_date_time: str, reason: st
         - patient_name (str): Name of the patient
         - appointment_date_time (str): ISO format datetime string (e.g., "2026-04-15T10:00:00")
         - reason (str): Reason for the appointment
+        - idempotency_key (str): Optional unique key for this booking request. If you retry
+          the same request, e.g., after a timeout, pass the same key, so it isn't booked twice.
+        - duration_minutes (int): Optional length of the appointment in minutes. If 0, the
+          default length, one hour, is used.
+        - provider (str): Optional name of the provider, e.g., the clinician, for the appointment.
+          If empty, the first provider who is free at that time is assigned.
 
     Returns:
         A tuple with the ID for the newly-created appointment and a success message,
@@ -99,7 +127,7 @@ def create_appointment(patient_name: str, appointment_date_time: str, reason: st
     """
     appt_dt = datetime.fromisoformat(appointment_date_time)
     am = get_appointment_manager()
-    return am.create_appointment(patient_name, appt_dt, reason)
+    return am.create_appointment(patient_name, appt_dt, reason, idempotency_key, duration_minutes or None, provider)
 
 
 @tool
@@ -123,15 +151,16 @@ def cancel_appointment(appointment_id: str) -> tuple[bool, str]:
 
 
 @tool
-def change_appointment(appointment_id: str, new_date_time: str) -> tuple[bool, str]:
+def change_appointment(appointment_id: str, new_date_time: str, provider: str = "") -> tuple[bool, str]:
     """
-    Change an appointment to a new time.
+    Change an appointment to a new time, and optionally, to another provider.
     Use "get_appointment_id_for_name_and_date_time" to get the ID for a patient name
     and appointment date and time, if necessary.
 
     Args:
         - appointment_id (str): ID of the appointment to change
         - new_date_time (str): New ISO format datetime string
+        - provider (str): Optional name of the new provider. If empty, the provider isn't changed.
 
     Returns:
         True with success message or False with a failure message with reasons for the failure.
@@ -141,17 +170,20 @@ def change_appointment(appointment_id: str, new_date_time: str) -> tuple[bool, s
     """
     new_dt = datetime.fromisoformat(new_date_time)
     am = get_appointment_manager()
-    return am.change_appointment(appointment_id, new_dt)
+    return am.change_appointment(appointment_id, new_dt, provider)
 
 
 @tool
-def get_appointments(patient_name: str = "", after_date_time: str = "") -> Sequence[MutableMapping[str, Any]]:
+def get_appointments(
+    patient_name: str = "", after_date_time: str = "", provider: str = ""
+) -> Sequence[MutableMapping[str, Any]]:
     """
     List all active appointments, with optional filtering.
 
     Args:
         - patient_name (str): Only return appointments for this patient (default: all patients)
         - after_date_time (str): Don't include appointments before this date time. If empty, the value `now().isoformat()` will be used to only return future appointments.
+        - provider (str): Only return appointments for this provider (default: all providers)
 
     Returns:
         List of dictionaries for the located appointments
@@ -163,7 +195,10 @@ def get_appointments(patient_name: str = "", after_date_time: str = "") -> Seque
     """
     am = get_appointment_manager()
     after_dt = datetime.fromisoformat(after_date_time) if after_date_time else now()
-    return am.get_appointments(patient_name=patient_name, after_date_time=after_dt)
+    # Return plain dictionaries, not the manager's in-memory records.
+    return [
+        dict(a) for a in am.get_appointments(patient_name=patient_name, after_date_time=after_dt, provider=provider)
+    ]
 
 
 @tool
@@ -189,7 +224,7 @@ def get_appointment_by_id(appointment_id: str) -> MutableMapping[str, Any]:
         Appointment dictionary for the input ID or {} if a matching appointment was not found
     """
     am = get_appointment_manager()
-    return am.get_appointment_by_id(appointment_id)
+    return dict(am.get_appointment_by_id(appointment_id))
 
 
 @tool
@@ -209,6 +244,78 @@ def get_appointment_id_for_name_and_date_time(patient_name: str, appointment_dat
     return am.get_appointment_id_for_name_and_date_time(patient_name, appointment_dt)
 
 
+@tool
+def find_patient_names(patient_name: str, limit: int = 5) -> list[dict[str, Any]]:
+    """
+    Find the names of patients with appointments that are similar to the input name.
+    Use this tool when looking up appointments by a patient name finds nothing, e.g., because
+    of differences in case, spelling, or middle initials, then use the best matching name.
+
+    Args:
+        - patient_name (str): The name to look up
+        - limit (int): The maximum number of names to return (default: 5).
+
+    Returns:
+        A list of dictionaries with the "patient_name" and its "similarity" to the input name,
+        from 0.0 to 1.0, most similar first, which is empty if no names are similar.
+
+    Example:
+        find_patient_names("john doe")
+    """
+    am = get_appointment_manager()
+    return [
+        {"patient_name": name, "similarity": round(similarity, 2)}
+        for name, similarity in am.find_patient_names(patient_name, limit)
+    ]
+
+
+@tool
+def find_available_slots(
+    start_date_time: str = "", end_date_time: str = "", limit: int = 10, duration_minutes: int = 0, provider: str = ""
+) -> list[str]:
+    """
+    Find the earliest available appointment date-times, i.e., times when a new appointment
+    can be created. Use this tool to offer the patient available times, rather than guessing.
+
+    Args:
+        - start_date_time (str): ISO format datetime string for the earliest time to consider.
+          If empty, the current time is used.
+        - end_date_time (str): ISO format datetime string. Only times before this one are returned.
+          If empty, the times in the two weeks after `start_date_time` are considered.
+        - limit (int): The maximum number of times to return (default: 10).
+        - duration_minutes (int): The length in minutes of the appointment to make. If 0, the
+          default length, one hour, is used.
+        - provider (str): If not empty, only the times when this provider is free are returned.
+          Otherwise, the times when any provider is free are returned.
+
+    Returns:
+        A list of ISO format datetime strings for the available times, in chronological order,
+        which is empty if no times are available.
+
+    Example:
+        find_available_slots()
+        find_available_slots("2026-04-15T00:00:00", "2026-04-18T00:00:00", 5)
+    """
+    am = get_appointment_manager()
+    start_dt = add_timezone(datetime.fromisoformat(start_date_time)) if start_date_time else now()
+    end_dt = add_timezone(datetime.fromisoformat(end_date_time)) if end_date_time else start_dt + timedelta(days=14)
+    duration = timedelta(minutes=duration_minutes) if duration_minutes else None
+    return [dt.isoformat() for dt in am.find_available_slots(start_dt, end_dt, limit, duration, provider)]
+
+
+@tool
+def get_providers() -> list[str]:
+    """
+    Return the names of the providers, e.g., the clinicians, who have their own calendars.
+    The list is empty if there is just one calendar, so no provider needs to be chosen.
+
+    Example:
+        get_providers()
+    """
+    am = get_appointment_manager()
+    return list(am.providers)
+
+
 # Export all tools as a list for easy registration
 # Note that get_appointment_manager is not a tool and so it is not in this list.
 # It is used internally.
@@ -220,4 +327,7 @@ APPOINTMENT_TOOLS = [  # pylint: disable=unused-variable
     get_appointments,
     get_appointments_count,
     get_appointment_id_for_name_and_date_time,
+    find_patient_names,
+    find_available_slots,
+    get_providers,
 ]
@@ -1,7 +1,23 @@
+from .appointment import Appointment
 from .appointment_manager import AppointmentManager
+from .async_appointment_manager import AppointmentSnapshot, AsyncAppointmentManager
+from .change_feed import ChangeEvent, ChangeFeed
+from .interval_index import IntervalIndex
 from .resource_manager import ResourceManager
+from .resource_query import Eq, In, Predicate, Prefix, Range
 
 __all__ = [
+    "Appointment",
     "AppointmentManager",
+    "AppointmentSnapshot",
+    "AsyncAppointmentManager",
+    "ChangeEvent",
+    "ChangeFeed",
+    "Eq",
+    "In",
+    "IntervalIndex",
+    "Predicate",
+    "Prefix",
+    "Range",
     "ResourceManager",
 ]
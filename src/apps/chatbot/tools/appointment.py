@@ -0,0 +1,153 @@
+"""
+A compact, slotted record type for appointments.
+
+`AppointmentManager` keeps its appointments in memory as `Appointment` instances
+rather than dictionaries. There are no per-instance dictionaries or repeated key
+strings, status and provider values are interned, and, optionally, the timestamps are stored
+as integer microseconds since the epoch instead of `datetime` objects. An
+`Appointment` is a `MutableMapping`, so code that treats appointments as
+dictionaries still works. Use `to_dict()` for a plain dictionary, e.g., at the
+tool and JSON boundaries.
+
+Timestamps decoded lazily from storage, as `LazyDatetime`s, are kept as they are until
+they are first read, when they are parsed and replaced with the `datetime`, or the epoch
+microseconds. Loading many appointments then doesn't parse the timestamps that are
+rarely read, like `created_at` and `cancelled_at`.
+"""
+
+# Allow types to self-reference during their definitions.
+from __future__ import annotations
+
+import sys
+from collections.abc import Iterator, Mapping, MutableMapping
+from dataclasses import dataclass, field
+from datetime import UTC, datetime, timedelta
+from typing import Any
+
+from common.date_time_utils import local_timezone
+from common.json_yaml import LazyDatetime
+
+# Too many of these warnings for variables that ARE used in other files.
+# pylint: disable=unused-variable
+
+_epoch = datetime(1970, 1, 1, tzinfo=UTC)
+# Only datetimes with this offset are kept as epoch microseconds, as they are returned in the local timezone.
+_local_utcoffset = local_timezone.utcoffset(None) if local_timezone is not None else None
+
+# The appointment keys stored in their own slots. Any other keys go in `extra`.
+FIELDS = (
+    "id",
+    "patient_name",
+    "appointment_date_time",
+    "reason",
+    "status",
+    "created_at",
+    "cancelled_at",
+    "changed_at",
+    "previous_time",
+    "duration_minutes",
+    "provider",
+)
+TIMESTAMP_FIELDS = frozenset({"appointment_date_time", "created_at", "cancelled_at", "changed_at", "previous_time"})
+_field_set = frozenset(FIELDS)
+
+
+def to_epoch_micros(dt: datetime) -> int:
+    """Convert a datetime with a timezone to microseconds since the epoch."""
+    return (dt - _epoch) // timedelta(microseconds=1)
+
+
+def from_epoch_micros(micros: int) -> datetime:
+    """Convert microseconds since the epoch to a datetime in the local timezone."""
+    return (_epoch + timedelta(microseconds=micros)).astimezone(local_timezone)
+
+
+@dataclass(slots=True, eq=False)
+class Appointment(MutableMapping[str, Any]):  # pylint: disable=too-many-instance-attributes
+    """
+    An appointment record. The keys are the names of the fields that aren't `None`,
+    plus the keys in `extra`. Timestamps are always returned as `datetime`s, even
+    when they are stored as epoch microseconds or haven't been parsed yet.
+    """
+
+    id: str | None = None
+    patient_name: str | None = None
+    appointment_date_time: datetime | int | LazyDatetime | None = None
+    reason: str | None = None
+    status: str | None = None
+    created_at: datetime | int | LazyDatetime | None = None
+    cancelled_at: datetime | int | LazyDatetime | None = None
+    changed_at: datetime | int | LazyDatetime | None = None
+    previous_time: datetime | int | LazyDatetime | None = None
+    duration_minutes: int | None = None
+    provider: str | None = None
+    extra: dict[str, Any] | None = None
+    # If True, timestamps in the local timezone are stored as epoch microseconds.
+    epoch_timestamps: bool = field(default=False, repr=False)
+
+    @classmethod
+    def from_dict(cls, d: Mapping[str, Any], epoch_timestamps: bool = False) -> Appointment:
+        """Make an appointment from a mapping, e.g., a record decoded from storage."""
+        appointment = cls(epoch_timestamps=epoch_timestamps)
+        for key, value in d.items():
+            appointment[key] = value
+        return appointment
+
+    def to_dict(self) -> dict[str, Any]:
+        """Return a plain dictionary with the same keys and values."""
+        return dict(self.items())
+
+    def __getitem__(self, key: str) -> Any:
+        if key in _field_set:
+            value = getattr(self, key)
+            if value is None:
+                raise KeyError(key)
+            if isinstance(value, int) and key in TIMESTAMP_FIELDS:
+                return from_epoch_micros(value)
+            if type(value) is LazyDatetime:
+                value = value.to_datetime()
+                if self.epoch_timestamps:
+                    self[key] = value
+                else:
+                    setattr(self, key, value)
+            return value
+        if self.extra is None:
+            raise KeyError(key)
+        return self.extra[key]
+
+    def __setitem__(self, key: str, value: Any):
+        if key not in _field_set:
+            if self.extra is None:
+                self.extra = {}
+            self.extra[key] = value
+            return
+        if key in ("status", "provider") and isinstance(value, str):
+            value = sys.intern(value)
+        elif (
+            self.epoch_timestamps
+            and key in TIMESTAMP_FIELDS
+            and isinstance(value, datetime)
+            and value.utcoffset() == _local_utcoffset
+        ):
+            value = to_epoch_micros(value)
+        setattr(self, key, value)
+
+    def __delitem__(self, key: str):
+        if key in _field_set:
+            if getattr(self, key) is None:
+                raise KeyError(key)
+            setattr(self, key, None)
+        elif self.extra is None:
+            raise KeyError(key)
+        else:
+            del self.extra[key]
+
+    def __iter__(self) -> Iterator[str]:
+        for key in FIELDS:
+            if getattr(self, key) is not None:
+                yield key
+        if self.extra:
+            yield from self.extra
+
+    def __len__(self) -> int:
+        return sum(1 for key in FIELDS if getattr(self, key) is not None) + len(self.extra or ())
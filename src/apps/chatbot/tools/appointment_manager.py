@@ -2,29 +2,36 @@
 Appointment management tool for the ChatBot.
 
 This tool manages patient appointments with the following constraints:
-- Only one patient at a time
-- One-hour appointment slots
+- Only one patient at a time per provider, e.g., a clinician or a room, with one calendar per provider
+- One-hour appointments by default, or any duration in minutes, with an optional buffer between appointments
 - Work week only (Monday-Friday)
 - Excludes common USA holidays
-- Appointments must be on the hour (e.g., 10:00, 11:00, not 10:30)
+- Appointments must start on the hour (e.g., 10:00, 11:00, not 10:30), or on a configurable, finer grid
 """
 
 # Allow types to self-reference during their definitions.
 from __future__ import annotations
 
+import heapq
 import json
 import logging
-from collections.abc import Callable, MutableMapping, Sequence
-from datetime import datetime, timedelta
+from collections.abc import Callable, Iterator, Mapping, MutableMapping, Sequence
+from datetime import datetime, time, timedelta
+from itertools import islice
 from pathlib import Path
 from typing import Any
 
 from common.date_time_utils import (
     local_datetime_min,
+    local_timezone,
     now,
 )
 
-from .resource_manager import ResourceManager
+from .appointment import TIMESTAMP_FIELDS, Appointment
+from .interval_index import IntervalIndex
+from .resource_manager import NO_SUCH_RESOURCE_MSG, ResourceManager
+from .resource_query import Eq, Range, normalize_text
+from .resource_transaction import UndoLog
 
 
 class AppointmentManagerEncoder(json.JSONEncoder):
@@ -63,7 +70,7 @@ class AppointmentManagerDecoder(json.JSONDecoder):
             return d
 
 
-class AppointmentManager(ResourceManager):
+class AppointmentManager(ResourceManager):  # pylint: disable=too-many-public-methods
     """
     A simple tool for managing patient appointments using a simple calendar
     with local file storage.
@@ -72,12 +79,23 @@ class AppointmentManager(ResourceManager):
     representing an appointment. The method return values are designed to work
     with LLMs in an agent context.
 
+    Each appointment lasts `duration_minutes`, if it has that field, or `DEFAULT_DURATION`,
+    and must end by the end of the work day. Appointments conflict if they overlap, including
+    the `buffer` after each one, which an `IntervalIndex` checks in logarithmic time.
+
+    A manager can keep the calendars of several `providers`, e.g., the clinicians at a site,
+    in one file. Only the appointments of the same `provider` conflict. Appointments without
+    one belong to the first provider, but new ones are assigned to the first free provider.
+
     NOTE: You will see a number of log messages with two versions, a "sanitized"
     version that passes CodeQL checks for leaking sensitive information into logs,
     and a commented-out version with more information that can be used temporarily
     for debugging, but shouldn't be left "on".
     """
 
+    # The duration of appointments without a `duration_minutes` field.
+    DEFAULT_DURATION = timedelta(hours=1)
+
     # Common USA holidays (simplified list)
     USA_HOLIDAYS = {  # noqa: RUF012
         (1, 1),  # New Year's Day
@@ -86,14 +104,35 @@ class AppointmentManager(ResourceManager):
         # Add more as needed
     }
 
+    # The work day hours, from 8 AM, inclusive, to 5 PM, exclusive. Appointments must end by 5 PM.
+    WORK_DAY_HOURS = range(8, 17)
+
     def_json_encoder = AppointmentManagerEncoder()
     def_json_decoder = AppointmentManagerDecoder()
 
+    # Only one patient at a time, so appointment date-times are kept in the slot index, per provider.
+    unique_datetime_key = "appointment_date_time"
+    unique_datetime_scope_key = "provider"
+
+    # The fields used by the most common queries.
+    secondary_indexes = {  # noqa: RUF012
+        "patient_name": "trigram",
+        "status": "hash",
+        "appointment_date_time": "sorted",
+    }
+
     def __init__(
         self,
         appointments_file: Path | str,
         start_empty: bool = False,
         logger: logging.Logger | None = None,
+        epoch_timestamps: bool = False,
+        archive_horizon: timedelta | None = None,
+        buffer: timedelta = timedelta(0),
+        start_granularity: timedelta = timedelta(hours=1),
+        providers: Sequence[str] = (),
+        lazy_timestamps: bool = False,
+        **manager_options: Any,
     ):
         """
         Initialize the appointment tool.
@@ -103,8 +142,246 @@ class AppointmentManager(ResourceManager):
             - start_empty (bool): `True` if we should clear the file and start "empty"
               or False if we should just load whatever appointments the file contains already.
             - logger (logging.Logger): Optional logger instance
+            - epoch_timestamps (bool): If True, the in-memory `Appointment` records store their timestamps
+              as epoch microseconds, rather than `datetime`s, to save memory.
+            - archive_horizon (timedelta | None): If not `None`, appointments more than this far in the
+              past are moved into compressed monthly archive files at startup and by
+              `archive_old_appointments()`, so memory holds just the recent and future schedule.
+              The archive is in `manager_options["archive_dir"]`, by default the directory next to
+              `appointments_file` named like it with an "_archive" suffix instead of the file suffix.
+            - buffer (timedelta): The free time required after each appointment, before the next one starts.
+            - start_granularity (timedelta): Appointments must start a multiple of this after midnight,
+              e.g., 15 minutes for 9:00, 9:15, 9:30, etc. It must divide an hour or a day evenly.
+            - providers (Sequence[str]): The names of the providers, each with their own calendar.
+              If empty, there is one calendar and appointments can't have a provider.
+            - lazy_timestamps (bool): If True, the timestamps loaded from storage are parsed when they are
+              first read, so loading doesn't parse those that rarely are, like `created_at`. This saves the
+              most time with `epoch_timestamps`, but the unparsed timestamps take more memory.
+            - manager_options: Other `ResourceManager` arguments, e.g., `storage_options` or `lazy_load`.
+        """
+        self.epoch_timestamps = epoch_timestamps
+        if lazy_timestamps:
+            self.lazy_datetime_keys = TIMESTAMP_FIELDS
+        if buffer < timedelta(0) or start_granularity <= timedelta(0) or timedelta(days=1) % start_granularity:
+            raise ValueError("The buffer can't be negative and the start granularity must divide a day evenly.")
+        if "" in providers or len(set(providers)) != len(providers):
+            raise ValueError("The provider names must be unique and not empty.")
+        self.buffer = buffer
+        self.start_granularity = start_granularity
+        self.providers = tuple(providers)
+        # The times reserved by the active appointments, including the buffers, by provider.
+        # Maintained with the slot index.
+        self._intervals: dict[str, IntervalIndex] = {}
+        self.archive_horizon = archive_horizon
+        if archive_horizon is not None and manager_options.get("archive_dir") is None:
+            path = Path(appointments_file)
+            manager_options["archive_dir"] = path.with_name(path.stem + "_archive")
+        super().__init__(appointments_file, start_empty, logger, **manager_options)
+        if archive_horizon is not None and not start_empty:
+            self.archive_old_appointments()
+
+    def archive_old_appointments(self) -> int:
+        """
+        Move the appointments more than `archive_horizon` in the past into the archive.
+        See `archive_resources()`.
+
+        Returns:
+            The count of appointments archived.
+        """
+        if self.archive_horizon is None:
+            raise ValueError("No archive_horizon was given, so appointments can't be archived.")
+        return self.archive_resources(now() - self.archive_horizon)
+
+    def _make_resource(self, fields: MutableMapping[str, Any]) -> MutableMapping[str, Any]:
+        """Keep appointments in memory as compact `Appointment` records."""
+        if isinstance(fields, Appointment) and fields.epoch_timestamps == self.epoch_timestamps:
+            return fields
+        return Appointment.from_dict(fields, epoch_timestamps=self.epoch_timestamps)
+
+    def _index_resource(self, resource: MutableMapping[str, Any]):
+        """Also add the time reserved by an active appointment to its provider's interval index."""
+        super()._index_resource(resource)
+        resource_id = resource.get("id", "")
+        provider = self._indexes.slots.scope_of(resource_id)
+        if provider is not None:
+            start = resource["appointment_date_time"]
+            intervals = self._intervals.setdefault(provider, IntervalIndex())
+            intervals.add(resource_id, start, start + self.duration_of(resource) + self.buffer)
+
+    def _unindex_resource(self, resource: MutableMapping[str, Any]):
+        """Also remove the appointment's reserved time from its provider's interval index."""
+        resource_id = resource.get("id", "")
+        # The slot index knows the provider the appointment was indexed for.
+        provider = self._indexes.slots.scope_of(resource_id)
+        super()._unindex_resource(resource)
+        if provider is not None:
+            self._intervals[provider].discard(resource_id)
+
+    def _rebuild_indexes(self):
+        self._intervals.clear()
+        super()._rebuild_indexes()
+
+    def _scope_of(self, resource: Mapping[str, Any]) -> Any:
+        """The slot index scope of an appointment is its provider."""
+        return self.provider_of(resource)
+
+    def provider_of(self, appointment: Mapping[str, Any]) -> str:
+        """
+        The provider of the appointment. Appointments without one belong to the first
+        provider, or to '' if there are no providers.
+        """
+        return appointment.get("provider") or (self.providers[0] if self.providers else "")
+
+    def _check_provider(self, provider: str) -> tuple[bool, str]:
+        """Check that the provider is one of the `providers`, if it isn't empty."""
+        if provider and provider not in self.providers:
+            return False, "There is no provider with the input name."
+            # return False, f"There is no provider named {provider}. The providers are {self.providers}."
+        return True, ""
+
+    def _apply_create(self, fields: MutableMapping[str, Any], idempotency_key: str, undo: UndoLog) -> tuple[str, str]:
+        """
+        Assign a new appointment without a provider to the first provider who is free at its time,
+        on a copy of the fields. If none is, or the fields aren't valid, `_is_valid_resource()` says so.
+        """
+        start = fields.get("appointment_date_time")
+        if not fields.get("provider") and isinstance(start, datetime) and self._check_duration(fields)[0]:
+            for provider in self.providers:
+                if self._check_interval(start, self.duration_of(fields), provider=provider)[0]:
+                    fields = {**fields, "provider": provider}
+                    break
+        return super()._apply_create(fields, idempotency_key, undo)
+
+    def _check_duration(self, fields: Mapping[str, Any]) -> tuple[bool, str]:
+        """Check that the `duration_minutes` field, if any, is a positive integer."""
+        minutes = fields.get("duration_minutes")
+        if minutes is not None and (not isinstance(minutes, int) or isinstance(minutes, bool) or minutes <= 0):
+            return False, "The 'duration_minutes' field must be a positive integer."
+        return True, ""
+
+    def duration_of(self, appointment: Mapping[str, Any]) -> timedelta:
+        """The duration of the appointment, `DEFAULT_DURATION` if it doesn't have a `duration_minutes` field."""
+        minutes = appointment.get("duration_minutes")
+        return timedelta(minutes=minutes) if minutes else self.DEFAULT_DURATION
+
+    def _work_day_bounds(self, a_date_time: datetime) -> tuple[datetime, datetime]:
+        """The start and end of the work day for the local date of the datetime."""
+        day = a_date_time.astimezone(local_timezone).date()
+        day_start = datetime.combine(day, time(self.WORK_DAY_HOURS.start), tzinfo=local_timezone)
+        return day_start, day_start + timedelta(hours=len(self.WORK_DAY_HOURS))
+
+    def _check_interval(
+        self, start: datetime, duration: timedelta, appointment_id: str = "", provider: str = ""
+    ) -> tuple[bool, str]:
+        """
+        Check that an appointment starting at `start` and lasting `duration` ends by the end of the
+        work day and doesn't overlap another active appointment of the provider, including their
+        buffers, ignoring the appointment with `appointment_id`, e.g., the one being moved.
+        The provider must already be resolved with `provider_of()`.
+
+        Returns:
+            A tuple with `(True, '')` on success or `(False, error_message)` on failure.
+        """
+        if duration <= timedelta(0) or duration % timedelta(minutes=1):
+            return False, "The appointment duration must be a positive whole number of minutes."
+        if start + duration > self._work_day_bounds(start)[1]:
+            return False, "The appointment must end by the end of the work day (5 PM)."
+        self._ensure_indexes()
+        intervals = self._intervals.get(provider)
+        if intervals is not None and intervals.overlaps(
+            start, start + duration + self.buffer, ignore_id=appointment_id
+        ):
+            return False, "The appointment would overlap another appointment."
+        return True, ""
+
+    def find_available_slots(  # pylint: disable=too-many-arguments,too-many-positional-arguments
+        self,
+        start: datetime,
+        end: datetime,
+        limit: int = 10,
+        duration: timedelta | None = None,
+        provider: str = "",
+    ) -> list[datetime]:
         """
-        super().__init__(appointments_file, start_empty, logger)
+        Find the earliest date-times `create_appointment()` would accept for an appointment of the
+        input duration, on the `start_granularity` grid in the free intervals of each work day.
+        Weekends, holidays, and other date-times rejected by `_further_date_time_validation()`
+        are skipped, while the times of cancelled appointments are available.
+
+        Args:
+            - start (datetime): The earliest date-time to consider. Past date-times are never returned.
+            - end (datetime): Only return date-times before this one.
+            - limit (int): The maximum number of date-times to return.
+            - duration (timedelta | None): The duration of the appointment, by default `DEFAULT_DURATION`.
+            - provider (str): If not empty, only the times when this provider is free are returned.
+              Otherwise, the times when any provider is free are returned.
+
+        Returns:
+            Up to `limit` available date-times, in the local timezone, in chronological order.
+        """
+        found: list[datetime] = []
+        for dt, _provider in self._available_slots(start, end, duration, provider):
+            if len(found) >= limit:
+                break
+            # Several providers may be free at the same time.
+            if not found or found[-1] != dt:
+                found.append(dt)
+        return found
+
+    def find_available_provider_slots(  # pylint: disable=too-many-arguments,too-many-positional-arguments
+        self,
+        start: datetime,
+        end: datetime,
+        limit: int = 10,
+        duration: timedelta | None = None,
+        provider: str = "",
+    ) -> list[tuple[datetime, str]]:
+        """
+        Like `find_available_slots()`, but returns the earliest `(date-time, provider)` pairs
+        across all the providers, or just `provider`, if not empty. The providers' free times
+        are merged lazily, so just the days up to the last pair returned are searched.
+
+        Returns:
+            Up to `limit` pairs, in chronological order, then in the order of `providers`.
+        """
+        return list(islice(self._available_slots(start, end, duration, provider), limit))
+
+    def _available_slots(
+        self, start: datetime, end: datetime, duration: timedelta | None, provider: str
+    ) -> Iterator[tuple[datetime, str]]:
+        """Yield the available `(date-time, provider)` pairs, merged across the providers."""
+        self.refresh()
+        self._ensure_indexes()
+        if not self._check_provider(provider)[0]:
+            return
+        duration = duration or self.DEFAULT_DURATION
+        start = max(start, now())
+        providers = [provider] if provider else list(self.providers or ("",))
+
+        def slots(rank: int, a_provider: str) -> Iterator[tuple[datetime, int, str]]:
+            for dt in self._free_start_times(a_provider, start, end, duration):
+                yield dt, rank, a_provider
+
+        for dt, _rank, a_provider in heapq.merge(*(slots(rank, p) for rank, p in enumerate(providers))):
+            yield dt, a_provider
+
+    def _free_start_times(
+        self, provider: str, start: datetime, end: datetime, duration: timedelta
+    ) -> Iterator[datetime]:
+        """Yield the start times in `[start, end)` when the provider is free for `duration`, in order."""
+        intervals = self._intervals.get(provider, IntervalIndex())
+        # The buffer after an appointment must be free too, even past the end of the work day.
+        length, step = duration + self.buffer, self.start_granularity
+        day = start.astimezone(local_timezone).date()
+        last_day = end.astimezone(local_timezone).date()
+        while day <= last_day:
+            if day.weekday() < 5 and (day.month, day.day) not in self.USA_HOLIDAYS:
+                day_start, day_end = self._work_day_bounds(datetime.combine(day, time(12), tzinfo=local_timezone))
+                midnight = day_start.replace(hour=0)
+                for dt in intervals.free_starts(day_start, day_end + self.buffer, length, step, midnight):
+                    if start <= dt < end and self._further_date_time_validation(dt)[0]:
+                        yield dt
+            day += timedelta(days=1)
 
     def _ignore(self, resource: MutableMapping[str, Any]) -> bool:
         """
@@ -120,30 +397,38 @@ class AppointmentManager(ResourceManager):
         patient_name: str | list[str],
         reason: str,
         status: str = "scheduled",
+        duration_minutes: int | None = None,
+        provider: str = "",
     ) -> dict[str, Any]:
         """
         Make a "raw" dictionary for an appointment, without checking
         values, etc. This is a service method used by create_appointment(),
-        and some tests.
+        and some tests. The `duration_minutes` and `provider` fields are only added if they are given.
         """
         if isinstance(patient_name, list):
             pname = " ".join(patient_name)
         else:
             pname = patient_name
-        return {
+        appointment = {
             "patient_name": pname,
             "appointment_date_time": appointment_date_time,
             "reason": reason,
             "status": "scheduled",
             "created_at": now(),
         }
+        if duration_minutes is not None:
+            appointment["duration_minutes"] = duration_minutes
+        if provider:
+            appointment["provider"] = provider
+        return appointment
 
     def _further_date_time_validation(self, a_date_time: datetime) -> tuple[bool, str]:
         """
         For appointments, we have additional requirements compared to the
         requirements defined in `ResourceManager._is_valid_date_time()`:
         1. Only weekday and non-holiday date-times are allowed.
-        2. Only on-the-hour date-times between 8AM, inclusive, and 5PM, exclusive, are allowed.
+        2. Only date-times between 8AM, inclusive, and 5PM, exclusive, are allowed, which are
+           on the hour, or on a multiple of `start_granularity` after midnight, if that isn't an hour.
 
         Args:
             - a_date_time (datetime): A datetime to validate
@@ -163,25 +448,30 @@ class AppointmentManager(ResourceManager):
             return False, "Allowed date-times cannot be scheduled on holidays."
 
         # Check if it's between 8AM, inclusive, and 5PM, exclusive
-        if a_date_time.hour < 8 or a_date_time.hour >= 17:
+        if a_date_time.hour not in self.WORK_DAY_HOURS:
             return (
                 False,
                 "Allowed date-times must be scheduled between 8 AM, inclusive, and 5 PM, exclusive (8:00-17:00).",
             )
 
-        # Check if it's on the hour
-        if a_date_time.minute != 0 or a_date_time.second != 0 or a_date_time.microsecond != 0:
-            return (
-                False,
-                "Allowed date-times must be scheduled on the hour (e.g., 10:00, 11:00).",
-            )
+        # Check if it's on the hour, or on the grid of allowed start times
+        midnight = a_date_time.replace(hour=0, minute=0, second=0, microsecond=0)
+        if (a_date_time - midnight) % self.start_granularity:
+            if self.start_granularity == timedelta(hours=1):
+                return (
+                    False,
+                    "Allowed date-times must be scheduled on the hour (e.g., 10:00, 11:00).",
+                )
+            minutes = self.start_granularity // timedelta(minutes=1)
+            return False, f"Allowed date-times must be scheduled on a multiple of {minutes} minutes after midnight."
 
         return True, ""
 
     def _is_valid_resource(self, fields: MutableMapping[str, Any]) -> tuple[bool, str]:
         """
-        For appointment "resources", the appointment date-time must be valid
-        and the patient name must be non-empty.
+        For appointment "resources", the appointment date-time must be valid for the provider
+        and the patient name must be non-empty. The fields aren't changed, so an appointment
+        without a provider is checked for the first provider. See `_apply_create()`.
 
         Args:
             - fields (dict[str,Any]): The dictionary to use to create the resource record.
@@ -197,11 +487,19 @@ class AppointmentManager(ResourceManager):
             is_valid_dt = False
             dt_error_msg = "No field 'appointment_date_time' found."
         else:
-            is_valid_dt, dt_error_msg = self._is_valid_date_time(
-                dt,
-                in_the_past_allowed=False,
-                unique_datetime_key="appointment_date_time",
-            )
+            is_valid_dt, dt_error_msg = self._check_duration(fields)
+            if is_valid_dt:
+                is_valid_dt, dt_error_msg = self._check_provider(fields.get("provider") or "")
+            if is_valid_dt:
+                provider = self.provider_of(fields)
+                is_valid_dt, dt_error_msg = self._is_valid_date_time(
+                    dt,
+                    in_the_past_allowed=False,
+                    unique_datetime_key="appointment_date_time",
+                    scope=provider,
+                )
+                if is_valid_dt:
+                    is_valid_dt, dt_error_msg = self._check_interval(dt, self.duration_of(fields), provider=provider)
 
         is_valid_pn = True
         pn_error_msg = ""
@@ -219,7 +517,15 @@ class AppointmentManager(ResourceManager):
         else:
             return True, ""
 
-    def create_appointment(self, patient_name: str, appointment_date_time: datetime, reason: str) -> tuple[str, str]:
+    def create_appointment(  # pylint: disable=too-many-arguments,too-many-positional-arguments
+        self,
+        patient_name: str,
+        appointment_date_time: datetime,
+        reason: str,
+        idempotency_key: str = "",
+        duration_minutes: int | None = None,
+        provider: str = "",
+    ) -> tuple[str, str]:
         """
         Create a new appointment.
 
@@ -227,6 +533,11 @@ class AppointmentManager(ResourceManager):
             - patient_name (str): Name of the patient
             - appointment_date_time (datetime): Desired appointment time
             - reason (str): Reason for the appointment
+            - idempotency_key (str): If not empty, a key for this request. Retrying with the same
+              key returns the id of the appointment already created, instead of creating another.
+            - duration_minutes (int | None): The length of the appointment, by default `DEFAULT_DURATION`.
+            - provider (str): The provider for the appointment. If empty, the first provider
+              who is free at that time is assigned, if there are providers.
 
         Returns:
             Non-empty string with the id of the successfully-created appointment or '' and a failure message with reasons for the failure.
@@ -237,8 +548,63 @@ class AppointmentManager(ResourceManager):
             patient_name=patient_name,
             reason=reason,
             status="scheduled",
+            duration_minutes=duration_minutes,
+            provider=provider,
         )
-        return self.create_resource(appointment)
+        return self.create_resource(appointment, idempotency_key)
+
+    def cancel_and_create_appointment(  # pylint: disable=too-many-arguments,too-many-positional-arguments
+        self,
+        appointment_id: str,
+        patient_name: str,
+        appointment_date_time: datetime,
+        reason: str,
+        idempotency_key: str = "",
+        duration_minutes: int | None = None,
+        provider: str = "",
+    ) -> tuple[str, str]:
+        """
+        Cancel an appointment and create another one in a single transaction, so either both
+        happen or neither does, and no other session can take the new time slot in between.
+        The new time may be the cancelled appointment's time.
+
+        Args:
+            - appointment_id (str): ID of the appointment to cancel
+            - patient_name (str): Name of the patient for the new appointment
+            - appointment_date_time (datetime): Desired time for the new appointment
+            - reason (str): Reason for the new appointment
+            - idempotency_key (str): If not empty, a key for this request. See `create_appointment()`.
+            - duration_minutes (int | None): The length of the new appointment, by default `DEFAULT_DURATION`.
+            - provider (str): The provider for the new appointment. See `create_appointment()`.
+
+        Returns:
+            The id of the new appointment and '' or '' and a failure message with reasons for the failure.
+        """
+
+        def is_scheduled(appointment: MutableMapping[str, Any], _changes: MutableMapping[str, Any]) -> tuple[bool, str]:
+            if self._ignore(appointment):
+                return False, "The appointment with the input ID is already cancelled."
+            return True, ""
+
+        with self.synchronized():
+            # A retry after the transaction committed must not fail because the appointment is now cancelled.
+            existing_id = self._idempotent_id(idempotency_key)
+            if existing_id:
+                return existing_id, ""
+            transaction = self.begin()
+            transaction.update(appointment_id, {"status": "cancelled", "cancelled_at": now()}, validate=is_scheduled)
+            transaction.create(
+                AppointmentManager.make_appointment_dict(
+                    appointment_date_time, patient_name, reason, duration_minutes=duration_minutes, provider=provider
+                ),
+                idempotency_key=idempotency_key,
+            )
+            ids, error_msg = transaction.commit()
+        if error_msg:
+            if error_msg == NO_SUCH_RESOURCE_MSG:
+                error_msg = "There is no appointment with the input ID."
+            return "", error_msg
+        return ids[-1], ""
 
     def set_appointments(self, appointments: Sequence[MutableMapping[str, Any]]) -> tuple[int, str]:
         """
@@ -267,60 +633,82 @@ class AppointmentManager(ResourceManager):
         Returns:
             True with success message or False with a failure message with reasons for the failure.
         """
-        appointment = self.get_resource_by_id(appointment_id)
-        if not appointment or not len(appointment):
-            error_msg = "There is no appointment with the input ID."
-            # error_msg = f"There is no appointment with ID {appointment_id}."
-            self.logger.error(error_msg)
-            return False, error_msg
-
-        appointment["status"] = "cancelled"
-        appointment["cancelled_at"] = now()
-
-        # Persist the updated status.
-        self._persist_resources([appointment])
+        # Hold the lock, so the appointment can't be changed between the check and the update.
+        with self.synchronized():
+            appointment = self.get_resource_by_id(appointment_id)
+            if not appointment or not len(appointment) or self._ignore(appointment):
+                error_msg = "There is no appointment with the input ID."
+                # error_msg = f"There is no appointment with ID {appointment_id}."
+                self.logger.error(error_msg)
+                return False, error_msg
+
+            # Persist the updated status, which also frees the time slot.
+            success, error_msg = self.update_resource(appointment_id, {"status": "cancelled", "cancelled_at": now()})
+            if not success:
+                error_msg = f"I could not cancel an appointment with the input ID. {error_msg}"
+                self.logger.error(error_msg)
+                return False, error_msg
         success_msg = "Appointment with the input ID is now cancelled."
         # success_msg = f"Appointment {appointment_id} is now cancelled."
         self.logger.info(success_msg)
         return True, success_msg
 
-    def change_appointment(self, appointment_id: str, new_date_time: datetime) -> tuple[bool, str]:
+    def change_appointment(self, appointment_id: str, new_date_time: datetime, provider: str = "") -> tuple[bool, str]:
         """
-        Change an appointment to a new time.
+        Change an appointment to a new time, and optionally, to another provider.
 
         Args:
             appointment_id: ID of the appointment to change
             new_date_time: New appointment time
+            provider: The new provider, or '' to keep the current one
 
         Returns:
             True with a success message or False a failure message with reasons for the failure.
         """
-        appointment = self.get_resource_by_id(appointment_id)
-        if not appointment or not len(appointment):
-            error_msg = "No appointment with the input ID was found."
-            # error_msg = f"No appointment with ID {appointment_id} was found."
-            self.logger.error(error_msg)
-            return False, error_msg
-
-        # Validate the new time
-        is_valid, error_msg = self._is_valid_date_time(
-            new_date_time,
-            in_the_past_allowed=False,
-            unique_datetime_key="appointment_date_time",
-        )
-        if not is_valid:
-            error_msg = f"I could not change an appointment with the input ID. {error_msg}"
-            # error_msg = f"I could not change the appointment {appointment_id}. {error_msg}"
-            self.logger.error(error_msg)
-            return False, error_msg
-
-        old_time = appointment["appointment_date_time"]
-        appointment["appointment_date_time"] = new_date_time
-        appointment["changed_at"] = now()
-        appointment["previous_time"] = old_time
-
-        # Save the updated appointment
-        self._persist_resources([appointment])
+        # Hold the lock, so another process can't take the new time slot before it is saved.
+        with self.synchronized():
+            appointment = self.get_resource_by_id(appointment_id)
+            if not appointment or not len(appointment) or self._ignore(appointment):
+                error_msg = "No appointment with the input ID was found."
+                # error_msg = f"No appointment with ID {appointment_id} was found."
+                self.logger.error(error_msg)
+                return False, error_msg
+
+            # Validate the new provider and time
+            is_valid, error_msg = self._check_provider(provider)
+            new_provider = provider or self.provider_of(appointment)
+            if is_valid:
+                is_valid, error_msg = self._is_valid_date_time(
+                    new_date_time,
+                    in_the_past_allowed=False,
+                    unique_datetime_key="appointment_date_time",
+                    scope=new_provider,
+                )
+            if is_valid:
+                is_valid, error_msg = self._check_interval(
+                    new_date_time, self.duration_of(appointment), appointment_id=appointment_id, provider=new_provider
+                )
+            if not is_valid:
+                error_msg = f"I could not change an appointment with the input ID. {error_msg}"
+                # error_msg = f"I could not change the appointment {appointment_id}. {error_msg}"
+                self.logger.error(error_msg)
+                return False, error_msg
+
+            old_time = appointment["appointment_date_time"]
+            changes: dict[str, Any] = {
+                "appointment_date_time": new_date_time,
+                "changed_at": now(),
+                "previous_time": old_time,
+            }
+            if provider:
+                changes["provider"] = provider
+
+            # Save the updated appointment
+            success, error_msg = self.update_resource(appointment_id, changes)
+            if not success:
+                error_msg = f"I could not change an appointment with the input ID. {error_msg}"
+                self.logger.error(error_msg)
+                return False, error_msg
 
         self.logger.info(
             "I changed an appointment from the old date-time to the new one."
@@ -332,6 +720,116 @@ class AppointmentManager(ResourceManager):
             # f"I changed appointment with id = {appointment_id} from {old_time} to {new_date_time}.",
         )
 
+    def create_appointments_bulk(self, appointments: Sequence[Mapping[str, Any]]) -> list[tuple[str, str]]:
+        """
+        Create many appointments at once, e.g., when onboarding a clinic. Each appointment is
+        validated against the existing appointments and the earlier ones in the batch in one
+        pass, using the slot index, and all the new appointments are saved with a single write.
+
+        Args:
+            - appointments (Sequence[Mapping[str,Any]]): The appointments, each with the `patient_name`,
+              `appointment_date_time`, and `reason` arguments of `create_appointment()`, and optionally
+              `duration_minutes` and `provider`.
+
+        Returns:
+            A list with one tuple per input appointment, in the same order, with the same values
+            `create_appointment()` returns.
+        """
+        return self.create_resources(
+            [
+                AppointmentManager.make_appointment_dict(
+                    appointment_date_time=a["appointment_date_time"],
+                    patient_name=a["patient_name"],
+                    reason=a.get("reason", ""),
+                    status="scheduled",
+                    duration_minutes=a.get("duration_minutes"),
+                    provider=a.get("provider", ""),
+                )
+                for a in appointments
+            ]
+        )
+
+    def cancel_appointments_bulk(self, appointment_ids: Sequence[str]) -> list[tuple[bool, str]]:
+        """
+        Cancel many appointments at once, saving the cancellations with a single write.
+
+        Args:
+            - appointment_ids (Sequence[str]): The IDs of the appointments to cancel.
+
+        Returns:
+            A list with one tuple per input ID, in the same order, with the same values
+            `cancel_appointment()` returns.
+        """
+        cancelled_at = now()
+        results = self.update_resources(
+            [
+                (appointment_id, {"status": "cancelled", "cancelled_at": cancelled_at})
+                for appointment_id in appointment_ids
+            ],
+            # Reject cancelled appointments, like `cancel_appointment()`.
+            validate=lambda appointment, _changes: (
+                (False, NO_SUCH_RESOURCE_MSG) if self._ignore(appointment) else (True, "")
+            ),
+        )
+        success_msg = "Appointment with the input ID is now cancelled."
+        error_msg = "There is no appointment with the input ID."
+        return [
+            (True, success_msg) if success else (False, error_msg if msg == NO_SUCH_RESOURCE_MSG else msg)
+            for success, msg in results
+        ]
+
+    def change_appointments_bulk(self, changes: Sequence[tuple[str, datetime]]) -> list[tuple[bool, str]]:
+        """
+        Change many appointments to new times at once. Each new time is validated after the
+        earlier changes in the batch were made, so an appointment can move into a slot freed
+        by an earlier change, but not into one taken by an earlier change. All the changed
+        appointments are saved with a single write.
+
+        Args:
+            - changes (Sequence[tuple[str,datetime]]): `(appointment_id, new_date_time)` pairs.
+
+        Returns:
+            A list with one tuple per input pair, in the same order, with the same values
+            `change_appointment()` returns.
+        """
+        changed_at = now()
+
+        def validate(appointment: MutableMapping[str, Any], fields: MutableMapping[str, Any]) -> tuple[bool, str]:
+            if self._ignore(appointment):  # Cancelled, like in `change_appointment()`.
+                return False, NO_SUCH_RESOURCE_MSG
+            provider = self.provider_of(appointment)
+            is_valid, error_msg = self._is_valid_date_time(
+                fields["appointment_date_time"],
+                in_the_past_allowed=False,
+                unique_datetime_key="appointment_date_time",
+                scope=provider,
+            )
+            if is_valid:
+                is_valid, error_msg = self._check_interval(
+                    fields["appointment_date_time"],
+                    self.duration_of(appointment),
+                    appointment_id=appointment["id"],
+                    provider=provider,
+                )
+            if not is_valid:
+                return False, f"I could not change an appointment with the input ID. {error_msg}"
+            fields["previous_time"] = appointment["appointment_date_time"]
+            return True, ""
+
+        results = self.update_resources(
+            [
+                (appointment_id, {"appointment_date_time": new_date_time, "changed_at": changed_at})
+                for appointment_id, new_date_time in changes
+            ],
+            validate=validate,
+        )
+        success_msg = "I changed an appointment from the old date-time to the new one."
+        error_msg = "No appointment with the input ID was found."
+        return [
+            (True, success_msg) if success else (False, error_msg if msg == NO_SUCH_RESOURCE_MSG else msg)
+            for success, msg in results
+        ]
+
     def get_appointments_by_criteria(
         self, criteria: MutableMapping[str, Callable[[Any], bool]]
     ) -> Sequence[MutableMapping[str, Any]]:
@@ -346,37 +844,88 @@ class AppointmentManager(ResourceManager):
         self,
         patient_name: str = "",
         after_date_time: datetime = local_datetime_min,
+        provider: str = "",
     ) -> Sequence[MutableMapping[str, Any]]:
         """
-        Get all appointments, optionally filtered by patient name and/or
+        Get all appointments, optionally filtered by patient name, provider, and/or
         those appointments scheduled at or after a specified date-time.
+        If there is an archive and a date-time is specified, the archived
+        appointments at or after it are included, by reading just the
+        archive files for those months.
 
         Args:
             - patient_name (str): Only return appointments for this patient (default: all patients)
             - after_date_time (datetime): Don't include appointments before this date time. Pass `now()` to only return future appointments.
+            - provider (str): Only return appointments for this provider (default: all providers)
 
         Returns:
             List of appointment dictionaries
         """
+        if provider:
+            # Appointments without a provider belong to the first one, so match them with `provider_of()`.
+            return [
+                appointment
+                for appointment in self.get_appointments(patient_name, after_date_time)
+                if self.provider_of(appointment) == provider
+            ]
         if not patient_name and after_date_time == local_datetime_min:
             return self.get_resources()
 
         criteria: MutableMapping[str, Callable[[Any], bool]] = {}
         if patient_name:
-            criteria["patient_name"] = lambda pn: pn == patient_name
+            criteria["patient_name"] = Eq(patient_name)
         if after_date_time != local_datetime_min:
-            criteria["appointment_date_time"] = lambda dt: dt >= after_date_time
-
-        return self.get_resources_by_criteria(criteria, sort_by_key="appointment_date_time")
+            criteria["appointment_date_time"] = Range(low=after_date_time)
+
+        found = self.get_resources_by_criteria(criteria, sort_by_key="appointment_date_time")
+        if self.archive is None or after_date_time == local_datetime_min:
+            return found
+        ids = {appointment["id"] for appointment in found}
+        archived = sorted(
+            (
+                appointment
+                for appointment in self.get_archived_resources(low=after_date_time)
+                if not self._ignore(appointment)
+                and appointment.get("id") not in ids
+                and (not patient_name or appointment.get("patient_name") == patient_name)
+            ),
+            key=lambda a: (a["appointment_date_time"], a["id"]),
+        )
+        if not archived:
+            return found
+        return list(heapq.merge(archived, found, key=lambda a: (a["appointment_date_time"], a["id"])))
 
     def get_appointments_count(self) -> int:
         """Return the number of appointments currently scheduled."""
         return self.get_resources_count()
 
+    def get_appointments_count_by_status(self) -> Mapping[str, int]:
+        """
+        Return the number of active appointments for each status, e.g., "scheduled". Cancelled
+        appointments aren't counted, since they aren't loaded from storage.
+        """
+        return self._current_indexes().counts("status")
+
     def get_appointment_by_id(self, appointment_id: str) -> MutableMapping[str, Any]:
         """An alias for `get_resource_by_id()`."""
         return self.get_resource_by_id(appointment_id)
 
+    def find_patient_names(self, patient_name: str, limit: int = 5, threshold: float = 0.4) -> list[tuple[str, float]]:
+        """
+        Find the names of patients with appointments that are similar to the input name,
+        ignoring differences in case, accents, punctuation, and word order, and tolerating
+        small differences like middle initials and typos. Use it when an exact name finds nothing.
+
+        Args:
+            - patient_name (str): The name to look up.
+            - limit (int): The maximum number of names to return.
+            - threshold (float): The minimum similarity, from 0.0 to 1.0, of the names returned.
+
+        Returns:
+            A list of `(patient_name, similarity)` tuples, most similar first.
+        """
+        return self._current_indexes().similar_values("patient_name", patient_name, threshold, limit)
+
     def get_appointment_id_for_name_and_date_time(self, patient_name: str, appointment_date_time: datetime) -> str:
         """
         Retrieve the appointment ID for the specified patient and date time.
@@ -396,6 +945,8 @@ class AppointmentManager(ResourceManager):
 
         Returns:
             ID of the appointment or '' if there is no appointment for that patient at that date time.
+            If no patient name matches exactly, a name that only differs in case, accents,
+            punctuation, or spacing matches.
         """
         errors = []
         if not patient_name:
@@ -406,17 +957,19 @@ class AppointmentManager(ResourceManager):
         if errors:
             raise ValueError(" ".join(errors))
 
-        criteria = {}
-        criteria["patient_name"] = lambda pn: pn == patient_name
+        criteria: MutableMapping[str, Callable[[Any], bool]] = {}
+        criteria["patient_name"] = Eq(patient_name)
         # Check within one second:
         one_second = timedelta(seconds=1)
-
-        def dt_eq(dt: datetime) -> bool:
-            return dt >= appointment_date_time - one_second and dt <= appointment_date_time + one_second
-
-        criteria["appointment_date_time"] = dt_eq
+        criteria["appointment_date_time"] = Range(
+            low=appointment_date_time - one_second, high=appointment_date_time + one_second
+        )
 
         found = self.get_resource_ids_by_criteria(criteria)
+        if not found:
+            normalized = normalize_text(patient_name)
+            criteria["patient_name"] = lambda name: isinstance(name, str) and normalize_text(name) == normalized
+            found = self.get_resource_ids_by_criteria(criteria)
         match len(found):
             case 0:
                 return ""
@@ -0,0 +1,215 @@
+"""
+An `asyncio` facade for `AppointmentManager`, for `async` handlers, e.g., in the API and MCP servers.
+
+The manager's methods do blocking file I/O, so calling them from a coroutine stalls the
+event loop. `AsyncAppointmentManager` runs every mutation, in order, on a single writer
+thread, so concurrent sessions can't interleave their validation and writes. Most reads
+don't touch the manager at all. They are answered from an immutable `AppointmentSnapshot`,
+which is rebuilt on the writer thread the first time it is read after a write, so any number
+of reads can run concurrently on the event loop between writes.
+"""
+
+# Allow types to self-reference during their definitions.
+from __future__ import annotations
+
+import asyncio
+import time
+from bisect import bisect_left
+from collections.abc import Callable, Mapping, MutableMapping, Sequence
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from functools import partial
+from typing import Any, TypeVar
+
+from common.date_time_utils import local_datetime_min
+
+from .appointment_manager import AppointmentManager
+
+# Too many of these warnings for variables that ARE used in other files.
+# pylint: disable=unused-variable
+
+T = TypeVar("T")
+
+
+@dataclass(frozen=True)
+class AppointmentSnapshot:
+    """
+    An immutable copy of the appointments after a particular write. The appointments are
+    plain dictionaries that must not be modified. The readers return copies of them.
+    """
+
+    # The number of writes the snapshot reflects.
+    version: int
+    # When the snapshot was taken, from `time.monotonic()`.
+    taken_at: float
+    # All the appointments, as returned by `AppointmentManager.get_appointments()` without filters.
+    appointments: tuple[Mapping[str, Any], ...]
+    # The appointments that aren't ignored, e.g., not cancelled, sorted by time, then id.
+    scheduled: tuple[Mapping[str, Any], ...]
+    by_id: Mapping[str, Mapping[str, Any]]
+
+    @classmethod
+    def take(cls, manager: AppointmentManager, version: int) -> AppointmentSnapshot:
+        """Copy the manager's appointments. Call it on the thread that makes the changes."""
+        appointments = tuple(dict(appointment) for appointment in manager.get_appointments())
+        by_id = {appointment["id"]: appointment for appointment in appointments}
+        scheduled = tuple(
+            by_id[appointment["id"]]
+            for appointment in manager.get_resources_by_criteria({}, sort_by_key="appointment_date_time")
+        )
+        return cls(version, time.monotonic(), appointments, scheduled, by_id)
+
+    def get_appointments(
+        self, patient_name: str = "", after_date_time: datetime = local_datetime_min
+    ) -> list[MutableMapping[str, Any]]:
+        """Like `AppointmentManager.get_appointments()`, using a binary search for the start time."""
+        if not patient_name and after_date_time == local_datetime_min:
+            return [dict(appointment) for appointment in self.appointments]
+        start = 0
+        if after_date_time != local_datetime_min:
+            start = bisect_left(self.scheduled, after_date_time, key=lambda a: a["appointment_date_time"])
+        return [
+            dict(appointment)
+            for appointment in self.scheduled[start:]
+            if not patient_name or appointment.get("patient_name") == patient_name
+        ]
+
+
+class AsyncAppointmentManager:
+    """
+    Coroutine versions of the `AppointmentManager` methods. Mutations and reads that must
+    see the latest state, e.g., `afind_available_slots()`, run on a single writer thread.
+    The other reads use an `AppointmentSnapshot`. Use just this facade to change the
+    appointments, not the wrapped manager, or the snapshot won't know about the changes.
+    """
+
+    def __init__(self, manager: AppointmentManager, refresh_interval: float = 1.0):
+        """
+        Initialize the facade.
+
+        Args:
+            - manager (AppointmentManager): The manager to wrap.
+            - refresh_interval (float): When the manager's storage is shared with other processes,
+              the maximum age in seconds of a snapshot before it is rebuilt to pick up their changes.
+        """
+        self.manager = manager
+        self.refresh_interval = refresh_interval
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="appointment-writer")
+        # Only changed on the writer thread.
+        self._version = 0
+        self._snapshot: AppointmentSnapshot | None = None
+        self._snapshot_lock: asyncio.Lock | None = None
+
+    async def _run(self, method: Callable[..., T], *args: Any, write: bool = True) -> T:
+        """Run the method on the writer thread, after the calls already queued."""
+
+        def call() -> T:
+            try:
+                return method(*args)
+            finally:
+                if write:
+                    self._version += 1
+
+        return await asyncio.get_running_loop().run_in_executor(self._writer, call)
+
+    async def snapshot(self) -> AppointmentSnapshot:
+        """Return a snapshot reflecting all the completed writes, rebuilding it if necessary."""
+        snapshot = self._snapshot
+        if snapshot is not None and self._is_current(snapshot):
+            return snapshot
+        if self._snapshot_lock is None:
+            self._snapshot_lock = asyncio.Lock()
+        async with self._snapshot_lock:
+            # Another reader may have rebuilt it while this one waited.
+            snapshot = self._snapshot
+            if snapshot is None or not self._is_current(snapshot):
+                snapshot = await self._run(lambda: AppointmentSnapshot.take(self.manager, self._version), write=False)
+                self._snapshot = snapshot
+        return snapshot
+
+    def _is_current(self, snapshot: AppointmentSnapshot) -> bool:
+        if snapshot.version != self._version:
+            return False
+        return not self.manager.storage.shared or time.monotonic() - snapshot.taken_at < self.refresh_interval
+
+    async def acreate_appointment(  # pylint: disable=too-many-arguments,too-many-positional-arguments
+        self,
+        patient_name: str,
+        appointment_date_time: datetime,
+        reason: str,
+        idempotency_key: str = "",
+        duration_minutes: int | None = None,
+        provider: str = "",
+    ) -> tuple[str, str]:
+        """
+        See `AppointmentManager.create_appointment()`. Pass an `idempotency_key`, e.g., a
+        request id, so retrying a request doesn't book the appointment twice.
+        """
+        return await self._run(
+            partial(
+                self.manager.create_appointment,
+                idempotency_key=idempotency_key,
+                duration_minutes=duration_minutes,
+                provider=provider,
+            ),
+            patient_name,
+            appointment_date_time,
+            reason,
+        )
+
+    async def acancel_appointment(self, appointment_id: str) -> tuple[bool, str]:
+        """See `AppointmentManager.cancel_appointment()`."""
+        return await self._run(self.manager.cancel_appointment, appointment_id)
+
+    async def achange_appointment(
+        self, appointment_id: str, new_date_time: datetime, provider: str = ""
+    ) -> tuple[bool, str]:
+        """See `AppointmentManager.change_appointment()`."""
+        return await self._run(self.manager.change_appointment, appointment_id, new_date_time, provider)
+
+    async def acreate_appointments_bulk(self, appointments: Sequence[Mapping[str, Any]]) -> list[tuple[str, str]]:
+        """See `AppointmentManager.create_appointments_bulk()`."""
+        return await self._run(self.manager.create_appointments_bulk, appointments)
+
+    async def acancel_appointments_bulk(self, appointment_ids: Sequence[str]) -> list[tuple[bool, str]]:
+        """See `AppointmentManager.cancel_appointments_bulk()`."""
+        return await self._run(self.manager.cancel_appointments_bulk, appointment_ids)
+
+    async def achange_appointments_bulk(self, changes: Sequence[tuple[str, datetime]]) -> list[tuple[bool, str]]:
+        """See `AppointmentManager.change_appointments_bulk()`."""
+        return await self._run(self.manager.change_appointments_bulk, changes)
+
+    async def aget_appointments(
+        self, patient_name: str = "", after_date_time: datetime = local_datetime_min, provider: str = ""
+    ) -> list[MutableMapping[str, Any]]:
+        """See `AppointmentManager.get_appointments()`."""
+        if self.manager.archive is not None and after_date_time != local_datetime_min:
+            # Reading the archive is file I/O, so let the manager do it on the writer thread.
+            found = await self._run(self.manager.get_appointments, patient_name, after_date_time, provider, write=False)
+            return [dict(appointment) for appointment in found]
+        found = (await self.snapshot()).get_appointments(patient_name, after_date_time)
+        if provider:
+            # Appointments without a provider belong to the first one, so match them with `provider_of()`.
+            return [appointment for appointment in found if self.manager.provider_of(appointment) == provider]
+        return found
+
+    async def aget_appointments_count(self) -> int:
+        """See `AppointmentManager.get_appointments_count()`."""
+        return len((await self.snapshot()).scheduled)
+
+    async def aget_appointment_by_id(self, appointment_id: str) -> MutableMapping[str, Any]:
+        """See `AppointmentManager.get_appointment_by_id()`."""
+        return dict((await self.snapshot()).by_id.get(appointment_id, {}))
+
+    async def afind_available_slots(  # pylint: disable=too-many-arguments,too-many-positional-arguments
+        self, start: datetime, end: datetime, limit: int = 10, duration: timedelta | None = None, provider: str = ""
+    ) -> list[datetime]:
+        """See `AppointmentManager.find_available_slots()`."""
+        return await self._run(
+            partial(self.manager.find_available_slots, start, end, limit, duration, provider), write=False
+        )
+
+    def close(self):
+        """Wait for the queued calls to finish and stop the writer thread."""
+        self._writer.shutdown(wait=True)
@@ -0,0 +1,211 @@
+"""
+An in-process feed of the changes made to a `ResourceManager`'s resources, so subscribers,
+e.g., dashboards and reminder jobs, can follow the changes instead of re-reading all the resources.
+
+Each `ChangeEvent` has a sequence number that increases by one per event. A subscriber
+keeps the `cursor` of the last event it handled and passes it to `read()` for the events
+after it. A cursor also identifies the feed that issued it, so after a restart, or when a
+subscriber fell so far behind that the events it missed were dropped, `read()` reports a
+"reset" and the subscriber must read all the resources again before following the feed.
+
+`read()` can wait for the next event in the calling thread, while `read_async()` waits
+on the running event loop, so many subscribers can wait without holding a thread each.
+"""
+
+# Allow types to self-reference during their definitions.
+from __future__ import annotations
+
+import asyncio
+import threading
+from collections import deque
+from collections.abc import Callable, Mapping
+from dataclasses import dataclass
+from datetime import datetime
+from itertools import islice
+from typing import Any
+from uuid import uuid4
+
+from common.date_time_utils import now
+
+# Too many of these warnings for variables that ARE used in other files.
+# pylint: disable=unused-variable
+
+# The kinds of changes.
+CREATE = "create"
+CHANGE = "change"
+CANCEL = "cancel"
+REMOVE = "remove"
+
+
+@dataclass(frozen=True)
+class ChangeEvent:
+    """
+    A change to one resource. `resource` is a copy of the resource after the change,
+    or `None` for a removal, and must not be modified.
+    """
+
+    seq: int
+    cursor: str
+    kind: str
+    resource_id: str
+    resource: Mapping[str, Any] | None
+    timestamp: datetime
+
+    def to_dict(self) -> dict[str, Any]:
+        """The event as a dictionary, e.g., to encode as JSON."""
+        return {
+            "seq": self.seq,
+            "cursor": self.cursor,
+            "kind": self.kind,
+            "resource_id": self.resource_id,
+            "resource": dict(self.resource) if self.resource is not None else None,
+            "timestamp": self.timestamp,
+        }
+
+
+class ChangeFeed:
+    """
+    A bounded, thread-safe log of the latest `ChangeEvent`s. Publishing is constant time
+    and reading the events after a recent cursor takes time proportional to the events read.
+    """
+
+    def __init__(self, max_events: int = 10_000):
+        """
+        Initialize the feed.
+
+        Args:
+            - max_events (int): The number of events kept for subscribers that fall behind.
+              Subscribers whose cursor is older than the oldest event kept must start over.
+        """
+        if max_events < 1:
+            raise ValueError("A change feed must keep at least one event.")
+        # Distinguishes the cursors of this feed from those of earlier runs.
+        self.feed_id = uuid4().hex[:12]
+        self._events: deque[ChangeEvent] = deque(maxlen=max_events)
+        self._last_seq = 0
+        self._new_events = threading.Condition()
+        # The functions that wake up the `read_async()` calls that are waiting, called with the lock held.
+        self._wakers: set[Callable[[], None]] = set()
+
+    @property
+    def last_seq(self) -> int:
+        """The sequence number of the latest event, or 0 if there aren't any yet."""
+        return self._last_seq
+
+    def latest_cursor(self) -> str:
+        """The cursor for reading just the events published from now on."""
+        return self._cursor(self._last_seq)
+
+    def _cursor(self, seq: int) -> str:
+        return f"{self.feed_id}-{seq}"
+
+    def _parse_cursor(self, cursor: str) -> int | None:
+        """The sequence number in one of this feed's cursors, or `None` if it isn't one."""
+        feed_id, _, seq = cursor.rpartition("-")
+        if feed_id != self.feed_id or not seq.isdigit() or int(seq) > self._last_seq:
+            return None
+        return int(seq)
+
+    def publish(self, kind: str, resource_id: str, resource: Mapping[str, Any] | None) -> ChangeEvent:
+        """Add an event for a change to a resource, copying the resource, and wake up the waiting readers."""
+        with self._new_events:
+            self._last_seq += 1
+            event = ChangeEvent(
+                self._last_seq,
+                self._cursor(self._last_seq),
+                kind,
+                resource_id,
+                dict(resource) if resource is not None else None,
+                now(),
+            )
+            self._events.append(event)
+            self._wake_readers()
+        return event
+
+    def reset(self):
+        """
+        Invalidate all the cursors issued so far, e.g., after all the resources were replaced,
+        so every subscriber reads all the resources again.
+        """
+        with self._new_events:
+            self.feed_id = uuid4().hex[:12]
+            self._events.clear()
+            self._wake_readers()
+
+    def _wake_readers(self):
+        """Wake up the readers waiting in `read()` and `read_async()`. The lock must be held."""
+        self._new_events.notify_all()
+        for wake in self._wakers:
+            wake()
+
+    def read(self, cursor: str = "", limit: int = 100, timeout: float = 0.0) -> tuple[list[ChangeEvent], str, bool]:
+        """
+        Return the events published after the cursor, oldest first.
+
+        Args:
+            - cursor (str): The cursor of the last event handled, or '' to start from the latest event.
+            - limit (int): The maximum number of events to return.
+            - timeout (float): If there are no events after the cursor, the seconds to wait for one.
+
+        Returns:
+            A tuple with the events, the cursor to pass to the next call, and True if the cursor
+            is from another feed, e.g., before a restart, or older than the oldest event kept.
+            In that case, no events are returned and the subscriber must read all the resources
+            again, then continue from the returned cursor.
+        """
+        with self._new_events:
+            if not cursor:
+                return [], self.latest_cursor(), False
+            seq = self._parse_cursor(cursor)
+            if seq is not None and seq == self._last_seq and timeout > 0:
+                feed_id, last_seq = self.feed_id, seq
+                self._new_events.wait_for(lambda: self._last_seq > last_seq or self.feed_id != feed_id, timeout)
+                seq = self._parse_cursor(cursor)
+            oldest_seq = self._events[0].seq if self._events else self._last_seq + 1
+            if seq is None or seq < oldest_seq - 1:
+                return [], self.latest_cursor(), True
+            # The sequence numbers in the deque are consecutive, so the events are found by position,
+            # iterating from the nearer end of the deque, as subscribers usually read the latest events.
+            count = len(self._events)
+            start = seq + 1 - oldest_seq
+            stop = min(count, start + limit)
+            if start <= count - stop:
+                events = list(islice(self._events, start, stop))
+            else:
+                events = list(islice(reversed(self._events), count - stop, count - start))[::-1]
+        return events, events[-1].cursor if events else cursor, False
+
+    async def read_async(
+        self, cursor: str = "", limit: int = 100, timeout: float = 0.0
+    ) -> tuple[list[ChangeEvent], str, bool]:
+        """
+        Like `read()`, but wait for an event on the running event loop instead of blocking a thread,
+        e.g., for the many subscribers of a server's change stream.
+
+        Returns:
+            The same tuple as `read()`.
+        """
+        loop = asyncio.get_running_loop()
+        new_events = asyncio.Event()
+
+        def wake():
+            loop.call_soon_threadsafe(new_events.set)
+
+        with self._new_events:
+            self._wakers.add(wake)
+        try:
+            deadline = loop.time() + timeout
+            while True:
+                # Cleared before reading, so an event published after the read sets it again.
+                new_events.clear()
+                events, next_cursor, reset = self.read(cursor, limit)
+                remaining = deadline - loop.time()
+                if events or reset or not cursor or remaining <= 0:
+                    return events, next_cursor, reset
+                try:
+                    await asyncio.wait_for(new_events.wait(), remaining)
+                except TimeoutError:
+                    pass
+        finally:
+            with self._new_events:
+                self._wakers.discard(wake)
@@ -0,0 +1,115 @@
+"""
+An index of half-open time intervals, e.g., appointments with durations, for overlap checks
+and free-interval searches.
+
+The intervals are kept in a list sorted by their start times. Since no interval is longer
+than the longest one added, the intervals that overlap a window all start in the window or
+at most that long before it, so a query bisects the list for that range and takes time
+O(log n + k) for the k intervals in the range, however many intervals there are.
+"""
+
+# Allow types to self-reference during their definitions.
+from __future__ import annotations
+
+from bisect import bisect_left, insort
+from collections.abc import Iterator
+from datetime import datetime, timedelta
+from operator import itemgetter
+
+# Too many of these warnings for variables that ARE used in other files.
+# pylint: disable=unused-variable
+
+
+class IntervalIndex:
+    """Half-open `[start, end)` intervals, each identified by an id, sorted by their starts."""
+
+    def __init__(self):
+        # (start, id) pairs, sorted, so ties are broken by id and each pair can be found by bisection.
+        self._entries: list[tuple[datetime, str]] = []
+        self._interval_of: dict[str, tuple[datetime, datetime]] = {}
+        # An upper bound on the length of the intervals, which isn't lowered when intervals are removed.
+        self._max_length = timedelta(0)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, interval_id: object) -> bool:
+        return interval_id in self._interval_of
+
+    def add(self, interval_id: str, start: datetime, end: datetime):
+        """Add or replace the interval for the id. Empty intervals, where `end <= start`, aren't added."""
+        self.discard(interval_id)
+        if end <= start:
+            return
+        insort(self._entries, (start, interval_id))
+        self._interval_of[interval_id] = (start, end)
+        self._max_length = max(self._max_length, end - start)
+
+    def discard(self, interval_id: str):
+        """Remove the interval for the id, if present."""
+        interval = self._interval_of.pop(interval_id, None)
+        if interval is not None:
+            del self._entries[bisect_left(self._entries, (interval[0], interval_id))]
+
+    def clear(self):
+        """Remove all the intervals."""
+        self._entries = []
+        self._interval_of = {}
+        self._max_length = timedelta(0)
+
+    def get(self, interval_id: str) -> tuple[datetime, datetime] | None:
+        """The `(start, end)` of the interval for the id, or `None`."""
+        return self._interval_of.get(interval_id)
+
+    def overlapping(self, start: datetime, end: datetime) -> Iterator[tuple[str, datetime, datetime]]:
+        """Yield the `(id, start, end)` of the intervals that overlap `[start, end)`, in the order of their starts."""
+        key = itemgetter(0)
+        lo = bisect_left(self._entries, start - self._max_length, key=key)
+        hi = bisect_left(self._entries, end, key=key)
+        for i in range(lo, hi):
+            interval_id = self._entries[i][1]
+            interval_start, interval_end = self._interval_of[interval_id]
+            if interval_end > start:
+                yield interval_id, interval_start, interval_end
+
+    def overlaps(self, start: datetime, end: datetime, ignore_id: str = "") -> bool:
+        """True if any interval, other than the one for `ignore_id`, overlaps `[start, end)`."""
+        return any(interval_id != ignore_id for interval_id, _start, _end in self.overlapping(start, end))
+
+    def busy(self, start: datetime, end: datetime) -> list[tuple[datetime, datetime]]:
+        """The union of the intervals that overlap `[start, end)`, as sorted, disjoint intervals, clipped to it."""
+        merged: list[tuple[datetime, datetime]] = []
+        for _interval_id, interval_start, interval_end in self.overlapping(start, end):
+            interval_start = max(interval_start, start)
+            interval_end = min(interval_end, end)
+            if merged and interval_start <= merged[-1][1]:
+                merged[-1] = (merged[-1][0], max(merged[-1][1], interval_end))
+            else:
+                merged.append((interval_start, interval_end))
+        return merged
+
+    def gaps(
+        self, start: datetime, end: datetime, min_length: timedelta = timedelta(0)
+    ) -> list[tuple[datetime, datetime]]:
+        """The free intervals in `[start, end)` that are at least `min_length` long, in order."""
+        free = []
+        free_start = start
+        for busy_start, busy_end in self.busy(start, end) + [(end, end)]:
+            if busy_start - free_start >= min_length and busy_start > free_start:
+                free.append((free_start, busy_start))
+            free_start = max(free_start, busy_end)
+        return free
+
+    def free_starts(
+        self, start: datetime, end: datetime, length: timedelta, step: timedelta, origin: datetime
+    ) -> Iterator[datetime]:
+        """
+        Yield the times in `[start, end)` on the grid of `step`s from `origin` when an interval
+        of `length` fits in one of the `gaps()`, in order.
+        """
+        for free_start, free_end in self.gaps(start, end, length):
+            # Round up to the grid.
+            dt = origin - (origin - free_start) // step * step
+            while dt + length <= free_end:
+                yield dt
+                dt += step
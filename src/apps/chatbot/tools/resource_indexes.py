@@ -0,0 +1,117 @@
+"""
+The in-memory indexes a `ResourceManager` keeps for its resources, maintained as the
+resources change: the secondary indexes by field, the ids of the active resources, i.e.,
+those that aren't ignored, for counting them in constant time, and a `SlotIndex` of their
+unique datetimes.
+"""
+
+# Allow types to self-reference during their definitions.
+from __future__ import annotations
+
+from collections.abc import Mapping
+from typing import Any
+
+from .resource_query import Eq, HashIndex, ResourceIndex, TrigramIndex, make_index
+from .slot_index import SlotIndex
+
+# Too many of these warnings for variables that ARE used in other files.
+# pylint: disable=unused-variable
+
+
+class ResourceIndexes:
+    """The secondary indexes, active ids, and slot index of a collection of resources."""
+
+    def __init__(self, secondary_indexes: Mapping[str, str]):
+        """
+        Initialize the indexes.
+
+        Args:
+            - secondary_indexes (Mapping[str, str]): The fields to index, mapped to the kind of index.
+              See `resource_query.make_index()`.
+        """
+        self.fields: dict[str, ResourceIndex] = {field: make_index(kind) for field, kind in secondary_indexes.items()}
+        self.active_ids: set[str] = set()
+        # The inactive resources, which are only in memory until they are next loaded from storage.
+        self.inactive_ids: set[str] = set()
+        self.slots = SlotIndex()
+        # False until the indexes reflect the resources, e.g., after a lazy load. The owner rebuilds them.
+        self.built = True
+
+    def add(self, resource: Mapping[str, Any], active: bool, datetime_key: str = "", scope: Any = ""):
+        """
+        Add the resource, which must have an id, to the indexes. The secondary indexes include
+        inactive resources, but only active ones are counted and added to the slot index, with
+        their `datetime_key` value, if a key is given, in the scope.
+        """
+        resource_id = resource["id"]
+        for field, index in self.fields.items():
+            value = resource.get(field)
+            if value is not None:
+                index.add(resource_id, value)
+        if not active:
+            self.inactive_ids.add(resource_id)
+            return
+        self.active_ids.add(resource_id)
+        if datetime_key:
+            self.slots.add(resource_id, resource.get(datetime_key), scope)
+
+    def discard(self, resource_id: str):
+        """Remove the resource from the indexes, if present."""
+        for index in self.fields.values():
+            index.discard(resource_id)
+        self.active_ids.discard(resource_id)
+        self.inactive_ids.discard(resource_id)
+        self.slots.discard(resource_id)
+
+    def clear(self):
+        """Remove all the resources, so the indexes can be rebuilt."""
+        self.built = True
+        self.active_ids = set()
+        self.inactive_ids = set()
+        self.slots.clear()
+        for index in self.fields.values():
+            index.clear()
+
+    def counts(self, field: str) -> Mapping[Any, int]:
+        """
+        The number of active resources for each value of `field`, which must have a "hash" index.
+        Inactive resources aren't counted, so the counts don't depend on which of them are still in
+        memory. This takes time proportional to the number of distinct values and inactive resources.
+        """
+        index = self.fields.get(field)
+        if not isinstance(index, HashIndex):
+            raise TypeError(f"Field {field} doesn't have a hash index, so it can't be counted.")
+        counts = index.counts()
+        for resource_id in self.inactive_ids:
+            value = index.value_of(resource_id)
+            if value is not None:
+                counts[value] -= 1
+                if not counts[value]:
+                    del counts[value]
+        return counts
+
+    def similar_values(self, field: str, text: str, threshold: float = 0.4, limit: int = 10) -> list[tuple[str, float]]:
+        """
+        Find the values of `field` that are similar to `text`, e.g., names that differ in case,
+        punctuation, or middle initials, using the field's "trigram" index. Values used only by
+        inactive resources aren't returned.
+
+        Args:
+            - field (str): The field, which must have a "trigram" index.
+            - text (str): The text to match.
+            - threshold (float): The minimum `trigram_similarity()`, from 0.0 to 1.0.
+            - limit (int): The maximum number of values to return.
+
+        Returns:
+            A list of `(value, similarity)` tuples, most similar first.
+        """
+        index = self.fields.get(field)
+        if not isinstance(index, TrigramIndex):
+            raise TypeError(f"Field {field} doesn't have a trigram index, so it can't be searched.")
+        found = []
+        for value, similarity in index.search(text, threshold):
+            if len(found) >= limit:
+                break
+            if not self.active_ids.isdisjoint(index.candidates(Eq(value))):
+                found.append((value, similarity))
+        return found
@@ -6,39 +6,100 @@ Abstraction for tool that manages "resources".
 from __future__ import annotations
 
 import logging
-from collections.abc import Callable, MutableMapping, Sequence
+from collections.abc import Callable, Generator, Iterable, Iterator, Mapping, MutableMapping, Sequence
+from contextlib import contextmanager
 from datetime import datetime, timedelta
 from pathlib import Path
 from typing import Any
 from uuid import uuid4
 
 from common.date_time_utils import now
-from common.file_persistent_storage import FilePersistentStorage
+from common.jsonl_offset_index import LazyRecords
+from common.monthly_archive import MonthlyArchive
+from common.persistent_storage import PersistentStorage, open_storage
 
+from .change_feed import CANCEL, CHANGE, CREATE, REMOVE, ChangeFeed
+from .resource_indexes import ResourceIndexes
+from .resource_query import Eq, plan_query
+from .resource_snapshot import SnapshotFile
+from .resource_transaction import Transaction, UndoLog, UpdateValidator
 
-class ResourceManager:
+# The error message for updates to resources that don't exist.
+NO_SUCH_RESOURCE_MSG = "There is no resource with the input ID."
+
+
+class ResourceManager:  # pylint: disable=too-many-instance-attributes
     """
     A simple tool for managing "resources" using local file storage for persistence.
 
-    Resources are stored in a JSONL file where each line is a JSON object
-    representing a resource instance. The method return values are designed
+    By default, resources are stored in a JSONL file where each line is a JSON object
+    representing a resource instance. A SQLite database can be used instead. The method return values are designed
     support LLMs in an agent context.
 
     In memory, the resources are stored as a mapping of the resource id as the
     key and the resource as the value, for efficient lookup by id, but most
     methods just accept or return sequences of resource values.
 
+    Subclasses can also declare `secondary_indexes` for fields that are commonly
+    used in criteria. When criteria use the declarative predicates in `resource_query`,
+    e.g., `Eq` and `Range`, `get_resources_by_criteria()` uses the most selective
+    index to find candidates instead of checking every resource. See `ResourceIndexes`.
+
+    If a subclass sets `unique_datetime_key`, the datetimes for that key in the
+    non-ignored resources are kept in a `SlotIndex`, keyed by the whole epoch second,
+    so checking whether a datetime is already reserved doesn't scan all the resources.
+    If it also sets `unique_datetime_scope_key`, e.g., for one calendar per provider, the
+    datetimes only need to be unique among the resources with the same value for that key.
+    The index is maintained by the methods that create, update, remove, and load
+    resources, so modify resources through them, e.g., `update_resource()`, rather
+    than mutating the dictionaries returned by the getters.
+
     NOTE: You will see a number of log messages with two versions, a "sanitized"
     version that passes CodeQL checks for leaking sensitive information into logs,
     and a commented-out version with more information that can be used temporarily
     for debugging, but shouldn't be left "on".
+
+    Set `snapshot_interval` to restart from periodic snapshots of the live resources instead
+    of reading every record; see `SnapshotFile`. Set `archive_dir` and call `archive_resources()`
+    to move the resources with a `unique_datetime_key` value before a cutoff into a `MonthlyArchive`.
+    Use `begin()` to group creates and updates into an all-or-nothing `Transaction`, written with
+    a single write, and pass an idempotency key to `create_resource()` so retrying a create that
+    may have succeeded doesn't create a duplicate.
+
+    Every change written by this manager, or read from other processes sharing the storage,
+    is published to the `changes` feed, so subscribers can follow the changes instead of
+    re-reading all the resources. See `ChangeFeed`. Updates that make a resource ignored,
+    e.g., cancelling an appointment, are "cancel" events, other updates are "change" events.
     """
 
+    # The key for datetimes that must be unique across non-ignored resources, if any.
+    unique_datetime_key: str = ""
+
+    # The key whose values partition the slot index, if any. A missing value is the '' scope.
+    unique_datetime_scope_key: str = ""
+
+    # Fields to index, mapped to the kind of index, "hash", "sorted", or "trigram". See `resource_query.make_index()`.
+    secondary_indexes: Mapping[str, str] = {}
+
+    # The field that holds the idempotency key a resource was created with, if any.
+    idempotency_key_field: str = "idempotency_key"
+
+    # Datetime fields the storage may decode lazily, as `LazyDatetime`s. Only set them when
+    # `_make_resource()` returns records that parse those values when they are read, like `Appointment`.
+    lazy_datetime_keys: frozenset[str] = frozenset()
+
     def __init__(
         self,
         resources_file: Path | str,
         start_empty: bool = False,
         logger: logging.Logger | None = None,
+        compaction_ratio: float = 0.5,
+        storage: PersistentStorage | None = None,
+        storage_options: Mapping[str, Any] | None = None,
+        lazy_load: bool = False,
+        snapshot_interval: int = 0,
+        archive_dir: Path | str | None = None,
+        change_feed_size: int = 10_000,
     ):
         """
         Initialize the manager.
@@ -47,6 +108,23 @@ class ResourceManager:
             - resources_file (Path | str): Path to the JSONL file storing the resources
             - start_empty (bool): True if we should clear the file and start "empty" or False if we should just load whatever resources the file already contains.
             - logger (logging.Logger | None): Optional logger instance; it not provided a default logger is created
+            - compaction_ratio (float): The fraction of superseded records in the storage file that triggers
+              a background compaction of the file. Use 0.0 to disable automatic compaction.
+            - storage (PersistentStorage | None): The storage to use. If `None`, the storage is chosen
+              by `open_storage()` from the `resources_file` suffix: SQLite for `.db` and `.sqlite` files,
+              otherwise JSONL. The fields in `secondary_indexes` are indexed columns in SQLite.
+            - storage_options (Mapping[str, Any] | None): Other options passed to `open_storage()` for
+              JSONL files, e.g., `{"group_commit": True, "durability": "fsync_batch"}`, or
+              `{"partition_key": "appointment_date_time"}` for one file per month in a directory.
+            - lazy_load (bool): If True, resources are decoded from storage when first accessed,
+              using the storage's `replay_by_id()`, and the indexes are built by the first method
+              that needs them, e.g., a query or a create, so startup doesn't parse every record.
+            - snapshot_interval (int): If positive, save a snapshot of the resources when at least this
+              many records were written since the last one, and start from the latest valid snapshot.
+              Use 0 to disable snapshots. They aren't used with `lazy_load`. See `SnapshotFile`.
+            - archive_dir (Path | str | None): If not `None`, the directory for the monthly archive
+              files used by `archive_resources()`. Requires a `unique_datetime_key`.
+            - change_feed_size (int): The number of the latest change events kept in the `changes` feed.
         """
         if logger:
             self.logger: logging.Logger = logger
@@ -54,20 +132,109 @@ class ResourceManager:
             self.logger = logging.getLogger(self.__class__.__name__)
             self.logger.setLevel(logging.INFO)
 
-        self.storage = FilePersistentStorage(Path(resources_file), logger, remove_old=start_empty)
+        if storage:
+            self.storage = storage
+            if start_empty:
+                self.storage.clear()
+        else:
+            self.storage = open_storage(
+                Path(resources_file),
+                logger,
+                remove_old=start_empty,
+                indexed_fields=list(self.secondary_indexes),
+                compaction_ratio=compaction_ratio,
+                background_compaction=True,
+                **(storage_options or {}),
+            )
+        if self.lazy_datetime_keys:
+            self.storage.lazy_datetime_keys = self.lazy_datetime_keys
         self.resources: MutableMapping[str, MutableMapping[str, Any]] = {}
+        # The ids of the resources created with idempotency keys are found with a hash index.
+        self._indexes = ResourceIndexes({self.idempotency_key_field: "hash", **self.secondary_indexes})
+        self.changes = ChangeFeed(change_feed_size)
+        self.lazy_load = lazy_load
+        self.snapshots = SnapshotFile(
+            self.storage, 0 if lazy_load else snapshot_interval, type(self).__qualname__, self.logger
+        )
+        self.archive = MonthlyArchive(archive_dir, self.unique_datetime_key, self.logger) if archive_dir else None
         if start_empty:
+            self.snapshots.remove()
             self.logger.info("Starting 'empty' with no resource records")
         else:
             all_count, loaded_count, errors = self._load_resources()
-            self.logger.info(f"Loaded {loaded_count}/{all_count} resource records read)")
+            self.logger.info("Loaded %d/%d resource records read", loaded_count, all_count)
             if errors:
-                self.logger.error(f"Errors while loading resource records: {', '.join(errors)}")
+                self.logger.error("Errors while loading resource records: %s", ", ".join(errors))
+            # Startup is the natural time to drop the versions superseded in previous runs.
+            self.storage.maybe_compact()
+            self._maybe_save_snapshot()
 
     def clear(self):
         """Remove all resources and clear the persistent records."""
         self.resources.clear()
+        self._rebuild_indexes()
         self.storage.clear()
+        self.snapshots.remove()
+        self.changes.reset()
+
+    def archive_resources(self, before: datetime) -> int:
+        """
+        Move the resources whose `unique_datetime_key` value is before the cutoff, including ignored
+        ones that are still in storage, e.g., cancelled appointments, from storage and memory into the
+        archive. See `MonthlyArchive.move_from()`. Call it occasionally, e.g., at startup.
+
+        Args:
+            - before (datetime): Archive the resources with earlier datetimes.
+
+        Returns:
+            The count of resources archived.
+        """
+        if self.archive is None:
+            raise ValueError("No archive_dir was given, so resources can't be archived.")
+        with self.synchronized():
+            archived = self.archive.move_from(self.storage, before)
+            if not archived:
+                return 0
+            for record in archived:
+                self._discard_resource(record["id"])
+            self.snapshots.writes_since_save = self.storage.record_count
+            self._maybe_save_snapshot()
+        self.logger.info("Archived %d resources.", len(archived))
+        return len(archived)
+
+    def get_archived_resources(
+        self, low: datetime | None = None, high: datetime | None = None
+    ) -> Iterator[MutableMapping[str, Any]]:
+        """
+        Stream the archived resources with a `unique_datetime_key` value between `low` and `high`,
+        inclusive, including ignored ones. See `MonthlyArchive.read()`. Yields nothing if there is no archive.
+        """
+        if self.archive is not None:
+            for record in self.archive.read(low, high):
+                yield self._make_resource(record)
+
+    def _maybe_save_snapshot(self):
+        """
+        Save a snapshot of the resources that aren't ignored, if one is due, pickling a shallow copy
+        of them on a background thread. See `SnapshotFile`.
+        """
+        if self.snapshots.due and not self.snapshots.saving:
+            with self.synchronized():
+                resources = {rid: r for rid, r in self.resources.items() if not self._ignore(r)}
+                self.snapshots.save(resources, background=True)
+
+    def _load_snapshot(self) -> tuple[int, int, Sequence[str]] | None:
+        """
+        Load the resources from the latest snapshot, then apply the records written after it.
+        Returns the same tuple as `_load_resources()`, or `None` if there is no valid snapshot.
+        """
+        loaded = self.snapshots.load()
+        if loaded is None:
+            return None
+        self.resources, (saved, removed, errors) = loaded
+        self._rebuild_indexes()
+        self._apply_changes(saved, removed)
+        return self.storage.record_count + len(errors), len(self.resources), errors
 
     def get_resources(self) -> Sequence[MutableMapping[str, Any]]:
         """
@@ -77,18 +244,16 @@ class ResourceManager:
             A mapping of ids to maps, one map for each resource, where the
             resource map also has the id as a member.
         """
+        self.refresh()
         return list(self.resources.values())
 
     def get_resources_count(self) -> int:
         """
         Return the number of resources, ignoring those where
-        `self._ignore(resource)` returns `True`.
+        `self._ignore(resource)` returns `True`. The count is maintained
+        as resources change, so this takes constant time.
         """
-        count = 0
-        for resource in self.resources.values():
-            if not self._ignore(resource):
-                count += 1
-        return count
+        return len(self._current_indexes().active_ids)
 
     def get_resource_by_id(self, resource_id: str) -> MutableMapping[str, Any]:
         """
@@ -100,6 +265,7 @@ class ResourceManager:
         Returns:
             Resource dictionary or {} if not found
         """
+        self.refresh()
         return self.resources.get(resource_id, {})
 
     @classmethod
@@ -149,6 +315,10 @@ class ResourceManager:
         resource's corresponding value and if `True` is returned, then the value
         matches. Finally,  Also, resources are ignored if `self._ignore(resource)` returns `True`.
 
+        When `v` is a declarative `resource_query.Predicate`, e.g., `Eq("John Doe")`, and
+        the key has a secondary index, only the candidates from the most selective such
+        index are checked. Plain callables are supported, but they can't use the indexes.
+
         Args:
             - criteria (MutableMapping[str,Callable[[Any],bool]]): A non-empty dictionary of
               key-value pairs for finding matches. See the method comments for
@@ -161,12 +331,20 @@ class ResourceManager:
         Returns:
             Sequence[MutableMapping[str,Any]] with resources that match the criteria, or [] if no matches are found.
         """
-        found = ResourceManager.get_resources_by_criteria_from(
-            list(self.resources.values()),
-            criteria,
-            sort_by_key,
-        )
-        return list(filter(lambda res: not self._ignore(res), found))
+        plan = plan_query(criteria, self._current_indexes().fields)
+        if plan.candidate_ids is None:
+            candidates: Iterable[MutableMapping[str, Any]] = self.resources.values()
+        else:
+            candidates = (self.resources[resource_id] for resource_id in plan.candidate_ids)
+        found = [
+            res
+            for res in candidates
+            if not self._ignore(res) and ResourceManager.resource_matches_criteria(res, criteria)
+        ]
+        if sort_by_key and sort_by_key != plan.ordered_by:
+            # Break ties by id, like the sorted indexes do.
+            found.sort(key=lambda res: (res[sort_by_key], res["id"]))
+        return found
 
     def get_resource_ids_by_criteria(self, criteria: MutableMapping[str, Any]) -> Sequence[str]:
         """
@@ -189,71 +367,370 @@ class ResourceManager:
         Remove a resource. This means it is logically no longer part
         of the collection of resources. If no matching resource is found
         for the input `resource_id`, a `ValueError` is raised. If the flag
-        `write_to_storage` is true, then the storage file is rewriting with
-        the remaining collection of resources.
+        `write_to_storage` is true, then a tombstone for the resource is
+        appended to the storage file, so it isn't loaded again.
+        """
+        with self.synchronized():
+            if self._discard_resource(resource_id) is None:
+                raise ValueError("An input ID is not in the resources.")
+                # raise ValueError(f"ID {resource_id} not in the resources.")
+            self.changes.publish(REMOVE, resource_id, None)
+            if write_to_storage:
+                self.snapshots.writes_since_save += self.storage.remove([resource_id])
+                self._maybe_save_snapshot()
+
+    def update_resource(self, resource_id: str, changes: MutableMapping[str, Any]) -> tuple[bool, str]:
+        """
+        Update the fields of an existing resource with the key-value pairs in
+        `changes`, keeping the indexes in sync, and append the new version of
+        the resource to the storage file. No validation is done here; callers
+        validate the changes first. If persisting fails, the changes are undone.
+
+        Args:
+            - resource_id (str): The id of the resource to update.
+            - changes (MutableMapping[str,Any]): The new field values.
+
+        Returns:
+            A tuple with `(True, '')` on success or `(False, error_message)` on failure.
+        """
+        return self.update_resources([(resource_id, changes)])[0]
+
+    def update_resources(
+        self,
+        updates: Sequence[tuple[str, MutableMapping[str, Any]]],
+        validate: UpdateValidator | None = None,
+    ) -> list[tuple[bool, str]]:
+        """
+        Like `update_resource()` for a batch of `(resource_id, changes)` pairs. Each update is
+        checked with `validate(resource, changes)`, if given, after the earlier updates in the
+        batch were applied in memory, so it sees them, e.g., in the slot index. The changed
+        resources are then persisted with a single write. If that fails, all the changes are
+        undone.
+
+        Returns:
+            A list with one `(success, error_message)` tuple per update, in the input order.
+        """
+        results: list[tuple[bool, str]] = []
+        undo = self._undo_log()
+        with self.synchronized():
+            for resource_id, changes in updates:
+                updated_id, message = self._apply_update(resource_id, changes, validate, undo)
+                results.append((updated_id != "", message))
+            error_msg = self._write_changes(undo)
+        if error_msg:
+            return [(False, error_msg) if success else (success, msg) for success, msg in results]
+        return results
+
+    def _undo_log(self) -> UndoLog:
+        """An `UndoLog` for `self.resources` that keeps the indexes in sync, and drops snapshots saved since on undo."""
+        saves = self.snapshots.saves
+        return UndoLog(self._index_resource, self._unindex_resource, lambda: self.snapshots.invalidate(saves))
+
+    def begin(self) -> Transaction:
+        """Start a transaction. Add changes to it, then call its `commit()`."""
+        return Transaction(self._commit)
+
+    def _commit(self, transaction: Transaction) -> tuple[list[str], str]:
+        """Apply the transaction's changes. See `Transaction.commit()`."""
+        undo = self._undo_log()
+        ids: list[str] = []
+        error_msg = ""
+        with self.synchronized():
+            for change in transaction.changes:
+                if change.resource_id is None:
+                    resource_id, error_msg = self._apply_create(change.fields, change.idempotency_key, undo)
+                else:
+                    resource_id, error_msg = self._apply_update(
+                        change.resource_id, change.fields, change.validate, undo
+                    )
+                if error_msg:
+                    break
+                ids.append(resource_id)
+            if error_msg:
+                undo.undo(self.resources)
+            else:
+                error_msg = self._write_changes(undo)
+        if error_msg:
+            self.logger.error("The transaction failed, so no changes were made: %s", error_msg)
+            return [], error_msg
+        return ids, ""
+
+    def _write_changes(self, undo: UndoLog) -> str:
+        """
+        Persist the resources changed in memory with a single write, then publish the changes.
+        If the write fails, the changes are undone. Returns '' on success or the error message.
+        """
+        changed = list(undo.changed.items())
+        if not changed:
+            return ""
+        _count, error_msg = self._persist_resources([resource for _resource_id, resource in changed])
+        if error_msg:
+            undo.undo(self.resources)
+            return error_msg
+        for resource_id, resource in changed:
+            if resource_id in undo.created_ids:
+                self.changes.publish(CREATE, resource_id, resource)
+            else:
+                self._publish_updates([resource])
+        return ""
+
+    def _apply_create(
+        self,
+        fields: MutableMapping[str, Any],
+        idempotency_key: str,
+        undo: UndoLog,
+    ) -> tuple[str, str]:
+        """
+        Validate and add a new resource in memory, with a new id and the idempotency key, if any,
+        unless one was already created with the key. The input fields aren't changed.
+
+        Returns:
+            A tuple with `(id, '')` on success or `('', error_message)` on failure.
+        """
+        existing_id = self._idempotent_id(idempotency_key)
+        if existing_id:
+            return existing_id, ""
+        success, message = self._is_valid_resource(fields)
+        if not success:
+            return "", message
+        resource_id = str(uuid4())
+        fields = {**fields, "id": resource_id}
+        if idempotency_key:
+            fields[self.idempotency_key_field] = idempotency_key
+        undo.create(self.resources, self._make_resource(fields))
+        return resource_id, ""
+
+    def _apply_update(
+        self,
+        resource_id: str,
+        changes: MutableMapping[str, Any],
+        validate: UpdateValidator | None,
+        undo: UndoLog,
+    ) -> tuple[str, str]:
         """
-        if resource_id not in self.resources:
-            raise ValueError("An input ID is not in the resources.")
-            # raise ValueError(f"ID {resource_id} not in the resources.")
-        del self.resources[resource_id]
-        if write_to_storage:
-            self.save_resources()
+        Validate and apply an update in memory.
+
+        Returns:
+            A tuple with `(id, '')` on success or `('', error_message)` on failure.
+        """
+        resource = self.resources.get(resource_id)
+        if resource is None:
+            return "", NO_SUCH_RESOURCE_MSG
+        if validate:
+            success, message = validate(resource, changes)
+            if not success:
+                return "", message
+        undo.update(resource, changes)
+        return resource_id, ""
+
+    def _publish_updates(self, resources: Iterable[MutableMapping[str, Any]]):
+        """Publish "cancel" events for the updated resources that are now ignored and "change" events for the others."""
+        for resource in resources:
+            self.changes.publish(CANCEL if self._ignore(resource) else CHANGE, resource["id"], resource)
+
+    def _idempotent_id(self, idempotency_key: str) -> str:
+        """The id of the resource created with the idempotency key, or '' if there isn't one."""
+        if not idempotency_key:
+            return ""
+        self._ensure_indexes()
+        candidates = self._indexes.fields[self.idempotency_key_field].candidates(Eq(idempotency_key))
+        return next((resource_id for resource_id in candidates if resource_id in self.resources), "")
+
+    def refresh(self):
+        """
+        If the storage is shared with other processes, apply the changes they made since the
+        resources were last read, so validation, e.g., of a reserved time slot, sees them.
+        Only the newly appended records are read, unless another process replaced the storage
+        file, e.g., by compacting it, in which case all the resources are loaded again.
+        """
+        if not self.storage.shared:
+            return
+        changes = self.storage.tail()
+        if changes is None:
+            self.logger.info("The storage was replaced by another process, so reloading the resource records.")
+            self._load_resources()
+            self.changes.reset()
+            return
+        saved, removed, errors = changes
+        if errors:
+            self.logger.error("%d new records from storage failed to parse: %s", len(errors), errors)
+        self._apply_changes(saved, removed, publish=True)
+
+    def _apply_changes(
+        self,
+        saved: Mapping[str, MutableMapping[str, Any]],
+        removed: Iterable[str],
+        publish: bool = False,
+    ):
+        """
+        Apply the changes returned by the storage's `tail()` to the resources and indexes.
+        If `publish` is True, e.g., for changes made by other processes, publish them to the change feed.
+        """
+        for resource_id in removed:
+            if self._discard_resource(resource_id) is not None and publish:
+                self.changes.publish(REMOVE, resource_id, None)
+        for resource_id, resource in saved.items():
+            old = self._discard_resource(resource_id)
+            # As when loading, ignore resources like cancelled appointments.
+            if not self._ignore(resource):
+                resource = self._make_resource(resource)
+                self.resources[resource_id] = resource
+                self._index_resource(resource)
+            if publish:
+                if old is None and not self._ignore(resource):
+                    self.changes.publish(CREATE, resource_id, resource)
+                elif old is not None:
+                    self._publish_updates([resource])
+
+    @contextmanager
+    def synchronized(self) -> Generator[None]:
+        """
+        Hold the storage's exclusive lock and apply any changes made by other processes,
+        so a caller can validate and write a change without another process writing in between.
+        Nested uses are allowed. Does nothing if the storage isn't shared.
+        """
+        if self.storage.shared:
+            with self.storage.exclusive():
+                self.refresh()
+                yield
+        else:
+            yield
+
+    def _index_resource(self, resource: MutableMapping[str, Any]):
+        """
+        Add the resource to the indexes. The slot index skips resources for which
+        `self._ignore(resource)` returns `True`, but the secondary indexes don't.
+        """
+        if not resource.get("id") or not self._indexes.built:
+            return
+        key = self.unique_datetime_key
+        self._indexes.add(resource, not self._ignore(resource), key, self._scope_of(resource) if key else "")
+
+    def _unindex_resource(self, resource: MutableMapping[str, Any]):
+        """Remove the resource from the indexes, if present."""
+        resource_id = resource.get("id")
+        if resource_id and self._indexes.built:
+            self._indexes.discard(resource_id)
+
+    def _discard_resource(self, resource_id: str) -> MutableMapping[str, Any] | None:
+        """Remove the resource from memory and the indexes. Returns it, or `None` if it isn't present."""
+        resource = self.resources.pop(resource_id, None)
+        if resource is not None:
+            self._unindex_resource(resource)
+        return resource
+
+    def _rebuild_indexes(self):
+        """Rebuild the indexes from `self.resources`."""
+        self._indexes.clear()
+        for resource in self.resources.values():
+            self._index_resource(resource)
+
+    def _ensure_indexes(self):
+        """
+        Build the indexes if they were deferred by a lazy load. Until then, changes to
+        `self.resources` don't need to update the indexes, because this rebuilds them.
+        """
+        if not self._indexes.built:
+            self._rebuild_indexes()
+
+    def _current_indexes(self) -> ResourceIndexes:
+        """The indexes, after applying any changes made by other processes and building them if they were deferred."""
+        self.refresh()
+        self._ensure_indexes()
+        return self._indexes
+
+    def _scope_of(self, resource: Mapping[str, Any]) -> Any:
+        """The slot index scope of the resource, its `unique_datetime_scope_key` value, or ''."""
+        if not self.unique_datetime_scope_key:
+            return ""
+        return resource.get(self.unique_datetime_scope_key) or ""
+
+    def _make_resource(self, fields: MutableMapping[str, Any]) -> MutableMapping[str, Any]:
+        """
+        A hook that subclasses can override to convert the fields of a resource, e.g., a
+        record decoded from storage, into the object kept in `self.resources`, such as a
+        more compact record type. It must still be a `MutableMapping`. By default, the
+        fields are kept as they are.
+        """
+        return fields
 
     def _ignore(self, resource: MutableMapping[str, Any]) -> bool:
         """
         A hook that subclasses can override to tell methods to "ignore"
         a resource for various actions. This is designed to support a few
-        scenarios. One scenario is when updates to a resource are written
-        to the persistent file, but older versions of the resource exist
-        earlier in the file and we want to ignore them.
+        scenarios. One scenario is when the latest version of a resource
+        marks it as logically inactive, e.g., a cancelled appointment, but
+        it is kept in storage for historical reasons.
         """
         return False
 
     def _load_resources(self) -> tuple[int, int, Sequence[str]]:
         """
-        Load resources from the JSONL file. `self._ignore(resource)` is called
-        on all loaded resources and any of them for which `True` is returned
-        are ignored.
+        Load resources from the JSONL file. The file is replayed so the last
+        version written for each resource id wins and removed resources are
+        dropped. `self._ignore(resource)` is called on all loaded resources and
+        any of them for which `True` is returned are ignored.
 
         Returns:
             A tuple `(all_count, loaded_count, list[messages])`, where `all_count`
-            is the count of all resource records in storage, `loaded_count`, which
+            is the count of all resource records in storage, including superseded
+            versions, `loaded_count`, which
             is <= `all_count`, is the number of resources that were successfully
             parsed and not filtered out by `self._ignore()`, and `list[messages]`
             are error messages, one per resource parse error, or [] if no errors
             occurred.
         """
-        resources, errors = self.storage.load()
-        loaded_count = len(resources)
-        error_count = len(errors)
-        all_count = loaded_count + error_count
+        if self.lazy_load:
+            return self._load_resources_lazily()
+        if self.snapshots.interval:
+            counts = self._load_snapshot()
+            if counts is not None:
+                return counts
+        resources, errors = self.storage.replay()
+        # Only load "non-ignorable" resources and those with ids.
+        kept = [resource for resource in resources if not self._ignore(resource)]
+        self.resources = {resource["id"]: self._make_resource(resource) for resource in kept if resource.get("id")}
+        anonymous_count = sum(1 for resource in kept if not resource.get("id"))
+        all_count = self._log_load_errors(errors, anonymous_count)
+        self._rebuild_indexes()
+        self.snapshots.writes_since_save = self.storage.record_count
+        return all_count, len(resources) - anonymous_count, errors
+
+    def _load_resources_lazily(self) -> tuple[int, int, Sequence[str]]:
+        """
+        Like `_load_resources()`, but leave the resources to be decoded when first accessed
+        and defer building the indexes. Resources for which `self._ignore(resource)` returns
+        `True` are dropped when they are decoded, so `loaded_count` may include some of them.
+        """
+        resources, anonymous, errors = self.storage.replay_by_id(
+            keep=lambda resource: not self._ignore(resource), convert=self._make_resource
+        )
+        all_count = self._log_load_errors(errors, len(anonymous))
+        self.resources = resources
+        self._indexes.built = False
+        loaded_count = resources.key_count if isinstance(resources, LazyRecords) else len(resources)
+        return all_count, loaded_count, errors
+
+    def _log_load_errors(self, errors: list[str], anonymous_count: int) -> int:
+        """
+        Log the records that failed to parse, adding an error for each of the `anonymous_count` resources
+        without an id. Returns the count of all the records in storage, including the ones that failed.
+        """
+        all_count = self.storage.record_count + len(errors)
         if errors:
             self.logger.error(
-                f"{error_count}/{all_count} records from storage file failed to parse: {errors}"
-                # f"{error_count}/{all_count} records from storage file {self.storage.storage_path} failed to parse: {errors}"
+                "%d/%d records from storage file failed to parse: %s",
+                len(errors),
+                all_count,
+                errors,
+                # f"{len(errors)}/{all_count} records from storage file {self.storage.storage_path} failed to parse: {errors}"
             )
-
-        self.resources = {}
-        for resource in resources:
-            # Only load "non-ignorable" resources and those with ids.
-            if not self._ignore(resource):
-                resource_id = resource.get("id")
-                if resource_id:
-                    if resource_id in self.resources:
-                        error_msg = "self.resources already has an entry for an ID. SKIPPING new one!"
-                        # error_msg = f"self.resources already has an entry for {resource_id} ({self.resources[resource_id]}) (from storage file: {self.storage.storage_path}). SKIPPING new one!"
-                        self.logger.error(error_msg)
-                        errors.append(error_msg)
-                    else:
-                        self.resources[resource_id] = resource
-                else:
-                    error_msg = "A resource doesn't have an ID!"
-                    # error_msg = f"resource doesn't have an id! resource = {resource} (from storage file: {self.storage.storage_path})."
-                    self.logger.error(error_msg)
-                    errors.append(error_msg)
-                    error_count += 1
-                    loaded_count -= 1
-        return all_count, loaded_count, errors
+        for _ in range(anonymous_count):
+            error_msg = "A resource doesn't have an ID!"
+            # error_msg = f"A resource doesn't have an ID! (from storage file: {self.storage.storage_path})."
+            self.logger.error(error_msg)
+            errors.append(error_msg)
+        return all_count
 
     def _persist_resources(self, resources: Sequence[MutableMapping[str, Any]]) -> tuple[int, str]:
         """
@@ -265,15 +742,26 @@ class ResourceManager:
         Returns:
             A tuple with the count of records saved, which should equal the length of
             the input records list, and an error message string or '' if no errors occurred.
+            If the storage raises an `OSError`, nothing was saved, so the callers undo
+            their changes in memory.
         """
-        count = self.storage.save(resources)
         lena = len(resources)
+        try:
+            count = self.storage.save(resources)
+        except OSError as e:
+            error_msg = f"Failed to save {lena} resources to the storage file: {e}"
+            self.logger.error(error_msg)
+            return 0, error_msg
+        self.snapshots.writes_since_save += count
         error_msg = ""
         if count != lena:
             diff = lena - count
             error_msg = f"Failed to save {diff} out of {lena} resources to the storage file."
             # error_msg = f"Failed to save {diff} out of {lena} resources to the storage file {self.storage.storage_path}. resources = {resources}"
             self.logger.error(error_msg)
+        else:
+            # The callers have already applied the resources in memory, so a snapshot is consistent.
+            self._maybe_save_snapshot()
         return count, error_msg
 
     def _is_valid_date_time(
@@ -281,6 +769,7 @@ class ResourceManager:
         a_date_time: datetime,
         in_the_past_allowed: bool = False,
         unique_datetime_key: str = "",
+        scope: Any = "",
     ) -> tuple[bool, str]:
         """
         Check if the resource time is valid. Subclasses can add more filtering
@@ -295,7 +784,10 @@ class ResourceManager:
             - unique_datetime_key (str): If not empty, we will check all resources for datetimes
               with this key and treat `a_date_time` as invalid if any of those found datetimes
               are within one second of `a_date_time`. However, any resources where `self._ignore()`
-              returns True won't be checked.
+              returns True won't be checked. When the key is `self.unique_datetime_key`, the slot
+              index is used, so the check takes constant time.
+            - scope (Any): If `unique_datetime_scope_key` is set, only the resources with this value
+              for it are checked, e.g., the appointments of one provider.
 
         Returns:
             Tuple of (is_valid, error_message)
@@ -314,8 +806,19 @@ class ResourceManager:
         # Check if the time slot is already "used". We check if any
         # occupied times are within 1 second of the proposed time, but
         # ignore resources if `self._ignore(resource)` returns `True`.
-        if unique_datetime_key:
+        conflict = ""
+        if unique_datetime_key and unique_datetime_key == self.unique_datetime_key:
+            self._ensure_indexes()
+            if self._indexes.slots.unslotted_ids:
+                conflict = """Resource found without a datetime for a key!"""
+                # conflict = f"""Resources {self._indexes.slots.unslotted_ids} found without a datetime for key "{unique_datetime_key}"!"""
+            elif self._indexes.slots.is_reserved(a_date_time, scope):
+                conflict = """The time slot the input date-time for a key is already reserved."""
+                # conflict = f"""The time slot {a_date_time} for key "{unique_datetime_key}" is already reserved."""
+        elif unique_datetime_key:
             for resource in self.resources.values():
+                if self._scope_of(resource) != scope:
+                    continue
                 dt = resource.get(unique_datetime_key)
                 if not dt:
                     return (
@@ -333,7 +836,7 @@ class ResourceManager:
                             # f"""The time slot {a_date_time} for key "{unique_datetime_key}" is already reserved.""",
                         )
 
-        return True, ""
+        return conflict == "", conflict
 
     def _further_date_time_validation(self, a_date_time: datetime) -> tuple[bool, str]:
         """
@@ -347,7 +850,7 @@ class ResourceManager:
         """
         return True, ""
 
-    def create_resource(self, fields: MutableMapping[str, Any]) -> tuple[str, str]:
+    def create_resource(self, fields: MutableMapping[str, Any], idempotency_key: str = "") -> tuple[str, str]:
         """
         Create a new resource. Calls `_is_valid_resource()` to perform any
         validation required on the input `fields`. Writes the resource to
@@ -357,33 +860,67 @@ class ResourceManager:
             - fields (dict[str,Any]): The dictionary to use to create the resource record.
               Calls `_is_valid_resource()` to perform any validation required
               on the input `fields`.
+            - idempotency_key (str): If not empty, a key that identifies this request, e.g., a
+              tool call. If a resource was already created with the same key, its id is returned
+              and nothing is created, so a retried request doesn't create a duplicate.
 
         Returns:
             A tuple with `(id, success_message)` on success, where `id` is the non-empty
             string with the id (a UUID) of the successfully-created resource, or on failure,
             `('', error_message)`.
         """
-        success, message = self._is_valid_resource(fields)
-        if not success:
-            self.logger.error(f"create_resource(): {message}")
-            return "", message
-
-        # Create the resource and save it to the persistent file.
-        resource_id = str(uuid4())
-        fields["id"] = resource_id
-        self.resources[resource_id] = fields
-        actual_count, error_msg = self._persist_resources([fields])
-        if actual_count != 1 or error_msg != "":
-            del self.resources[resource_id]
-            msg = f"Failed to persist the new resource, so no changes made! Error: {error_msg}"
-            self.logger.error(msg)
-            return "", msg
+        with self.synchronized():
+            undo = self._undo_log()
+            resource_id, message = self._apply_create(fields, idempotency_key, undo)
+            if not resource_id:
+                self.logger.error("create_resource(): %s", message)
+                return "", message
+            if not undo.changed:
+                self.logger.info("A resource was already created with the input idempotency key.")
+                return resource_id, "The resource was already created for this request."
+
+            error_msg = self._write_changes(undo)
+            if error_msg:
+                msg = f"Failed to persist the new resource, so no changes made! Error: {error_msg}"
+                self.logger.error(msg)
+                return "", msg
 
         success_msg = f"Resource created at {now()} with a new ID."
         # success_msg = f"Resource created at {now()} with ID {resource_id}."
         self.logger.info(success_msg)
         return resource_id, success_msg
 
+    def create_resources(self, fields_list: Sequence[MutableMapping[str, Any]]) -> list[tuple[str, str]]:
+        """
+        Like `create_resource()` for a batch of resources. Each one is validated with
+        `_is_valid_resource()` after the earlier valid ones in the batch were added to the
+        indexes, so conflicts within the batch are found in the same pass as conflicts with
+        existing resources. The valid resources are then persisted with a single write.
+        If that fails, none of them are created.
+
+        Args:
+            - fields_list (Sequence[MutableMapping[str,Any]]): The dictionaries to use to create the resource records.
+
+        Returns:
+            A list with one tuple per input, in the same order, with `(id, success_message)`
+            for a created resource or `('', error_message)` for one that wasn't created.
+        """
+        results: list[tuple[str, str]] = []
+        undo = self._undo_log()
+        with self.synchronized():
+            for fields in fields_list:
+                results.append(self._apply_create(fields, "", undo))
+            created_count = len(undo.changed)
+            error_msg = self._write_changes(undo)
+            if error_msg:
+                msg = f"Failed to persist the new resources, so no changes made! Error: {error_msg}"
+                self.logger.error(msg)
+                return [("", msg) if resource_id else (resource_id, message) for resource_id, message in results]
+
+        success_msg = f"Resource created at {now()} with a new ID."
+        self.logger.info("%d/%d resources created.", created_count, len(fields_list))
+        return [(resource_id, success_msg) if resource_id else ("", message) for resource_id, message in results]
+
     def _is_valid_resource(self, fields: MutableMapping[str, Any]) -> tuple[bool, str]:
         """
         A hook for subclasses to validate the fields for a resource.
@@ -397,16 +934,14 @@ class ResourceManager:
 
     def save_resources(self):
         """
-        Save the current resource collection to storage, overwriting
+        Save the current resource collection to storage, atomically overwriting
         the existing contents.
         """
         resources = self.get_resources()
         len_resources = len(resources)
-        actual_count, error_msg = self._persist_resources(resources)
-        if actual_count != len_resources or error_msg != "":
-            raise ValueError(
-                f"Failed to write the current list of resources. {actual_count}/{len_resources} written. Errors: {error_msg}"
-            )
+        actual_count = self.storage.rewrite(resources)
+        if actual_count != len_resources:
+            raise ValueError(f"Failed to write the current list of resources. {actual_count}/{len_resources} written.")
 
     def set_resources(self, resources: Sequence[MutableMapping[str, Any]]) -> tuple[int, str]:
         """
@@ -451,13 +986,14 @@ class ResourceManager:
             return 0, error_msg
 
         # All good at this point!
-        # Save to memory and file
-        self.clear()
-        actual_count, error_msg = self._persist_resources(resources)
-        if actual_count != len_resources or error_msg != "":
-            msg = f"Failed to persist all the new resources ({actual_count} out of {len_resources}). File is now out of sync with the in memory self.resources (unchanged)! Error: {error_msg}"
+        # Atomically replace the file contents, then memory.
+        actual_count = self.storage.rewrite(resources)
+        if actual_count != len_resources:
+            msg = f"Failed to persist all the new resources ({actual_count} out of {len_resources}). File is now out of sync with the in memory self.resources (unchanged)!"
             self.logger.error(msg)
             return 0, msg
-        self.resources = {a["id"]: a for a in resources}
-        self.logger.info(f"Records replaced with {len_resources} new resources.")
+        self.resources = {a["id"]: self._make_resource(a) for a in resources}
+        self._rebuild_indexes()
+        self.changes.reset()
+        self.logger.info("Records replaced with %d new resources.", len_resources)
         return len(self.resources), ""
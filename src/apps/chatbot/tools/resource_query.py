@@ -0,0 +1,439 @@
+"""
+Declarative predicates, secondary indexes, and a small query planner for `ResourceManager`.
+
+The predicates are callable, so they can be used anywhere the older "matcher" lambdas
+are used in criteria mappings, e.g., `{"patient_name": Eq("John Doe")}`. Unlike the
+lambdas, the planner can look inside them and use a secondary index to find candidate
+resources, rather than calling every matcher on every resource.
+
+For fuzzy matching of names, `Similar` compares the trigrams of the normalized strings,
+i.e., the three-character substrings of each word, padded like PostgreSQL's `pg_trgm`,
+so differences in case, accents, punctuation, word order, and middle initials only
+lower the similarity a little. A `TrigramIndex` answers it from the posting lists of
+the trigrams and ranks the matching values with `search()`.
+"""
+
+# Allow types to self-reference during their definitions.
+from __future__ import annotations
+
+import re
+import unicodedata
+from abc import ABC, abstractmethod
+from bisect import bisect_left, bisect_right, insort
+from collections import Counter
+from collections.abc import Callable, Collection, Iterable, Mapping
+from dataclasses import dataclass
+from functools import lru_cache
+from operator import itemgetter
+from typing import Any
+
+# Too many of these warnings for variables that ARE used in other files.
+# pylint: disable=unused-variable
+
+# Characters that separate the words of a name, after normalization.
+_non_word = re.compile(r"[\W_]+")
+
+
+@lru_cache(maxsize=4096)
+def normalize_text(text: str) -> str:
+    """Case fold the text, remove accents, and replace punctuation and runs of whitespace with one space."""
+    decomposed = unicodedata.normalize("NFKD", text.casefold())
+    without_accents = "".join(c for c in decomposed if not unicodedata.combining(c))
+    return _non_word.sub(" ", without_accents).strip()
+
+
+@lru_cache(maxsize=4096)
+def trigrams(text: str) -> frozenset[str]:
+    """
+    The trigrams of the normalized text. Each word is padded with two spaces before
+    and one after, so short words, e.g., initials, and word starts get trigrams.
+    """
+    grams = set()
+    for word in normalize_text(text).split():
+        padded = f"  {word} "
+        grams.update(padded[i : i + 3] for i in range(len(padded) - 2))
+    return frozenset(grams)
+
+
+def _untrigrammed_key(text: str) -> str:
+    """The key that texts without trigrams, e.g., "-" or "'", must share to match exactly."""
+    return " ".join(text.casefold().split())
+
+
+def trigram_similarity(text1: str, text2: str) -> float:
+    """
+    The Jaccard similarity of the trigrams of the two texts, from 0.0 to 1.0. Texts
+    without letters or digits have no trigrams, so they are only similar, with 1.0,
+    to the same non-empty text, ignoring case and whitespace.
+    """
+    grams1 = trigrams(text1)
+    grams2 = trigrams(text2)
+    if not grams1 and not grams2:
+        key = _untrigrammed_key(text1)
+        return 1.0 if key and key == _untrigrammed_key(text2) else 0.0
+    if not grams1 or not grams2:
+        return 0.0
+    shared = len(grams1 & grams2)
+    return shared / (len(grams1) + len(grams2) - shared)
+
+
+class Predicate(ABC):  # pylint: disable=too-few-public-methods
+    """A declarative test for the value of a named field."""
+
+    @abstractmethod
+    def __call__(self, value: Any) -> bool:
+        """Return True if the value satisfies the predicate."""
+
+
+@dataclass(frozen=True)
+class Eq(Predicate):
+    """The value equals `value`."""
+
+    value: Any
+
+    def __call__(self, value: Any) -> bool:
+        return value == self.value
+
+
+@dataclass(frozen=True)
+class In(Predicate):
+    """The value is one of `values`."""
+
+    values: Collection[Any]
+
+    def __call__(self, value: Any) -> bool:
+        return value in self.values
+
+
+@dataclass(frozen=True)
+class Range(Predicate):
+    """
+    The value is between `low` and `high`. A bound of `None` means unbounded.
+    By default, both bounds are inclusive.
+    """
+
+    low: Any = None
+    high: Any = None
+    low_inclusive: bool = True
+    high_inclusive: bool = True
+
+    def __call__(self, value: Any) -> bool:
+        if self.low is not None and (value < self.low if self.low_inclusive else value <= self.low):
+            return False
+        return self.high is None or (value <= self.high if self.high_inclusive else value < self.high)
+
+
+@dataclass(frozen=True)
+class Prefix(Predicate):
+    """The value is a string that starts with `prefix`."""
+
+    prefix: str
+
+    def __call__(self, value: Any) -> bool:
+        return isinstance(value, str) and value.startswith(self.prefix)
+
+
+@dataclass(frozen=True)
+class Similar(Predicate):
+    """The value is a string with a `trigram_similarity()` to `text` of at least `threshold`."""
+
+    text: str
+    threshold: float = 0.4
+
+    def __call__(self, value: Any) -> bool:
+        return isinstance(value, str) and trigram_similarity(self.text, value) >= self.threshold
+
+
+class ResourceIndex(ABC):
+    """
+    A secondary index from the values of one field to resource ids.
+    Resources without a value for the field are not indexed.
+    """
+
+    @abstractmethod
+    def add(self, resource_id: str, value: Any):
+        """Add the id with its field value."""
+
+    @abstractmethod
+    def discard(self, resource_id: str):
+        """Remove the id, if present."""
+
+    @abstractmethod
+    def clear(self):
+        """Remove all ids."""
+
+    @abstractmethod
+    def estimate(self, predicate: Callable[[Any], bool]) -> int | None:
+        """
+        Return the number of ids `candidates(predicate)` would return, or `None`
+        if this index can't answer the predicate. Must be cheap to compute.
+        """
+
+    @abstractmethod
+    def candidates(self, predicate: Callable[[Any], bool]) -> Iterable[str]:
+        """Return the ids whose values satisfy the predicate. Only call if `estimate()` isn't `None`."""
+
+    def ordered_by_value(self) -> bool:
+        """True if `candidates()` returns ids in the order of their values."""
+        return False
+
+
+class HashIndex(ResourceIndex):
+    """An index for equality and membership predicates."""
+
+    def __init__(self):
+        self._ids_by_value: dict[Any, set[str]] = {}
+        self._value_of: dict[str, Any] = {}
+
+    def add(self, resource_id: str, value: Any):
+        self.discard(resource_id)
+        self._ids_by_value.setdefault(value, set()).add(resource_id)
+        self._value_of[resource_id] = value
+
+    def discard(self, resource_id: str):
+        if resource_id not in self._value_of:
+            return
+        value = self._value_of.pop(resource_id)
+        ids = self._ids_by_value[value]
+        ids.discard(resource_id)
+        if not ids:
+            del self._ids_by_value[value]
+
+    def clear(self):
+        self._ids_by_value = {}
+        self._value_of = {}
+
+    def counts(self) -> dict[Any, int]:
+        """The number of ids for each value."""
+        return {value: len(ids) for value, ids in self._ids_by_value.items()}
+
+    def value_of(self, resource_id: str) -> Any:
+        """The indexed value for the id, or `None` if it isn't indexed."""
+        return self._value_of.get(resource_id)
+
+    def estimate(self, predicate: Callable[[Any], bool]) -> int | None:
+        match predicate:
+            case Eq(value=value):
+                return len(self._ids_by_value.get(value, ()))
+            case In(values=values):
+                return sum(len(self._ids_by_value.get(value, ())) for value in set(values))
+            case _:
+                return None
+
+    def candidates(self, predicate: Callable[[Any], bool]) -> Iterable[str]:
+        match predicate:
+            case Eq(value=value):
+                return self._ids_by_value.get(value, set())
+            case In(values=values):
+                return [rid for value in set(values) for rid in self._ids_by_value.get(value, ())]
+            case _:
+                raise ValueError(f"HashIndex can't answer predicate {predicate}")
+
+
+class TrigramIndex(HashIndex):
+    """
+    A `HashIndex` for string values that also answers `Similar` predicates. The distinct
+    values are grouped by their trigrams, so a search scores just the values that share
+    a trigram with the text, and its cost doesn't depend on how many ids have each value.
+    """
+
+    def __init__(self):
+        super().__init__()
+        # The distinct string values with each trigram.
+        self._values_by_trigram: dict[str, set[str]] = {}
+        # The distinct string values without trigrams, by `_untrigrammed_key()`.
+        self._untrigrammed_values: dict[str, set[str]] = {}
+
+    def _groups(self, value: str) -> tuple[dict[str, set[str]], Iterable[str]]:
+        """The mapping that groups the value and its keys in that mapping."""
+        grams = trigrams(value)
+        if grams:
+            return self._values_by_trigram, grams
+        return self._untrigrammed_values, (_untrigrammed_key(value),)
+
+    def add(self, resource_id: str, value: Any):
+        self.discard(resource_id)
+        if isinstance(value, str) and value not in self._ids_by_value:
+            groups, keys = self._groups(value)
+            for key in keys:
+                groups.setdefault(key, set()).add(value)
+        super().add(resource_id, value)
+
+    def discard(self, resource_id: str):
+        value = self._value_of.get(resource_id)
+        super().discard(resource_id)
+        if isinstance(value, str) and value not in self._ids_by_value:
+            groups, keys = self._groups(value)
+            for key in keys:
+                values = groups[key]
+                values.discard(value)
+                if not values:
+                    del groups[key]
+
+    def clear(self):
+        super().clear()
+        self._values_by_trigram = {}
+        self._untrigrammed_values = {}
+
+    def search(self, text: str, threshold: float = 0.4, limit: int = 0) -> list[tuple[str, float]]:
+        """
+        Find the indexed values with a `trigram_similarity()` to the text of at least `threshold`.
+
+        Returns:
+            A list of `(value, similarity)` tuples, most similar first, then by value,
+            with at most `limit` tuples, unless `limit` is 0.
+        """
+        grams = trigrams(text)
+        if not grams:
+            # Only the same text, ignoring case and whitespace, is similar. See `trigram_similarity()`.
+            key = _untrigrammed_key(text)
+            values = sorted(self._untrigrammed_values.get(key, ())) if key and threshold <= 1.0 else []
+            matches = [(value, 1.0) for value in values]
+            return matches[:limit] if limit > 0 else matches
+        shared: Counter[str] = Counter()
+        for gram in grams:
+            shared.update(self._values_by_trigram.get(gram, ()))
+        matches = []
+        for value, count in shared.items():
+            similarity = count / (len(grams) + len(trigrams(value)) - count)
+            if similarity >= threshold:
+                matches.append((value, similarity))
+        matches.sort(key=lambda match: (-match[1], match[0]))
+        return matches[:limit] if limit > 0 else matches
+
+    def estimate(self, predicate: Callable[[Any], bool]) -> int | None:
+        if isinstance(predicate, Similar):
+            return sum(len(self._ids_by_value[value]) for value, _ in self.search(predicate.text, predicate.threshold))
+        return super().estimate(predicate)
+
+    def candidates(self, predicate: Callable[[Any], bool]) -> Iterable[str]:
+        if isinstance(predicate, Similar):
+            return [
+                rid
+                for value, _ in self.search(predicate.text, predicate.threshold)
+                for rid in self._ids_by_value[value]
+            ]
+        return super().candidates(predicate)
+
+
+class SortedIndex(ResourceIndex):
+    """
+    An index for equality, range, and string prefix predicates, which
+    returns candidates in the order of their values, then their ids. The
+    values must be mutually comparable, e.g., all `datetime`s with timezones.
+    """
+
+    def __init__(self):
+        # (value, id) pairs, sorted, so ties are broken by id and each pair can be found by bisection.
+        self._entries: list[tuple[Any, str]] = []
+        self._value_of: dict[str, Any] = {}
+
+    def add(self, resource_id: str, value: Any):
+        self.discard(resource_id)
+        insort(self._entries, (value, resource_id))
+        self._value_of[resource_id] = value
+
+    def discard(self, resource_id: str):
+        if resource_id not in self._value_of:
+            return
+        entry = (self._value_of.pop(resource_id), resource_id)
+        del self._entries[bisect_left(self._entries, entry)]
+
+    def clear(self):
+        self._entries = []
+        self._value_of = {}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _bounds(self, predicate: Callable[[Any], bool]) -> tuple[int, int] | None:
+        """The slice of the entries that satisfies the predicate."""
+        entries = self._entries
+        key = itemgetter(0)
+        match predicate:
+            case Eq(value=value):
+                return bisect_left(entries, value, key=key), bisect_right(entries, value, key=key)
+            case Range(low=low, high=high, low_inclusive=low_inclusive, high_inclusive=high_inclusive):
+                lo = 0
+                if low is not None:
+                    bisect = bisect_left if low_inclusive else bisect_right
+                    lo = bisect(entries, low, key=key)
+                hi = len(entries)
+                if high is not None:
+                    bisect = bisect_right if high_inclusive else bisect_left
+                    hi = bisect(entries, high, key=key)
+                return lo, max(lo, hi)
+            case Prefix(prefix=prefix):
+                lo = bisect_left(entries, prefix, key=key)
+                return lo, max(lo, bisect_left(entries, prefix + "\U0010ffff", key=key))
+            case _:
+                return None
+
+    def estimate(self, predicate: Callable[[Any], bool]) -> int | None:
+        bounds = self._bounds(predicate)
+        return None if bounds is None else bounds[1] - bounds[0]
+
+    def candidates(self, predicate: Callable[[Any], bool]) -> Iterable[str]:
+        bounds = self._bounds(predicate)
+        if bounds is None:
+            raise ValueError(f"SortedIndex can't answer predicate {predicate}")
+        return [resource_id for _value, resource_id in self._entries[bounds[0] : bounds[1]]]
+
+    def ordered_by_value(self) -> bool:
+        return True
+
+
+def make_index(kind: str) -> ResourceIndex:
+    """Make an index of the input kind, `"hash"`, `"sorted"`, or `"trigram"`."""
+    match kind:
+        case "hash":
+            return HashIndex()
+        case "sorted":
+            return SortedIndex()
+        case "trigram":
+            return TrigramIndex()
+        case _:
+            raise ValueError(f"Unknown index kind: {kind}. Use 'hash', 'sorted', or 'trigram'.")
+
+
+@dataclass(frozen=True)
+class QueryPlan:
+    """
+    The result of planning a query: the candidate ids from the most selective index,
+    or `None` if no index applies and all resources must be scanned. If
+    `ordered_by` is not empty, the candidates are sorted by that field's values.
+    """
+
+    candidate_ids: Iterable[str] | None
+    index_field: str = ""
+    ordered_by: str = ""
+
+
+def plan_query(
+    criteria: Mapping[str, Callable[[Any], bool] | None],
+    indexes: Mapping[str, ResourceIndex],
+) -> QueryPlan:
+    """
+    Pick the index that can answer one of the declarative criteria with the
+    fewest candidates. Criteria that are plain callables can't use indexes.
+    All criteria must still be checked against the candidates.
+    """
+    best_field = ""
+    best_estimate = -1
+    for field, predicate in criteria.items():
+        index = indexes.get(field)
+        if index is None or not isinstance(predicate, Predicate):
+            continue
+        estimate = index.estimate(predicate)
+        if estimate is not None and (best_estimate < 0 or estimate < best_estimate):
+            best_field, best_estimate = field, estimate
+    if not best_field:
+        return QueryPlan(None)
+    index = indexes[best_field]
+    predicate = criteria[best_field]
+    assert predicate is not None
+    return QueryPlan(
+        index.candidates(predicate),
+        index_field=best_field,
+        ordered_by=best_field if index.ordered_by_value() else "",
+    )
@@ -0,0 +1,187 @@
+"""
+Pickled snapshots of a resource manager's live resources, to speed up restarts.
+
+A snapshot is saved next to the storage file, with the storage's `checkpoint()`, so
+loading it only needs to read the records written after it. Snapshots are trusted like
+the storage file itself, so keep them just as private.
+
+Pickling a large store takes a while, so a snapshot can be saved on a background thread
+from a shallow copy of the resources. The resources may still change in place meanwhile.
+That is harmless for changes written to the storage, since they are after the checkpoint
+and `load()` applies them again, but changes that are undone must `invalidate()` the save.
+"""
+
+# Allow types to self-reference during their definitions.
+from __future__ import annotations
+
+import logging
+import os
+import pickle
+import threading
+from collections.abc import Mapping, MutableMapping
+from typing import Any
+
+from common.persistent_storage import PersistentStorage
+
+# Too many of these warnings for variables that ARE used in other files.
+# pylint: disable=unused-variable
+
+# Bump when the snapshot format changes, so old snapshots are ignored.
+SNAPSHOT_VERSION = 3
+
+# The changes returned by a storage's `tail()`: the new live records by id, the removed ids, and any parse errors.
+TailChanges = tuple[dict[str, MutableMapping[str, Any]], set[str], list[str]]
+
+
+class SnapshotFile:  # pylint: disable=too-many-instance-attributes
+    """The snapshot file for a storage, saved when enough records were written since the last one."""
+
+    def __init__(self, storage: PersistentStorage, interval: int, kind: str, logger: logging.Logger | None = None):
+        """
+        Initialize the snapshot file.
+
+        Args:
+            - storage (PersistentStorage): The storage the snapshots are for. The file is next to the storage file.
+            - interval (int): If positive, snapshots are `due` when at least this many records were
+              written since the last one. Use 0 to disable snapshots.
+            - kind (str): The kind of resources, e.g., the manager's class name. Snapshots of other kinds are ignored.
+            - logger (logging.Logger | None): Optional logger instance.
+        """
+        self.storage = storage
+        self.interval = interval
+        self.kind = kind
+        if logger:
+            self.logger: logging.Logger = logger
+        else:
+            self.logger = logging.getLogger(self.__class__.__name__)
+            self.logger.setLevel(logging.INFO)
+        self.path = storage.storage_path.with_name(storage.storage_path.name + ".snap")
+        # The records written since the last snapshot, or since the start of storage if there isn't one.
+        self.writes_since_save = 0
+        # The number of snapshots saved, which `invalidate()` uses to find those saved since a change.
+        self.saves = 0
+        # Guards replacing the snapshot file, and the epoch, which `invalidate()` increments,
+        # so a background save started before it knows its copy of the resources is stale.
+        self._lock = threading.Lock()
+        self._epoch = 0
+        self._thread: threading.Thread | None = None
+
+    @property
+    def due(self) -> bool:
+        """True if snapshots are enabled and enough records were written since the last one."""
+        return 0 < self.interval <= self.writes_since_save
+
+    @property
+    def saving(self) -> bool:
+        """True if a snapshot is being saved on a background thread."""
+        return self._thread is not None and self._thread.is_alive()
+
+    def save(self, resources: Mapping[str, MutableMapping[str, Any]], background: bool = False) -> bool:
+        """
+        Save a snapshot of the resources, with the storage's `checkpoint()`, replacing the previous
+        snapshot atomically. The resources must be up to date with the storage, e.g., hold its
+        `exclusive()` lock when it is shared. Snapshots only speed up restarts, so failing to
+        write one is logged as a warning.
+
+        Args:
+            - resources (Mapping[str, MutableMapping[str, Any]]): The resources by id. For a background
+              save, pass a copy of the mapping, which isn't changed later.
+            - background (bool): If True, only take the checkpoint now, then pickle the resources on
+              a background thread. See `saving` and `wait()`.
+
+        Returns:
+            True if the snapshot was saved or started, or False if the storage doesn't support
+            checkpoints, a background save is still running, or the snapshot couldn't be written.
+        """
+        if self.saving:
+            return False
+        checkpoint = self.storage.checkpoint()
+        if checkpoint is None:
+            return False
+        snapshot = {"version": SNAPSHOT_VERSION, "kind": self.kind, "checkpoint": checkpoint, "resources": resources}
+        # The writes since are after the checkpoint, so they count towards the next snapshot.
+        self.writes_since_save = 0
+        if not background:
+            return self._write(snapshot, self._epoch)
+        self._thread = threading.Thread(
+            target=self._write, args=(snapshot, self._epoch), name=f"snapshot-{self.path.name}", daemon=True
+        )
+        self._thread.start()
+        return True
+
+    def _write(self, snapshot: Mapping[str, Any], epoch: int) -> bool:
+        """Pickle the snapshot to a temporary file, then replace the snapshot file, unless it was invalidated."""
+        # Unique per process, since processes sharing the storage may save snapshots at the same time.
+        temp_path = self.path.with_name(f"{self.path.name}.{os.getpid()}.tmp")
+        try:
+            with open(temp_path, "wb") as f:
+                pickle.dump(snapshot, f, protocol=5)
+            with self._lock:
+                if epoch != self._epoch:
+                    temp_path.unlink()
+                    return False
+                os.replace(temp_path, self.path)
+                self.saves += 1
+        except (OSError, RuntimeError) as e:
+            # RuntimeError if a resource gained a field while a background save was pickling it.
+            self.logger.warning("Failed to save a snapshot of the resources: %s", e)
+            temp_path.unlink(missing_ok=True)
+            return False
+        return True
+
+    def wait(self, timeout: float | None = None):
+        """Block until any background save finishes."""
+        thread = self._thread
+        if thread:
+            thread.join(timeout)
+
+    def invalidate(self, saves_before: int):
+        """
+        Drop the snapshots that may include changes made in memory and then undone: a background
+        save still running, and the snapshot, if any were saved since `saves` was `saves_before`.
+        """
+        with self._lock:
+            self._epoch += 1
+            if self.saves != saves_before:
+                self.logger.info("Removing a snapshot that may include changes that were undone.")
+                self.path.unlink(missing_ok=True)
+
+    def load(self) -> tuple[MutableMapping[str, MutableMapping[str, Any]], TailChanges] | None:
+        """
+        Load the resources from the latest snapshot, `resume()` the storage from its checkpoint,
+        and read the changes made after it with the storage's `tail()`.
+
+        Returns:
+            A tuple with the resources by id and the changes returned by `tail()`, or `None` if
+            there is no valid snapshot for the storage.
+        """
+        try:
+            with open(self.path, "rb") as f:
+                snapshot = pickle.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as e:  # noqa pylint: disable=broad-exception-caught
+            # Unpickling can fail in many ways for a corrupt or stale snapshot. Just ignore it.
+            self.logger.warning("Ignoring an unreadable snapshot of the resources: %s", e)
+            return None
+        if (
+            not isinstance(snapshot, dict)
+            or snapshot.get("version") != SNAPSHOT_VERSION
+            or snapshot.get("kind") != self.kind
+            or not self.storage.resume(snapshot.get("checkpoint", {}))
+        ):
+            self.logger.info("The snapshot of the resources doesn't match the storage, so reading all the records.")
+            return None
+        snapshot_records = self.storage.record_count
+        changes = self.storage.tail()
+        if changes is None:
+            return None
+        self.writes_since_save = self.storage.record_count - snapshot_records
+        return snapshot["resources"], changes
+
+    def remove(self):
+        """Remove the snapshot, if any, and stop a background save from replacing it, e.g., when the storage is cleared."""
+        with self._lock:
+            self._epoch += 1
+            self.path.unlink(missing_ok=True)
+        self.writes_since_save = 0
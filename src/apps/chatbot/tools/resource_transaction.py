@@ -0,0 +1,141 @@
+"""
+All-or-nothing changes to the resources of a `ResourceManager`.
+
+A `Transaction` collects creates and updates, then commits them together. While the changes
+are applied in memory, an `UndoLog` records the old field values, so they can be undone if a
+change is invalid or the write to storage fails.
+"""
+
+# Allow types to self-reference during their definitions.
+from __future__ import annotations
+
+from collections.abc import Callable, MutableMapping
+from dataclasses import dataclass
+from typing import Any
+
+# Too many of these warnings for variables that ARE used in other files.
+# pylint: disable=unused-variable
+
+# Marks keys that were missing before an update, so undoing the update removes them.
+_missing = object()
+
+# A function that validates an update, `validate(resource, changes)`, returning `(success, error_message)`.
+UpdateValidator = Callable[[MutableMapping[str, Any], MutableMapping[str, Any]], tuple[bool, str]]
+
+
+class Transaction:
+    """
+    Changes to the resources of a `ResourceManager` that are applied all-or-nothing.
+    Create one with `ResourceManager.begin()`, add changes, then call `commit()`.
+    Nothing is validated or changed until then.
+    """
+
+    @dataclass(frozen=True)
+    class Change:
+        """A create, when `resource_id` is `None`, or an update of the resource."""
+
+        resource_id: str | None
+        fields: MutableMapping[str, Any]
+        validate: UpdateValidator | None = None
+        idempotency_key: str = ""
+
+    def __init__(self, commit: Callable[[Transaction], tuple[list[str], str]]):
+        """
+        Initialize the transaction.
+
+        Args:
+            - commit (Callable[[Transaction], tuple[list[str], str]]): The manager's function that applies the changes.
+        """
+        self._commit = commit
+        self.changes: list[Transaction.Change] = []
+        self.committed = False
+
+    def create(self, fields: MutableMapping[str, Any], idempotency_key: str = "") -> Transaction:
+        """Add the creation of a resource. See `ResourceManager.create_resource()`. Returns this transaction."""
+        self.changes.append(Transaction.Change(None, fields, idempotency_key=idempotency_key))
+        return self
+
+    def update(
+        self, resource_id: str, changes: MutableMapping[str, Any], validate: UpdateValidator | None = None
+    ) -> Transaction:
+        """
+        Add an update of a resource, which is checked with `validate(resource, changes)`, if given,
+        when the transaction is committed. See `ResourceManager.update_resources()`. Returns this transaction.
+        """
+        self.changes.append(Transaction.Change(resource_id, changes, validate))
+        return self
+
+    def commit(self) -> tuple[list[str], str]:
+        """
+        Apply the changes in memory, in order, validating each one after the earlier ones were
+        applied, e.g., so a cancellation frees a time slot for a later create. If all of them are
+        valid, the changed resources are persisted with a single write. Otherwise, or if the write
+        fails, all the changes are undone. A transaction can only be committed once.
+
+        Returns:
+            A tuple with the ids of the created or updated resources, one per change, in order,
+            and '' on success, or `[]` and an error message for the first failure.
+        """
+        if self.committed:
+            raise ValueError("The transaction was already committed.")
+        self.committed = True
+        return self._commit(self)
+
+
+class UndoLog:
+    """
+    The resources created and updated in memory, with the old values of the updated fields,
+    so the changes can be undone in reverse order. The resources are removed from the indexes
+    before they change and added back after, with the input functions. `on_undo`, if given,
+    is called after changes are undone.
+    """
+
+    def __init__(
+        self,
+        index: Callable[[MutableMapping[str, Any]], None],
+        unindex: Callable[[MutableMapping[str, Any]], None],
+        on_undo: Callable[[], None] | None = None,
+    ):
+        self._index = index
+        self._unindex = unindex
+        self._on_undo = on_undo
+        # Each changed resource, with the old values of the changed fields, or `None` if it was created.
+        self._entries: list[tuple[MutableMapping[str, Any], dict[str, Any] | None]] = []
+        # The changed resources by id, in the order they were first changed.
+        self.changed: dict[str, MutableMapping[str, Any]] = {}
+        self.created_ids: set[str] = set()
+
+    def create(self, resources: MutableMapping[str, MutableMapping[str, Any]], resource: MutableMapping[str, Any]):
+        """Add the new resource to `resources` and the indexes."""
+        resources[resource["id"]] = resource
+        self._index(resource)
+        self._entries.append((resource, None))
+        self.changed[resource["id"]] = resource
+        self.created_ids.add(resource["id"])
+
+    def update(self, resource: MutableMapping[str, Any], changes: MutableMapping[str, Any]):
+        """Update the fields of the resource, keeping the indexes in sync."""
+        self._unindex(resource)
+        self._entries.append((resource, {key: resource.get(key, _missing) for key in changes}))
+        resource.update(changes)
+        self._index(resource)
+        self.changed[resource["id"]] = resource
+
+    def undo(self, resources: MutableMapping[str, MutableMapping[str, Any]]):
+        """Undo the changes, in reverse order, removing the created resources from `resources`."""
+        for resource, old_values in reversed(self._entries):
+            self._unindex(resource)
+            if old_values is None:
+                del resources[resource["id"]]
+                continue
+            for key, value in old_values.items():
+                if value is _missing:
+                    del resource[key]
+                else:
+                    resource[key] = value
+            self._index(resource)
+        if self._entries and self._on_undo:
+            self._on_undo()
+        self._entries = []
+        self.changed = {}
+        self.created_ids = set()
@@ -0,0 +1,79 @@
+"""
+An index of the datetimes reserved by resources, e.g., appointment times, for checking in
+constant time whether a datetime is within one second of a reserved one.
+
+The datetimes are kept in "slots", keyed by the whole epoch second they fall in, so only
+the slot of a datetime and its two neighbors need to be checked. Each datetime belongs to
+a scope, e.g., one provider's calendar, and only conflicts within a scope are found.
+"""
+
+# Allow types to self-reference during their definitions.
+from __future__ import annotations
+
+import math
+from datetime import datetime, timedelta
+from typing import Any
+
+# Too many of these warnings for variables that ARE used in other files.
+# pylint: disable=unused-variable
+
+_one_second = timedelta(seconds=1)
+
+
+def _second_of(a_date_time: datetime) -> int:
+    """The slot key for a datetime: the whole epoch second it falls in."""
+    return math.floor(a_date_time.timestamp())
+
+
+class SlotIndex:
+    """Reserved datetimes, each identified by a resource id, in scopes."""
+
+    def __init__(self):
+        # (scope, epoch second) -> {id -> datetime}, and the reverse mapping.
+        self._slots: dict[tuple[Any, int], dict[str, datetime]] = {}
+        self._slot_of: dict[str, tuple[Any, int]] = {}
+        # The ids of the resources that were added without a datetime.
+        self.unslotted_ids: set[str] = set()
+
+    def __len__(self) -> int:
+        return len(self._slot_of)
+
+    def add(self, resource_id: str, a_date_time: datetime | None, scope: Any = ""):
+        """Add or replace the datetime reserved by the resource. A missing datetime is tracked in `unslotted_ids`."""
+        self.discard(resource_id)
+        if not a_date_time:
+            self.unslotted_ids.add(resource_id)
+            return
+        slot = (scope, _second_of(a_date_time))
+        self._slots.setdefault(slot, {})[resource_id] = a_date_time
+        self._slot_of[resource_id] = slot
+
+    def discard(self, resource_id: str):
+        """Remove the resource's datetime, if present."""
+        self.unslotted_ids.discard(resource_id)
+        slot = self._slot_of.pop(resource_id, None)
+        if slot is not None:
+            ids = self._slots[slot]
+            del ids[resource_id]
+            if not ids:
+                del self._slots[slot]
+
+    def clear(self):
+        """Remove all the datetimes."""
+        self._slots = {}
+        self._slot_of = {}
+        self.unslotted_ids = set()
+
+    def scope_of(self, resource_id: str) -> Any | None:
+        """The scope the resource's datetime was added in, or `None` if it wasn't added."""
+        slot = self._slot_of.get(resource_id)
+        return slot[0] if slot is not None else None
+
+    def is_reserved(self, a_date_time: datetime, scope: Any = "") -> bool:
+        """True if a datetime in the scope is within one second of `a_date_time`."""
+        second = _second_of(a_date_time)
+        for neighbor in (second - 1, second, second + 1):
+            for dt in self._slots.get((scope, neighbor), {}).values():
+                if dt - _one_second < a_date_time < dt + _one_second:
+                    return True
+        return False
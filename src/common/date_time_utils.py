@@ -3,9 +3,13 @@
 # Allow types to self-reference during their definitions.
 from __future__ import annotations
 
+import calendar
+import locale
 import re
+import time as time_module
 from collections.abc import Callable
 from datetime import UTC, date, datetime, time, timedelta, timezone, tzinfo
+from itertools import product
 
 # Too many of these warnings for variables that ARE used in other files.
 # pylint: disable=unused-variable
@@ -188,6 +192,160 @@ def is_work_hours(
     return not (weekdays_only and is_week_day(dt) or dt.hour < start_hour_inclusive or dt.hour > end_hour_inclusive)
 
 
+# The tokens of date-time strings: runs of letters, runs of digits, and any other character except whitespace.
+_token_re = re.compile(r"[^\W\d_]+|\d+|[^\w\s]|_")
+
+# What `datetime.strptime()` uses for "%c", "%x", and "%X" in the C locale.
+_c_locale_formats = {"%c": "%a %b %d %H:%M:%S %Y", "%x": "%m/%d/%y", "%X": "%H:%M:%S"}
+
+# Examples of the texts `datetime.strptime()` accepts for "%z", one for each shape.
+_utc_offset_examples = ("Z",) + tuple(
+    sign + offset for sign in "+-" for offset in ("0530", "05:30", "05:30:00", "053000.5", "05:3000.5", "05:30:00.5")
+)
+
+
+def _tokens_shape(tokens: list[str]) -> str:
+    """The shape of the tokens, where runs of letters are "a" and runs of digits are "9"."""
+    return " ".join("9" if token[0].isdigit() else "a" if token[0].isalpha() else token for token in tokens)
+
+
+def _shape(dt_str: str) -> str:
+    """
+    The shape of a date-time string, e.g., "a a 9 9 a 9 9 a" for "Monday January 05 2030T10 30 AM".
+    Whitespace is ignored, because `datetime.strptime()` matches any amount of it for a space.
+    """
+    return _tokens_shape(_token_re.findall(dt_str))
+
+
+def _parsing_environment() -> tuple[object, ...]:
+    """What the names and formats `datetime.strptime()` accepts depend on."""
+    return locale.getlocale(locale.LC_TIME), time_module.tzname
+
+
+def _directive_examples() -> dict[str, tuple[str, ...]]:
+    """
+    Examples of the texts `datetime.strptime()` accepts for the directives in the friendly formats,
+    one for each shape, in the current locale. Formats with other directives match any shape.
+    """
+    examples = {
+        "Y": ("2030",),
+        "y": ("30",),
+        "m": ("1",),
+        "d": ("1", " 1"),
+        "H": ("1",),
+        "I": ("1",),
+        "M": ("1",),
+        "S": ("1",),
+        "f": ("1",),
+        "z": _utc_offset_examples,
+        "Z": ("utc", "gmt", *time_module.tzname),
+    }
+    am_pm = [time_module.strftime("%p", (1999, 3, 17, hour, 44, 55, 2, 76, 0)) for hour in (1, 22)]
+    names = [*calendar.month_name[1:], *calendar.month_abbr[1:], *calendar.day_name, *calendar.day_abbr, *am_pm]
+    if all(_shape(name) == "a" for name in names):
+        examples.update({directive: ("x",) for directive in "AaBbp"})
+    return examples
+
+
+def _format_shapes(fmt: str, examples: dict[str, tuple[str, ...]], c_locale: bool) -> set[str] | None:
+    """
+    The shapes of the strings `datetime.strptime()` can match with the format, or `None` if the
+    format has directives without examples, so it may match strings of any shape.
+    """
+    if c_locale:
+        fmt = re.sub("%.", lambda m: _c_locale_formats.get(m.group(), m.group()), fmt)
+    choices: list[tuple[str, ...]] = []
+    for i, part in enumerate(re.split("(%.)", fmt)):
+        if i % 2 == 0:
+            choices.append((part,))
+        elif part[1] in examples:
+            choices.append(examples[part[1]])
+        else:
+            return None
+    return {_shape("".join(texts)) for texts in product(*choices)}
+
+
+class _FormatDispatch:  # pylint: disable=too-many-instance-attributes
+    """
+    Dispatches date-time strings to the formats in a list, e.g., `friendly_date_time_formats`,
+    that can match their shapes, so `_str_to_object()` tries a handful of formats instead of
+    hundreds, each failing with a `ValueError`. The candidates keep their order in the list,
+    so the first one that matches is the same as when trying every format.
+
+    The format that matched is also learned for each "fingerprint", i.e., the shape with the
+    lengths of the tokens, e.g., full or abbreviated month names, in a bounded LRU cache, and
+    tried first for later strings with that fingerprint. That is only done for shapes whose
+    candidates differ just in full or abbreviated names, which parse to the same values.
+    """
+
+    def __init__(self, formats: list[str], max_learned: int = 1024):
+        self.formats = formats
+        self._size = len(formats)
+        self._environment = _parsing_environment()
+        examples = _directive_examples()
+        c_locale = locale.getlocale(locale.LC_TIME) == (None, None)
+        shapes = [_format_shapes(fmt, examples, c_locale) for fmt in formats]
+        any_shape = [i for i, format_shapes in enumerate(shapes) if format_shapes is None]
+        indexes: dict[str, set[int]] = {}
+        for i, format_shapes in enumerate(shapes):
+            for shape in format_shapes or ():
+                indexes.setdefault(shape, set(any_shape)).add(i)
+        self._any_shape = [formats[i] for i in any_shape]
+        self._candidates = {shape: [formats[i] for i in sorted(ids)] for shape, ids in indexes.items()}
+        self._interchangeable = {
+            shape for shape, candidates in self._candidates.items() if len({_short_names(c) for c in candidates}) == 1
+        }
+        self._learned: dict[str, str] = {}
+        self._max_learned = max_learned
+
+    def is_current(self, formats: list[str]) -> bool:
+        """True if this dispatch is for the format list, unchanged, in the current locale and timezone."""
+        return formats is self.formats and len(formats) == self._size and _parsing_environment() == self._environment
+
+    def candidates(self, dt_str: str) -> tuple[list[str], str]:
+        """
+        The formats to try for the string, in order, and its fingerprint, which is empty
+        if nothing should be learned about it.
+        """
+        tokens = _token_re.findall(dt_str)
+        shape = _tokens_shape(tokens)
+        candidates = self._candidates.get(shape, self._any_shape)
+        if shape not in self._interchangeable:
+            return candidates, ""
+        fingerprint = shape + "|" + " ".join(str(len(token)) for token in tokens)
+        learned = self._learned.pop(fingerprint, None)
+        if learned is None:
+            return candidates, fingerprint
+        self._learned[fingerprint] = learned
+        return [learned, *(fmt for fmt in candidates if fmt != learned)], fingerprint
+
+    def learn(self, fingerprint: str, fmt: str):
+        """Remember the format that matched a string with the fingerprint, forgetting the least recently used."""
+        if not fingerprint:
+            return
+        self._learned.pop(fingerprint, None)
+        self._learned[fingerprint] = fmt
+        if len(self._learned) > self._max_learned:
+            self._learned.pop(next(iter(self._learned)), None)
+
+
+def _short_names(fmt: str) -> str:
+    """The format with abbreviated weekday and month names instead of full ones."""
+    return re.sub("%.", lambda m: {"%A": "%a", "%B": "%b"}.get(m.group(), m.group()), fmt)
+
+
+# The dispatches for the format lists used by `_str_to_object()`, by the lists' ids.
+_format_dispatches: dict[int, _FormatDispatch] = {}
+
+
+def _format_dispatch(formats: list[str]) -> _FormatDispatch:
+    """The dispatch for the format list, which is built again if the list or the locale changed."""
+    dispatch = _format_dispatches.get(id(formats))
+    if dispatch is None or not dispatch.is_current(formats):
+        dispatch = _format_dispatches[id(formats)] = _FormatDispatch(formats)
+    return dispatch
+
+
 def _str_to_object[DT](
     date_time_str: str,
     input_format: str,
@@ -224,10 +382,12 @@ def _str_to_object[DT](
             return extract(dt), ""
 
     # Okay, try the the input format and if that fails, the supplied
-    # friendly formats. First try without the "cleaning" step, which
-    # would cause some formats like %c to fail. Then try the cleaned
-    # string.
-    fmts = [input_format] + friendly_formats
+    # friendly formats that can match the string's shape. First try without
+    # the "cleaning" step, which would cause some formats like %c to fail.
+    # Then try the cleaned string.
+    dispatch = _format_dispatch(friendly_formats)
+    candidates, fingerprint = dispatch.candidates(dt_str)
+    fmts = [input_format] + candidates
     for fmt in fmts:
         if not fmt:  # skip empties...
             continue
@@ -236,6 +396,8 @@ def _str_to_object[DT](
             if not dt:
                 dt = datetime.strptime(clean_dt_str(dt_str), fmt)  # noqa: DTZ007
             if dt:
+                if fmt != input_format:
+                    dispatch.learn(fingerprint, fmt)
                 return extract(add_timezone(dt)), ""
         except ValueError:
             pass
@@ -1,28 +1,142 @@
 """
 Persistent storage of JSONL data in a local file.
+
+The file is treated as an append-only log. Every `save()` appends new versions of
+records and `remove()` appends "tombstone" records. Use `replay()` to recover the
+live set of records, where the last version written for an id wins and tombstoned
+ids are dropped. Superseded versions accumulate until `compact()` atomically rewrites
+the file with just the live records, which can also be triggered automatically when
+the fraction of superseded records crosses a threshold.
+
+Appends go through one file handle that is kept open. Optionally, a "group commit"
+writer thread takes the records from a bounded queue, so concurrent saves are
+coalesced into one write and one flush or fsync, as selected by the `Durability`.
+Each `save()` waits for the batch with its records to be written and raises the
+writer's error if that failed, except with `Durability.NONE`, when it returns once
+the records are queued. Then use `flush()` as a barrier when a caller needs to know
+the records are written.
+
+For large files, `replay_by_id()` uses an `OffsetIndex` of the live records, saved in
+a sidecar file, and returns `LazyRecords`, which decodes each record on first access.
+
+To restart without reading the whole file, save a `checkpoint()` with a snapshot of the
+live records, then `resume()` from it later, so `tail()` returns just the records appended
+since. A checkpoint is only valid for the same file, e.g., not after it is compacted.
+
+When several processes share a file, e.g., API server workers, use `cross_process=True`.
+Then all changes to the file are made while holding an advisory lock on a ".lock" file
+next to it, and each process remembers how far it has read, so `tail()` returns just the
+records appended since, by any process.
 """
 
 from __future__ import annotations
 
+import atexit
 import json
 import logging
-from collections.abc import MutableMapping, Sequence
+import os
+import queue
+import tempfile
+import threading
+import weakref
+from collections.abc import Callable, Generator, Mapping, MutableMapping, Sequence
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from enum import StrEnum
 from pathlib import Path
 from typing import Any
 
-from common.json_yaml import decode_json_dict, encode_json
+from common.json_yaml import encode_json, parse_json
+from common.jsonl_offset_index import LazyRecords, OffsetIndex, open_buffer, sidecar_path
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None  # type: ignore[assignment]
+from common.persistent_storage import PersistentStorage
+
+# The key added to a record to mark its id as removed.
+TOMBSTONE_KEY = "__tombstone__"
+
+# How many bytes before a checkpoint's offset must still match for `resume()` to accept it.
+_FINGERPRINT_SIZE = 64
+
+
+class Durability(StrEnum):
+    """How hard `FilePersistentStorage` works to get appended records onto the disk."""
+
+    NONE = "none"  # Leave records in the process's buffer until it fills or `flush()` is called.
+    FLUSH = "flush"  # Flush each write (or batch) to the operating system.
+    FSYNC_BATCH = "fsync_batch"  # Also fsync once per write (or batch).
+    FSYNC_RECORD = "fsync_record"  # Flush and fsync after every record.
+
+
+@dataclass(slots=True)
+class _QueuedSave:
+    """The lines of a `save()` that waits for the group commit writer, and the writer's error, if any."""
+
+    lines: Sequence[str]
+    done: threading.Event = field(default_factory=threading.Event)
+    error: OSError | None = None
 
 
-class FilePersistentStorage:
+def _parse_record(line: str) -> dict[str, Any] | None:
+    """Parse a JSONL line, returning `None` if it isn't a JSON object."""
+    try:
+        record = parse_json(line)
+    except ValueError:
+        return None
+    return record if isinstance(record, dict) else None
+
+
+def _close_at_exit(ref: weakref.ref[FilePersistentStorage]):
+    storage = ref()
+    if storage:
+        storage.close()
+
+
+# The public methods are the `PersistentStorage` interface, plus the compaction and offset index methods.
+class FilePersistentStorage(PersistentStorage):  # pylint: disable=too-many-instance-attributes,too-many-public-methods
     """Persistent storage of JSONL data in a local file."""
 
-    def __init__(self, storage_path: Path | str, logger: logging.Logger | None = None, remove_old: bool = False):
+    def __init__(  # pylint: disable=too-many-arguments,too-many-positional-arguments
+        self,
+        storage_path: Path | str,
+        logger: logging.Logger | None = None,
+        remove_old: bool = False,
+        id_key: str = "id",
+        compaction_ratio: float = 0.0,
+        compaction_min_records: int = 1000,
+        background_compaction: bool = False,
+        durability: Durability | str = Durability.FLUSH,
+        group_commit: bool = False,
+        queue_size: int = 1024,
+        cross_process: bool = False,
+    ):
         """
-        Initialize the appointment tool.
+        Initialize the storage.
 
         Args:
             - storage_path: Path to the JSONL file for storing data
             - logger: Optional logger instance
+            - remove_old: If True, delete any existing file and start empty.
+            - id_key: The record key used to identify versions of the same record in `replay()`.
+            - compaction_ratio: When > 0, `compact()` is triggered automatically after writes once
+              at least this fraction of the records in the file are superseded or tombstoned.
+              The default, 0.0, disables automatic compaction.
+            - compaction_min_records: Automatic compaction is never triggered for files with fewer records.
+            - background_compaction: If True, automatic compaction runs in a background thread.
+            - durability: When appended records are flushed and fsynced. See `Durability`.
+            - group_commit: If True, `save()` queues the records for a writer thread, which writes
+              everything queued by concurrent callers at once, then flushes or fsyncs once, per
+              `durability`. `save()` waits for its records to be written and raises the `OSError`
+              if that failed. With `Durability.NONE`, it returns once the records are queued
+              instead, and `flush()` waits for them and raises any error.
+            - queue_size: The maximum number of queued `save()` calls before callers block.
+            - cross_process: If True, other processes may change the file, so writes, reads, and
+              compaction hold an advisory lock on the file `<storage_path>.lock` and `tail()` can be
+              used to catch up with their changes. Requires `fcntl`, so it isn't supported on Windows,
+              and can't be combined with `group_commit`, because writes must be done while locked.
         """
         self.storage_path = Path(storage_path)
         if logger:
@@ -30,9 +144,56 @@ class FilePersistentStorage:
         else:
             self.logger = logging.getLogger(self.__class__.__name__)
             self.logger.setLevel(logging.INFO)
+        self.id_key = id_key
+        self.compaction_ratio = compaction_ratio
+        self.compaction_min_records = compaction_min_records
+        self.background_compaction = background_compaction
+        self.durability = Durability(durability)
+        self.group_commit = group_commit
+        self.cross_process = cross_process
+        if cross_process and group_commit:
+            raise ValueError("cross_process=True can't be combined with group_commit=True.")
+        if cross_process and fcntl is None:
+            raise ValueError("cross_process=True requires file locking with fcntl, which isn't available.")
+
+        # Guards all writes to the file and the statistics below.
+        self._lock = threading.RLock()
+        self._compaction_thread: threading.Thread | None = None
+        # Incremented whenever the file is replaced or cleared outside of compaction,
+        # so an in-flight compaction knows its view of the file is stale.
+        self._generation = 0
+        # Statistics used to decide when to compact. They are exact after `replay()`.
+        self._total_records = 0
+        self._anonymous_records = 0
+        self._live_ids: set[str] = set()
+        # The handle used for appends, which is reopened after the file is replaced.
+        self._append_file: Any = None
+        # The file's inode and the byte offset read up to by `replay()`, `tail()`, etc.
+        self._read_position = (0, 0)
+        # The advisory lock file when `cross_process` is True, and how deeply `exclusive()` is nested.
+        self._lock_file: Any = None
+        self._lock_depth = 0
+        if cross_process:
+            self.storage_path.parent.mkdir(parents=True, exist_ok=True)
+            # pylint: disable-next=unspecified-encoding,consider-using-with
+            self._lock_file = open(self.storage_path.with_name(self.storage_path.name + ".lock"), "a")  # noqa: SIM115
 
         # Create file if it doesn't exist
-        self.__create_file(remove_old=remove_old)
+        with self.exclusive():
+            self.__create_file(remove_old=remove_old)
+            if remove_old:
+                # The empty file is read up to its end, so `tail()` doesn't report it as replaced.
+                self._read_position = (self.storage_path.stat().st_ino, 0)
+
+        self._queue: queue.Queue[Any] = queue.Queue(maxsize=queue_size)
+        self._writer_error: OSError | None = None
+        self._writer: threading.Thread | None = None
+        if group_commit:
+            self._writer = threading.Thread(
+                target=self._writer_loop, name=f"writer-{self.storage_path.name}", daemon=True
+            )
+            self._writer.start()
+            atexit.register(_close_at_exit, weakref.ref(self))
 
     def __create_file(self, remove_old: bool = False):
         """
@@ -40,60 +201,611 @@ class FilePersistentStorage:
         then nothing is done.
         """
         if remove_old:
+            self._close_append_file()
             self.storage_path.unlink(missing_ok=True)
+            sidecar_path(self.storage_path).unlink(missing_ok=True)
+            self._reset_stats()
         if not self.storage_path.exists():
             self.storage_path.parent.mkdir(parents=True, exist_ok=True)
             self.storage_path.touch()
 
+    def _reset_stats(self):
+        self._total_records = 0
+        self._anonymous_records = 0
+        self._live_ids = set()
+
+    @property
+    def shared(self) -> bool:
+        """True if other processes may change the file. See `cross_process`."""
+        return self.cross_process
+
+    @contextmanager
+    def exclusive(self) -> Generator[None]:
+        """
+        Hold the lock that guards changes to the file. When `cross_process` is True, this
+        is also an advisory lock that other processes respect, so a caller can read the
+        latest records, validate a change, and write it, without another process writing
+        in between. Nested uses in the same thread are allowed.
+        """
+        with self._lock:
+            # The outermost use locks the lock file, which only exists if `fcntl` is available.
+            locking = fcntl if self._lock_depth == 0 and self._lock_file is not None else None
+            if locking is not None:
+                locking.flock(self._lock_file.fileno(), locking.LOCK_EX)
+            self._lock_depth += 1
+            try:
+                yield
+            finally:
+                self._lock_depth -= 1
+                if locking is not None:
+                    locking.flock(self._lock_file.fileno(), locking.LOCK_UN)
+
     def clear(self):
         """Clear the storage file of all records."""
-        self.__create_file(remove_old=True)
+        self.flush()
+        with self.exclusive():
+            self._generation += 1
+            self.__create_file(remove_old=True)
+            self._read_position = (self.storage_path.stat().st_ino, 0)
+
+    @property
+    def record_count(self) -> int:
+        """The number of records in the file, including superseded versions and tombstones."""
+        return self._total_records
+
+    @property
+    def live_record_count(self) -> int:
+        """The number of records that `replay()` would return."""
+        return len(self._live_ids) + self._anonymous_records
 
     def load(self) -> tuple[Sequence[MutableMapping[str, Any]], list[str]]:
         """
-        Load records from the JSONL storage file and parses them using `decode_json_dict(line)`.
+        Load records from the JSONL storage file and parses them using `self.decode_record(line)`.
 
         Returns:
             A tuple of lists. The first list has dictionaries successfully parsed
             from the JSONL records. The list reflects the same order found in the file, so when
             later records are intended to override earlier records, that can be
             inferred by code using this module and the list ordering. The second list
-            contains any JSONL records that failed to parse.
+            contains any JSONL records that failed to parse. Use `replay()` to get just the
+            live version of each record.
+        """
+        self.flush()
+        with self.exclusive():
+            return self._read()
+
+    def _read(self, start: int = 0) -> tuple[list[MutableMapping[str, Any]], list[str]]:
+        """
+        Read and parse the records from byte offset `start` to the end of the file.
+        Remember the file's inode and the offset read up to. Hold the lock.
         """
         dicts = []
         errors = []
-        if self.storage_path.exists():
-            with open(self.storage_path, "r") as f:  # pylint: disable=unspecified-encoding
-                for line in f:
-                    line = line.strip()
-                    if line:
-                        try:
-                            d = decode_json_dict(line)
-                            dicts.append(d)
-                        except json.JSONDecodeError as e:
-                            errors.append(line)
-                            self.logger.error("Error parsing record line: %s (line: %s)", e, line)
+        if not self.storage_path.exists():
+            self._read_position = (0, 0)
+            return dicts, errors
+        with open(self.storage_path, "rb") as f:
+            f.seek(start)
+            data = f.read()
+            self._read_position = (os.fstat(f.fileno()).st_ino, start + len(data))
+        for line in data.decode("utf-8").splitlines():
+            line = line.strip()
+            if line:
+                try:
+                    d = self.decode_record(line)
+                    dicts.append(d)
+                except ValueError as e:
+                    errors.append(line)
+                    self.logger.error("Error parsing record line: %s (line: %s)", e, line)
         return dicts, errors
 
+    def tail(self) -> tuple[dict[str, MutableMapping[str, Any]], set[str], list[str]] | None:
+        """
+        Return the changes appended to the file, by any process, since it was last read
+        with `replay()`, `replay_by_id()`, or `tail()`, with last-write-wins applied. When
+        `cross_process` is True, records written by this instance while it was up to date
+        are skipped.
+
+        Returns:
+            A tuple with the new live records keyed by id, the removed ids, and the JSONL records
+            that failed to parse, or `None` if the file was replaced, e.g., by compaction in
+            another process, so the caller must `replay()` it all again.
+        """
+        self.flush()
+        with self.exclusive():
+            inode, offset = self._read_position
+            try:
+                stat = self.storage_path.stat()
+            except FileNotFoundError:
+                return None
+            if stat.st_ino != inode or stat.st_size < offset:
+                return None
+            if stat.st_size == offset:
+                return {}, set(), []
+            records, errors = self._read(offset)
+            saved: dict[str, MutableMapping[str, Any]] = {}
+            removed: set[str] = set()
+            for record in records:
+                self._track(record)
+                record_id = record.get(self.id_key)
+                if record_id is None:
+                    continue
+                if record.get(TOMBSTONE_KEY):
+                    saved.pop(record_id, None)
+                    removed.add(record_id)
+                else:
+                    removed.discard(record_id)
+                    saved[record_id] = record
+        return saved, removed, errors
+
+    def checkpoint(self) -> dict[str, Any]:
+        """
+        Return the state needed to `resume()` reading the file where it ends now: its inode, its
+        size, the bytes just before the end, which `resume()` checks are unchanged, and the record
+        statistics used to decide when to compact. See `PersistentStorage.checkpoint()`.
+        """
+        self.flush()
+        with self.exclusive():
+            stat = self.storage_path.stat()
+            return {
+                "inode": stat.st_ino,
+                "offset": stat.st_size,
+                "fingerprint": self._fingerprint(stat.st_size),
+                "total_records": self._total_records,
+                "anonymous_records": self._anonymous_records,
+                "live_ids": set(self._live_ids),
+            }
+
+    def resume(self, checkpoint: Mapping[str, Any]) -> bool:
+        """
+        Continue from a `checkpoint()` of this file, so `tail()` reads just the records appended
+        since. Returns False if the file was replaced or truncated, or the bytes before the
+        checkpoint's offset changed. See `PersistentStorage.resume()`.
+        """
+        self.flush()
+        with self.exclusive():
+            try:
+                inode, offset = checkpoint["inode"], checkpoint["offset"]
+                stat = self.storage_path.stat()
+                if stat.st_ino != inode or stat.st_size < offset:
+                    return False
+                if self._fingerprint(offset) != checkpoint["fingerprint"]:
+                    return False
+                self._total_records = checkpoint["total_records"]
+                self._anonymous_records = checkpoint["anonymous_records"]
+                self._live_ids = set(checkpoint["live_ids"])
+            except (OSError, KeyError, TypeError) as e:
+                self.logger.warning("Ignoring an invalid checkpoint: %s", e)
+                return False
+            self._read_position = (inode, offset)
+        return True
+
+    def _fingerprint(self, offset: int) -> bytes:
+        """The bytes of the file just before `offset`. Hold the lock."""
+        start = max(0, offset - _FINGERPRINT_SIZE)
+        with open(self.storage_path, "rb") as f:
+            f.seek(start)
+            return f.read(offset - start)
+
+    def replay(self) -> tuple[Sequence[MutableMapping[str, Any]], list[str]]:
+        """
+        Replay the log and return the live records. For each value of `self.id_key`, the
+        last version written wins and ids whose last record is a tombstone are dropped.
+        Records without an id are returned unchanged after the records with ids.
+
+        Returns:
+            A tuple with the list of live records and a list of the JSONL records that
+            failed to parse.
+        """
+        self.flush()
+        with self.exclusive():
+            records, errors = self._read()
+            live, anonymous = self._live_records(records)
+            self._total_records = len(records)
+            self._live_ids = set(live)
+            self._anonymous_records = len(anonymous)
+        return list(live.values()) + anonymous, errors
+
+    def offset_index(self) -> OffsetIndex:
+        """
+        Return the offset index for the current contents of the file. The index saved in
+        the sidecar file is used if it matches the file's size and modification time.
+        Otherwise, the file is scanned and the new index is saved. Either way, the record
+        counts are updated, as for `replay()`.
+        """
+        self.flush()
+        with self.exclusive():
+            return self._offset_index()
+
+    def _offset_index(self) -> OffsetIndex:
+        """See `offset_index()`. Hold the lock."""
+        stat = self.storage_path.stat()
+        index = OffsetIndex.load(sidecar_path(self.storage_path))
+        if index is None or not index.matches(stat):
+            buffer = open_buffer(self.storage_path, stat.st_size)
+            index = OffsetIndex.build(buffer, stat.st_size, stat.st_mtime_ns, self.id_key, TOMBSTONE_KEY, self.logger)
+            try:
+                index.save(sidecar_path(self.storage_path))
+            except OSError as e:
+                self.logger.warning("Failed to save the offset index: %s", e)
+        self._read_position = (stat.st_ino, index.size)
+        self._total_records = index.total_records
+        self._live_ids = set(index.offsets)
+        self._anonymous_records = len(index.anonymous)
+        return index
+
+    def replay_by_id(
+        self,
+        keep: Callable[[MutableMapping[str, Any]], bool] | None = None,
+        convert: Callable[[MutableMapping[str, Any]], MutableMapping[str, Any]] | None = None,
+    ) -> tuple[MutableMapping[str, MutableMapping[str, Any]], list[MutableMapping[str, Any]], list[str]]:
+        """
+        Like `replay()`, but return the live records with ids as `LazyRecords`, which decodes
+        each record from a memory map of the file when it is first accessed. Records for
+        which `keep(record)` returns False are left out and, if `convert` is given, the others
+        are replaced by `convert(record)` when they are decoded. Startup time is proportional to
+        the number of live ids when the saved offset index is still valid.
+
+        Returns:
+            A tuple with the live records keyed by id, the live records without an id, and
+            the JSONL records that failed to parse.
+        """
+        self.flush()
+        with self.exclusive():
+            index = self._offset_index()
+            buffer = open_buffer(self.storage_path, index.size)
+        anonymous = [
+            self.decode_record(buffer[offset : offset + length].decode("utf-8")) for offset, length in index.anonymous
+        ]
+        return LazyRecords(buffer, index.offsets, keep, convert, self.decode_record), anonymous, list(index.errors)
+
+    def _live_records(
+        self, records: Sequence[MutableMapping[str, Any]]
+    ) -> tuple[dict[str, MutableMapping[str, Any]], list[MutableMapping[str, Any]]]:
+        """
+        Apply last-write-wins to the records, in log order. A record keeps the position
+        where its id was first written, unless the id was removed and then written again.
+        """
+        live: dict[str, MutableMapping[str, Any]] = {}
+        anonymous: list[MutableMapping[str, Any]] = []
+        for record in records:
+            record_id = record.get(self.id_key)
+            if record_id is None:
+                anonymous.append(record)
+            elif record.get(TOMBSTONE_KEY):
+                live.pop(record_id, None)
+            else:
+                live[record_id] = record
+        return live, anonymous
+
     def save(self, records: Sequence[MutableMapping[str, Any]]) -> int:
         """
         Append the list of records to the JSONL file, encoding them
-        using `encode_json(record)`. To overwrite the
-        existing records in the storage file, call `clear()`, then
-        `save()` with _all_ the records.
+        using `encode_json(record)`. A record with the same id as an earlier
+        record supersedes it. To overwrite the existing records in the storage
+        file, call `rewrite()` with _all_ the records.
 
         Args:
             - records: list of dictionaries to convert to JSONL and write.
 
         Returns:
-            The count of the number of records written, which should be equal to len(records).
+            The count of the number of records written, or queued when `group_commit` is True
+            and `durability` is `Durability.NONE`, which should be equal to len(records).
+
+        Raises:
+            OSError: If the records couldn't be written.
+        """
+        lines = [encode_json(record) + "\n" for record in records]
+        # After `close()`, there is no writer to wait for, so write directly.
+        writing = self._writer is not None and self._writer.is_alive()
+        if writing and self.durability == Durability.NONE:
+            self._queue.put(lines)
+            with self._lock:
+                for record in records:
+                    self._track(record)
+        elif writing:
+            queued = _QueuedSave(lines)
+            self._queue.put(queued)
+            queued.done.wait()
+            if queued.error:
+                raise queued.error
+            with self._lock:
+                for record in records:
+                    self._track(record)
+        else:
+            with self.exclusive():
+                self._write_lines(lines)
+                for record in records:
+                    self._track(record)
+        self.maybe_compact()
+        return len(lines)
+
+    def _write_lines(self, lines: Sequence[str]):
+        """Append the lines, then flush and fsync as required by `self.durability`. Hold the lock."""
+        if self.cross_process:
+            self._write_shared_lines(lines)
+            return
+        f = self._append_handle()
+        if self.durability == Durability.FSYNC_RECORD:
+            for line in lines:
+                f.write(line)
+                f.flush()
+                os.fsync(f.fileno())
+            return
+        f.writelines(lines)
+        if self.durability != Durability.NONE:
+            f.flush()
+        if self.durability == Durability.FSYNC_BATCH:
+            os.fsync(f.fileno())
+
+    def _write_shared_lines(self, lines: Sequence[str]):
+        """
+        Like `_write_lines()`, when other processes share the file. Reopen the append handle
+        if another process replaced the file, and always flush before the lock is released.
+        If this instance had read everything before writing, skip the new lines when reading.
+        """
+        f = self._append_handle()
+        if os.fstat(f.fileno()).st_ino != self.storage_path.stat().st_ino:
+            self._close_append_file()
+            f = self._append_handle()
+        stat = os.fstat(f.fileno())
+        caught_up = self._read_position == (stat.st_ino, stat.st_size)
+        for line in lines:
+            f.write(line)
+            if self.durability == Durability.FSYNC_RECORD:
+                f.flush()
+                os.fsync(f.fileno())
+        f.flush()
+        if self.durability == Durability.FSYNC_BATCH:
+            os.fsync(f.fileno())
+        if caught_up:
+            self._read_position = (stat.st_ino, os.fstat(f.fileno()).st_size)
+
+    def _append_handle(self) -> Any:
+        if self._append_file is None:
+            # pylint: disable-next=unspecified-encoding,consider-using-with
+            self._append_file = open(self.storage_path, "a")  # noqa: SIM115
+        return self._append_file
+
+    def _close_append_file(self):
+        if self._append_file is not None:
+            self._append_file.close()
+            self._append_file = None
+
+    def _writer_loop(self):
+        """
+        The group commit writer: wait for queued lines, then drain the queue and write
+        everything in one batch. The waiting `save()` calls and the barriers queued by
+        `flush()` are released once all the lines queued before them are written. If the
+        write fails, the error is passed to the waiting saves, or kept for `flush()` if
+        the batch has lines of saves that didn't wait. `None` stops the writer.
+        """
+        while True:
+            batch = [self._queue.get()]
+            while True:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            self._write_batch(batch)
+            if None in batch:
+                return
+
+    def _write_batch(self, batch: Sequence[Any]):
+        """Write the lines of the queued items in one write, then release the waiting callers."""
+        lines = []
+        waiting = []
+        barriers = []
+        unwaited = False
+        for item in batch:
+            if isinstance(item, threading.Event):
+                barriers.append(item)
+            elif isinstance(item, _QueuedSave):
+                waiting.append(item)
+                lines.extend(item.lines)
+            elif item is not None:
+                unwaited = True
+                lines.extend(item)
+        if lines:
+            try:
+                with self._lock:
+                    self._write_lines(lines)
+            except OSError as e:
+                for queued in waiting:
+                    queued.error = e
+                if unwaited:
+                    self._writer_error = e
+                self.logger.error("Failed to write %d queued records: %s", len(lines), e)
+        for queued in waiting:
+            queued.done.set()
+        for barrier in barriers:
+            barrier.set()
+
+    def _raise_writer_error(self):
+        error, self._writer_error = self._writer_error, None
+        if error:
+            raise error
+
+    def flush(self):
+        """
+        Wait until all records passed to `save()` so far are written and flushed to the
+        operating system, regardless of `durability`. Raises the `OSError` if the group
+        commit writer failed to write records queued with `Durability.NONE` since the last call.
+        """
+        if self._writer and self._writer.is_alive():
+            barrier = threading.Event()
+            self._queue.put(barrier)
+            barrier.wait()
+        with self._lock:
+            if self._append_file is not None:
+                self._append_file.flush()
+        self._raise_writer_error()
+
+    def close(self):
+        """Write any queued records, stop the group commit writer, if any, and close the file."""
+        if self._writer and self._writer.is_alive():
+            self.flush()
+            self._queue.put(None)
+            self._writer.join()
+        with self._lock:
+            self._close_append_file()
+            if self._lock_file is not None:
+                self._lock_file.close()
+                self._lock_file = None
+
+    def remove(self, ids: Sequence[str]) -> int:
+        """
+        Append tombstones for the input ids, so `replay()` no longer returns them.
+
+        Returns:
+            The count of tombstones written.
+        """
+        return self.save([{self.id_key: record_id, TOMBSTONE_KEY: True} for record_id in ids])
+
+    def _track(self, record: MutableMapping[str, Any]):
+        self._total_records += 1
+        record_id = record.get(self.id_key)
+        if record_id is None:
+            self._anonymous_records += 1
+        elif record.get(TOMBSTONE_KEY):
+            self._live_ids.discard(record_id)
+        else:
+            self._live_ids.add(record_id)
+
+    def rewrite(self, records: Sequence[MutableMapping[str, Any]]) -> int:
+        """
+        Atomically replace the file contents with the input records. Readers see either
+        the old file or the new file, never a partially-written file.
+
+        Returns:
+            The count of the number of records written.
         """
-        count = 0
-        with open(self.storage_path, "a") as f:  # pylint: disable=unspecified-encoding
+        lines = [encode_json(record) + "\n" for record in records]
+        self.flush()
+        with self.exclusive():
+            self._generation += 1
+            self._atomic_write(lines)
+            self._read_position = (self.storage_path.stat().st_ino, sum(len(line.encode()) for line in lines))
+            self._reset_stats()
             for record in records:
-                f.write(encode_json(record) + "\n")
-                count += 1
-        return count
+                self._track(record)
+        return len(lines)
+
+    def _atomic_write(self, lines: Sequence[str]):
+        """Write the lines to a temporary file in the same directory, then rename it over the storage file."""
+        self._close_append_file()
+        sidecar_path(self.storage_path).unlink(missing_ok=True)
+        self.storage_path.parent.mkdir(parents=True, exist_ok=True)
+        fd, temp_name = tempfile.mkstemp(
+            dir=self.storage_path.parent, prefix=f".{self.storage_path.name}.", suffix=".tmp"
+        )
+        try:
+            with os.fdopen(fd, "w") as f:  # pylint: disable=unspecified-encoding
+                f.writelines(lines)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_name, self.storage_path)
+        except BaseException:
+            Path(temp_name).unlink(missing_ok=True)
+            raise
+
+    def needs_compaction(self) -> bool:
+        """True if automatic compaction is enabled and enough of the file is superseded records."""
+        total = self._total_records
+        if self.compaction_ratio <= 0 or total < self.compaction_min_records:
+            return False
+        return total - self.live_record_count >= self.compaction_ratio * total
+
+    def maybe_compact(self) -> bool:
+        """
+        Compact the file if `needs_compaction()` is True, in a background thread
+        if `self.background_compaction` is True.
+
+        Returns:
+            True if a compaction was run or started.
+        """
+        if not self.needs_compaction():
+            return False
+        if not self.background_compaction:
+            self.compact()
+            return True
+        with self._lock:
+            if self._compaction_thread and self._compaction_thread.is_alive():
+                return False
+            self._compaction_thread = threading.Thread(
+                target=self.compact, name=f"compact-{self.storage_path.name}", daemon=True
+            )
+            self._compaction_thread.start()
+        return True
+
+    def wait_for_compaction(self, timeout: float | None = None):
+        """Block until any background compaction finishes."""
+        thread = self._compaction_thread
+        if thread:
+            thread.join(timeout)
+
+    def compact(self) -> int:
+        """
+        Atomically rewrite the file so it contains only the lines of the live records, in the
+        same order `replay()` returns them. Lines that fail to parse are kept at the end, so
+        no data is silently lost. The bulk of the file is read and replayed without
+        holding the write lock; only the records appended while that happens are copied
+        under the lock, just before the new file replaces the old one.
+
+        Returns:
+            The number of records in the compacted file, not counting the lines that failed to
+            parse, or -1 if the compaction was abandoned because the file was cleared or
+            rewritten meanwhile.
+        """
+        self.flush()
+        with self.exclusive():
+            generation = self._generation
+            stat = self.storage_path.stat()
+            end = stat.st_size
+
+        with open(self.storage_path, "rb") as f:
+            prefix = f.read(end).decode("utf-8")
+        # Only the ids and tombstones are needed, so the records are decoded without their
+        # datetimes and the lines of the live records are copied as they are.
+        records = []
+        line_of: dict[int, str] = {}
+        bad_lines = []
+        for line in prefix.splitlines():
+            line = line.strip()
+            if line:
+                record = _parse_record(line)
+                if record is not None:
+                    records.append(record)
+                    line_of[id(record)] = line
+                else:
+                    bad_lines.append(line)
+        live, anonymous = self._live_records(records)
+        lines = [line_of[id(record)] + "\n" for record in [*live.values(), *anonymous]]
+        lines.extend(line + "\n" for line in bad_lines)
+        if bad_lines:
+            self.logger.error("Compaction kept %d records that failed to parse", len(bad_lines))
+
+        with self.exclusive():
+            if generation != self._generation or self.storage_path.stat().st_ino != stat.st_ino:
+                self.logger.info("Compaction abandoned; the storage file was replaced while compacting.")
+                return -1
+            if self._append_file is not None:
+                self._append_file.flush()
+            with open(self.storage_path, "rb") as f:
+                f.seek(end)
+                tail = f.read().decode("utf-8")
+            tail_lines = [line + "\n" for line in tail.splitlines() if line.strip()]
+            caught_up = self._read_position == (stat.st_ino, end + len(tail.encode()))
+            self._atomic_write(lines + tail_lines)
+            if caught_up:
+                new_size = sum(len(line.encode()) for line in lines + tail_lines)
+                self._read_position = (self.storage_path.stat().st_ino, new_size)
+            before = self._total_records
+            # Like `replay()`, count just the records that parse, so the kept bad lines don't look superseded.
+            tail_records = sum(1 for line in tail_lines if _parse_record(line) is not None)
+            self._total_records = len(live) + len(anonymous) + tail_records
+        self.logger.info("Compacted the storage file from %d to %d records", before, self._total_records)
+        return self._total_records
 
     def __str__(self) -> str:
         return self.to_json()
@@ -103,7 +815,7 @@ class FilePersistentStorage:
         return json.dumps(
             {
                 "__class__": "FilePersistentStorage",
-                "storage_path": self.storage_path,
+                "storage_path": str(self.storage_path),
             }
         )
 
@@ -1,8 +1,14 @@
-"""YAML and JSON utilities."""
+"""
+YAML and JSON utilities.
+
+The JSON functions use the stdlib `json` module. The C-accelerated `orjson` library, when it is
+installed, can be used instead with `set_json_backend("orjson")`, with the same datetime convention.
+"""
 
 import json
+import math
 import re
-from collections.abc import Mapping, MutableMapping, Sequence
+from collections.abc import Collection, Mapping, MutableMapping, Sequence
 from datetime import datetime
 from json.decoder import JSONDecodeError
 from pathlib import Path
@@ -10,6 +16,11 @@ from typing import Any
 
 import yaml
 
+try:
+    import orjson
+except ImportError:  # Optional; the stdlib json module is used instead.
+    orjson = None  # type: ignore[assignment]
+
 # Too many of these warnings for variables that ARE used in other files.
 # pylint: disable=unused-variable
 
@@ -19,12 +30,44 @@ def load_yaml(path: Path) -> Mapping[str, Any]:
     return yaml.safe_load(path.read_text())
 
 
+class LazyDatetime:
+    """
+    An encoded datetime that hasn't been parsed yet, returned by `decode_json_record()`.
+    Call `to_datetime()` to parse it. It is encoded again without being parsed.
+    """
+
+    __slots__ = ("iso_str",)
+
+    def __init__(self, iso_str: str):
+        self.iso_str = iso_str
+
+    def to_datetime(self) -> datetime:
+        """Parse the datetime."""
+        return datetime.fromisoformat(self.iso_str)
+
+    def __eq__(self, other: object) -> bool:
+        return isinstance(other, LazyDatetime) and self.iso_str == other.iso_str
+
+    def __hash__(self) -> int:
+        return hash(self.iso_str)
+
+    def __repr__(self) -> str:
+        return f"LazyDatetime({self.iso_str!r})"
+
+
 class DatetimeEncoder(json.JSONEncoder):
-    """Specialized JSON encoder that handles datetime instances."""
+    """
+    Specialized JSON encoder that handles datetime instances and mappings
+    that aren't dictionaries, e.g., compact record types.
+    """
 
     def default(self, o: Any) -> Any:
         if isinstance(o, datetime):
             return {"__class__": "datetime", "iso_str": o.isoformat()}
+        if isinstance(o, LazyDatetime):
+            return {"__class__": "datetime", "iso_str": o.iso_str}
+        if isinstance(o, Mapping):
+            return dict(o)
         return super().default(o)
 
 
@@ -48,9 +91,176 @@ def_datetime_encoder = DatetimeEncoder()
 def_datetime_decoder = DatetimeDecoder()
 
 
+class JsonBackend:
+    """
+    The JSON library used by `encode_json()`, `decode_json_dict()`, `decode_json_list()`,
+    `decode_json_record()`, and `from_json()`. This one uses the stdlib `json` module.
+    Use `set_json_backend()` to choose the backend.
+    """
+
+    name = "json"
+
+    def encode(self, obj: Any) -> str:
+        """Encode the object, including datetimes and other mappings, like `DatetimeEncoder`."""
+        return def_datetime_encoder.encode(obj)
+
+    def decode(self, text: Any) -> Any:
+        """Decode the text, converting the encoded datetimes, like `DatetimeDecoder`."""
+        return def_datetime_decoder.decode(text)
+
+    def loads(self, text: Any) -> Any:
+        """Decode the text without converting the encoded datetimes."""
+        return json.loads(text)
+
+
+def _orjson_default(o: Any) -> Any:
+    """The conversions of `DatetimeEncoder.default()`, for `orjson.dumps()`."""
+    if isinstance(o, datetime):
+        return {"__class__": "datetime", "iso_str": o.isoformat()}
+    if isinstance(o, LazyDatetime):
+        return {"__class__": "datetime", "iso_str": o.iso_str}
+    if isinstance(o, Mapping):
+        return dict(o)
+    raise TypeError(f"Object of type {type(o).__name__} is not JSON serializable")
+
+
+def _from_dicts(obj: Any) -> Any:
+    """Apply `DatetimeDecoder.from_dict()` to the dictionaries in the decoded object, innermost first."""
+    if isinstance(obj, dict):
+        for key, value in obj.items():
+            if isinstance(value, (dict, list)):
+                obj[key] = _from_dicts(value)
+        return DatetimeDecoder.from_dict(obj) if "__class__" in obj else obj
+    if isinstance(obj, list):
+        for i, value in enumerate(obj):
+            if isinstance(value, (dict, list)):
+                obj[i] = _from_dicts(value)
+    return obj
+
+
+def _has_non_finite_floats(obj: Any) -> bool:
+    """True if the object has a NaN or infinite float, which `orjson` would encode as `null`."""
+    if isinstance(obj, float):
+        return not math.isfinite(obj)
+    if isinstance(obj, Mapping):
+        return any(_has_non_finite_floats(value) for value in obj.values())
+    if isinstance(obj, (list, tuple)):
+        return any(_has_non_finite_floats(value) for value in obj)
+    return False
+
+
+# A run of digits that may be an integer outside the 64-bit range, which `orjson` decodes as a float.
+_long_digits = re.compile(r"\d{19}")
+_long_digit_bytes = re.compile(rb"\d{19}")
+
+
+def _may_have_long_integers(text: Any) -> bool:
+    """True if the JSON text or bytes may have an integer outside the 64-bit range."""
+    if isinstance(text, str):
+        return _long_digits.search(text) is not None
+    if isinstance(text, (bytes, bytearray)):
+        return _long_digit_bytes.search(text) is not None
+    return False
+
+
+class OrjsonBackend(JsonBackend):
+    """
+    A backend that uses the C-accelerated `orjson` library, if it is installed, with the same
+    datetime convention. Datetimes and dates aren't serialized natively by `orjson`, so they are
+    encoded or rejected like the stdlib encoder does. Anything `orjson` can't handle, e.g., integers
+    larger than 64 bits, non-finite floats, which it writes as `null`, non-ASCII text, which the stdlib
+    escapes, bytes, or the `NaN` literal, is passed to the stdlib backend, so the decoded results,
+    including the errors raised, are the same. The encoded text is compact, without the spaces
+    the stdlib writes after the separators.
+    """
+
+    name = "orjson"
+
+    def __init__(self):
+        if orjson is None:
+            raise ValueError("The orjson backend requires the orjson library, which isn't installed.")
+        self._orjson = orjson
+        self._options = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS
+
+    def encode(self, obj: Any) -> str:
+        try:
+            text = self._orjson.dumps(obj, default=_orjson_default, option=self._options).decode()
+        except self._orjson.JSONEncodeError:
+            return super().encode(obj)
+        # Keep the stored text ASCII, as the stdlib escapes other characters. Non-finite floats
+        # are written as `null`, so only the objects encoded with a `null` are checked for them.
+        if not text.isascii() or ("null" in text and _has_non_finite_floats(obj)):
+            return super().encode(obj)
+        return text
+
+    def decode(self, text: Any) -> Any:
+        if not isinstance(text, str) or _may_have_long_integers(text):
+            return super().decode(text)
+        try:
+            obj = self._orjson.loads(text)
+        except self._orjson.JSONDecodeError:
+            return super().decode(text)
+        # Only walk the objects when the text may have encoded datetimes, which the stdlib never
+        # writes with escaped key characters. The substring search is much faster than the walk.
+        return _from_dicts(obj) if '"__class__"' in text else obj
+
+    def loads(self, text: Any) -> Any:
+        if _may_have_long_integers(text):
+            return super().loads(text)
+        try:
+            return self._orjson.loads(text)
+        except self._orjson.JSONDecodeError:
+            return super().loads(text)
+
+
+_json_backends: dict[str, type[JsonBackend]] = {JsonBackend.name: JsonBackend}
+if orjson is not None:
+    _json_backends[OrjsonBackend.name] = OrjsonBackend
+# The stdlib backend is the default. `orjson` is opt-in, e.g., for large stores, as its encoded
+# text differs from the stdlib's, although it decodes to the same records.
+_json_backend: JsonBackend = JsonBackend()
+
+
+def json_backend_names() -> list[str]:
+    """The names of the available JSON backends."""
+    return list(_json_backends)
+
+
+def get_json_backend() -> JsonBackend:
+    """The JSON backend in use."""
+    return _json_backend
+
+
+def set_json_backend(name: str) -> JsonBackend:
+    """
+    Use the named JSON backend, one of `json_backend_names()`.
+
+    Returns:
+        The previous backend, which can be passed to `set_json_backend(previous.name)` to restore it.
+
+    Raises:
+        ValueError if the backend isn't available.
+    """
+    global _json_backend  # pylint: disable=global-statement
+    if name not in _json_backends:
+        raise ValueError(f"Unknown or unavailable JSON backend {name!r}. Available: {json_backend_names()}")
+    previous = _json_backend
+    _json_backend = _json_backends[name]()
+    return previous
+
+
 def encode_json(dct: Mapping[str, Any] | Sequence[Mapping[str, Any]]) -> str:
     """Create a JSON string from the input object."""
-    return def_datetime_encoder.encode(dct)
+    return _json_backend.encode(dct)
+
+
+def parse_json(text: str | bytes) -> Any:
+    """
+    Parse a JSON string or UTF-8 bytes, e.g., a line of a JSONL file, like `json.loads()`,
+    without converting the encoded datetimes, e.g., for scans that only need a few fields.
+    Raises a JSONDecodeError, which is a ValueError, if the text fails to parse.
+    """
+    return _json_backend.loads(text)
 
 
 def decode_json_dict(text: Any) -> MutableMapping[str, Any]:
@@ -62,7 +272,7 @@ def decode_json_dict(text: Any) -> MutableMapping[str, Any]:
     this one and `decode_json_list`, so we can type them more specifically!
     """
     try:
-        obj = def_datetime_decoder.decode(text)
+        obj = _json_backend.decode(text)
         if not isinstance(obj, MutableMapping):
             raise TypeError(
                 f"decode_json_dict called with a string that is not a dictionary!? type: {type(obj)}, obj = <{obj}>"
@@ -72,6 +282,34 @@ def decode_json_dict(text: Any) -> MutableMapping[str, Any]:
         raise ValueError(f"JSONDecodeError or TypeError {err}: text not JSON? <{text}> (type: {type(text)})") from err
 
 
+def decode_json_record(text: Any, lazy_datetime_keys: Collection[str] = ()) -> MutableMapping[str, Any]:
+    """
+    Like `decode_json_dict()`, but the encoded datetimes that are the values of the top-level
+    `lazy_datetime_keys` are returned as `LazyDatetime`s, which are only parsed when needed,
+    e.g., for records whose timestamps are mostly never read after loading. The caller must
+    handle `LazyDatetime` values, like the `Appointment` record type does. Records with any
+    other nested objects are decoded by `decode_json_dict()`.
+    """
+    if not lazy_datetime_keys or not isinstance(text, str):
+        return decode_json_dict(text)
+    try:
+        record = _json_backend.loads(text)
+    except JSONDecodeError:
+        record = None
+    if not isinstance(record, dict):
+        # Raise the usual error.
+        return decode_json_dict(text)
+    for key, value in record.items():
+        if isinstance(value, dict):
+            if key in lazy_datetime_keys and value.get("__class__") == "datetime" and value.get("iso_str"):
+                record[key] = LazyDatetime(value["iso_str"])
+            else:
+                return decode_json_dict(text)
+        elif isinstance(value, list):
+            return decode_json_dict(text)
+    return record
+
+
 def decode_json_list(text: Any) -> Sequence[MutableMapping[str, Any]]:
     """
     Parse a JSON string, returning a list or raise a ValueError
@@ -81,7 +319,7 @@ def decode_json_list(text: Any) -> Sequence[MutableMapping[str, Any]]:
     this one and `decode_json_dict`, so we can type them more specifically!
     """
     try:
-        obj = def_datetime_decoder.decode(text)
+        obj = _json_backend.decode(text)
         if not isinstance(obj, Sequence):
             raise TypeError(
                 f"decode_json_list called with a string that is not a list!? type: {type(obj)}, obj = <{obj}>"
@@ -153,7 +391,7 @@ def from_json(json_str: str, keys_indices: list[Any]) -> Any:
     if not keys_indices:
         raise ValueError("Input keys must be nonzero length!")
 
-    value = json.loads(json_str)
+    value = parse_json(json_str)
     for key_index in keys_indices:
         value = value[key_index]
     return value
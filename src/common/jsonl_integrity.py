@@ -0,0 +1,436 @@
+"""
+An offline integrity checker and repair tool for the JSONL files written by
+`FilePersistentStorage`, for stores too large to check by loading them.
+
+`check_store()` splits the file into chunks that end at line boundaries and scans
+them in parallel worker processes, using `parse_json()` like `OffsetIndex.build()`.
+Each worker summarizes its chunk by id, with the last version of each id and whether it
+was removed in the chunk, so merging the chunks in order applies the same last-write-wins
+rules as `FilePersistentStorage.replay()`. The `IntegrityReport` lists:
+
+- Malformed lines, which `load()` only logs.
+- Records without an id, which `ResourceManager` reports when it loads them.
+- Duplicate ids, where a version of an id has a different creation time than the
+  version it supersedes, i.e., two different resources were given the same id.
+- Slot conflicts, where two live, active resources reserve the same time slot, e.g.,
+  two scheduled appointments of the same provider in the same second.
+- The count of superseded versions and tombstones, which compaction would drop.
+
+`repair_store()` then writes a compacted file with just the live records, copying their
+lines unchanged, in the order `replay()` returns them. Malformed lines and records without
+an id are written to a separate "rejected" file, so no data is silently lost. Duplicate ids
+and slot conflicts are reported, but not resolved, since that requires a human decision.
+"""
+
+# Allow types to self-reference during their definitions.
+from __future__ import annotations
+
+import json
+import multiprocessing
+import os
+import tempfile
+from collections.abc import Sequence
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from datetime import datetime
+from itertools import repeat
+from pathlib import Path
+from typing import Any
+
+from common.file_persistent_storage import TOMBSTONE_KEY
+from common.json_yaml import get_json_backend, parse_json, set_json_backend
+from common.jsonl_offset_index import open_buffer, sidecar_path
+
+# Too many of these warnings for variables that ARE used in other files.
+# pylint: disable=unused-variable
+
+# The default number of bytes scanned by each worker task.
+DEFAULT_CHUNK_BYTES = 64 * 1024 * 1024
+
+# How much of a malformed line is kept in a report.
+_MAX_LINE_TEXT = 200
+
+
+@dataclass(frozen=True)
+class CheckOptions:  # pylint: disable=too-many-instance-attributes
+    """
+    The record keys checked. The defaults are for appointment stores.
+
+    - id_key: The key identifying the versions of a record.
+    - slot_key: The datetime key whose values must be unique, to the second, among the
+      live, active records with the same `scope_key` value. '' disables the slot check.
+    - scope_key: The key whose values have separate slots, e.g., the provider. '' for one scope.
+    - default_scope: The scope of records without a `scope_key` value.
+    - created_key: The key whose value must be the same for all versions of a record,
+      between removals. '' disables the duplicate id check.
+    - inactive_key, inactive_values: Records with one of these values for the key, e.g.,
+      cancelled appointments, don't reserve a slot.
+    """
+
+    id_key: str = "id"
+    slot_key: str = "appointment_date_time"
+    scope_key: str = "provider"
+    default_scope: str = ""
+    created_key: str = "created_at"
+    inactive_key: str = "status"
+    inactive_values: tuple[str, ...] = ("cancelled",)
+
+
+@dataclass(slots=True)
+class _IdState:  # pylint: disable=too-many-instance-attributes
+    """
+    What a chunk did to one id: its last version, whether the chunk removed the id
+    before that, and the creation time of the chunk's first version of the id.
+    """
+
+    line: int
+    offset: int
+    length: int
+    deleted: bool = False
+    removed: bool = False
+    first_line: int = 0
+    first_created: Any = None
+    created: Any = None
+    slot: tuple[Any, int] | None = None
+    when: str = ""
+
+
+@dataclass
+class _ChunkResult:
+    """The summary of one chunk. Line numbers are relative to the chunk's first line."""
+
+    lines: int = 0
+    records: int = 0
+    tombstones: int = 0
+    malformed: list[tuple[int, int, int, str]] = field(default_factory=list)
+    anonymous: list[tuple[int, int, int]] = field(default_factory=list)
+    duplicates: list[tuple[str, int]] = field(default_factory=list)
+    ids: dict[str, _IdState] = field(default_factory=dict)
+
+
+@dataclass
+class IntegrityReport:  # pylint: disable=too-many-instance-attributes
+    """
+    The problems found in a store. Line numbers start at 1. `live_offsets` has the
+    byte offsets and lengths of the live records, in `replay()` order, for `repair_store()`.
+    """
+
+    path: str
+    size: int
+    mtime_ns: int
+    chunks: int = 0
+    lines: int = 0
+    records: int = 0
+    live: int = 0
+    tombstones: int = 0
+    superseded: int = 0
+    malformed: list[tuple[int, str]] = field(default_factory=list)
+    anonymous: list[int] = field(default_factory=list)
+    duplicate_ids: list[tuple[str, int]] = field(default_factory=list)
+    slot_conflicts: list[tuple[Any, str, list[str]]] = field(default_factory=list)
+    live_offsets: list[tuple[int, int]] = field(default_factory=list, repr=False)
+    rejected_offsets: list[tuple[int, int]] = field(default_factory=list, repr=False)
+
+    @property
+    def ok(self) -> bool:
+        """True if no problems were found. Superseded versions aren't problems."""
+        return not (self.malformed or self.anonymous or self.duplicate_ids or self.slot_conflicts)
+
+    def to_dict(self) -> dict[str, Any]:
+        """The report as a dictionary, e.g., to encode as JSON, without the offsets."""
+        return {
+            "path": self.path,
+            "size": self.size,
+            "chunks": self.chunks,
+            "lines": self.lines,
+            "records": self.records,
+            "live": self.live,
+            "tombstones": self.tombstones,
+            "superseded": self.superseded,
+            "ok": self.ok,
+            "malformed": [{"line": line, "text": text} for line, text in self.malformed],
+            "anonymous": [{"line": line} for line in self.anonymous],
+            "duplicate_ids": [{"id": record_id, "line": line} for record_id, line in self.duplicate_ids],
+            "slot_conflicts": [{"scope": scope, "time": when, "ids": ids} for scope, when, ids in self.slot_conflicts],
+        }
+
+
+def _scalar(value: Any) -> Any:
+    """A hashable form of a value, where encoded datetimes are their ISO strings."""
+    if isinstance(value, dict):
+        if value.get("__class__") == "datetime":
+            return value.get("iso_str")
+        return json.dumps(value, sort_keys=True)
+    if isinstance(value, list):
+        return json.dumps(value, sort_keys=True)
+    return value
+
+
+def _slot_of(record: dict[str, Any], options: CheckOptions) -> tuple[tuple[Any, int] | None, str]:
+    """
+    The `(scope, epoch second)` slot the record reserves, as in `ResourceManager._slot()`,
+    and the time as written, or `(None, '')` if it doesn't reserve one.
+    """
+    if not options.slot_key:
+        return None, ""
+    if options.inactive_key and record.get(options.inactive_key) in options.inactive_values:
+        return None, ""
+    when = _scalar(record.get(options.slot_key))
+    if not isinstance(when, str) or not when:
+        return None, ""
+    try:
+        second = int(datetime.fromisoformat(when).timestamp() // 1)
+    except ValueError:
+        return None, ""
+    scope = _scalar(record.get(options.scope_key)) if options.scope_key else ""
+    return (scope or options.default_scope, second), when
+
+
+def _scan_chunk(path: str, start: int, end: int, options: CheckOptions) -> _ChunkResult:
+    """Scan the lines in bytes `[start, end)` of the file. Runs in a worker process."""
+    result = _ChunkResult()
+    if end <= start:
+        return result
+    buffer = open_buffer(Path(path), end)
+    ids = result.ids
+    pos = start
+    while pos < end:
+        line_end = buffer.find(b"\n", pos, end)
+        if line_end < 0:
+            line_end = end
+        result.lines += 1
+        line = buffer[pos:line_end]
+        if line.strip():
+            try:
+                record = parse_json(line)
+                if not isinstance(record, dict):
+                    raise TypeError(f"Not a JSON object: {type(record)}")
+            except (ValueError, TypeError) as e:
+                text = line.decode("utf-8", errors="replace").strip()[:_MAX_LINE_TEXT]
+                result.malformed.append((result.lines, pos, line_end - pos, f"{e}: {text}"))
+            else:
+                result.records += 1
+                _scan_record(result, ids, record, (result.lines, pos, line_end - pos), options)
+        pos = line_end + 1
+    return result
+
+
+def _scan_record(
+    result: _ChunkResult,
+    ids: dict[str, _IdState],
+    record: dict[str, Any],
+    location: tuple[int, int, int],
+    options: CheckOptions,
+):
+    """Apply one parsed record to the chunk's summary."""
+    line, offset, length = location
+    record_id = record.get(options.id_key)
+    if record_id is None:
+        result.anonymous.append(location)
+        return
+    record_id = _scalar(record_id)
+    state = ids.get(record_id)
+    if record.get(TOMBSTONE_KEY):
+        result.tombstones += 1
+        if state is None:
+            state = _IdState(line, offset, length, first_line=line)
+        else:
+            # Move the id to the end, where it is added again if it is written again.
+            del ids[record_id]
+        state.line, state.offset, state.length = location
+        state.deleted = state.removed = True
+        state.created = None
+        ids[record_id] = state
+        return
+
+    created = _scalar(record.get(options.created_key)) if options.created_key else None
+    if state is None:
+        state = ids[record_id] = _IdState(line, offset, length, first_line=line, first_created=created)
+    elif state.deleted:
+        del ids[record_id]
+        ids[record_id] = state
+    elif created is not None and state.created is not None and created != state.created:
+        result.duplicates.append((record_id, line))
+    state.line, state.offset, state.length = location
+    state.deleted = False
+    state.created = created
+    state.slot, state.when = _slot_of(record, options)
+
+
+def _chunk_starts(path: Path, size: int, chunk_bytes: int) -> list[int]:
+    """The byte offsets of chunks of about `chunk_bytes` bytes, each starting at the beginning of a line."""
+    starts = [0]
+    if size == 0:
+        return starts
+    buffer = open_buffer(path, size)
+    pos = chunk_bytes
+    while pos < size:
+        newline = buffer.find(b"\n", pos - 1, size)
+        if newline < 0 or newline + 1 >= size:
+            break
+        starts.append(newline + 1)
+        pos = newline + 1 + chunk_bytes
+    return starts
+
+
+def check_store(
+    path: Path | str,
+    options: CheckOptions | None = None,
+    workers: int | None = None,
+    chunk_bytes: int = DEFAULT_CHUNK_BYTES,
+) -> IntegrityReport:
+    """
+    Check the integrity of a JSONL store without loading it.
+
+    Args:
+        - path (Path | str): The JSONL file written by `FilePersistentStorage`.
+        - options (CheckOptions | None): The record keys checked. Default: `CheckOptions()`.
+        - workers (int | None): The number of worker processes. Default: the number of CPUs.
+          With 1 worker, or just one chunk, the chunks are scanned in this process.
+        - chunk_bytes (int): The approximate number of bytes scanned by each worker task.
+
+    Returns:
+        The `IntegrityReport`.
+    """
+    options = options or CheckOptions()
+    path = Path(path)
+    stat = path.stat()
+    starts = _chunk_starts(path, stat.st_size, max(1, chunk_bytes))
+    ends = [*starts[1:], stat.st_size]
+    processes = min(workers or os.cpu_count() or 1, len(starts))
+    if processes <= 1:
+        results = list(map(_scan_chunk, repeat(str(path)), starts, ends, repeat(options)))
+    else:
+        # Spawned, since forking a process that may be running other threads can copy their held locks.
+        # The workers use the same JSON backend as this process.
+        with ProcessPoolExecutor(
+            max_workers=processes,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=set_json_backend,
+            initargs=(get_json_backend().name,),
+        ) as executor:
+            results = list(executor.map(_scan_chunk, repeat(str(path)), starts, ends, repeat(options)))
+    return _merge(IntegrityReport(str(path), stat.st_size, stat.st_mtime_ns, chunks=len(starts)), results)
+
+
+def _merge(report: IntegrityReport, results: Sequence[_ChunkResult]) -> IntegrityReport:
+    """Merge the chunk summaries, in file order, into the report."""
+    live: dict[str, _IdState] = {}
+    line_base = 0
+    for result in results:
+        report.records += result.records
+        report.tombstones += result.tombstones
+        for line, offset, length, text in result.malformed:
+            report.malformed.append((line_base + line, text))
+            report.rejected_offsets.append((offset, length))
+        for line, offset, length in result.anonymous:
+            report.anonymous.append(line_base + line)
+            report.rejected_offsets.append((offset, length))
+        report.duplicate_ids.extend((record_id, line_base + line) for record_id, line in result.duplicates)
+        for record_id, state in result.ids.items():
+            current = live.get(record_id)
+            if (
+                current is not None
+                and state.first_created is not None
+                and current.created is not None
+                and state.first_created != current.created
+            ):
+                report.duplicate_ids.append((record_id, line_base + state.first_line))
+            if state.removed:
+                live.pop(record_id, None)
+            if not state.deleted:
+                state.line += line_base
+                live[record_id] = state
+        line_base += result.lines
+    report.lines = line_base
+    report.duplicate_ids.sort(key=lambda duplicate: duplicate[1])
+    report.rejected_offsets.sort()
+    report.live = len(live)
+    report.superseded = report.records - len(report.anonymous) - report.live
+    report.live_offsets = [(state.offset, state.length) for state in live.values()]
+
+    slots: dict[tuple[Any, int], list[tuple[int, str, str]]] = {}
+    for record_id, state in live.items():
+        if state.slot is not None:
+            slots.setdefault(state.slot, []).append((state.line, state.when, record_id))
+    for (scope, _second), reservations in slots.items():
+        if len(reservations) > 1:
+            reservations.sort()
+            report.slot_conflicts.append((scope, reservations[0][1], [record_id for *_, record_id in reservations]))
+    report.slot_conflicts.sort(key=lambda conflict: (str(conflict[0]), conflict[1]))
+    return report
+
+
+def repair_store(report: IntegrityReport, output: Path | str, rejected: Path | str | None = None) -> tuple[int, int]:
+    """
+    Write a compacted copy of the checked store with just its live records, in `replay()` order.
+    The output may be the store itself, which is replaced atomically.
+
+    Args:
+        - report (IntegrityReport): The report from `check_store()`. The store must not have changed since.
+        - output (Path | str): The file to write.
+        - rejected (Path | str | None): Where to write the malformed lines and the records without
+          an id, if there are any. Default: the output path with a ".rejected" suffix added.
+
+    Returns:
+        A tuple with the counts of the records written to the output and rejected files.
+    """
+    path = Path(report.path)
+    stat = path.stat()
+    if stat.st_size != report.size or stat.st_mtime_ns != report.mtime_ns:
+        raise ValueError(f"The store {path} changed after it was checked. Check it again.")
+    output = Path(output)
+    rejected = Path(rejected) if rejected else output.with_name(output.name + ".rejected")
+    buffer = open_buffer(path, report.size)
+    if report.rejected_offsets:
+        _write_lines(buffer, report.rejected_offsets, rejected)
+    _write_lines(buffer, report.live_offsets, output)
+    sidecar_path(output).unlink(missing_ok=True)
+    return len(report.live_offsets), len(report.rejected_offsets)
+
+
+def _write_lines(buffer: Any, offsets: Sequence[tuple[int, int]], path: Path):
+    """Copy the lines at the offsets to a temporary file, then rename it over `path`."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, temp_name = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            for offset, length in offsets:
+                f.write(buffer[offset : offset + length].rstrip(b"\r"))
+                f.write(b"\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_name, path)
+    except BaseException:
+        Path(temp_name).unlink(missing_ok=True)
+        raise
+
+
+def format_report(report: IntegrityReport, max_items: int = 20) -> str:
+    """A readable summary of the report, listing at most `max_items` problems of each kind."""
+    lines = [
+        f"Store: {report.path} ({report.size:,} bytes, {report.lines:,} lines, {report.chunks} chunks)",
+        (
+            f"Records: {report.records:,}, live: {report.live:,}, superseded: {report.superseded:,} "
+            f"(including {report.tombstones:,} tombstones)"
+        ),
+    ]
+    sections: list[tuple[str, list[str]]] = [
+        ("Malformed lines", [f"line {line}: {text}" for line, text in report.malformed]),
+        ("Records without an id", [f"line {line}" for line in report.anonymous]),
+        (
+            "Duplicate ids (a different resource with the same id)",
+            [f"{record_id!r} at line {line}" for record_id, line in report.duplicate_ids],
+        ),
+        (
+            "Slot conflicts",
+            [f"{when} (scope {scope!r}): {', '.join(ids)}" for scope, when, ids in report.slot_conflicts],
+        ),
+    ]
+    for title, items in sections:
+        lines.append(f"{title}: {len(items):,}")
+        lines.extend(f"  {item}" for item in items[:max_items])
+        if len(items) > max_items:
+            lines.append(f"  ... and {len(items) - max_items:,} more")
+    lines.append("OK" if report.ok else "PROBLEMS FOUND")
+    return "\n".join(lines)
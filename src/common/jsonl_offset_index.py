@@ -0,0 +1,231 @@
+"""
+An index from record ids to the byte offsets of their live versions in a JSONL
+storage file, for loading large files lazily.
+
+Building the index scans the file once, using `parse_json()`, without the
+datetime decoding done by `decode_json_dict()`. The index is saved in a "sidecar"
+file next to the storage file, with the storage file's size and modification time,
+so later runs can load the index directly, in time proportional to the number of
+live ids, as long as the storage file hasn't changed. `LazyRecords` then decodes
+each record from a memory map of the file the first time it is accessed.
+"""
+
+# Allow types to self-reference during their definitions.
+from __future__ import annotations
+
+import json
+import logging
+import mmap
+import os
+from collections.abc import Callable, Iterator, MutableMapping
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any
+
+from common.json_yaml import decode_json_dict, parse_json
+
+# Too many of these warnings for variables that ARE used in other files.
+# pylint: disable=unused-variable
+
+# Bump when the sidecar format changes, so old sidecars are rebuilt.
+SIDECAR_VERSION = 1
+
+
+def sidecar_path(storage_path: Path) -> Path:
+    """The path of the offset index sidecar for the storage file."""
+    return storage_path.with_name(storage_path.name + ".idx")
+
+
+@dataclass
+class OffsetIndex:
+    """
+    The byte offsets and lengths of the live records in a JSONL file of `size` bytes,
+    last modified at `mtime_ns`. The `offsets` are in the order `replay()` returns
+    the records. Records without an id are in `anonymous` and lines that failed to
+    parse are in `errors`. `total_records` counts all the parsed lines, including
+    superseded versions and tombstones.
+    """
+
+    size: int
+    mtime_ns: int
+    offsets: dict[str, tuple[int, int]] = field(default_factory=dict)
+    anonymous: list[tuple[int, int]] = field(default_factory=list)
+    errors: list[str] = field(default_factory=list)
+    total_records: int = 0
+
+    def matches(self, stat: os.stat_result) -> bool:
+        """True if the index describes a file with the input status."""
+        return self.size == stat.st_size and self.mtime_ns == stat.st_mtime_ns
+
+    def save(self, path: Path):
+        """Write the index to the sidecar `path`, atomically."""
+        data = {
+            "version": SIDECAR_VERSION,
+            "size": self.size,
+            "mtime_ns": self.mtime_ns,
+            "total_records": self.total_records,
+            "ids": list(self.offsets),
+            "offsets": [offset for offset, _ in self.offsets.values()],
+            "lengths": [length for _, length in self.offsets.values()],
+            "anonymous": self.anonymous,
+            "errors": self.errors,
+        }
+        temp_path = path.with_name(path.name + ".tmp")
+        with open(temp_path, "w") as f:  # pylint: disable=unspecified-encoding
+            json.dump(data, f)
+        os.replace(temp_path, path)
+
+    @classmethod
+    def load(cls, path: Path) -> OffsetIndex | None:
+        """Read the index from the sidecar `path`, or return `None` if it is missing or unreadable."""
+        try:
+            with open(path) as f:  # pylint: disable=unspecified-encoding
+                data = json.load(f)
+            if data.get("version") != SIDECAR_VERSION:
+                return None
+            return cls(
+                size=data["size"],
+                mtime_ns=data["mtime_ns"],
+                offsets=dict(zip(data["ids"], zip(data["offsets"], data["lengths"], strict=True), strict=True)),
+                anonymous=[tuple(pair) for pair in data["anonymous"]],
+                errors=data["errors"],
+                total_records=data["total_records"],
+            )
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+
+    @classmethod
+    def build(
+        cls, buffer: Any, size: int, mtime_ns: int, id_key: str, tombstone_key: str, logger: logging.Logger
+    ) -> OffsetIndex:
+        """
+        Scan the first `size` bytes of the buffer, e.g., a memory map of the file, applying
+        the same last-write-wins rules as `FilePersistentStorage.replay()`.
+        """
+        index = cls(size, mtime_ns)
+        offsets = index.offsets
+        pos = 0
+        while pos < size:
+            end = buffer.find(b"\n", pos, size)
+            if end < 0:
+                end = size
+            line = buffer[pos:end]
+            if line.strip():
+                try:
+                    record = parse_json(line)
+                    if not isinstance(record, dict):
+                        raise TypeError(f"Not a JSON object: {type(record)}")
+                    index.total_records += 1
+                    record_id = record.get(id_key)
+                    if record_id is None:
+                        index.anonymous.append((pos, end - pos))
+                    elif record.get(tombstone_key):
+                        offsets.pop(record_id, None)
+                    else:
+                        offsets[record_id] = (pos, end - pos)
+                except (ValueError, TypeError) as e:
+                    text = line.decode("utf-8", errors="replace").strip()
+                    index.errors.append(text)
+                    logger.error("Error parsing record line: %s (line: %s)", e, text)
+            pos = end + 1
+        return index
+
+
+class LazyRecords(MutableMapping[str, MutableMapping[str, Any]]):
+    """
+    A mapping from ids to records that decodes each record from the memory-mapped
+    storage file the first time it is accessed, then keeps the decoded record, so
+    in-place changes stick. Records set or deleted later only change the mapping,
+    not the file.
+
+    If `keep` is given, decoded records for which it returns False are treated as
+    absent. Since that is only known after decoding, `len()` decodes all the records.
+    If `convert` is given, the decoded records that are kept are replaced with
+    `convert(record)`, e.g., to convert them to a more compact type. Records are
+    decoded with `decode`, by default `decode_json_dict()`.
+    """
+
+    def __init__(
+        self,
+        buffer: Any,
+        offsets: dict[str, tuple[int, int]],
+        keep: Callable[[MutableMapping[str, Any]], bool] | None = None,
+        convert: Callable[[MutableMapping[str, Any]], MutableMapping[str, Any]] | None = None,
+        decode: Callable[[str], MutableMapping[str, Any]] = decode_json_dict,
+    ):
+        self._buffer = buffer
+        # The offsets of the records not decoded yet.
+        self._offsets = dict(offsets)
+        # The ids in iteration order, which are kept when records are decoded.
+        self._order: dict[str, None] = dict.fromkeys(offsets)
+        self._decoded: dict[str, MutableMapping[str, Any]] = {}
+        self.keep = keep
+        self.convert = convert
+        self.decode = decode
+
+    @property
+    def key_count(self) -> int:
+        """
+        The number of ids, including those of records not decoded yet, which `keep` may
+        still exclude. Unlike `len()`, this doesn't decode any records.
+        """
+        return len(self._order)
+
+    @property
+    def decoded_count(self) -> int:
+        """The number of records decoded so far, or set since the mapping was created."""
+        return len(self._decoded)
+
+    def _decode(self, key: str) -> MutableMapping[str, Any] | None:
+        """Decode the record for the key, if it wasn't already. Returns `None` if it is absent."""
+        offset_length = self._offsets.pop(key, None)
+        if offset_length is None:
+            return self._decoded.get(key)
+        offset, length = offset_length
+        record = self.decode(self._buffer[offset : offset + length].decode("utf-8"))
+        if self.keep and not self.keep(record):
+            del self._order[key]
+            return None
+        if self.convert:
+            record = self.convert(record)
+        self._decoded[key] = record
+        return record
+
+    def __getitem__(self, key: str) -> MutableMapping[str, Any]:
+        record = self._decode(key)
+        if record is None:
+            raise KeyError(key)
+        return record
+
+    def __setitem__(self, key: str, record: MutableMapping[str, Any]):
+        self._offsets.pop(key, None)
+        self._order[key] = None
+        self._decoded[key] = record
+
+    def __delitem__(self, key: str):
+        if key not in self:
+            raise KeyError(key)
+        del self._order[key]
+        self._decoded.pop(key, None)
+
+    def __contains__(self, key: object) -> bool:
+        return isinstance(key, str) and self._decode(key) is not None
+
+    def __iter__(self) -> Iterator[str]:
+        for key in list(self._order):
+            if self._decode(key) is not None:
+                yield key
+
+    def __len__(self) -> int:
+        if self.keep and self._offsets:
+            for key in list(self._offsets):
+                self._decode(key)
+        return len(self._order)
+
+
+def open_buffer(storage_path: Path, size: int) -> Any:
+    """Memory-map the first `size` bytes of the file, read only. Returns `b""` for an empty file."""
+    if size == 0:
+        return b""
+    with open(storage_path, "rb") as f:
+        return mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ)
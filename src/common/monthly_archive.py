@@ -0,0 +1,196 @@
+"""
+Compressed, append-only archive files of records, one per month of a datetime field.
+
+Records that are no longer needed in memory, e.g., appointments in the past, are moved
+out of the live storage into files named like "2024-05.jsonl.gz" in the archive directory,
+where the month is the UTC month of the record's datetime. The files are compressed with
+gzip, which allows appending, so each `append()` adds a new compressed member to the files.
+`read()` streams the records in a datetime range, only opening the months it overlaps.
+`move_from()` moves the old records out of a `PersistentStorage` into the archive.
+"""
+
+from __future__ import annotations
+
+import gzip
+import logging
+import os
+from collections.abc import Callable, Iterator, Mapping, MutableMapping, Sequence
+from datetime import UTC, datetime
+from pathlib import Path
+from typing import IO, Any
+
+from common.json_yaml import LazyDatetime, decode_json_dict, encode_json
+from common.persistent_storage import PersistentStorage
+from common.sqlite_persistent_storage import SqlitePersistentStorage
+
+# Too many of these warnings for variables that ARE used in other files.
+# pylint: disable=unused-variable
+
+# The suffix of new archive files.
+ARCHIVE_SUFFIX = ".jsonl.gz"
+
+# The functions that open archive files, by suffix.
+_openers: dict[str, Callable[..., IO[Any]]] = {".jsonl.gz": gzip.open}
+
+
+def _opener(path: Path) -> Callable[..., IO[Any]]:
+    """The function that opens the archive file. Raises `ValueError` for an unknown suffix."""
+    for suffix, opener in _openers.items():
+        if path.name.endswith(suffix):
+            return opener
+    raise ValueError(f"{path} isn't an archive file. The suffix must be one of: {', '.join(_openers)}.")
+
+
+def utc_month(dt: datetime) -> tuple[int, int]:
+    """The (year, month) of the datetime in UTC, so the month doesn't depend on the timezone."""
+    utc = dt.astimezone(UTC)
+    return utc.year, utc.month
+
+
+class MonthlyArchive:
+    """Compressed, append-only archive files of records, one per UTC month of the `key` datetime."""
+
+    def __init__(self, archive_dir: Path | str, key: str, logger: logging.Logger | None = None):
+        """
+        Initialize the archive.
+
+        Args:
+            - archive_dir (Path | str): The directory for the archive files, created when first needed.
+            - key (str): The record key for the datetime that selects a record's month. It can't be empty.
+            - logger (logging.Logger | None): Optional logger instance.
+        """
+        if not key:
+            raise ValueError("The archive needs the key for the datetime that selects a record's month.")
+        self.archive_dir = Path(archive_dir)
+        self.key = key
+        if logger:
+            self.logger: logging.Logger = logger
+        else:
+            self.logger = logging.getLogger(self.__class__.__name__)
+            self.logger.setLevel(logging.INFO)
+        self.suffix = ARCHIVE_SUFFIX
+
+    def months(self) -> list[tuple[int, int]]:
+        """The sorted (year, month) pairs that have archive files."""
+        return sorted(self._files())
+
+    def _files(self) -> dict[tuple[int, int], list[Path]]:
+        files: dict[tuple[int, int], list[Path]] = {}
+        if not self.archive_dir.is_dir():
+            return files
+        for path in self.archive_dir.iterdir():
+            for suffix in _openers:
+                if path.name.endswith(suffix):
+                    year, _, month = path.name.removesuffix(suffix).partition("-")
+                    if year.isdigit() and month.isdigit():
+                        files.setdefault((int(year), int(month)), []).append(path)
+        return files
+
+    def append(self, records: Sequence[Mapping[str, Any]]) -> int:
+        """
+        Append the records to the files for their months, and sync the files to disk, so
+        the caller can then remove the records from the live storage.
+
+        Returns:
+            The count of records archived. Records without a datetime for `key` are skipped.
+        """
+        by_month: dict[tuple[int, int], list[str]] = {}
+        for record in records:
+            dt = record.get(self.key)
+            if isinstance(dt, datetime):
+                by_month.setdefault(utc_month(dt), []).append(encode_json(record) + "\n")
+            else:
+                self.logger.error("Not archiving a record without a datetime for the archive key.")
+                # self.logger.error(f"Not archiving a record without a datetime for key {self.key}: {record}")
+        if not by_month:
+            return 0
+        self.archive_dir.mkdir(parents=True, exist_ok=True)
+        opener = _openers[self.suffix]
+        for (year, month), lines in by_month.items():
+            path = self.archive_dir / f"{year:04d}-{month:02d}{self.suffix}"
+            with open(path, "ab") as raw:
+                with opener(raw, "at", encoding="utf-8") as f:
+                    f.writelines(lines)
+                raw.flush()
+                os.fsync(raw.fileno())
+        return sum(len(lines) for lines in by_month.values())
+
+    def move_from(self, storage: PersistentStorage, before: datetime) -> list[MutableMapping[str, Any]]:
+        """
+        Move the live records whose `key` datetime is before the cutoff from the storage into the
+        archive. The archive files are written and synced first, then the archived records are
+        removed from the storage. SQLite storage with a column for `key` loads just the old records
+        with `load_range()`. Other storage is replayed and rewritten, so it isn't cheap. Callers
+        sharing the storage with other processes must hold its `exclusive()` lock.
+
+        Args:
+            - storage (PersistentStorage): The storage to move the records from.
+            - before (datetime): Archive the records with earlier datetimes.
+
+        Returns:
+            The archived records, or [] if there are none, or if records in storage failed to
+            parse in storage that is rewritten, because that would drop them.
+        """
+        if isinstance(storage, SqlitePersistentStorage) and self.key in storage.indexed_fields:
+            records, errors = storage.load_range(self.key, high=before)
+        else:
+            records, errors = storage.replay()
+        # SQLite storage just removes the archived records, so it keeps those that fail to parse.
+        if errors and not isinstance(storage, SqlitePersistentStorage):
+            self.logger.error("Not archiving, because %d records in storage failed to parse.", len(errors))
+            return []
+        for record in records:
+            # The archive needs the datetime to choose a record's month.
+            if isinstance(record.get(self.key), LazyDatetime):
+                record[self.key] = record[self.key].to_datetime()
+        old_ids: set[str] = {
+            record["id"]
+            for record in records
+            if record.get("id") and isinstance(record.get(self.key), datetime) and record[self.key] < before
+        }
+        if not old_ids:
+            return []
+        archived = [record for record in records if record.get("id") in old_ids]
+        self.append(archived)
+        if isinstance(storage, SqlitePersistentStorage):
+            storage.remove(sorted(old_ids))
+        else:
+            storage.rewrite([record for record in records if record.get("id") not in old_ids])
+        return archived
+
+    def read(self, low: datetime | None = None, high: datetime | None = None) -> Iterator[MutableMapping[str, Any]]:
+        """
+        Stream the archived records with a datetime for `key` between `low` and `high`, inclusive,
+        where `None` means unbounded. Only the files for the months in the range are read. The
+        records are in month order, but not sorted within a month. If a record was archived more
+        than once, e.g., after a crash before it was removed from the live storage, it is
+        returned once.
+        """
+        first = utc_month(low) if low else None
+        last = utc_month(high) if high else None
+        for month, paths in sorted(self._files().items()):
+            if (first and month < first) or (last and month > last):
+                continue
+            seen: set[Any] = set()
+            for path in paths:
+                for record in self._read_file(path):
+                    dt = record.get(self.key)
+                    if not isinstance(dt, datetime) or (low and dt < low) or (high and dt > high):
+                        continue
+                    record_id = record.get("id")
+                    if record_id is not None:
+                        if record_id in seen:
+                            continue
+                        seen.add(record_id)
+                    yield record
+
+    def _read_file(self, path: Path) -> Iterator[MutableMapping[str, Any]]:
+        opener = _opener(path)
+        with opener(path, "rt", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    try:
+                        yield decode_json_dict(line)
+                    except ValueError as e:
+                        self.logger.error("Error parsing archived record line: %s (line: %s)", e, line)
@@ -0,0 +1,327 @@
+"""
+Persistent storage of records in a directory of JSONL files, one per month of a datetime field.
+
+Each partition, e.g., "2026-10.jsonl" for records whose datetime is in October 2026 (UTC),
+is a `FilePersistentStorage`, so it is an append-only log that is compacted on its own,
+without blocking writes to the other partitions. Records without a datetime go in
+"undated.jsonl". A save is routed to the partition for the record's datetime. When a
+record moves to another month, the new version is written first, then a tombstone in
+the old partition, so a crash in between leaves a duplicate rather than losing the record.
+Every version is stored with a write stamp, which increases with each write, and `replay()`
+keeps the version with the latest stamp, so a duplicate never undoes a move, whichever
+partition sorts last. The stamps aren't returned with the records.
+`load_range()` reads just the partitions a range touches.
+
+Sharing the directory between processes (`cross_process`) isn't supported.
+"""
+
+from __future__ import annotations
+
+import logging
+import threading
+import time
+from collections.abc import MutableMapping, Sequence
+from datetime import datetime
+from pathlib import Path
+from typing import Any
+
+from common.file_persistent_storage import FilePersistentStorage
+from common.jsonl_offset_index import sidecar_path
+from common.monthly_archive import utc_month
+from common.persistent_storage import PersistentStorage
+
+# Too many of these warnings for variables that ARE used in other files.
+# pylint: disable=unused-variable
+
+# The key of the write stamp stored with each version of a record, e.g., nanoseconds since the epoch.
+WRITE_STAMP_KEY = "__written__"
+
+
+class PartitionedPersistentStorage(PersistentStorage):  # pylint: disable=too-many-instance-attributes
+    """Persistent storage of records in one JSONL file per UTC month of `partition_key`."""
+
+    # The partition for records without a datetime for `partition_key`.
+    undated_name = "undated"
+
+    def __init__(  # pylint: disable=too-many-arguments,too-many-positional-arguments
+        self,
+        storage_path: Path | str,
+        logger: logging.Logger | None = None,
+        remove_old: bool = False,
+        id_key: str = "id",
+        partition_key: str = "",
+        **file_options: Any,
+    ):
+        """
+        Initialize the storage.
+
+        Args:
+            - storage_path: Path to the directory for the partition files, created if necessary.
+            - logger: Optional logger instance
+            - remove_old: If True, delete the existing partitions and start empty.
+            - id_key: The record key that identifies a record.
+            - partition_key: The record key for the datetime that selects a record's partition.
+            - file_options: Other `FilePersistentStorage` arguments used for every partition,
+              e.g., `compaction_ratio` and `durability`.
+        """
+        if not partition_key:
+            raise ValueError("A partition_key is required for partitioned storage.")
+        if file_options.get("cross_process"):
+            raise ValueError("Partitioned storage can't be shared between processes.")
+        self.storage_path = Path(storage_path)
+        if logger:
+            self.logger: logging.Logger = logger
+        else:
+            self.logger = logging.getLogger(self.__class__.__name__)
+            self.logger.setLevel(logging.INFO)
+        self.id_key = id_key
+        self.partition_key = partition_key
+        self.file_options = file_options
+        self._lock = threading.RLock()
+        self._partitions: dict[str, FilePersistentStorage] = {}
+        self._lazy_datetime_keys: frozenset[str] = frozenset()
+        # The partition holding the live version of each id seen so far, so updates that move a
+        # record to another partition and removals know where to write the tombstone.
+        self._partition_of_id: dict[str, str] = {}
+        # The last write stamp, so stamps increase even if the clock doesn't.
+        self._last_stamp = 0
+        self.storage_path.mkdir(parents=True, exist_ok=True)
+        for path in sorted(self.storage_path.glob("*.jsonl")):
+            self._partition(path.stem)
+        if remove_old:
+            self.clear()
+
+    def _partition(self, name: str) -> FilePersistentStorage:
+        """Return the storage for the named partition, creating it if necessary."""
+        partition = self._partitions.get(name)
+        if partition is None:
+            partition = FilePersistentStorage(
+                self.storage_path / f"{name}.jsonl", self.logger, id_key=self.id_key, **self.file_options
+            )
+            partition.lazy_datetime_keys = self.lazy_datetime_keys
+            self._partitions[name] = partition
+        return partition
+
+    @property  # type: ignore[override]
+    def lazy_datetime_keys(self) -> frozenset[str]:
+        """
+        See `PersistentStorage.lazy_datetime_keys`. The `partition_key` is never decoded lazily,
+        since `load_range()` compares its values.
+        """
+        return self._lazy_datetime_keys
+
+    @lazy_datetime_keys.setter
+    def lazy_datetime_keys(self, keys: frozenset[str]):
+        self._lazy_datetime_keys = frozenset(keys) - {self.partition_key}
+        for partition in self._partitions.values():
+            partition.lazy_datetime_keys = self._lazy_datetime_keys
+
+    def partition_name(self, value: Any) -> str:
+        """The name of the partition for a `partition_key` value, e.g., "2026-10"."""
+        if isinstance(value, datetime):
+            year, month = utc_month(value)
+            return f"{year:04d}-{month:02d}"
+        return self.undated_name
+
+    def partition_names(self, low: datetime | None = None, high: datetime | None = None) -> list[str]:
+        """
+        The sorted names of the existing partitions that may have records with `partition_key` values
+        between `low` and `high`, inclusive, where `None` means unbounded. The undated partition is
+        only included when both are `None`.
+        """
+        first = self.partition_name(low) if low else ""
+        last = self.partition_name(high) if high else ""
+        names = []
+        for name in sorted(self._partitions):
+            if name == self.undated_name:
+                if not low and not high:
+                    names.append(name)
+            elif (not first or name >= first) and (not last or name <= last):
+                names.append(name)
+        return names
+
+    def clear(self):
+        """Remove all records and the partition files."""
+        with self._lock:
+            for partition in self._partitions.values():
+                partition.close()
+                partition.storage_path.unlink(missing_ok=True)
+                sidecar_path(partition.storage_path).unlink(missing_ok=True)
+            self._partitions = {}
+            self._partition_of_id = {}
+
+    def load(self) -> tuple[Sequence[MutableMapping[str, Any]], list[str]]:
+        """
+        Return all the records, including superseded versions, partition by partition,
+        in the order they were written within each partition, and the records that failed to parse.
+        """
+        with self._lock:
+            records: list[MutableMapping[str, Any]] = []
+            errors: list[str] = []
+            for name in sorted(self._partitions):
+                partition_records, partition_errors = self._partitions[name].load()
+                for record in partition_records:
+                    record.pop(WRITE_STAMP_KEY, None)
+                records.extend(partition_records)
+                errors.extend(partition_errors)
+        return records, errors
+
+    def replay(self) -> tuple[Sequence[MutableMapping[str, Any]], list[str]]:
+        """Return the live records, partition by partition, and the records that failed to parse."""
+        with self._lock:
+            return self._replay(sorted(self._partitions))
+
+    def _replay(self, names: Sequence[str]) -> tuple[list[MutableMapping[str, Any]], list[str]]:
+        """
+        Replay the named partitions and remember where each id is. If an id is live in more
+        than one partition, e.g., after a crash while moving it, the version with the latest
+        write stamp wins. Versions written before stamps were added lose to stamped versions,
+        and among themselves, the last partition wins. The other versions are removed, so they
+        can't reappear when the record is later moved or removed.
+        """
+        live: dict[Any, MutableMapping[str, Any]] = {}
+        stamps: dict[Any, int] = {}
+        stale: dict[str, list[Any]] = {}
+        anonymous: list[MutableMapping[str, Any]] = []
+        errors: list[str] = []
+        for name in names:
+            partition_records, partition_errors = self._partitions[name].replay()
+            errors.extend(partition_errors)
+            for record in partition_records:
+                stamp = record.pop(WRITE_STAMP_KEY, 0)
+                self._last_stamp = max(self._last_stamp, stamp)
+                record_id = record.get(self.id_key)
+                if record_id is None:
+                    anonymous.append(record)
+                    continue
+                if record_id in live:
+                    old_name = self._partition_of_id[record_id]
+                    kept, removed = (old_name, name) if stamp < stamps[record_id] else (name, old_name)
+                    self.logger.warning("Record %s is live in more than one partition. Keeping %s.", record_id, kept)
+                    stale.setdefault(removed, []).append(record_id)
+                    if kept == old_name:
+                        continue
+                    del live[record_id]
+                live[record_id] = record
+                stamps[record_id] = stamp
+                self._partition_of_id[record_id] = name
+        for name, ids in stale.items():
+            self._partitions[name].remove(ids)
+        return list(live.values()) + anonymous, errors
+
+    def _stamped(self, record: MutableMapping[str, Any]) -> dict[str, Any]:
+        """A copy of the record with the next write stamp, which is larger than all the earlier ones."""
+        self._last_stamp = max(time.time_ns(), self._last_stamp + 1)
+        return {**record, WRITE_STAMP_KEY: self._last_stamp}
+
+    def load_range(
+        self, field: str, low: datetime | None = None, high: datetime | None = None
+    ) -> tuple[Sequence[MutableMapping[str, Any]], list[str]]:
+        """
+        Load just the live records where the `partition_key` field is between `low` and `high`,
+        inclusive, ordered by the field, reading just the partitions for those months.
+        A bound of `None` means unbounded.
+        """
+        if field != self.partition_key:
+            raise ValueError(f"Only the partition key, {self.partition_key}, can be used for range loads.")
+        with self._lock:
+            records, errors = self._replay(self.partition_names(low, high))
+        in_range = [
+            record
+            for record in records
+            if isinstance(value := record.get(field), datetime)
+            and (low is None or value >= low)
+            and (high is None or value <= high)
+        ]
+        in_range.sort(key=lambda record: record[field])
+        return in_range, errors
+
+    def save(self, records: Sequence[MutableMapping[str, Any]]) -> int:
+        """
+        Append the records to their partitions. For records that moved to another partition,
+        a tombstone is appended to the old one after the new versions are written.
+
+        Returns:
+            The count of the number of records written, which should be equal to len(records).
+        """
+        with self._lock:
+            by_name: dict[str, list[MutableMapping[str, Any]]] = {}
+            moved: dict[str, list[str]] = {}
+            for record in records:
+                name = self.partition_name(record.get(self.partition_key))
+                by_name.setdefault(name, []).append(self._stamped(record))
+                record_id = record.get(self.id_key)
+                if record_id is not None:
+                    old_name = self._partition_of_id.get(record_id)
+                    if old_name is not None and old_name != name:
+                        moved.setdefault(old_name, []).append(record_id)
+                    self._partition_of_id[record_id] = name
+            count = sum(self._partition(name).save(group) for name, group in by_name.items())
+            for old_name, ids in moved.items():
+                self._partitions[old_name].remove(ids)
+        return count
+
+    def remove(self, ids: Sequence[str]) -> int:
+        """
+        Append tombstones for the input ids to their partitions. Ids that haven't been seen,
+        e.g., because only some partitions were loaded, get a tombstone in every partition.
+
+        Returns:
+            The count of ids processed.
+        """
+        with self._lock:
+            by_name: dict[str, list[str]] = {}
+            for record_id in ids:
+                name = self._partition_of_id.pop(record_id, None)
+                for target in [name] if name else self._partitions:
+                    by_name.setdefault(target, []).append(record_id)
+            for name, group in by_name.items():
+                self._partitions[name].remove(group)
+        return len(ids)
+
+    def rewrite(self, records: Sequence[MutableMapping[str, Any]]) -> int:
+        """
+        Replace all the records with the input records. Each partition is replaced atomically,
+        but not all the partitions at once.
+
+        Returns:
+            The count of the number of records written.
+        """
+        with self._lock:
+            by_name: dict[str, list[MutableMapping[str, Any]]] = {name: [] for name in self._partitions}
+            for record in records:
+                by_name.setdefault(self.partition_name(record.get(self.partition_key)), []).append(
+                    self._stamped(record)
+                )
+            self._partition_of_id = {}
+            count = 0
+            for name, group in by_name.items():
+                count += self._partition(name).rewrite(group)
+                for record in group:
+                    record_id = record.get(self.id_key)
+                    if record_id is not None:
+                        self._partition_of_id[record_id] = name
+        return count
+
+    @property
+    def record_count(self) -> int:
+        """The number of records in all the partitions, including superseded versions and tombstones."""
+        return sum(partition.record_count for partition in self._partitions.values())
+
+    def flush(self):
+        """Wait until the records saved so far are written to every partition."""
+        for partition in list(self._partitions.values()):
+            partition.flush()
+
+    def maybe_compact(self) -> bool:
+        """Compact each partition that needs it, independently. Returns True if any compaction was run or started."""
+        compacted = False
+        for partition in list(self._partitions.values()):
+            compacted = partition.maybe_compact() or compacted
+        return compacted
+
+    def close(self):
+        """Close every partition."""
+        with self._lock:
+            for partition in self._partitions.values():
+                partition.close()
@@ -0,0 +1,213 @@
+"""
+The interface for persistent storage of records, i.e., dictionaries with an id,
+plus helpers to pick an implementation and to copy records between implementations.
+"""
+
+# Allow types to self-reference during their definitions.
+from __future__ import annotations
+
+import logging
+from abc import ABC, abstractmethod
+from collections.abc import Callable, Generator, Mapping, MutableMapping, Sequence
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any
+
+from common.json_yaml import decode_json_record
+
+# Too many of these warnings for variables that ARE used in other files.
+# pylint: disable=unused-variable
+
+# File suffixes that select the SQLite implementation in `open_storage()`.
+sqlite_suffixes = {".db", ".sqlite", ".sqlite3"}
+
+
+class PersistentStorage(ABC):
+    """
+    Persistent storage of records. Records with the same id supersede earlier
+    versions; `replay()` returns just the live version of each record.
+    """
+
+    storage_path: Path
+    # The top-level record keys whose datetimes are decoded lazily by `replay()`, `load()`,
+    # `replay_by_id()`, and `tail()`. See `decode_json_record()`. Only set this when all the
+    # code reading the records handles `LazyDatetime` values, e.g., `AppointmentManager`.
+    lazy_datetime_keys: frozenset[str] = frozenset()
+
+    def decode_record(self, text: str) -> MutableMapping[str, Any]:
+        """Decode a stored record, with the `lazy_datetime_keys` decoded lazily. Raises `ValueError` if it fails."""
+        return decode_json_record(text, self.lazy_datetime_keys)
+
+    @abstractmethod
+    def clear(self):
+        """Remove all records."""
+
+    @abstractmethod
+    def load(self) -> tuple[Sequence[MutableMapping[str, Any]], list[str]]:
+        """
+        Return all the stored records, in the order they were written, including
+        superseded versions if the implementation keeps them, and a list of any
+        stored records that failed to parse.
+        """
+
+    @abstractmethod
+    def replay(self) -> tuple[Sequence[MutableMapping[str, Any]], list[str]]:
+        """Return the live records and a list of any stored records that failed to parse."""
+
+    def replay_by_id(
+        self,
+        keep: Callable[[MutableMapping[str, Any]], bool] | None = None,
+        convert: Callable[[MutableMapping[str, Any]], MutableMapping[str, Any]] | None = None,
+    ) -> tuple[MutableMapping[str, MutableMapping[str, Any]], list[MutableMapping[str, Any]], list[str]]:
+        """
+        Return the live records with an id, in a mapping keyed by the id, excluding those for
+        which `keep(record)` returns False, then the live records without an id, and a list
+        of any stored records that failed to parse. If `convert` is given, the kept records
+        with an id are replaced by `convert(record)`. Implementations may return a mapping
+        that decodes the records lazily. This default implementation uses `replay()`.
+        """
+        records, errors = self.replay()
+        id_key = getattr(self, "id_key", "id")
+        by_id = {}
+        anonymous = []
+        for record in records:
+            record_id = record.get(id_key)
+            if record_id is None:
+                anonymous.append(record)
+            elif keep is None or keep(record):
+                by_id[record_id] = convert(record) if convert else record
+        return by_id, anonymous, errors
+
+    @abstractmethod
+    def save(self, records: Sequence[MutableMapping[str, Any]]) -> int:
+        """Write new records or new versions of records. Returns the count written."""
+
+    @abstractmethod
+    def remove(self, ids: Sequence[str]) -> int:
+        """Remove the records with the input ids. Returns the count of ids processed."""
+
+    @abstractmethod
+    def rewrite(self, records: Sequence[MutableMapping[str, Any]]) -> int:
+        """Atomically replace all the records with the input records. Returns the count written."""
+
+    @property
+    @abstractmethod
+    def record_count(self) -> int:
+        """The number of stored records, including superseded versions if the implementation keeps them."""
+
+    @property
+    def shared(self) -> bool:
+        """True if other processes may change the storage, so callers should use `tail()` to catch up."""
+        return False
+
+    @contextmanager
+    def exclusive(self) -> Generator[None]:
+        """
+        Hold a lock that keeps other writers, including other processes for shared storage,
+        from changing the storage. This default implementation doesn't lock anything.
+        """
+        yield
+
+    def tail(self) -> tuple[dict[str, MutableMapping[str, Any]], set[str], list[str]] | None:
+        """
+        Return the changes made by other writers since the records were last read: the new live
+        records keyed by id, the removed ids, and any records that failed to parse, or `None` if
+        the caller must read all the records again. This default implementation returns no changes.
+        """
+        return {}, set(), []
+
+    def flush(self):
+        """Wait until all the records saved so far are written. Only needed by buffering implementations."""
+
+    def checkpoint(self) -> dict[str, Any] | None:
+        """
+        Return the state needed to `resume()` reading the storage where it ends now, e.g., to save
+        with a snapshot of the live records, or `None` if the implementation doesn't support it.
+        The caller's view of the records must be up to date, e.g., hold `exclusive()` after
+        catching up with `tail()` when the storage is shared. This default implementation returns `None`.
+        """
+        return None
+
+    def resume(self, checkpoint: Mapping[str, Any]) -> bool:  # pylint: disable=unused-argument
+        """
+        Continue from a `checkpoint()`, instead of reading all the records, so `tail()` returns just
+        the changes made since. Returns False if the storage no longer matches the checkpoint, e.g.,
+        because it was compacted, so the caller must `replay()` it all. This default returns False.
+        """
+        return False
+
+    def maybe_compact(self) -> bool:
+        """
+        Reclaim the space used by superseded records, if the implementation needs
+        to and it's time to do so. Returns True if compaction was run or started.
+        """
+        return False
+
+
+def open_storage(  # pylint: disable=too-many-arguments,too-many-positional-arguments
+    storage_path: Path | str,
+    logger: logging.Logger | None = None,
+    remove_old: bool = False,
+    id_key: str = "id",
+    indexed_fields: Sequence[str] = (),
+    compaction_ratio: float = 0.0,
+    background_compaction: bool = False,
+    partition_key: str = "",
+    **file_options: Any,
+) -> PersistentStorage:
+    """
+    Open the storage for the input path. Paths ending with one of the `sqlite_suffixes`
+    use `SqlitePersistentStorage`, with columns for the `indexed_fields`. All other
+    paths use the default, `FilePersistentStorage`, which uses the compaction arguments
+    and any other `file_options`, e.g., `durability` and `group_commit`. If `partition_key`
+    is not empty, the path is instead a directory with one `FilePersistentStorage` file
+    per month of that datetime field. See `PartitionedPersistentStorage`. SQLite storage
+    ignores the `partition_key` and `file_options`, with a warning.
+    """
+    # pylint: disable=import-outside-toplevel
+    from common.file_persistent_storage import FilePersistentStorage
+    from common.partitioned_persistent_storage import PartitionedPersistentStorage
+    from common.sqlite_persistent_storage import SqlitePersistentStorage
+
+    path = Path(storage_path)
+    if path.suffix in sqlite_suffixes:
+        ignored = sorted(file_options) + (["partition_key"] if partition_key else [])
+        if ignored:
+            (logger or logging.getLogger(__name__)).warning(
+                "Ignoring options that SQLite storage doesn't support for %s: %s", path, ", ".join(ignored)
+            )
+        return SqlitePersistentStorage(
+            path, logger, remove_old=remove_old, id_key=id_key, indexed_fields=indexed_fields
+        )
+    if partition_key:
+        return PartitionedPersistentStorage(
+            path,
+            logger,
+            remove_old=remove_old,
+            id_key=id_key,
+            partition_key=partition_key,
+            compaction_ratio=compaction_ratio,
+            background_compaction=background_compaction,
+            **file_options,
+        )
+    return FilePersistentStorage(
+        path,
+        logger,
+        remove_old=remove_old,
+        id_key=id_key,
+        compaction_ratio=compaction_ratio,
+        background_compaction=background_compaction,
+        **file_options,
+    )
+
+
+def copy_records(source: PersistentStorage, target: PersistentStorage) -> tuple[int, list[str]]:
+    """
+    Replace the records in `target` with the live records in `source`, e.g., to
+    import a JSONL file into SQLite or export SQLite to JSONL.
+
+    Returns:
+        A tuple with the count of records copied and a list of the source records that failed to parse.
+    """
+    records, errors = source.replay()
+    return target.rewrite(records), errors
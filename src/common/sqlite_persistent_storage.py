@@ -0,0 +1,335 @@
+"""
+Persistent storage of records in a local SQLite database.
+
+Each record is stored as one row, with the JSON encoding of the record, using
+`encode_json(record)`, and separate, indexed columns for the id and any other
+fields that are commonly queried. Saving a record with an existing id replaces
+it in place, so there are no superseded versions to compact. The database uses
+write-ahead logging (WAL), so readers in other processes aren't blocked by writers.
+
+Other processes may share the database. `exclusive()` holds a write transaction, so a
+caller can catch up with `tail()`, validate a change, and save it without another process
+writing in between. For `tail()`, each write transaction stamps the rows it saves with the
+next version of the database, and the ids it removes are kept with their version in a
+second table. Clearing or rewriting all the records starts a new generation instead, so
+the other processes read all the records again.
+"""
+
+from __future__ import annotations
+
+import logging
+import re
+import sqlite3
+import threading
+from collections.abc import Generator, MutableMapping, Sequence
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from typing import Any
+
+from common.json_yaml import LazyDatetime, encode_json
+from common.persistent_storage import PersistentStorage
+
+
+class SqlitePersistentStorage(PersistentStorage):  # pylint: disable=too-many-instance-attributes
+    """Persistent storage of records in a local SQLite database."""
+
+    table = "records"
+
+    def __init__(  # pylint: disable=too-many-arguments,too-many-positional-arguments
+        self,
+        storage_path: Path | str,
+        logger: logging.Logger | None = None,
+        remove_old: bool = False,
+        id_key: str = "id",
+        indexed_fields: Sequence[str] = (),
+    ):
+        """
+        Initialize the storage.
+
+        Args:
+            - storage_path: Path to the SQLite database file
+            - logger: Optional logger instance
+            - remove_old: If True, delete any existing records and start empty.
+            - id_key: The record key that identifies a record.
+            - indexed_fields: Other record keys to store in indexed columns. Datetimes are
+              stored as epoch seconds, so they sort correctly across timezones.
+        """
+        self.storage_path = Path(storage_path)
+        if logger:
+            self.logger: logging.Logger = logger
+        else:
+            self.logger = logging.getLogger(self.__class__.__name__)
+            self.logger.setLevel(logging.INFO)
+        self.id_key = id_key
+        self.indexed_fields = [field for field in indexed_fields if field != id_key]
+        self._columns = ["f_" + re.sub(r"\W", "_", field) for field in self.indexed_fields]
+
+        self.storage_path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.RLock()
+        # How deeply transactions are nested, and the (generation, version) of the database when the
+        # current transaction first wrote, and whether it replaced all the records.
+        self._depth = 0
+        self._written: tuple[int, int] | None = None
+        self._replaced = False
+        # The (generation, version) of the database when the records were last read, for `tail()`.
+        self._read_at: tuple[int, int] | None = None
+        self._conn = sqlite3.connect(self.storage_path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self.__create_table()
+        if remove_old:
+            self.clear()
+
+    def __create_table(self):
+        """
+        Create the table and indexes, if necessary. If the table already exists, but
+        without columns for some of the indexed fields, add them and fill them in.
+        """
+        with self._transaction() as cur:
+            cur.execute(
+                f"CREATE TABLE IF NOT EXISTS {self.table} "
+                "(seq INTEGER PRIMARY KEY AUTOINCREMENT, id TEXT UNIQUE, body TEXT NOT NULL)"
+            )
+            cur.execute(f"CREATE TABLE IF NOT EXISTS {self.table}_removed (id TEXT PRIMARY KEY, version INTEGER)")
+            cur.execute(f"CREATE TABLE IF NOT EXISTS {self.table}_meta (generation INTEGER, version INTEGER)")
+            cur.execute(f"INSERT INTO {self.table}_meta SELECT 0, 0 WHERE NOT EXISTS (SELECT 1 FROM {self.table}_meta)")
+            existing = {row[1] for row in cur.execute(f"PRAGMA table_info({self.table})")}
+            if "version" not in existing:
+                cur.execute(f"ALTER TABLE {self.table} ADD COLUMN version INTEGER NOT NULL DEFAULT 0")
+            added = [column for column in self._columns if column not in existing]
+            for column in added:
+                cur.execute(f"ALTER TABLE {self.table} ADD COLUMN {column}")
+            for column in ["version", *self._columns]:
+                cur.execute(f"CREATE INDEX IF NOT EXISTS {self.table}_{column} ON {self.table} ({column})")
+            cur.execute(f"CREATE INDEX IF NOT EXISTS {self.table}_removed_version ON {self.table}_removed (version)")
+        if added and self.record_count:
+            records, _errors = self.load()
+            self.save(records)
+
+    @property
+    def shared(self) -> bool:
+        """True, since other processes may always open the database."""
+        return True
+
+    @contextmanager
+    def exclusive(self) -> Generator[None]:
+        """
+        Hold a write transaction, so other processes can't write until it ends, and a caller can
+        read the latest records with `tail()`, validate a change, and save it without another process
+        writing in between. The changes are committed when the outermost use ends, or rolled back
+        if it raises. Nested uses in the same thread are allowed.
+        """
+        with self._transaction():
+            yield
+
+    @contextmanager
+    def _transaction(self, write: bool = True) -> Generator[sqlite3.Cursor]:
+        """
+        Run the statements in a single transaction that is rolled back if an exception is raised.
+        A write transaction starts with `BEGIN IMMEDIATE`, which waits for other writers, while a
+        read transaction sees a consistent snapshot. Nested in another transaction, e.g., in
+        `exclusive()`, the statements run in a savepoint of the outer one.
+        """
+        with self._lock:
+            cur = self._conn.cursor()
+            outermost = self._depth == 0
+            cur.execute(("BEGIN IMMEDIATE" if write else "BEGIN") if outermost else "SAVEPOINT nested")
+            self._depth += 1
+            try:
+                yield cur
+                if outermost:
+                    self._commit(cur)
+                else:
+                    cur.execute("RELEASE nested")
+            except BaseException:
+                cur.execute("ROLLBACK" if outermost else "ROLLBACK TO nested")
+                if not outermost:
+                    cur.execute("RELEASE nested")
+                raise
+            finally:
+                self._depth -= 1
+                if outermost:
+                    self._written, self._replaced = None, False
+                cur.close()
+
+    def _commit(self, cur: sqlite3.Cursor):
+        """
+        Commit the outermost transaction. If it wrote, advance the version, or the generation if it
+        replaced all the records. The records read before are still current if they were current
+        when the transaction began, so `tail()` then skips this transaction's own changes.
+        """
+        if self._written is None:
+            cur.execute("COMMIT")
+            return
+        generation, version = self._written
+        new_state = (generation + 1 if self._replaced else generation, version + 1)
+        cur.execute(f"UPDATE {self.table}_meta SET generation = ?, version = ?", new_state)
+        cur.execute("COMMIT")
+        if self._replaced or self._read_at == self._written:
+            self._read_at = new_state
+
+    def _write_version(self, cur: sqlite3.Cursor, replace: bool = False) -> int:
+        """The version stamped on the rows written by the current transaction. Set `replace` when replacing them all."""
+        if self._written is None:
+            self._written = cur.execute(f"SELECT generation, version FROM {self.table}_meta").fetchone()
+        self._replaced = self._replaced or replace
+        return self._written[1] + 1
+
+    @staticmethod
+    def _column_value(value: Any) -> Any:
+        """The value stored in an indexed column. The exact value is always in the JSON body."""
+        if isinstance(value, LazyDatetime):
+            value = value.to_datetime()
+        if isinstance(value, datetime):
+            return value.timestamp()
+        if isinstance(value, int) and not -(2**63) <= value < 2**63:
+            return float(value)  # Too big for a SQLite INTEGER.
+        if value is None or isinstance(value, (str, int, float)):
+            return value
+        return encode_json(value)
+
+    def _row(self, record: MutableMapping[str, Any]) -> tuple[Any, ...]:
+        record_id = record.get(self.id_key)
+        return (
+            None if record_id is None else str(record_id),
+            encode_json(record),
+            *(SqlitePersistentStorage._column_value(record.get(field)) for field in self.indexed_fields),
+        )
+
+    def _insert(self, cur: sqlite3.Cursor, records: Sequence[MutableMapping[str, Any]]) -> int:
+        version = self._write_version(cur)
+        names = ", ".join(["id", "body", *self._columns, "version"])
+        placeholders = ", ".join("?" * (3 + len(self._columns)))
+        updates = ", ".join(f"{name} = excluded.{name}" for name in ["body", *self._columns, "version"])
+        rows = [(*self._row(record), version) for record in records]
+        cur.executemany(
+            f"INSERT INTO {self.table} ({names}) VALUES ({placeholders}) ON CONFLICT(id) DO UPDATE SET {updates}",
+            rows,
+        )
+        cur.executemany(f"DELETE FROM {self.table}_removed WHERE id = ?", [(row[0],) for row in rows if row[0]])
+        return len(records)
+
+    def _delete_all(self, cur: sqlite3.Cursor):
+        """Delete all the records, starting a new generation, so other processes read them all again."""
+        self._write_version(cur, replace=True)
+        cur.execute(f"DELETE FROM {self.table}")
+        cur.execute(f"DELETE FROM {self.table}_removed")
+
+    def clear(self):
+        """Remove all records."""
+        with self._transaction() as cur:
+            self._delete_all(cur)
+
+    def load(self) -> tuple[Sequence[MutableMapping[str, Any]], list[str]]:
+        """
+        Load all the records, in the order they were first written, and parse them using
+        `self.decode_record(body)`. Since superseded versions aren't kept, this is the same as `replay()`.
+        """
+        with self._transaction(write=False) as cur:
+            self._read_at = cur.execute(f"SELECT generation, version FROM {self.table}_meta").fetchone()
+            rows = cur.execute(f"SELECT body FROM {self.table} ORDER BY seq").fetchall()
+        return self._decode(rows)
+
+    def replay(self) -> tuple[Sequence[MutableMapping[str, Any]], list[str]]:
+        """Return the live records. See `load()`."""
+        return self.load()
+
+    def load_range(
+        self, field: str, low: Any = None, high: Any = None
+    ) -> tuple[Sequence[MutableMapping[str, Any]], list[str]]:
+        """
+        Load just the records where the indexed `field` is between `low` and `high`,
+        inclusive, ordered by the field. A bound of `None` means unbounded.
+        """
+        if field not in self.indexed_fields:
+            raise ValueError(
+                f"Only the indexed fields, {', '.join(self.indexed_fields) or 'none'}, can be used for range loads."
+            )
+        column = self._columns[self.indexed_fields.index(field)]
+        clauses = []
+        params = []
+        if low is not None:
+            clauses.append(f"{column} >= ?")
+            params.append(SqlitePersistentStorage._column_value(low))
+        if high is not None:
+            clauses.append(f"{column} <= ?")
+            params.append(SqlitePersistentStorage._column_value(high))
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT body FROM {self.table} {where} ORDER BY {column}, seq", params
+            ).fetchall()
+        return self._decode(rows)
+
+    def tail(self) -> tuple[dict[str, MutableMapping[str, Any]], set[str], list[str]] | None:
+        """
+        Return the changes made by other processes since the records were last read with `load()`,
+        `replay()`, or `tail()`: the saved records keyed by id, the removed ids, and the records that
+        failed to parse, or `None` if the records were never read, or were cleared or rewritten since.
+        """
+        with self._transaction(write=False) as cur:
+            generation, version = cur.execute(f"SELECT generation, version FROM {self.table}_meta").fetchone()
+            if self._read_at is None or self._read_at[0] != generation:
+                return None
+            last = self._read_at[1]
+            self._read_at = (generation, version)
+            if version == last:
+                return {}, set(), []
+            rows = cur.execute(f"SELECT body FROM {self.table} WHERE version > ? ORDER BY seq", (last,)).fetchall()
+            removed = {row[0] for row in cur.execute(f"SELECT id FROM {self.table}_removed WHERE version > ?", (last,))}
+        records, errors = self._decode(rows)
+        saved = {record[self.id_key]: record for record in records if record.get(self.id_key) is not None}
+        return saved, removed, errors
+
+    def _decode(self, rows: Sequence[tuple[str]]) -> tuple[Sequence[MutableMapping[str, Any]], list[str]]:
+        """Decode the bodies of the rows using `self.decode_record(body)`."""
+        records = []
+        errors = []
+        for (body,) in rows:
+            try:
+                records.append(self.decode_record(body))
+            except ValueError as e:
+                errors.append(body)
+                self.logger.error("Error parsing record: %s (record: %s)", e, body)
+        return records, errors
+
+    def save(self, records: Sequence[MutableMapping[str, Any]]) -> int:
+        """
+        Insert the records in one transaction. A record with the same id as an
+        existing record replaces it, but keeps the existing record's position.
+
+        Returns:
+            The count of the number of records written, which should be equal to len(records).
+        """
+        with self._transaction() as cur:
+            return self._insert(cur, records)
+
+    def remove(self, ids: Sequence[str]) -> int:
+        """Delete the records with the input ids in one transaction. Returns `len(ids)`."""
+        with self._transaction() as cur:
+            version = self._write_version(cur)
+            cur.executemany(f"DELETE FROM {self.table} WHERE id = ?", [(str(i),) for i in ids])
+            cur.executemany(
+                f"INSERT INTO {self.table}_removed (id, version) VALUES (?, ?) "
+                "ON CONFLICT(id) DO UPDATE SET version = excluded.version",
+                [(str(i), version) for i in ids],
+            )
+        return len(ids)
+
+    def rewrite(self, records: Sequence[MutableMapping[str, Any]]) -> int:
+        """Replace all the records in one transaction."""
+        with self._transaction() as cur:
+            self._delete_all(cur)
+            return self._insert(cur, records)
+
+    @property
+    def record_count(self) -> int:
+        """The number of records."""
+        with self._lock:
+            return self._conn.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0]
+
+    def close(self):
+        """Close the database connection."""
+        with self._lock:
+            self._conn.close()
@@ -7,12 +7,14 @@ with the ChatBot implementation.
 
 import json
 import logging
+from datetime import datetime, timedelta
 from pathlib import Path
 
 import pytest
 from fastapi.testclient import TestClient
 
 from apps.chatbot.api_server.server import APIServer
+from apps.chatbot.skills.appointments.appointment_tools import get_appointment_manager
 
 # pylint: disable=unused-variable
 
@@ -93,6 +95,30 @@ def test_api_server_list_models_endpoint(client):
     assert "owned_by" in model
 
 
+def test_api_server_appointment_changes_endpoint(client):
+    """Test that the appointment change stream resumes after a cursor."""
+    manager = get_appointment_manager()
+    cursor = manager.changes.latest_cursor()
+    day = (datetime.now().astimezone() + timedelta(days=365)).replace(hour=10, minute=0, second=0, microsecond=0)
+    while day.weekday() >= 5:
+        day += timedelta(days=1)
+    a_id, msg = manager.create_appointment("Jane Doe", day, "checkup")
+    assert a_id, msg
+    assert manager.cancel_appointment(a_id)[0]
+
+    response = client.get("/v1/appointments/changes", params={"follow": "false"}, headers={"Last-Event-ID": cursor})
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    events = [chunk for chunk in response.text.split("\n\n") if chunk]
+    names = [
+        line.removeprefix("event: ") for chunk in events for line in chunk.split("\n") if line.startswith("event:")
+    ]
+    assert ["create", "cancel"] == names
+    data = json.loads(events[-1].split("data: ", 1)[1])
+    assert a_id == data["resource_id"]
+    assert "cancelled" == data["resource"]["status"]
+
+
 class TestChatCompletions:
     """Test the chat completions endpoint."""
 
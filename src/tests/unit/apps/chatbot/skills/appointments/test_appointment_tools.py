@@ -18,14 +18,18 @@ from hypothesis import strategies as st
 from langchain_core.tools.structured import BaseTool
 
 from apps.chatbot.skills.appointments.appointment_tools import (
+    AppointmentManagerTool,
     cancel_appointment,
     change_appointment,
     create_appointment,
+    find_available_slots,
+    find_patient_names,
     get_appointment_by_id,
     get_appointment_id_for_name_and_date_time,
     get_appointment_manager,
     get_appointments,
     get_appointments_count,
+    get_providers,
 )
 from apps.chatbot.tools.appointment_manager import AppointmentManager
 from common.date_time_utils import (
@@ -443,6 +447,13 @@ class TestAppointmentTools:
         )
         assert "" == a_id2, f"{a_id2}, {bad_dt}, {apmt_dict}"
 
+    @given(appointment_dicts())
+    def test_find_patient_names_finds_names_that_differ_in_case(self, apmt_dict: dict[str, Any]):
+        test_util = AppointmentToolsTestUtil()
+        test_util.successfully_add_valid_appointment(apmt_dict)
+        names = find_patient_names.run({"patient_name": apmt_dict["patient_name"].lower()})
+        assert {"patient_name": apmt_dict["patient_name"], "similarity": 1.0} == names[0]
+
     @given(appointment_dicts())
     def test_get_appointment_id_for_name_and_date_time_returns_matching_values(self, apmt_dict: dict[str, Any]):
         """Test that get_appointment returns existing appointments."""
@@ -551,3 +562,89 @@ class TestAppointmentTools:
         """Test that initialization creates the appointments file if it doesn't exist"""
         test_util = AppointmentToolsTestUtil()
         test_util.check_file()
+
+    @given(appointment_dicts_lists().filter(lambda lst: len(lst) > 0))
+    def test_cancelled_and_changed_appointments_persist_across_instances(self, apmt_dicts: list[dict[str, Any]]):
+        """Test that the latest version of each appointment is loaded by a new instance."""
+        test_util, ids = self._add_apmts(apmt_dicts)
+        old_tool = test_util.tool
+        old_tool.cancel_appointment(ids[0])
+        first_appointments = old_tool.get_appointments()
+
+        new_tool = test_util.make_manager(make_new=True)
+        assert old_tool is not new_tool
+        assert len(apmt_dicts) - 1 == new_tool.get_appointments_count()
+        assert {} == new_tool.get_appointment_by_id(ids[0])
+        second_appointments = new_tool.get_appointments()
+        test_util.check_appointments_lists(
+            [a for a in first_appointments if a["status"] != "cancelled"], second_appointments
+        )
+
+    @given(appointment_dicts())
+    def test_cancel_appointment_frees_the_time_slot(self, appointment_dict: dict[str, Any]):
+        """Test that a new appointment can be created at the time of a cancelled appointment."""
+        test_util = AppointmentToolsTestUtil()
+        appointment = test_util.successfully_add_valid_appointment(appointment_dict)
+        test_util.fail_to_add_invalid_appointment(appointment_dict)
+        success, msg = test_util.capture_output(cancel_appointment, {"appointment_id": appointment["id"]})
+        assert success, msg
+        test_util.successfully_add_valid_appointment(appointment_dict)
+
+    @given(appointment_dicts(), appointment_future_work_datetimes())
+    def test_change_appointment_frees_the_old_time_slot_and_reserves_the_new_one(
+        self, appointment_dict: dict[str, Any], new_date_time: datetime
+    ):
+        test_util = AppointmentToolsTestUtil()
+        appointment = test_util.successfully_add_valid_appointment(appointment_dict)
+        if appointment["appointment_date_time"] == new_date_time:
+            return
+        success, msg = test_util.capture_output(
+            change_appointment, {"appointment_id": appointment["id"], "new_date_time": new_date_time.isoformat()}
+        )
+        assert success, msg
+        test_util.fail_to_add_invalid_appointment(appointment_dict | {"appointment_date_time": new_date_time})
+        test_util.successfully_add_valid_appointment(appointment_dict)
+
+    @given(appointment_dicts_lists().filter(lambda lst: len(lst) > 0))
+    def test_find_available_slots_returns_times_that_can_be_booked(self, apmt_dicts: list[dict[str, Any]]):
+        test_util = AppointmentToolsTestUtil()
+        for d in apmt_dicts:
+            test_util.successfully_add_valid_appointment(d, all_appointments=apmt_dicts)
+        first = min(d["appointment_date_time"] for d in apmt_dicts)
+        start = first.replace(hour=0)
+        times = find_available_slots.run(
+            {"start_date_time": start.isoformat(), "end_date_time": (start + timedelta(days=3)).isoformat(), "limit": 5}
+        )
+        assert 0 < len(times) <= 5
+        assert sorted(times) == times
+        booked = {d["appointment_date_time"] for d in apmt_dicts}
+        for time_str in times:
+            dt = datetime.fromisoformat(time_str)
+            assert dt not in booked
+            a_id, msg = create_appointment.run(
+                {"patient_name": "Jane Doe", "appointment_date_time": time_str, "reason": "checkup"}
+            )
+            assert a_id, msg
+
+    def test_tools_book_and_find_times_per_provider(self):
+        AppointmentManagerTool.def_providers = ("Dr. A", "Dr. B")
+        try:
+            test_util = AppointmentToolsTestUtil()
+            assert ["Dr. A", "Dr. B"] == get_providers.run({})
+            start = (now() + timedelta(days=365)).isoformat()
+            [dt] = find_available_slots.run({"start_date_time": start, "limit": 1})
+            fields = {"patient_name": "Jane Doe", "appointment_date_time": dt, "reason": "checkup"}
+            a_id, msg = create_appointment.run(fields | {"provider": "Dr. B"})
+            assert a_id, msg
+            assert [dt] == find_available_slots.run({"start_date_time": start, "limit": 1})
+            assert [dt] == find_available_slots.run({"start_date_time": start, "limit": 1, "provider": "Dr. A"})
+            assert [dt] != find_available_slots.run({"start_date_time": start, "limit": 1, "provider": "Dr. B"})
+
+            b_id, msg = create_appointment.run(fields | {"patient_name": "John Doe"})
+            assert b_id, msg
+            assert "Dr. A" == get_appointment_by_id.run({"appointment_id": b_id})["provider"]
+            assert not create_appointment.run(fields | {"patient_name": "Jim Doe"})[0]
+            assert [b_id] == [a["id"] for a in get_appointments.run({"provider": "Dr. A"})]
+            assert test_util.tool.providers == ("Dr. A", "Dr. B")
+        finally:
+            AppointmentManagerTool.def_providers = ()
@@ -0,0 +1,59 @@
+"""
+Unit tests for the compact appointment record type.
+Uses Hypothesis.
+"""
+
+import sys
+from datetime import datetime
+from typing import Any
+
+import pytest
+from hypothesis import given
+from hypothesis import strategies as st
+
+from apps.chatbot.tools.appointment import Appointment
+from common.date_time_utils import now
+from common.json_yaml import LazyDatetime, decode_json_dict, decode_json_record, encode_json
+from tests.common.hypothesis.appointments import appointment_dicts
+
+# pylint: disable=unused-variable,missing-function-docstring
+
+
+class TestAppointment:
+    """Test the `Appointment` record type."""
+
+    @given(appointment_dicts(), st.booleans())
+    def test_an_appointment_is_equivalent_to_its_dict(self, apmt_dict: dict[str, Any], epoch_timestamps: bool):
+        apmt_dict["id"] = "an-id"
+        apmt_dict["custom"] = [1, 2]
+        appointment = Appointment.from_dict(apmt_dict, epoch_timestamps=epoch_timestamps)
+        assert apmt_dict == appointment
+        assert apmt_dict == appointment.to_dict()
+        assert apmt_dict == decode_json_dict(encode_json(appointment))
+        assert not hasattr(appointment, "__dict__")
+        if epoch_timestamps:
+            assert isinstance(appointment.created_at, int)
+
+    def test_an_appointment_is_a_mutable_mapping(self):
+        status = "cancel" + str.lower("LED")  # Not interned.
+        appointment = Appointment.from_dict({"id": "1", "status": "scheduled"})
+        assert "scheduled" == appointment["status"]
+        appointment.update({"status": status, "cancelled_at": now()})
+        assert sys.intern(status) is appointment.status
+        assert {"id", "status", "cancelled_at"} == set(appointment)
+        del appointment["cancelled_at"]
+        assert "cancelled_at" not in appointment
+        assert appointment.get("reason") is None
+        with pytest.raises(KeyError):
+            del appointment["reason"]
+
+    @given(appointment_dicts(), st.booleans())
+    def test_lazy_timestamps_are_parsed_when_first_read(self, apmt_dict: dict[str, Any], epoch_timestamps: bool):
+        text = encode_json(apmt_dict)
+        record = decode_json_record(text, {"appointment_date_time", "created_at"})
+        appointment = Appointment.from_dict(record, epoch_timestamps=epoch_timestamps)
+        assert isinstance(appointment.created_at, LazyDatetime)
+        assert apmt_dict == decode_json_dict(encode_json(appointment))
+        assert isinstance(appointment.created_at, datetime | int)
+        assert apmt_dict["created_at"] == appointment["created_at"]
+        assert apmt_dict == appointment
@@ -0,0 +1,598 @@
+"""
+Unit tests for the appointment manager that aren't covered by the appointment skill tests.
+Uses Hypothesis.
+"""
+
+import logging
+import multiprocessing
+import os
+import tempfile
+from collections import Counter
+from datetime import datetime, timedelta
+from itertools import pairwise
+from pathlib import Path
+from typing import Any
+
+import pytest
+from hypothesis import given
+from hypothesis import strategies as st
+
+from apps.chatbot.tools.appointment import Appointment
+from apps.chatbot.tools.appointment_manager import AppointmentManager
+from common.date_time_utils import now
+from common.json_yaml import LazyDatetime
+from tests.common.hypothesis.appointments import appointment_dicts_lists
+
+# pylint: disable=unused-variable,missing-function-docstring,consider-using-with
+
+
+class AppointmentManagerTestUtil:
+    """Creates appointment managers with storage in a temporary directory."""
+
+    def __init__(self, file_name: str = "appointments.jsonl"):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.path = Path(self.temp_dir.name) / file_name
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.logger.setLevel(logging.CRITICAL)  # suppress almost everything...
+
+    def make_manager(self, start_empty: bool = False, **manager_options: Any) -> AppointmentManager:
+        return AppointmentManager(self.path, start_empty=start_empty, logger=self.logger, **manager_options)
+
+    def add(self, manager: AppointmentManager, apmt_dicts: list[dict[str, Any]]) -> list[str]:
+        ids = []
+        for d in apmt_dicts:
+            a_id, msg = manager.create_appointment(d["patient_name"], d["appointment_date_time"], d["reason"])
+            assert a_id, msg
+            ids.append(a_id)
+        return ids
+
+
+def _work_hours(count: int) -> list[datetime]:
+    """Valid appointment times on the first working day at least a year from now."""
+    day = (now() + timedelta(days=365)).replace(hour=0, minute=0, second=0, microsecond=0)
+    while day.weekday() >= 5 or (day.month, day.day) in AppointmentManager.USA_HOLIDAYS:
+        day += timedelta(days=1)
+    return [day.replace(hour=9 + i) for i in range(count)]
+
+
+def _shared_options(path: Path) -> dict[str, Any]:
+    """The options for managers sharing the storage with other processes. SQLite storage is always shared."""
+    return {} if path.suffix == ".db" else {"storage_options": {"cross_process": True}}
+
+
+def _book_all(path: Path, times: list[datetime], results: Any):
+    """Run in a separate process: try to book every time."""
+    manager = AppointmentManager(path, **_shared_options(path))
+    booked = 0
+    for dt in times:
+        a_id, _msg = manager.create_appointment(f"Patient {os.getpid()}", dt, "checkup")
+        booked += 1 if a_id else 0
+    results.put(booked)
+
+
+class TestAppointmentManager:
+    """Test the appointment manager."""
+
+    @given(appointment_dicts_lists().filter(lambda lst: len(lst) > 1))
+    def test_appointments_persist_in_sqlite_storage(self, apmt_dicts: list[dict[str, Any]]):
+        test_util = AppointmentManagerTestUtil("appointments.db")
+        manager = test_util.make_manager(start_empty=True)
+        ids = test_util.add(manager, apmt_dicts)
+        manager.cancel_appointment(ids[0])
+        manager.change_appointment(ids[1], apmt_dicts[0]["appointment_date_time"])
+
+        manager2 = test_util.make_manager()
+        assert manager.get_appointments_count() == manager2.get_appointments_count()
+        assert {} == manager2.get_appointment_by_id(ids[0])
+        assert apmt_dicts[0]["appointment_date_time"] == manager2.get_appointment_by_id(ids[1])["appointment_date_time"]
+        assert [a["id"] for a in manager.get_appointments() if a["status"] != "cancelled"] == [
+            a["id"] for a in manager2.get_appointments()
+        ]
+
+    @given(appointment_dicts_lists().filter(lambda lst: len(lst) > 1))
+    def test_lazy_load_matches_an_eager_load(self, apmt_dicts: list[dict[str, Any]]):
+        test_util = AppointmentManagerTestUtil()
+        manager = test_util.make_manager(start_empty=True)
+        ids = test_util.add(manager, apmt_dicts)
+        manager.cancel_appointment(ids[0])
+
+        eager = test_util.make_manager()
+        for _ in range(2):  # The second time, the saved offset index is used.
+            lazy = test_util.make_manager(lazy_load=True)
+            assert {} == lazy.get_appointment_by_id(ids[0])
+            assert eager.get_appointment_by_id(ids[1]) == lazy.get_appointment_by_id(ids[1])
+            assert eager.get_appointments_count() == lazy.get_appointments_count()
+            assert eager.get_appointments() == lazy.get_appointments()
+        assert test_util.path.with_name(test_util.path.name + ".idx").exists()
+
+        # The slot of an existing appointment is still reserved.
+        a_id, _msg = lazy.create_appointment("Someone", apmt_dicts[1]["appointment_date_time"], "checkup")
+        assert not a_id
+
+    @pytest.mark.parametrize("file_name", ["appointments.jsonl", "appointments.db"])
+    def test_shared_managers_see_each_others_changes(self, file_name: str):
+        test_util = AppointmentManagerTestUtil(file_name)
+        options = _shared_options(test_util.path)
+        manager = test_util.make_manager(start_empty=True, **options)
+        other = test_util.make_manager(**options)
+        times = _work_hours(3)
+
+        a_id, msg = manager.create_appointment("Jane Doe", times[0], "checkup")
+        assert a_id, msg
+        b_id, _msg = other.create_appointment("John Doe", times[0], "checkup")
+        assert not b_id, "double booked"
+        assert manager.get_appointment_by_id(a_id) == other.get_appointment_by_id(a_id)
+
+        assert other.change_appointment(a_id, times[1])[0]
+        assert times[1] == manager.get_appointment_by_id(a_id)["appointment_date_time"]
+        b_id, msg = manager.create_appointment("John Doe", times[0], "checkup")
+        assert b_id, msg
+
+        assert manager.cancel_appointment(a_id)[0]
+        assert {} == other.get_appointment_by_id(a_id)
+        assert 1 == other.get_appointments_count()
+
+    @pytest.mark.skipif(os.name != "posix", reason="Requires fork and fcntl.")
+    @pytest.mark.parametrize("file_name", ["appointments.jsonl", "appointments.db"])
+    def test_processes_sharing_a_file_never_double_book(self, file_name: str):
+        test_util = AppointmentManagerTestUtil(file_name)
+        test_util.make_manager(start_empty=True)
+        times = _work_hours(5)
+        context = multiprocessing.get_context("fork")
+        results = context.Queue()
+        processes = [context.Process(target=_book_all, args=(test_util.path, times, results)) for _ in range(4)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join(60)
+        assert len(times) == sum(results.get(timeout=5) for _ in processes)
+        assert len(times) == test_util.make_manager().get_appointments_count()
+
+    def test_failed_writes_leave_memory_unchanged(self, monkeypatch: pytest.MonkeyPatch):
+        test_util = AppointmentManagerTestUtil()
+        manager = test_util.make_manager(start_empty=True, storage_options={"group_commit": True})
+        times = _work_hours(2)
+        a_id, msg = manager.create_appointment("Jane Doe", times[0], "checkup")
+        assert a_id, msg
+
+        def fail(records: Any) -> int:
+            raise OSError("disk full")
+
+        monkeypatch.setattr(manager.storage, "save", fail)
+        b_id, msg = manager.create_appointment("John Doe", times[1], "checkup")
+        assert not b_id and "disk full" in msg
+        success, msg = manager.update_resource(a_id, {"appointment_date_time": times[1], "reason": "other"})
+        assert not success and "disk full" in msg
+        assert ("checkup", times[0]) == tuple(
+            manager.get_appointment_by_id(a_id)[key] for key in ("reason", "appointment_date_time")
+        )
+        assert 1 == manager.get_appointments_count()
+        monkeypatch.undo()
+        b_id, msg = manager.create_appointment("John Doe", times[1], "checkup")
+        assert b_id, msg
+
+    def test_cancelled_appointments_cant_be_cancelled_or_changed(self, monkeypatch: pytest.MonkeyPatch):
+        test_util = AppointmentManagerTestUtil()
+        manager = test_util.make_manager(start_empty=True)
+        times = _work_hours(3)
+        a_id, _msg = manager.create_appointment("Jane Doe", times[0], "checkup")
+        b_id, _msg = manager.create_appointment("John Doe", times[1], "checkup")
+        assert manager.cancel_appointment(a_id)[0]
+        assert not manager.cancel_appointment(a_id)[0]
+        assert not manager.change_appointment(a_id, times[2])[0]
+        assert [False] == [success for success, _msg in manager.cancel_appointments_bulk([a_id])]
+        results = manager.change_appointments_bulk([(a_id, times[2]), (b_id, times[0])])
+        assert [False, True] == [success for success, _msg in results]
+        assert "No appointment with the input ID was found." == results[0][1]
+
+        # Failed writes are reported.
+        def fail(records: Any) -> int:
+            raise OSError("disk full")
+
+        monkeypatch.setattr(manager.storage, "save", fail)
+        success, msg = manager.cancel_appointment(b_id)
+        assert not success and "disk full" in msg
+        success, msg = manager.change_appointment(b_id, times[2])
+        assert not success and "disk full" in msg
+        assert ("scheduled", times[0]) == tuple(
+            manager.get_appointment_by_id(b_id)[key] for key in ("status", "appointment_date_time")
+        )
+
+    @given(appointment_dicts_lists().filter(lambda lst: len(lst) > 2))
+    def test_bulk_operations_match_one_at_a_time_operations(self, apmt_dicts: list[dict[str, Any]]):
+        test_util = AppointmentManagerTestUtil()
+        manager = test_util.make_manager(start_empty=True)
+        # The duplicate of the first appointment's time conflicts within the batch.
+        results = manager.create_appointments_bulk([*apmt_dicts, apmt_dicts[0]])
+        ids = [a_id for a_id, _msg in results]
+        assert all(ids[:-1]) and not ids[-1]
+        assert len(apmt_dicts) == manager.get_appointments_count()
+
+        # Move the first appointment, then move the second into the slot it freed.
+        first, second = apmt_dicts[0]["appointment_date_time"], apmt_dicts[1]["appointment_date_time"]
+        new_time = max(a["appointment_date_time"] for a in apmt_dicts) + timedelta(days=7)
+        while new_time.weekday() >= 5 or (new_time.month, new_time.day) in AppointmentManager.USA_HOLIDAYS:
+            new_time += timedelta(days=1)
+        results2 = manager.change_appointments_bulk(
+            [(ids[0], new_time), (ids[1], first), (ids[2], second), ("x", first)]
+        )
+        assert [True, True, True, False] == [success for success, _msg in results2]
+
+        results3 = manager.cancel_appointments_bulk([ids[2], "x"])
+        assert [True, False] == [success for success, _msg in results3]
+
+        reloaded = test_util.make_manager()
+        assert len(apmt_dicts) - 1 == reloaded.get_appointments_count()
+        assert new_time == reloaded.get_appointment_by_id(ids[0])["appointment_date_time"]
+        assert first == reloaded.get_appointment_by_id(ids[1])["appointment_date_time"]
+        assert second == reloaded.get_appointment_by_id(ids[1])["previous_time"]
+        assert {} == reloaded.get_appointment_by_id(ids[2])
+
+    @given(appointment_dicts_lists().filter(lambda lst: len(lst) > 1))
+    def test_find_available_slots_matches_validating_every_slot(self, apmt_dicts: list[dict[str, Any]]):
+        test_util = AppointmentManagerTestUtil()
+        manager = test_util.make_manager(start_empty=True)
+        ids = test_util.add(manager, apmt_dicts)
+        manager.cancel_appointment(ids[0])
+        manager.change_appointment(ids[1], apmt_dicts[0]["appointment_date_time"])
+
+        start = min(d["appointment_date_time"] for d in apmt_dicts).replace(hour=0)
+        end = start + timedelta(days=4)
+        expected = []
+        dt = start
+        while dt < end:
+            if manager._is_valid_date_time(dt, unique_datetime_key="appointment_date_time")[0]:
+                expected.append(dt)
+            dt += timedelta(hours=1)
+        assert expected == manager.find_available_slots(start, end, limit=1000)
+        assert expected[:3] == manager.find_available_slots(start, end, limit=3)
+
+    @given(appointment_dicts_lists().filter(lambda lst: len(lst) > 1))
+    def test_maintained_counts_match_counting_every_appointment(self, apmt_dicts: list[dict[str, Any]]):
+        test_util = AppointmentManagerTestUtil()
+        manager = test_util.make_manager(start_empty=True)
+        ids = test_util.add(manager, apmt_dicts)
+        manager.cancel_appointment(ids[0])
+        manager.change_appointment(ids[1], apmt_dicts[0]["appointment_date_time"])
+
+        # The cancelled appointment is still in the first manager's memory, but isn't counted.
+        for m in [manager, test_util.make_manager(), test_util.make_manager(lazy_load=True)]:
+            appointments = list(m.resources.values())
+            expected = Counter(a["status"] for a in appointments if a["status"] != "cancelled")
+            assert expected == m.get_appointments_count_by_status()
+            assert expected["scheduled"] == m.get_appointments_count()
+        assert manager.get_appointments_count_by_status() == m.get_appointments_count_by_status()
+
+        after = apmt_dicts[1]["appointment_date_time"]
+        expected_after = sorted(
+            (
+                a
+                for a in manager.get_appointments()
+                if a["status"] == "scheduled" and a["appointment_date_time"] >= after
+            ),
+            key=lambda a: (a["appointment_date_time"], a["id"]),
+        )
+        assert expected_after == manager.get_appointments(after_date_time=after)
+
+    @given(appointment_dicts_lists().filter(lambda lst: len(lst) > 2))
+    def test_loading_a_snapshot_and_the_later_records_matches_reading_every_record(
+        self, apmt_dicts: list[dict[str, Any]]
+    ):
+        test_util = AppointmentManagerTestUtil()
+        manager = test_util.make_manager(start_empty=True, snapshot_interval=2)
+        ids = test_util.add(manager, apmt_dicts[:-1])
+        manager.snapshots.wait()
+        assert test_util.path.with_name(test_util.path.name + ".snap").exists()
+        # Written without snapshots, so these records are after the latest one.
+        other = test_util.make_manager(snapshot_interval=0)
+        other.cancel_appointment(ids[0])
+        test_util.add(other, apmt_dicts[-1:])
+
+        for _ in range(2):  # The first load saves a new snapshot, which the second load uses.
+            expected = test_util.make_manager()
+            loaded = test_util.make_manager(snapshot_interval=2)
+            loaded.snapshots.wait()
+            assert expected.get_appointments() == loaded.get_appointments()
+            assert expected.get_appointments_count_by_status() == loaded.get_appointments_count_by_status()
+            assert loaded.storage.record_count == expected.storage.record_count
+
+        # The slots are still reserved and the storage still accepts writes.
+        a_id, _msg = loaded.create_appointment("Someone", apmt_dicts[1]["appointment_date_time"], "checkup")
+        assert not a_id
+        loaded.cancel_appointment(ids[1])
+        assert len(apmt_dicts) - 2 == test_util.make_manager(snapshot_interval=2).get_appointments_count()
+
+    @given(appointment_dicts_lists().filter(lambda lst: len(lst) > 1))
+    def test_lazy_timestamps_match_parsed_timestamps(self, apmt_dicts: list[dict[str, Any]]):
+        test_util = AppointmentManagerTestUtil()
+        manager = test_util.make_manager(start_empty=True)
+        ids = test_util.add(manager, apmt_dicts)
+        manager.cancel_appointment(ids[0])
+
+        expected = test_util.make_manager().get_appointments()
+        for options in [{}, {"epoch_timestamps": True}, {"lazy_load": True}]:
+            lazy = test_util.make_manager(lazy_timestamps=True, **options)
+            record = lazy.resources[ids[1]]
+            assert isinstance(record, Appointment) and isinstance(record.created_at, LazyDatetime)
+            assert expected == lazy.get_appointments()
+            record = lazy.resources[ids[1]]
+            assert isinstance(record, Appointment) and not isinstance(record.created_at, LazyDatetime)
+
+        # Archiving needs the appointment times of all the records in storage.
+        lazy = test_util.make_manager(lazy_timestamps=True, archive_dir=test_util.path.with_name("archive"))
+        cutoff = max(d["appointment_date_time"] for d in apmt_dicts)
+        assert len(apmt_dicts) - 1 == lazy.archive_resources(cutoff)
+        assert [a for a in expected if a["appointment_date_time"] >= cutoff] == lazy.get_appointments()
+
+    @given(appointment_dicts_lists().filter(lambda lst: len(lst) > 2))
+    def test_archived_appointments_leave_memory_but_are_still_found_by_date(self, apmt_dicts: list[dict[str, Any]]):
+        test_util = AppointmentManagerTestUtil()
+        archive_dir = test_util.path.with_name("archive")
+        manager = test_util.make_manager(start_empty=True, archive_dir=archive_dir)
+        ids = test_util.add(manager, apmt_dicts)
+        first = min(d["appointment_date_time"] for d in apmt_dicts)
+        manager.cancel_appointment(ids[[d["appointment_date_time"] for d in apmt_dicts].index(first)])
+        expected = manager.get_appointments(after_date_time=first)
+
+        # Archive all but the latest appointment, including the cancelled one.
+        cutoff = max(d["appointment_date_time"] for d in apmt_dicts)
+        assert len(apmt_dicts) - 1 == manager.archive_resources(cutoff)
+        assert 1 == len(manager.resources) == manager.get_appointments_count()
+        assert expected == manager.get_appointments(after_date_time=first)
+        assert expected[-1:] == manager.get_appointments()
+        assert len(apmt_dicts) - 1 == len(list(manager.get_archived_resources()))
+
+        reloaded = test_util.make_manager(archive_dir=archive_dir)
+        assert 1 == len(reloaded.resources)
+        assert expected == reloaded.get_appointments(after_date_time=first)
+        patient_name = expected[0]["patient_name"]
+        assert [a for a in expected if a["patient_name"] == patient_name] == reloaded.get_appointments(
+            patient_name=patient_name, after_date_time=first
+        )
+
+    @given(appointment_dicts_lists().filter(lambda lst: len(lst) > 1))
+    def test_appointments_persist_in_monthly_partitions(self, apmt_dicts: list[dict[str, Any]]):
+        test_util = AppointmentManagerTestUtil("appointments")
+        options: dict[str, Any] = {"storage_options": {"partition_key": "appointment_date_time"}}
+        manager = test_util.make_manager(start_empty=True, **options)
+        ids = test_util.add(manager, apmt_dicts)
+        manager.cancel_appointment(ids[0])
+        # Move an appointment to a later month.
+        new_time = max(d["appointment_date_time"] for d in apmt_dicts) + timedelta(days=35)
+        while new_time.weekday() >= 5 or (new_time.month, new_time.day) in AppointmentManager.USA_HOLIDAYS:
+            new_time += timedelta(days=1)
+        assert manager.change_appointment(ids[1], new_time)[0]
+
+        reloaded = test_util.make_manager(**options)
+        assert manager.get_appointments_count() == reloaded.get_appointments_count()
+        assert new_time == reloaded.get_appointment_by_id(ids[1])["appointment_date_time"]
+        assert {} == reloaded.get_appointment_by_id(ids[0])
+        partitions = [path.name for path in test_util.path.iterdir()]
+        assert f"{new_time.year:04d}-{new_time.month:02d}.jsonl" in partitions
+
+    @given(appointment_dicts_lists().filter(lambda lst: len(lst) > 2))
+    def test_transactions_are_all_or_nothing_and_creates_are_idempotent(self, apmt_dicts: list[dict[str, Any]]):
+        test_util = AppointmentManagerTestUtil()
+        manager = test_util.make_manager(start_empty=True)
+        ids = test_util.add(manager, apmt_dicts[:2])
+        first, second = (d["appointment_date_time"] for d in apmt_dicts[:2])
+        record_count = manager.storage.record_count
+
+        # The second create conflicts with the first, so nothing changes.
+        transaction = manager.begin().update(ids[0], {"status": "cancelled"})
+        transaction.create(AppointmentManager.make_appointment_dict(apmt_dicts[2]["appointment_date_time"], "A", ""))
+        transaction.create(AppointmentManager.make_appointment_dict(second, "B", ""))
+        committed_ids, error_msg = transaction.commit()
+        assert not committed_ids and error_msg
+        assert record_count == manager.storage.record_count
+        assert 2 == manager.get_appointments_count()
+        assert "scheduled" == manager.get_appointment_by_id(ids[0])["status"]
+        with pytest.raises(ValueError):
+            transaction.commit()
+
+        # Cancelling frees the slot for the new appointment, with one write.
+        new_id, msg = manager.cancel_and_create_appointment(ids[0], "C", first, "", idempotency_key="k1")
+        assert new_id, msg
+        assert record_count + 2 == manager.storage.record_count
+        assert (new_id, "") == manager.cancel_and_create_appointment(ids[0], "C", first, "", idempotency_key="k1")
+        assert not manager.cancel_and_create_appointment(ids[0], "C", first, "")[0]
+
+        a_id, _msg = manager.create_appointment("D", apmt_dicts[2]["appointment_date_time"], "", idempotency_key="k2")
+        assert a_id == manager.create_appointment("D", apmt_dicts[2]["appointment_date_time"], "", "k2")[0]
+        reloaded = test_util.make_manager()
+        assert a_id == reloaded.create_appointment("D", apmt_dicts[2]["appointment_date_time"], "", "k2")[0]
+        assert 3 == reloaded.get_appointments_count()
+
+    @given(appointment_dicts_lists().filter(lambda lst: len(lst) > 2))
+    def test_the_change_feed_has_an_event_for_every_change(self, apmt_dicts: list[dict[str, Any]]):
+        test_util = AppointmentManagerTestUtil()
+        manager = test_util.make_manager(start_empty=True)
+        cursor = manager.changes.latest_cursor()
+        ids = test_util.add(manager, apmt_dicts[:2])
+        assert manager.cancel_appointment(ids[0])[0]
+        new_time = apmt_dicts[2]["appointment_date_time"]
+        assert manager.change_appointment(ids[1], new_time)[0]
+        manager.remove_resource_by_id(ids[1])
+
+        events, cursor, reset = manager.changes.read(cursor)
+        assert not reset
+        expected = [("create", ids[0]), ("create", ids[1]), ("cancel", ids[0]), ("change", ids[1]), ("remove", ids[1])]
+        assert expected == [(event.kind, event.resource_id) for event in events]
+        assert list(range(1, len(expected) + 1)) == [event.seq for event in events]
+        assert events[3].resource is not None
+        assert new_time == events[3].resource["appointment_date_time"]
+        assert ([], cursor, False) == manager.changes.read(cursor)
+
+    def test_the_change_feed_has_the_changes_made_by_other_processes(self):
+        test_util = AppointmentManagerTestUtil()
+        # Compacting the file would make the other manager reload it and reset its change feed.
+        options: dict[str, Any] = {"storage_options": {"cross_process": True}, "compaction_ratio": 0.0}
+        manager = test_util.make_manager(start_empty=True, **options)
+        other = test_util.make_manager(**options)
+        times = _work_hours(2)
+        cursor = manager.changes.latest_cursor()
+
+        a_id, msg = other.create_appointment("Jane Doe", times[0], "checkup")
+        assert a_id, msg
+        assert other.change_appointment(a_id, times[1])[0]
+        assert other.cancel_appointment(a_id)[0]
+        manager.refresh()
+        events, _cursor, _reset = manager.changes.read(cursor)
+        # The refresh sees just the latest version of the appointment, which is cancelled.
+        assert [] == events
+
+        b_id, msg = other.create_appointment("John Doe", times[0], "checkup")
+        assert b_id, msg
+        manager.refresh()
+        assert other.change_appointment(b_id, times[1])[0]
+        manager.refresh()
+        events, _cursor, _reset = manager.changes.read(cursor)
+        assert [("create", b_id), ("change", b_id)] == [(event.kind, event.resource_id) for event in events]
+
+    def test_find_patient_names_ranks_similar_names_of_active_appointments(self):
+        test_util = AppointmentManagerTestUtil()
+        manager = test_util.make_manager(start_empty=True)
+        times = _work_hours(4)
+        ids = [
+            manager.create_appointment(name, dt, "checkup")[0]
+            for name, dt in zip(["John Q. Doe", "Jane Doe", "Mary Smith", "John Doe"], times, strict=True)
+        ]
+        assert all(ids)
+        names = [name for name, _similarity in manager.find_patient_names("john doe")]
+        assert ["John Doe", "John Q. Doe"] == names[:2]
+        assert "Mary Smith" not in names
+        assert 1 == len(manager.find_patient_names("john doe", limit=1))
+
+        # Names used only by cancelled appointments aren't found.
+        assert manager.cancel_appointment(ids[3])[0]
+        assert "John Doe" not in [name for name, _similarity in manager.find_patient_names("john doe")]
+        reloaded = test_util.make_manager()
+        assert "John Q. Doe" == reloaded.find_patient_names("Doe, John Q")[0][0]
+
+        # Exact lookups fall back to names that only differ in case and punctuation.
+        assert ids[0] == manager.get_appointment_id_for_name_and_date_time("john q doe", times[0])
+        assert "" == manager.get_appointment_id_for_name_and_date_time("john doe", times[0])
+
+    @given(appointment_dicts_lists().filter(lambda lst: len(lst) > 1), st.sampled_from([15, 30, 90]))
+    def test_appointments_with_durations_and_buffers_never_overlap(
+        self, apmt_dicts: list[dict[str, Any]], duration_minutes: int
+    ):
+        test_util = AppointmentManagerTestUtil()
+        options: dict[str, Any] = {"buffer": timedelta(minutes=10), "start_granularity": timedelta(minutes=15)}
+        manager = test_util.make_manager(start_empty=True, **options)
+        for d in apmt_dicts:
+            manager.create_appointment(
+                d["patient_name"], d["appointment_date_time"], d["reason"], duration_minutes=duration_minutes
+            )
+        duration = timedelta(minutes=duration_minutes)
+        start = min(d["appointment_date_time"] for d in apmt_dicts).replace(hour=0)
+        end = start + timedelta(days=3)
+        expected = []
+        dt = start
+        while dt < end:
+            if (
+                manager._is_valid_date_time(dt, unique_datetime_key="appointment_date_time")[0]
+                and manager._check_interval(dt, duration)[0]
+            ):
+                expected.append(dt)
+            dt += timedelta(minutes=15)
+        assert expected == manager.find_available_slots(start, end, limit=1000, duration=duration)
+        for dt in manager.find_available_slots(start, end, limit=3, duration=duration):
+            a_id, msg = manager.create_appointment("Jane Doe", dt, "checkup", duration_minutes=duration_minutes)
+            # The earlier slots taken may overlap the later ones.
+            assert a_id or "overlap" in msg
+
+        appointments = sorted(manager.get_appointments(after_date_time=start), key=lambda a: a["appointment_date_time"])
+        for earlier, later in pairwise(appointments):
+            earlier_end = earlier["appointment_date_time"] + manager.duration_of(earlier) + manager.buffer
+            assert earlier_end <= later["appointment_date_time"]
+        reloaded = test_util.make_manager(**options)
+        assert duration_minutes == reloaded.get_appointment_by_id(appointments[0]["id"])["duration_minutes"]
+
+    def test_changing_an_appointment_checks_overlaps_with_the_others(self):
+        test_util = AppointmentManagerTestUtil()
+        manager = test_util.make_manager(start_empty=True, start_granularity=timedelta(minutes=30))
+        times = _work_hours(3)
+        a_id, msg = manager.create_appointment("Jane Doe", times[0], "checkup", duration_minutes=90)
+        assert a_id, msg
+        b_id, msg = manager.create_appointment("John Doe", times[0] + timedelta(minutes=30), "checkup")
+        assert not b_id and "overlap" in msg
+        b_id, msg = manager.create_appointment("John Doe", times[2], "checkup", duration_minutes=30)
+        assert b_id, msg
+        # An appointment can move within its own time, but not onto another one.
+        assert manager.change_appointment(a_id, times[0] + timedelta(minutes=30))[0]
+        assert not manager.change_appointment(b_id, times[1])[0]
+        assert not manager.create_appointment("Late", times[0].replace(hour=16, minute=30), "", duration_minutes=60)[0]
+        assert not manager.create_appointment("Bad", times[2] + timedelta(hours=1), "", duration_minutes=0)[0]
+        assert manager.cancel_appointment(a_id)[0]
+        assert manager.change_appointment(b_id, times[1])[0]
+
+    @given(appointment_dicts_lists().filter(lambda lst: len(lst) > 1), st.sampled_from(["", "Dr. B"]))
+    def test_providers_have_separate_calendars(self, apmt_dicts: list[dict[str, Any]], provider: str):
+        test_util = AppointmentManagerTestUtil()
+        providers = ("Dr. A", "Dr. B")
+        manager = test_util.make_manager(start_empty=True, providers=providers)
+        for d in apmt_dicts:
+            manager.create_appointment(d["patient_name"], d["appointment_date_time"], d["reason"], provider=provider)
+        start = min(d["appointment_date_time"] for d in apmt_dicts).replace(hour=0)
+        end = start + timedelta(days=3)
+        expected_pairs = []
+        dt = start
+        while dt < end:
+            for p in providers:
+                fields = AppointmentManager.make_appointment_dict(dt, "Jane Doe", "checkup", provider=p)
+                if manager._is_valid_resource(fields)[0]:
+                    expected_pairs.append((dt, p))
+            dt += timedelta(hours=1)
+        assert expected_pairs == manager.find_available_provider_slots(start, end, limit=1000)
+        expected = sorted({dt for dt, _p in expected_pairs})
+        assert expected == manager.find_available_slots(start, end, limit=1000)
+        assert [dt for dt, p in expected_pairs if p == "Dr. A"] == manager.find_available_slots(
+            start, end, limit=1000, provider="Dr. A"
+        )
+        assert not manager.find_available_slots(start, end, provider="Dr. Nobody")
+
+        # A new appointment without a provider goes to the first free provider, until none is free.
+        dt = apmt_dicts[0]["appointment_date_time"]
+        booked = [manager.create_appointment(f"Patient {i}", dt, "checkup") for i in range(3)]
+        assert not booked[-1][0]
+        at_dt = manager.get_appointments(after_date_time=dt)
+        assert sorted(providers) == sorted(manager.provider_of(a) for a in at_dt if a["appointment_date_time"] == dt)
+        assert all(manager.provider_of(a) == "Dr. B" for a in manager.get_appointments(provider="Dr. B"))
+
+        reloaded = test_util.make_manager(providers=providers)
+        assert manager.find_available_provider_slots(start, end, limit=1000) == reloaded.find_available_provider_slots(
+            start, end, limit=1000
+        )
+
+    def test_changing_providers_and_appointments_without_a_provider(self):
+        test_util = AppointmentManagerTestUtil()
+        times = _work_hours(2)
+        manager = test_util.make_manager(start_empty=True)
+        a_id, msg = manager.create_appointment("Jane Doe", times[0], "checkup")
+        assert a_id, msg
+        assert not manager.create_appointment("John Doe", times[1], "checkup", provider="Dr. A")[0]
+
+        # Appointments made before providers were configured belong to the first provider.
+        manager = test_util.make_manager(providers=("Dr. A", "Dr. B"))
+        assert [times[0]] == [a["appointment_date_time"] for a in manager.get_appointments(provider="Dr. A")]
+        assert not manager.create_appointment("John Doe", times[0], "checkup", provider="Dr. A")[0]
+        # The caller's fields aren't changed, whether or not they are valid.
+        fields = AppointmentManager.make_appointment_dict(times[0], "", "checkup")
+        unchanged = dict(fields)
+        assert not manager.create_resource(fields)[0]
+        assert unchanged == fields
+        fields["patient_name"] = "John Doe"
+        b_id, msg = manager.create_resource(fields)
+        assert b_id, msg
+        assert "provider" not in fields
+        assert "Dr. B" == manager.get_appointment_by_id(b_id)["provider"]
+        assert not manager.change_appointment(a_id, times[0], provider="Dr. B")[0]
+        assert not manager.change_appointment(a_id, times[1], provider="Dr. C")[0]
+        assert manager.change_appointment(b_id, times[1], provider="Dr. A")[0]
+        assert manager.change_appointment(a_id, times[1], provider="Dr. B")[0]
+        assert [(times[1], "Dr. A"), (times[1], "Dr. B")] == sorted(
+            (a["appointment_date_time"], manager.provider_of(a)) for a in manager.get_appointments()
+        )
+        with pytest.raises(ValueError):
+            test_util.make_manager(providers=("Dr. A", "Dr. A"))
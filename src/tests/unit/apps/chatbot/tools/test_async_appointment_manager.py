@@ -0,0 +1,81 @@
+"""
+Unit tests for the "async_appointment_manager" module using Hypothesis for property-based testing.
+https://hypothesis.readthedocs.io/en/latest/
+"""
+
+import asyncio
+from typing import Any
+
+from hypothesis import given, settings
+
+from apps.chatbot.tools.async_appointment_manager import AsyncAppointmentManager
+from tests.common.hypothesis.appointments import appointment_dicts_lists
+from tests.unit.apps.chatbot.tools.test_appointment_manager import AppointmentManagerTestUtil, _work_hours
+
+# pylint: disable=unused-variable,missing-function-docstring
+
+
+class TestAsyncAppointmentManager:
+    """Class to test the async appointment manager."""
+
+    @settings(max_examples=20)
+    @given(appointment_dicts_lists().filter(lambda lst: len(lst) > 1))
+    def test_concurrent_bookings_and_reads_match_the_manager(self, apmt_dicts: list[dict[str, Any]]):
+        test_util = AppointmentManagerTestUtil()
+        manager = test_util.make_manager(start_empty=True)
+        amanager = AsyncAppointmentManager(manager)
+
+        async def book_all() -> list[tuple[str, str]]:
+            # Every appointment is booked twice at once, but each slot is only booked once.
+            bookings = [
+                amanager.acreate_appointment(d["patient_name"], d["appointment_date_time"], d["reason"])
+                for d in apmt_dicts + apmt_dicts
+            ]
+            return await asyncio.gather(*bookings)
+
+        async def check(ids: list[str]):
+            assert (await amanager.acancel_appointment(ids[0]))[0]
+            after = apmt_dicts[1]["appointment_date_time"]
+            patient_name = apmt_dicts[1]["patient_name"]
+            counts, appointments, by_name, one = await asyncio.gather(
+                amanager.aget_appointments_count(),
+                amanager.aget_appointments(),
+                amanager.aget_appointments(patient_name=patient_name, after_date_time=after),
+                amanager.aget_appointment_by_id(ids[1]),
+            )
+            assert manager.get_appointments_count() == counts
+            assert [dict(a) for a in manager.get_appointments()] == appointments
+            expected = manager.get_appointments(patient_name=patient_name, after_date_time=after)
+            assert [dict(a) for a in expected] == by_name
+            assert dict(manager.get_appointment_by_id(ids[1])) == one
+
+        results = asyncio.run(book_all())
+        ids = [a_id for a_id, _msg in results if a_id]
+        assert len(apmt_dicts) == len(ids)
+        asyncio.run(check(ids))
+        amanager.close()
+
+    def test_retried_bookings_are_idempotent_and_reads_filter_by_provider(self):
+        test_util = AppointmentManagerTestUtil()
+        manager = test_util.make_manager(start_empty=True, providers=["Dr. A", "Dr. B"])
+        amanager = AsyncAppointmentManager(manager)
+        times = _work_hours(2)
+
+        async def run() -> tuple[list[tuple[str, str]], list[Any], list[Any]]:
+            # A request and its retry, made at the same time, book one appointment.
+            bookings = await asyncio.gather(
+                *(amanager.acreate_appointment("Jane Doe", times[0], "checkup", idempotency_key="r1") for _ in range(2))
+            )
+            await amanager.acreate_appointment("John Doe", times[1], "checkup", provider="Dr. B")
+            return (
+                bookings,
+                await amanager.aget_appointments(provider="Dr. A"),
+                await amanager.aget_appointments(provider="Dr. B"),
+            )
+
+        bookings, dr_a, dr_b = asyncio.run(run())
+        assert bookings[0][0] and bookings[0][0] == bookings[1][0]
+        assert 2 == manager.get_appointments_count()
+        assert [bookings[0][0]] == [appointment["id"] for appointment in dr_a]
+        assert ["John Doe"] == [appointment["patient_name"] for appointment in dr_b]
+        amanager.close()
@@ -0,0 +1,108 @@
+"""
+Unit tests for the "change_feed" module using Hypothesis for property-based testing.
+https://hypothesis.readthedocs.io/en/latest/
+"""
+
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from hypothesis import given
+from hypothesis import strategies as st
+
+from apps.chatbot.tools.change_feed import CHANGE, CREATE, REMOVE, ChangeFeed
+
+# pylint: disable=unused-variable,missing-function-docstring
+
+
+class TestChangeFeed:
+    """Class to test the change feed."""
+
+    @given(st.integers(min_value=1, max_value=20), st.integers(min_value=0, max_value=40), st.integers(1, 7))
+    def test_reading_in_batches_returns_every_kept_event_once_in_order(self, max_events: int, count: int, limit: int):
+        feed = ChangeFeed(max_events)
+        cursor = feed.latest_cursor()
+        for i in range(count):
+            feed.publish(CREATE, str(i), {"id": str(i)})
+        assert count == feed.last_seq
+
+        events, next_cursor, reset = feed.read(cursor, limit)
+        assert reset == (count > max_events)
+        if reset:
+            # Start over from the returned cursor, which only sees the later events.
+            assert not events
+            cursor = next_cursor
+            feed.publish(REMOVE, "0", None)
+            count += 1
+            events, next_cursor, reset = feed.read(cursor, limit)
+            assert not reset
+            assert [count] == [event.seq for event in events]
+            return
+        seqs = []
+        while events:
+            seqs.extend(event.seq for event in events)
+            assert len(events) <= limit
+            events, next_cursor, reset = feed.read(next_cursor, limit)
+            assert not reset
+        assert list(range(1, count + 1)) == seqs
+
+    def test_cursors_from_other_feeds_and_resets_require_starting_over(self):
+        feed = ChangeFeed()
+        other = ChangeFeed()
+        other.publish(CREATE, "a", {"id": "a"})
+        assert ([], feed.latest_cursor(), True) == feed.read(other.latest_cursor())
+        assert feed.read("not a cursor")[2]
+
+        feed.publish(CREATE, "a", {"id": "a"})
+        cursor = feed.latest_cursor()
+        feed.reset()
+        events, new_cursor, reset = feed.read(cursor)
+        assert reset and not events
+        feed.publish(CHANGE, "a", {"id": "a"})
+        events, _cursor, reset = feed.read(new_cursor)
+        assert not reset
+        assert [(2, CHANGE)] == [(event.seq, event.kind) for event in events]
+
+    def test_events_copy_the_resource(self):
+        feed = ChangeFeed()
+        cursor = feed.latest_cursor()
+        resource = {"id": "a", "status": "scheduled"}
+        feed.publish(CREATE, "a", resource)
+        resource["status"] = "cancelled"
+        events, _cursor, _reset = feed.read(cursor)
+        assert events[0].resource is not None
+        assert "scheduled" == events[0].resource["status"]
+        assert "scheduled" == events[0].to_dict()["resource"]["status"]
+
+    def test_a_waiting_reader_wakes_up_for_a_new_event(self):
+        feed = ChangeFeed()
+        cursor = feed.latest_cursor()
+        timer = threading.Timer(0.05, feed.publish, (CREATE, "a", {"id": "a"}))
+        timer.start()
+        events, _cursor, _reset = feed.read(cursor, timeout=10.0)
+        timer.join()
+        assert ["a"] == [event.resource_id for event in events]
+
+    def test_more_async_readers_than_executor_threads_all_wake_up_for_a_new_event(self):
+        feed = ChangeFeed()
+        cursor = feed.latest_cursor()
+
+        async def run():
+            # A waiting reader mustn't hold one of the default executor's threads.
+            loop = asyncio.get_running_loop()
+            loop.set_default_executor(ThreadPoolExecutor(max_workers=2))
+            readers = [asyncio.create_task(feed.read_async(cursor, timeout=10.0)) for _ in range(50)]
+            await asyncio.sleep(0.05)
+            # The executor is still free, and the readers wake up when a thread publishes.
+            await asyncio.wait_for(asyncio.to_thread(feed.publish, CREATE, "a", {"id": "a"}), 5.0)
+            return await asyncio.wait_for(asyncio.gather(*readers), 5.0)
+
+        results = asyncio.run(run())
+        assert all(["a"] == [event.resource_id for event in events] for events, _cursor, _reset in results)
+        assert not feed._wakers  # pylint: disable=protected-access
+
+        async def read_idle():
+            return await feed.read_async(feed.latest_cursor(), timeout=0.05)
+
+        events, _cursor, reset = asyncio.run(read_idle())
+        assert not events and not reset
@@ -0,0 +1,89 @@
+"""
+Unit tests for the "interval_index" module using Hypothesis for property-based testing.
+https://hypothesis.readthedocs.io/en/latest/
+"""
+
+from datetime import UTC, datetime, timedelta
+
+from hypothesis import given
+from hypothesis import strategies as st
+
+from apps.chatbot.tools.interval_index import IntervalIndex
+
+# pylint: disable=unused-variable,missing-function-docstring
+
+_base = datetime(2030, 1, 1, tzinfo=UTC)
+# Intervals in minutes after `_base`, as (start, length) pairs.
+minute_intervals = st.tuples(st.integers(0, 600), st.integers(1, 120))
+intervals_by_id = st.dictionaries(st.text(min_size=1, max_size=4), minute_intervals, max_size=30)
+
+
+def _dt(minutes: int) -> datetime:
+    return _base + timedelta(minutes=minutes)
+
+
+def _index(intervals: dict[str, tuple[int, int]]) -> IntervalIndex:
+    index = IntervalIndex()
+    for interval_id, (start, length) in intervals.items():
+        index.add(interval_id, _dt(start), _dt(start + length))
+    return index
+
+
+class TestIntervalIndex:
+    """Class to test the interval index."""
+
+    @given(intervals_by_id, st.sets(st.text(min_size=1, max_size=4)), minute_intervals)
+    def test_overlapping_matches_a_scan(
+        self, intervals: dict[str, tuple[int, int]], discards: set[str], window: tuple[int, int]
+    ):
+        index = _index(intervals)
+        for interval_id in discards:
+            index.discard(interval_id)
+        kept = {interval_id: iv for interval_id, iv in intervals.items() if interval_id not in discards}
+        assert len(kept) == len(index)
+        low, high = window[0], window[0] + window[1]
+        expected = {interval_id for interval_id, (s, n) in kept.items() if s < high and s + n > low}
+        found = [interval_id for interval_id, _start, _end in index.overlapping(_dt(low), _dt(high))]
+        assert expected == set(found)
+        assert bool(expected) == index.overlaps(_dt(low), _dt(high))
+        starts = [kept[interval_id][0] for interval_id in found]
+        assert sorted(starts) == starts
+
+    @given(intervals_by_id, minute_intervals, st.integers(0, 60))
+    def test_gaps_are_the_free_minutes(
+        self, intervals: dict[str, tuple[int, int]], window: tuple[int, int], min_length: int
+    ):
+        index = _index(intervals)
+        low, high = window[0], window[0] + window[1]
+        busy = {m for s, n in intervals.values() for m in range(s, s + n)}
+        free_minutes = set()
+        for free_start, free_end in index.gaps(_dt(low), _dt(high), timedelta(minutes=min_length)):
+            assert free_end - free_start >= timedelta(minutes=min_length)
+            free_minutes.update(
+                range((free_start - _base) // timedelta(minutes=1), (free_end - _base) // timedelta(minutes=1))
+            )
+        assert not free_minutes & busy
+        # Every run of free minutes long enough is returned.
+        run: list[int] = []
+        for m in [*range(low, high), None]:
+            if m is not None and m not in busy:
+                run.append(m)
+                continue
+            if run and len(run) >= max(min_length, 1):
+                assert set(run) <= free_minutes
+            run = []
+
+    @given(intervals_by_id, minute_intervals, st.integers(1, 60), st.integers(1, 30))
+    def test_free_starts_are_the_grid_times_where_the_length_fits(
+        self, intervals: dict[str, tuple[int, int]], window: tuple[int, int], length: int, step: int
+    ):
+        index = _index(intervals)
+        low, high = window[0], window[0] + window[1]
+        busy = {m for s, n in intervals.values() for m in range(s, s + n)}
+        expected = [
+            _dt(m)
+            for m in range(0, high, step)
+            if m >= low and m + length <= high and busy.isdisjoint(range(m, m + length))
+        ]
+        one = timedelta(minutes=1)
+        assert expected == list(index.free_starts(_dt(low), _dt(high), length * one, step * one, _base))
@@ -0,0 +1,56 @@
+"""
+Unit tests for the "resource_indexes" module using Hypothesis for property-based testing.
+https://hypothesis.readthedocs.io/en/latest/
+"""
+
+from collections import Counter
+from datetime import UTC, datetime, timedelta
+
+import pytest
+from hypothesis import given
+from hypothesis import strategies as st
+
+from apps.chatbot.tools.resource_indexes import ResourceIndexes
+
+# pylint: disable=unused-variable,missing-function-docstring
+
+_base = datetime(2030, 1, 1, tzinfo=UTC)
+# Resources by id: a status, a name sharing trigrams with the others, and whether they are active.
+resources = st.dictionaries(
+    st.text(min_size=1, max_size=4),
+    st.tuples(
+        st.sampled_from(["scheduled", "cancelled"]),
+        st.sampled_from(["Jane Doe", "Jane M. Doe", "John Doe"]),
+        st.booleans(),
+    ),
+    max_size=20,
+)
+
+
+class TestResourceIndexes:
+    """Class to test the resource indexes."""
+
+    @given(resources, st.sets(st.text(min_size=1, max_size=4)))
+    def test_the_indexes_match_the_resources(self, added: dict[str, tuple[str, str, bool]], discards: set[str]):
+        indexes = ResourceIndexes({"status": "hash", "name": "trigram"})
+        for i, (resource_id, (status, name, active)) in enumerate(added.items()):
+            resource = {"id": resource_id, "status": status, "name": name, "when": _base + timedelta(minutes=i)}
+            indexes.add(resource, active, "when")
+        for resource_id in discards:
+            indexes.discard(resource_id)
+        kept = {resource_id: r for resource_id, r in added.items() if resource_id not in discards}
+        active_ids = {resource_id for resource_id, r in kept.items() if r[2]}
+        assert active_ids == indexes.active_ids
+        assert len(active_ids) == len(indexes.slots)
+        assert Counter(r[0] for r in kept.values() if r[2]) == indexes.counts("status")
+        found = {name for name, _similarity in indexes.similar_values("name", "jane doe", threshold=0.0, limit=5)}
+        assert found == {r[1] for r in kept.values() if r[2]}
+        indexes.clear()
+        assert not indexes.active_ids and not indexes.counts("status") and indexes.built
+
+    def test_counting_or_searching_a_field_needs_the_right_kind_of_index(self):
+        indexes = ResourceIndexes({"status": "hash", "when": "sorted"})
+        with pytest.raises(TypeError):
+            indexes.counts("when")
+        with pytest.raises(TypeError):
+            indexes.similar_values("status", "scheduled")
@@ -0,0 +1,142 @@
+"""
+Unit tests for the declarative predicates, indexes, and query planner.
+Uses Hypothesis.
+"""
+
+from typing import Any
+
+from hypothesis import given
+from hypothesis import strategies as st
+
+from apps.chatbot.tools.resource_query import (
+    Eq,
+    HashIndex,
+    In,
+    Prefix,
+    Range,
+    Similar,
+    SortedIndex,
+    TrigramIndex,
+    plan_query,
+    trigram_similarity,
+)
+
+# pylint: disable=unused-variable,missing-function-docstring
+
+small_ints = st.integers(min_value=0, max_value=20)
+values_by_id = st.dictionaries(st.text(min_size=1, max_size=5), small_ints, max_size=30)
+names = st.sampled_from(
+    ["John Doe", "john  doe", "John Q. Doe", "Jane Doe", "Doe, John", "José Díaz", "Jose Diaz", "-", " - ", "'", ""]
+)
+names_by_id = st.dictionaries(st.text(min_size=1, max_size=5), names, max_size=30)
+predicates = st.one_of(
+    small_ints.map(Eq),
+    st.lists(small_ints, max_size=4).map(lambda vs: In(tuple(vs))),
+    st.tuples(
+        st.one_of(st.none(), small_ints),
+        st.one_of(st.none(), small_ints),
+        st.booleans(),
+        st.booleans(),
+    ).map(lambda t: Range(*t)),
+)
+
+
+def _index(index: Any, values: dict[str, Any]) -> Any:
+    for resource_id, value in values.items():
+        index.add(resource_id, value)
+    return index
+
+
+class TestResourceQuery:
+    """Test the predicates, indexes, and planner."""
+
+    @given(values_by_id, predicates)
+    def test_hash_index_candidates_match_a_scan(self, values: dict[str, int], predicate: Any):
+        index = _index(HashIndex(), values)
+        expected = {rid for rid, value in values.items() if predicate(value)}
+        if isinstance(predicate, Range):
+            assert index.estimate(predicate) is None
+        else:
+            assert len(expected) == index.estimate(predicate)
+            assert expected == set(index.candidates(predicate))
+
+    @given(values_by_id, predicates.filter(lambda p: not isinstance(p, In)))
+    def test_sorted_index_candidates_match_a_scan_and_are_ordered(self, values: dict[str, int], predicate: Any):
+        index = _index(SortedIndex(), values)
+        expected = {rid for rid, value in values.items() if predicate(value)}
+        candidates = list(index.candidates(predicate))
+        assert len(expected) == index.estimate(predicate)
+        assert expected == set(candidates)
+        ordered = [values[rid] for rid in candidates]
+        assert sorted(ordered) == ordered
+
+    @given(st.dictionaries(st.text(min_size=1, max_size=5), st.text(max_size=5), max_size=30), st.text(max_size=2))
+    def test_sorted_index_answers_prefix_predicates(self, values: dict[str, str], prefix: str):
+        index = _index(SortedIndex(), values)
+        expected = {rid for rid, value in values.items() if value.startswith(prefix)}
+        assert expected == set(index.candidates(Prefix(prefix)))
+
+    @given(values_by_id, st.sets(st.text(min_size=1, max_size=5)))
+    def test_indexes_forget_discarded_ids(self, values: dict[str, int], discards: set[str]):
+        for index in (HashIndex(), SortedIndex()):
+            _index(index, values)
+            for rid in discards:
+                index.discard(rid)
+            expected = {rid for rid in values if rid not in discards}
+            assert expected == set(index.candidates(Range() if isinstance(index, SortedIndex) else In(range(21))))
+
+    @given(names_by_id, st.sets(st.text(min_size=1, max_size=5)), names, st.sampled_from([0.3, 0.5, 1.0]))
+    def test_trigram_index_candidates_match_a_scan(
+        self, values: dict[str, str], discards: set[str], text: str, threshold: float
+    ):
+        index = _index(TrigramIndex(), values)
+        for rid in discards:
+            index.discard(rid)
+        kept = {rid: value for rid, value in values.items() if rid not in discards}
+        predicate = Similar(text, threshold)
+        expected = {rid for rid, value in kept.items() if predicate(value)}
+        assert len(expected) == index.estimate(predicate)
+        assert expected == set(index.candidates(predicate))
+        assert {rid for rid, value in kept.items() if value == text} == set(index.candidates(Eq(text)))
+        ranked = index.search(text, threshold)
+        assert {kept[rid] for rid in expected} == {value for value, _ in ranked}
+        assert sorted(ranked, key=lambda match: -match[1]) == ranked
+
+    def test_trigram_similarity_ignores_case_accents_punctuation_and_word_order(self):
+        assert 1.0 == trigram_similarity("John Doe", "  john DOE ")
+        assert 1.0 == trigram_similarity("Doe, John", "John Doe")
+        assert 1.0 == trigram_similarity("José Díaz", "Jose Diaz")
+        assert 0.5 < trigram_similarity("John Q. Doe", "John Doe") < 1.0
+        assert trigram_similarity("John Doe", "Jane Doe") < trigram_similarity("John Q. Doe", "John Doe")
+        assert 0.0 == trigram_similarity("", "John Doe")
+
+    def test_texts_without_trigrams_only_match_the_same_text(self):
+        assert 1.0 == trigram_similarity("-", " - ")
+        assert 0.0 == trigram_similarity("-", "'")
+        assert 0.0 == trigram_similarity("-", "John Doe")
+        assert 0.0 == trigram_similarity("", "")
+        index = _index(TrigramIndex(), {"1": "-", "2": " - ", "3": "'", "4": "John Doe", "5": ""})
+        assert [(" - ", 1.0), ("-", 1.0)] == index.search("-")
+        assert {"1", "2"} == set(index.candidates(Similar("-", 1.0)))
+        assert [] == index.search("")
+        index.discard("3")
+        assert [] == index.search("'")
+
+    def test_plan_query_picks_the_most_selective_index(self):
+        names = _index(HashIndex(), {"1": "a", "2": "a", "3": "b"})
+        times = _index(SortedIndex(), {"1": 10, "2": 20, "3": 30})
+        indexes = {"name": names, "time": times}
+
+        plan = plan_query({"name": Eq("a"), "time": Range(low=25)}, indexes)
+        assert "time" == plan.index_field
+        assert "time" == plan.ordered_by
+        assert ["3"] == list(plan.candidate_ids or [])
+
+        plan = plan_query({"name": Eq("b"), "time": Range(low=0)}, indexes)
+        assert "name" == plan.index_field
+        assert "" == plan.ordered_by
+
+    def test_plan_query_falls_back_to_a_scan_for_callables(self):
+        indexes = {"name": _index(HashIndex(), {"1": "a"})}
+        plan = plan_query({"name": lambda name: name == "a", "other": Eq(1)}, indexes)
+        assert plan.candidate_ids is None
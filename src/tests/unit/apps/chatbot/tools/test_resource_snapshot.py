@@ -0,0 +1,77 @@
+"""
+Unit tests for the "resource_snapshot" module using Hypothesis for property-based testing.
+https://hypothesis.readthedocs.io/en/latest/
+"""
+
+import tempfile
+from pathlib import Path
+from typing import Any
+
+from hypothesis import given
+from hypothesis import strategies as st
+
+from apps.chatbot.tools.resource_snapshot import SnapshotFile
+from common.file_persistent_storage import FilePersistentStorage
+
+# pylint: disable=unused-variable,missing-function-docstring
+
+records = st.lists(st.fixed_dictionaries({"name": st.text(max_size=8)}), min_size=1, max_size=10)
+
+
+class TestSnapshotFile:
+    """Class to test the snapshot file."""
+
+    @given(records, records, st.booleans())
+    def test_load_returns_the_saved_resources_and_the_later_records(
+        self, saved: list[dict[str, Any]], later: list[dict[str, Any]], background: bool
+    ):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            storage = FilePersistentStorage(Path(temp_dir) / "records.jsonl")
+            resources = {str(i): {"id": str(i)} | r for i, r in enumerate(saved)}
+            storage.save(list(resources.values()))
+            snapshots = SnapshotFile(storage, 1, "kind")
+            snapshots.writes_since_save = len(resources)
+            assert snapshots.due
+            assert snapshots.save(dict(resources), background=background)
+            assert not snapshots.due
+            snapshots.wait()
+            assert not snapshots.saving
+            assert 1 == snapshots.saves
+            storage.save([{"id": f"later-{i}"} | r for i, r in enumerate(later)])
+
+            reopened = FilePersistentStorage(Path(temp_dir) / "records.jsonl")
+            assert SnapshotFile(reopened, 1, "other kind").load() is None
+            loaded = SnapshotFile(reopened, 1, "kind").load()
+            assert loaded is not None
+            assert resources == loaded[0]
+            assert {f"later-{i}" for i in range(len(later))} == set(loaded[1][0])
+
+    def test_a_missing_or_corrupt_snapshot_is_ignored(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            snapshots = SnapshotFile(FilePersistentStorage(Path(temp_dir) / "records.jsonl"), 0, "kind")
+            assert not snapshots.due
+            assert snapshots.load() is None
+            snapshots.path.write_bytes(b"not a pickle")
+            assert snapshots.load() is None
+            snapshots.remove()
+            assert not snapshots.path.exists()
+
+    @given(records)
+    def test_invalidate_drops_the_snapshots_saved_since_and_any_background_save(self, saved: list[dict[str, Any]]):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            storage = FilePersistentStorage(Path(temp_dir) / "records.jsonl")
+            resources = {str(i): {"id": str(i)} | r for i, r in enumerate(saved)}
+            storage.save(list(resources.values()))
+            snapshots = SnapshotFile(storage, 1, "kind")
+            assert snapshots.save(resources)
+            snapshots.invalidate(snapshots.saves)
+            assert snapshots.path.exists()
+            snapshots.invalidate(snapshots.saves - 1)
+            assert not snapshots.path.exists()
+
+            saves = snapshots.saves
+            assert snapshots.save(dict(resources), background=True)
+            snapshots.invalidate(saves)
+            snapshots.wait()
+            assert not snapshots.path.exists()
+            assert not list(Path(temp_dir).glob("*.tmp"))
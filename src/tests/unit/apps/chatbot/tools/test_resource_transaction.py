@@ -0,0 +1,71 @@
+"""
+Unit tests for the "resource_transaction" module using Hypothesis for property-based testing.
+https://hypothesis.readthedocs.io/en/latest/
+"""
+
+import copy
+from collections.abc import MutableMapping
+from typing import Any
+
+import pytest
+from hypothesis import given
+from hypothesis import strategies as st
+
+from apps.chatbot.tools.resource_transaction import Transaction, UndoLog
+
+# pylint: disable=unused-variable,missing-function-docstring
+
+fields = st.dictionaries(st.sampled_from(["a", "b", "c"]), st.integers(), max_size=3)
+
+
+class TestResourceTransaction:
+    """Class to test transactions and the undo log."""
+
+    @given(
+        st.dictionaries(st.sampled_from(["1", "2", "3"]), fields, max_size=3),
+        st.lists(st.tuples(st.sampled_from(["1", "2", "3", "new"]), fields), max_size=6),
+    )
+    def test_undo_restores_the_resources_and_the_index(
+        self, resources: dict[str, dict[str, Any]], changes: list[tuple[str, dict[str, Any]]]
+    ):
+        live: dict[str, MutableMapping[str, Any]] = {
+            resource_id: {"id": resource_id} | r for resource_id, r in resources.items()
+        }
+        original = copy.deepcopy(live)
+        indexed = {resource_id: dict(r) for resource_id, r in live.items()}
+
+        def index(resource: MutableMapping[str, Any]):
+            indexed[resource["id"]] = dict(resource)
+
+        def unindex(resource: MutableMapping[str, Any]):
+            del indexed[resource["id"]]
+
+        undone = []
+        undo = UndoLog(index, unindex, lambda: undone.append(True))
+        for resource_id, update in changes:
+            if resource_id in live:
+                undo.update(live[resource_id], update)
+            else:
+                undo.create(live, {"id": resource_id} | update)
+            assert live == indexed
+        assert {resource_id for resource_id, _ in changes} == set(undo.changed)
+        undo.undo(live)
+        assert original == live == indexed
+        assert not undo.changed
+        # Only called if there was something to undo.
+        assert [True] * bool(changes) == undone
+        undo.undo(live)
+        assert len(undone) <= 1
+
+    def test_a_transaction_can_only_be_committed_once(self):
+        committed: list[Transaction] = []
+
+        def commit(transaction: Transaction) -> tuple[list[str], str]:
+            committed.append(transaction)
+            return [change.resource_id or "new" for change in transaction.changes], ""
+
+        transaction = Transaction(commit).update("1", {"a": 1}).create({"b": 2}, idempotency_key="k")
+        assert (["1", "new"], "") == transaction.commit()
+        assert [transaction] == committed
+        with pytest.raises(ValueError):
+            transaction.commit()
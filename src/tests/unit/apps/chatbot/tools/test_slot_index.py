@@ -0,0 +1,59 @@
+"""
+Unit tests for the "slot_index" module using Hypothesis for property-based testing.
+https://hypothesis.readthedocs.io/en/latest/
+"""
+
+from datetime import UTC, datetime, timedelta
+
+from hypothesis import given
+from hypothesis import strategies as st
+
+from apps.chatbot.tools.slot_index import SlotIndex
+
+# pylint: disable=unused-variable,missing-function-docstring
+
+_base = datetime(2030, 1, 1, tzinfo=UTC)
+# Datetimes as milliseconds after `_base`, in one of two scopes, by id.
+reservations = st.dictionaries(
+    st.text(min_size=1, max_size=4), st.tuples(st.integers(0, 5_000), st.sampled_from(["", "Dr. A"])), max_size=30
+)
+
+
+def _dt(millis: int) -> datetime:
+    return _base + timedelta(milliseconds=millis)
+
+
+class TestSlotIndex:
+    """Class to test the slot index."""
+
+    @given(
+        reservations, st.sets(st.text(min_size=1, max_size=4)), st.integers(0, 5_000), st.sampled_from(["", "Dr. A"])
+    )
+    def test_is_reserved_matches_a_scan(
+        self, reserved: dict[str, tuple[int, str]], discards: set[str], millis: int, scope: str
+    ):
+        index = SlotIndex()
+        for resource_id, (at, at_scope) in reserved.items():
+            index.add(resource_id, _dt(at), at_scope)
+        for resource_id in discards:
+            index.discard(resource_id)
+        kept = {resource_id: r for resource_id, r in reserved.items() if resource_id not in discards}
+        assert len(kept) == len(index)
+        assert {resource_id: r[1] for resource_id, r in kept.items()} == {
+            resource_id: index.scope_of(resource_id) for resource_id in reserved if resource_id not in discards
+        }
+        expected = any(at_scope == scope and abs(at - millis) < 1_000 for at, at_scope in kept.values())
+        assert expected == index.is_reserved(_dt(millis), scope)
+
+    def test_resources_without_datetimes_are_unslotted(self):
+        index = SlotIndex()
+        index.add("a", None)
+        index.add("b", _base)
+        assert {"a"} == index.unslotted_ids
+        assert index.scope_of("a") is None
+        assert "" == index.scope_of("b")
+        index.add("a", _base + timedelta(seconds=5))
+        assert not index.unslotted_ids
+        index.clear()
+        assert 0 == len(index)
+        assert not index.is_reserved(_base)
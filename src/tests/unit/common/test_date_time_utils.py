@@ -10,15 +10,18 @@ from hypothesis import given
 from hypothesis import strategies as st
 
 from common.date_time_utils import (
+    _FormatDispatch,
     add_timezone,
     datetimes_approx_equal,
     friendly_date_formats,
     friendly_date_time_formats,
+    friendly_time_formats,
     is_week_day,
     now,
     one_second,
     string_to_date,
     string_to_datetime,
+    string_to_time,
 )
 from tests.common.hypothesis.datetimes import (
     check_date_to_str_and_back,
@@ -113,3 +116,52 @@ def test_string_to_date_can_parse_iso_formatted_strings(d):
     actual, error = string_to_date(d_iso)
     assert d == actual, f"d: {d}"
     assert "" == error
+
+
+def _first_match(dt_str: str, formats: list[str]) -> datetime | None:
+    """What parsing returned before the formats were dispatched by shape: ISO or the first format that matches."""
+    dt_str = dt_str.strip()
+    try:
+        return add_timezone(datetime.fromisoformat(dt_str))
+    except ValueError:
+        pass
+    for fmt in formats:
+        try:
+            return add_timezone(datetime.strptime(dt_str, fmt))
+        except ValueError:
+            pass
+    return None
+
+
+@given(
+    local_datetimes_2000(),
+    st.sampled_from(friendly_date_time_formats + friendly_date_formats + friendly_time_formats),
+    st.sampled_from(["", " ", "Z", "+05:30", " utc", " PM", "T10", "x"]),
+)
+def test_string_parsing_finds_the_same_first_format_as_trying_every_format(dt: datetime, fmt: str, suffix: str):
+    dt_str = dt.strftime(fmt) + suffix
+    for parse, formats, extract in [
+        (string_to_datetime, friendly_date_time_formats, lambda x: x),
+        (string_to_date, friendly_date_formats, lambda x: x.date()),
+        (string_to_time, friendly_time_formats, lambda x: x.time()),
+    ]:
+        # Parse twice, so the second parse uses the learned format.
+        for _ in range(2):
+            expected = _first_match(dt_str, formats)
+            actual, error = parse(dt_str)
+            assert (extract(expected) if expected else None) == actual, f"{dt_str!r} with {fmt!r}"
+            assert bool(error) == (expected is None)
+
+
+def test_format_dispatch_learns_the_formats_that_matched():
+    dispatch = _FormatDispatch(friendly_date_formats, max_learned=2)
+    candidates, fingerprint = dispatch.candidates("Mon Jan 05 2030")
+    assert ["%A %B %d %Y", "%A %b %d %Y", "%a %B %d %Y", "%a %b %d %Y"] == candidates
+    dispatch.learn(fingerprint, "%a %b %d %Y")
+    assert "%a %b %d %Y" == dispatch.candidates("Fri Feb 08 2030")[0][0]
+    assert "%A %B %d %Y" == dispatch.candidates("Friday February 08 2030")[0][0]
+    dispatch.learn("a", "%x")
+    dispatch.learn("b", "%x")
+    assert "%A %B %d %Y" == dispatch.candidates("Fri Feb 08 2030")[0][0]
+    # Shapes that no format can match have no candidates.
+    assert ([], "") == dispatch.candidates("next Tuesday at noon!")
@@ -5,18 +5,32 @@ https://hypothesis.readthedocs.io/en/latest/
 
 import os
 import tempfile
+import threading
 from datetime import datetime
 from typing import Any
 
+import pytest
 from hypothesis import given
 from hypothesis import strategies as st
 
-from common.file_persistent_storage import FilePersistentStorage
+from common.file_persistent_storage import Durability, FilePersistentStorage
+from common.jsonl_offset_index import LazyRecords
 from tests.common.hypothesis.datetimes import local_datetimes_2000
 
 # pylint: disable=unused-variable,missing-function-docstring
 
 
+class FailingStorage(FilePersistentStorage):
+    """Storage whose writes fail while `failing` is True."""
+
+    failing = False
+
+    def _write_lines(self, lines):
+        if self.failing:
+            raise OSError("disk full")
+        super()._write_lines(lines)
+
+
 class TestFilePersistentStorageUtil:
     """Class to test file persistent storage."""
 
@@ -97,3 +111,247 @@ class TestFilePersistentStorageUtil:
         lst2, errors = tool.load()
         assert not lst2, f"list2: {lst2}"
         assert 0 == len(errors), str(errors)
+
+    @given(
+        st.lists(
+            st.tuples(st.sampled_from(["a", "b", "c", "d"]), st.integers(), st.booleans()),
+            min_size=0,
+            max_size=20,
+        )
+    )
+    def test_replay_keeps_the_last_version_of_each_record_and_drops_removed_ids(self, ops: list[tuple[str, int, bool]]):
+        """
+        Check that replaying a log of saves and removes matches applying the same
+        operations to a dictionary.
+        """
+        tool, _ = self.init()
+        expected: dict[str, dict[str, Any]] = {}
+        for record_id, value, is_remove in ops:
+            if is_remove:
+                tool.remove([record_id])
+                expected.pop(record_id, None)
+            else:
+                record = {"id": record_id, "value": value}
+                tool.save([record])
+                expected[record_id] = record
+
+        records, errors = tool.replay()
+        assert 0 == len(errors), str(errors)
+        assert sorted(expected.values(), key=lambda r: r["id"]) == sorted(records, key=lambda r: r["id"])
+        assert len(ops) == tool.record_count
+        assert len(expected) == tool.live_record_count
+
+    @given(
+        st.lists(
+            st.tuples(st.sampled_from(["a", "b", "c", "d"]), st.integers(), st.booleans()),
+            min_size=0,
+            max_size=20,
+        )
+    )
+    def test_compact_rewrites_the_file_with_just_the_live_records(self, ops: list[tuple[str, int, bool]]):
+        tool, _ = self.init()
+        for record_id, value, is_remove in ops:
+            if is_remove:
+                tool.remove([record_id])
+            else:
+                tool.save([{"id": record_id, "value": value}])
+        before, _errors = tool.replay()
+
+        count = tool.compact()
+        after, errors = tool.replay()
+        raw, _errors = tool.load()
+        assert before == after
+        assert 0 == len(errors), str(errors)
+        assert len(after) == count == len(raw) == tool.record_count
+
+    def test_compaction_is_triggered_when_enough_records_are_superseded(self):
+        _, temp_file = self.init()
+        tool = FilePersistentStorage(temp_file.name, compaction_ratio=0.5, compaction_min_records=10)
+        for i in range(9):
+            tool.save([{"id": "same", "value": i}])
+        assert 9 == tool.record_count
+        tool.save([{"id": "same", "value": 9}])
+        assert 1 == tool.record_count
+        records, _errors = tool.load()
+        assert [{"id": "same", "value": 9}] == records
+
+    def test_a_save_after_compacting_a_file_with_bad_lines_does_not_compact_again(self):
+        _, temp_file = self.init()
+        with open(temp_file.name, "w", encoding="utf-8") as f:
+            f.writelines([f"bad line {i}\n" for i in range(20)] + [f'{{"id": "r{i}"}}\n' for i in range(10)])
+        tool = FilePersistentStorage(temp_file.name, compaction_ratio=0.5, compaction_min_records=10)
+        tool.replay()
+        for i in range(10):
+            tool.save([{"id": "r0", "value": i}])
+        assert 10 == tool.record_count == tool.live_record_count
+        assert not tool.needs_compaction()
+        inode = os.stat(temp_file.name).st_ino
+        tool.save([{"id": "new"}])
+        assert inode == os.stat(temp_file.name).st_ino
+        records, errors = tool.replay()
+        assert 11 == len(records) == tool.record_count
+        assert 20 == len(errors)
+
+    def test_background_compaction_keeps_records_written_during_the_compaction(self):
+        _, temp_file = self.init()
+        tool = FilePersistentStorage(
+            temp_file.name, compaction_ratio=0.5, compaction_min_records=10, background_compaction=True
+        )
+        for i in range(10):
+            tool.save([{"id": "same", "value": i}])
+        tool.save([{"id": "other", "value": 0}])
+        tool.wait_for_compaction()
+        records, _errors = tool.replay()
+        assert [{"id": "same", "value": 9}, {"id": "other", "value": 0}] == records
+
+    @given(st.sampled_from(list(Durability)))
+    def test_every_durability_level_writes_the_records(self, durability: Durability):
+        _, temp_file = self.init()
+        tool = FilePersistentStorage(temp_file.name, durability=durability)
+        records = [{"id": str(i), "value": i} for i in range(5)]
+        assert 5 == tool.save(records)
+        tool.flush()
+        reopened = FilePersistentStorage(temp_file.name)
+        assert records == reopened.replay()[0]
+        tool.close()
+
+    def test_group_commit_coalesces_concurrent_saves(self):
+        _, temp_file = self.init()
+        tool = FilePersistentStorage(temp_file.name, group_commit=True, durability=Durability.FSYNC_BATCH, queue_size=4)
+
+        def writer(n: int):
+            for i in range(50):
+                tool.save([{"id": f"{n}-{i}", "value": i}])
+
+        threads = [threading.Thread(target=writer, args=(n,)) for n in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        tool.flush()
+        records, errors = FilePersistentStorage(temp_file.name).replay()
+        assert 0 == len(errors), str(errors)
+        assert 200 == len(records) == tool.record_count
+        for n in range(4):
+            values = [r["value"] for r in records if r["id"].startswith(f"{n}-")]
+            assert list(range(50)) == values
+        tool.close()
+
+    def test_group_commit_write_errors_are_raised_by_the_failed_save(self):
+        _, temp_file = self.init()
+        tool = FailingStorage(temp_file.name, group_commit=True)
+        tool.failing = True
+        with pytest.raises(OSError, match="disk full"):
+            tool.save([{"id": "a", "value": 1}])
+        tool.failing = False
+        assert 1 == tool.save([{"id": "b", "value": 2}])
+        tool.flush()
+        assert [{"id": "b", "value": 2}] == FilePersistentStorage(temp_file.name).replay()[0]
+        assert 1 == tool.record_count
+
+        # Saves that don't wait for the writer get the error from `flush()`.
+        tool.durability = Durability.NONE
+        tool.failing = True
+        assert 1 == tool.save([{"id": "c", "value": 3}])
+        with pytest.raises(OSError, match="disk full"):
+            tool.flush()
+        tool.close()
+
+    def test_group_commit_reads_and_rewrites_see_queued_records(self):
+        _, temp_file = self.init()
+        tool = FilePersistentStorage(temp_file.name, group_commit=True)
+        tool.save([{"id": "a", "value": 1}])
+        tool.remove(["a"])
+        tool.save([{"id": "b", "value": 2}])
+        assert [{"id": "b", "value": 2}] == tool.replay()[0]
+        tool.rewrite([{"id": "c", "value": 3}])
+        tool.save([{"id": "d", "value": 4}])
+        tool.close()
+        assert [{"id": "c", "value": 3}, {"id": "d", "value": 4}] == FilePersistentStorage(temp_file.name).load()[0]
+
+    @given(
+        st.lists(
+            st.tuples(st.sampled_from(["a", "b", "c", "d"]), st.integers(), st.booleans()),
+            min_size=0,
+            max_size=20,
+        )
+    )
+    def test_replay_by_id_matches_replay(self, ops: list[tuple[str, int, bool]]):
+        tool, _ = self.init()
+        for record_id, value, is_remove in ops:
+            if is_remove:
+                tool.remove([record_id])
+            else:
+                tool.save([{"id": record_id, "value": value}])
+        tool.save([{"value": "no id"}])
+        expected, _errors = tool.replay()
+        for _i in range(2):  # The second time, the sidecar index is used.
+            by_id, anonymous, errors = tool.replay_by_id()
+            assert 0 == len(errors), str(errors)
+            assert expected == list(by_id.values()) + anonymous
+            assert len(ops) + 1 == tool.record_count
+
+    def test_replay_by_id_decodes_records_on_demand(self):
+        tool, _ = self.init()
+        tool.save([{"id": str(i), "value": i} for i in range(10)])
+        tool.save([{"id": "3", "value": -3}])
+        by_id, _anonymous, _errors = tool.replay_by_id(keep=lambda record: record["value"] != 5)
+        assert isinstance(by_id, LazyRecords)
+        assert 0 == by_id.decoded_count
+        assert {"id": "3", "value": -3} == by_id["3"]
+        assert 1 == by_id.decoded_count
+        assert "5" not in by_id
+        assert 9 == len(by_id)
+
+        # A stale sidecar index is rebuilt.
+        tool.save([{"id": "3", "value": 3}])
+        by_id, _anonymous, _errors = tool.replay_by_id()
+        assert {"id": "3", "value": 3} == by_id["3"]
+
+    def test_tail_returns_the_changes_made_by_other_writers(self):
+        _, temp_file = self.init()
+        tool = FilePersistentStorage(temp_file.name, cross_process=True)
+        other = FilePersistentStorage(temp_file.name, cross_process=True)
+        tool.save([{"id": "a", "value": 1}, {"id": "b", "value": 1}])
+        assert 2 == len(tool.replay()[0])
+        assert ({}, set(), []) == tool.tail()
+
+        other.save([{"id": "a", "value": 2}, {"id": "c", "value": 1}])
+        other.remove(["b", "c"])
+        tool.save([{"id": "d", "value": 1}])  # Not caught up, so this is in the tail, too.
+        changes = tool.tail()
+        assert changes is not None
+        saved, removed, errors = changes
+        assert {"a": {"id": "a", "value": 2}, "d": {"id": "d", "value": 1}} == saved
+        assert {"b", "c"} == removed
+        assert 0 == len(errors)
+
+        # Caught up, so its own writes aren't in the tail.
+        tool.save([{"id": "e", "value": 1}])
+        assert ({}, set(), []) == tool.tail()
+
+        # After another writer replaces the file, everything must be read again.
+        assert 0 < other.compact()
+        assert tool.tail() is None
+        assert {"a", "d", "e"} == {r["id"] for r in tool.replay()[0]}
+        tool.close()
+        other.close()
+
+    def test_resume_from_a_checkpoint_reads_just_the_later_records(self):
+        _, temp_file = self.init()
+        tool = FilePersistentStorage(temp_file.name)
+        tool.save([{"id": "a", "value": 1}, {"id": "b", "value": 1}])
+        checkpoint = tool.checkpoint()
+        tool.save([{"id": "a", "value": 2}])
+        tool.remove(["b"])
+
+        restarted = FilePersistentStorage(temp_file.name)
+        assert restarted.resume(checkpoint)
+        assert ({"a": {"id": "a", "value": 2}}, {"b"}, []) == restarted.tail()
+        assert tool.record_count == restarted.record_count
+        assert tool.live_record_count == restarted.live_record_count
+
+        # After compaction, the checkpoint no longer describes the file.
+        assert 0 < tool.compact()
+        assert not FilePersistentStorage(temp_file.name).resume(checkpoint)
+        assert not FilePersistentStorage(temp_file.name).resume({"offset": 1})
@@ -11,16 +11,24 @@ from datetime import datetime, timedelta
 from json.decoder import JSONDecodeError
 from typing import Any
 
+import pytest
 from hypothesis import given
 from hypothesis import strategies as st
 
 from common.date_time_utils import now
 from common.json_yaml import (
+    DatetimeEncoder,
+    LazyDatetime,
     decode_json_dict,
     decode_json_list,
+    decode_json_record,
     encode_json,
     extract_jsonl_list,
     from_json,
+    get_json_backend,
+    json_backend_names,
+    parse_json,
+    set_json_backend,
 )
 from common.utils import ExpectedFail
 from tests.common.hypothesis.datetimes import local_datetimes_2000
@@ -368,6 +376,27 @@ def test_extract_jsonl_list_handles_invalid_jsonl_all_on_one_line(
         do_test_extract_jsonl_list(delim + ",", count, question, label, prescription, body_part, timestamp)
 
 
+@given(local_datetimes_2000(), local_datetimes_2000())
+def test_decode_json_record_leaves_the_schema_datetimes_unparsed(start: datetime, created: datetime):
+    record = {"id": "1", "start": start, "created": created, "note": "x"}
+    text = encode_json(record)
+    lazy = decode_json_record(text, {"start", "created"})
+    assert LazyDatetime(created.isoformat()) == lazy["created"]
+    assert created == lazy["created"].to_datetime()
+    assert start == lazy["start"].to_datetime()
+    # Unparsed datetimes are encoded again as they were.
+    assert text == encode_json(lazy)
+    assert record == decode_json_record(text)
+
+    # Records with other objects, which may have datetimes, are decoded as usual.
+    assert record == decode_json_record(text, {"created"})
+    nested = encode_json({**record, "history": [{"at": start}]})
+    assert {**record, "history": [{"at": start}]} == decode_json_record(nested, {"start", "created"})
+    for bad in ["{", "[]", '"created"']:
+        with pytest.raises(ValueError):
+            decode_json_record(bad, {"created"})
+
+
 def test_from_json():
     d = {
         "one": 1,
@@ -403,3 +432,62 @@ def test_from_json():
     efje(lambda: from_json("]", ["ignored"]))
     efje(lambda: from_json("{", ["ignored"]))
     efje(lambda: from_json("}", ["ignored"]))
+
+
+# JSON values with encoded datetimes, as the records in the stores have, and the values
+# that orjson can't handle, e.g., big integers and infinite floats.
+json_values = st.recursive(
+    st.none() | st.booleans() | st.integers() | st.floats(allow_nan=False) | st.text() | local_datetimes_2000(),
+    lambda children: st.lists(children, max_size=4) | st.dictionaries(st.text(max_size=5), children, max_size=4),
+    max_leaves=10,
+)
+
+
+class TestJsonBackends:
+    """Test that every JSON backend gives the same results as the stdlib."""
+
+    @given(st.dictionaries(st.text(max_size=5), json_values, max_size=5))
+    def test_backends_read_and_write_the_same_records(self, record: dict[str, Any]):
+        stdlib_text = json.dumps(record, cls=DatetimeEncoder)
+        for name in json_backend_names():
+            previous = set_json_backend(name)
+            try:
+                assert name == get_json_backend().name
+                text = encode_json(record)
+                assert text.isascii()
+                assert json.loads(stdlib_text) == json.loads(text)
+                assert record == decode_json_dict(text) == decode_json_dict(stdlib_text)
+                assert [record] == decode_json_list(encode_json([record]))
+                assert json.loads(stdlib_text) == parse_json(stdlib_text) == parse_json(stdlib_text.encode())
+            finally:
+                set_json_backend(previous.name)
+
+    @pytest.mark.parametrize("name", json_backend_names())
+    def test_backends_fall_back_to_the_stdlib_for_what_they_cannot_handle(self, name: str):
+        previous = set_json_backend(name)
+        try:
+            record: dict[Any, Any] = {"big": 2**80, "text": "caf\u00e9 \U0001f600", 1: [datetime(2030, 1, 2, 3, 4)]}
+            text = encode_json(record)
+            assert json.dumps({"big": 2**80, "text": "caf\u00e9 \U0001f600"})[:-1] in text
+            assert 2**80 == json.loads(text)["big"]
+            assert {"text": "caf\u00e9 \U0001f600", "1": [datetime(2030, 1, 2, 3, 4)]} == {
+                key: value for key, value in decode_json_dict(text).items() if key != "big"
+            }
+            assert {"n": float("inf")} == decode_json_dict('{"n": Infinity}')
+            assert '{"n": -Infinity, "m": null}' == encode_json({"n": float("-inf"), "m": None})
+            assert {"small": -(2**63) - 1} == decode_json_dict('{"small": -9223372036854775809}')
+            assert [-(2**63) - 1] == parse_json(b"[-9223372036854775809]")
+            with pytest.raises(TypeError):
+                encode_json({"when": datetime(2030, 1, 2).date()})
+            for bad in ["{", "[1]", b"{}", None]:
+                with pytest.raises(ValueError):
+                    decode_json_dict(bad)
+            with pytest.raises(JSONDecodeError):
+                from_json("{", ["ignored"])
+        finally:
+            set_json_backend(previous.name)
+
+    def test_unknown_backends_are_rejected(self):
+        with pytest.raises(ValueError):
+            set_json_backend("simplejson")
+        assert "json" in json_backend_names()
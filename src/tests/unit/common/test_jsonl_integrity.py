@@ -0,0 +1,123 @@
+"""
+Unit tests for the "jsonl_integrity" module using Hypothesis for property-based testing.
+https://hypothesis.readthedocs.io/en/latest/
+"""
+
+import tempfile
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from hypothesis import given, settings
+from hypothesis import strategies as st
+
+from common.file_persistent_storage import FilePersistentStorage
+from common.jsonl_integrity import CheckOptions, check_store, format_report, repair_store
+
+# pylint: disable=unused-variable,missing-function-docstring
+
+START = datetime(2030, 1, 7, 9)
+
+
+def appointment(record_id: str, hour: int, provider: str = "", status: str = "scheduled", created: int = 0) -> dict:
+    return {
+        "id": record_id,
+        "appointment_date_time": START + timedelta(hours=hour),
+        "provider": provider,
+        "status": status,
+        "created_at": START - timedelta(days=created + 1),
+    }
+
+
+# The operations on a store: save a version of an id, remove an id, or write a malformed line.
+operations = st.lists(
+    st.one_of(
+        st.tuples(st.just("save"), st.integers(0, 5), st.integers(0, 20)),
+        st.tuples(st.just("remove"), st.integers(0, 5), st.just(0)),
+        st.tuples(st.just("malformed"), st.just(0), st.just(0)),
+    ),
+    max_size=30,
+)
+
+
+class TestJsonlIntegrity:
+    """Class to test the JSONL store integrity checker."""
+
+    @staticmethod
+    def write_store(directory: str, ops: list[tuple[str, int, int]]) -> FilePersistentStorage:
+        storage = FilePersistentStorage(Path(directory) / "store.jsonl")
+        for op, index, hour in ops:
+            if op == "save":
+                storage.save([appointment(f"id{index}", hour, provider=f"p{index % 2}")])
+            elif op == "remove":
+                storage.remove([f"id{index}"])
+            else:
+                with open(storage.storage_path, "a") as f:  # pylint: disable=unspecified-encoding
+                    f.write("{not json\n")
+        storage.flush()
+        return storage
+
+    @settings(max_examples=50, deadline=None)
+    @given(operations, st.integers(min_value=1, max_value=300))
+    def test_chunked_checks_and_repairs_match_replay(self, ops: list[tuple[str, int, int]], chunk_bytes: int):
+        with tempfile.TemporaryDirectory() as directory:
+            storage = self.write_store(directory, ops)
+            replayed, errors = storage.replay()
+            report = check_store(storage.storage_path, workers=1, chunk_bytes=chunk_bytes)
+            assert len(errors) == len(report.malformed)
+            assert len(replayed) == report.live
+            assert len(ops) == report.lines
+            assert sum(op == "remove" for op, _, _ in ops) == report.tombstones
+            assert report.records - report.live == report.superseded
+            # All versions of an id have the same creation time, so there are no duplicates.
+            assert not report.duplicate_ids
+
+            output = Path(directory) / "repaired.jsonl"
+            written, rejected = repair_store(report, output)
+            assert (len(replayed), len(errors)) == (written, rejected)
+            repaired, repaired_errors = FilePersistentStorage(output).replay()
+            assert replayed == repaired
+            assert not repaired_errors
+
+    def test_reports_duplicates_conflicts_and_rejects_bad_lines(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = Path(directory) / "store.jsonl"
+            storage = FilePersistentStorage(path)
+            storage.save(
+                [
+                    appointment("a", 1, "p1"),
+                    appointment("b", 1, "p1"),
+                    appointment("c", 1, "p2"),
+                    appointment("d", 1, "p1", status="cancelled"),
+                    appointment("e", 2, ""),
+                    appointment("f", 2, "p1"),
+                    {"patient_name": "No Id"},
+                ]
+            )
+            storage.save([appointment("a", 1, "p1", created=3), appointment("g", 5), appointment("g", 6)])
+            storage.remove(["g"])
+            storage.save([appointment("g", 7, created=9)])
+            storage.flush()
+            with open(path, "a") as f:  # pylint: disable=unspecified-encoding
+                f.write("[1, 2]\n")
+
+            for workers, chunk_bytes in [(1, 1 << 20), (1, 100), (2, 100)]:
+                report = check_store(path, workers=workers, chunk_bytes=chunk_bytes)
+                assert [("a", 8)] == report.duplicate_ids
+                assert [7] == report.anonymous
+                assert [13] == [line for line, _text in report.malformed]
+                assert [("p1", (START + timedelta(hours=1)).isoformat(), ["b", "a"])] == report.slot_conflicts
+                assert (7, 12, 1) == (report.live, report.records, report.tombstones)
+                assert not report.ok
+                assert "Duplicate ids" in format_report(report)
+
+            # Records without a provider belong to the default scope.
+            report = check_store(path, CheckOptions(default_scope="p1"), workers=1)
+            assert ["b", "a"] == report.slot_conflicts[0][2]
+            assert ["e", "f"] == report.slot_conflicts[1][2]
+
+            written, rejected = repair_store(report, path)
+            assert (7, 2) == (written, rejected)
+            assert 2 == len(path.with_name("store.jsonl.rejected").read_text().splitlines())
+            report = check_store(path, CheckOptions(created_key="", slot_key=""), workers=1)
+            assert report.ok
+            assert (7, 0) == (report.records, report.superseded)
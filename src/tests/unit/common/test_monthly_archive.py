@@ -0,0 +1,68 @@
+"""
+Unit tests for the "monthly_archive" module using Hypothesis for property-based testing.
+https://hypothesis.readthedocs.io/en/latest/
+"""
+
+import tempfile
+from datetime import UTC, datetime
+from pathlib import Path
+from typing import Any
+
+import pytest
+from hypothesis import given
+from hypothesis import strategies as st
+
+from common.monthly_archive import MonthlyArchive
+from common.persistent_storage import open_storage
+from tests.common.hypothesis.datetimes import local_datetimes_2000
+
+# pylint: disable=unused-variable,missing-function-docstring
+
+
+class TestMonthlyArchive:
+    """Class to test the monthly archive."""
+
+    @given(st.lists(local_datetimes_2000(), min_size=1, max_size=20), st.data())
+    def test_read_returns_each_archived_record_in_the_range_once(self, dts: list[datetime], data: st.DataObject):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            archive = MonthlyArchive(temp_dir, "when")
+            records: list[dict[str, Any]] = [{"id": str(i), "when": dt} for i, dt in enumerate(dts)]
+            assert len(records) == archive.append(records)
+            # Archiving a record again, e.g., after a crash, doesn't duplicate it.
+            assert 1 == archive.append(records[:1] + [{"id": "x"}])
+            assert sorted({(dt.astimezone(UTC).year, dt.astimezone(UTC).month) for dt in dts}) == archive.months()
+
+            low, high = sorted(data.draw(st.sampled_from(dts)) for _ in range(2))
+            expected = sorted(r["id"] for r in records if low <= r["when"] <= high)
+            assert expected == sorted(r["id"] for r in archive.read(low, high))
+            assert [r["when"] for r in records] == [
+                r["when"] for r in sorted(archive.read(), key=lambda r: int(r["id"]))
+            ]
+
+    def test_reading_a_file_with_an_unknown_suffix_raises_a_value_error(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            archive = MonthlyArchive(temp_dir, "when")
+            archive.append([{"id": "1", "when": datetime(2024, 5, 1, tzinfo=UTC)}])
+            path = Path(temp_dir) / "2024-05.jsonl.bz2"
+            path.write_bytes(b"")
+            assert [(2024, 5)] == archive.months()
+            with pytest.raises(ValueError, match="isn't an archive file"):
+                next(archive._read_file(path))  # pylint: disable=protected-access
+
+    @pytest.mark.parametrize("file_name", ["records.jsonl", "records.db"])
+    @given(st.lists(local_datetimes_2000(), min_size=1, max_size=20), st.data())
+    def test_move_from_moves_the_old_records_out_of_the_storage(
+        self, file_name: str, dts: list[datetime], data: st.DataObject
+    ):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            storage = open_storage(Path(temp_dir) / file_name, indexed_fields=["when"])
+            records: list[dict[str, Any]] = [{"id": str(i), "when": dt} for i, dt in enumerate(dts)]
+            storage.save(records)
+            archive = MonthlyArchive(Path(temp_dir) / "archive", "when")
+            before = data.draw(st.sampled_from(dts))
+            old_ids = {r["id"] for r in records if r["when"] < before}
+            assert old_ids == {r["id"] for r in archive.move_from(storage, before)}
+            assert old_ids == {r["id"] for r in archive.read()}
+            remaining, errors = storage.replay()
+            assert not errors
+            assert {r["id"] for r in records} - old_ids == {r["id"] for r in remaining}
@@ -0,0 +1,81 @@
+"""
+Unit tests for the "partitioned_persistent_storage" module using Hypothesis for property-based testing.
+https://hypothesis.readthedocs.io/en/latest/
+"""
+
+import tempfile
+from datetime import UTC, datetime
+from typing import Any
+
+import pytest
+from hypothesis import given
+from hypothesis import strategies as st
+
+from common.partitioned_persistent_storage import WRITE_STAMP_KEY, PartitionedPersistentStorage
+from tests.common.hypothesis.datetimes import local_datetimes_2000
+
+# pylint: disable=unused-variable,missing-function-docstring,protected-access
+
+
+class TestPartitionedPersistentStorage:
+    """Class to test partitioned persistent storage."""
+
+    @given(
+        st.lists(
+            st.tuples(st.sampled_from(["save", "remove"]), st.integers(0, 5), st.none() | local_datetimes_2000()),
+            max_size=30,
+        ),
+        st.data(),
+    )
+    def test_replay_and_load_range_match_the_live_records(
+        self, ops: list[tuple[str, int, datetime | None]], data: st.DataObject
+    ):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            storage = PartitionedPersistentStorage(temp_dir, partition_key="when")
+            expected: dict[str, dict[str, Any]] = {}
+            for op, i, dt in ops:
+                if op == "save":
+                    record = {"id": str(i), "when": dt} if dt else {"id": str(i)}
+                    storage.save([record])
+                    expected[str(i)] = record
+                else:
+                    storage.remove([str(i)])
+                    expected.pop(str(i), None)
+            assert expected == {r["id"]: r for r in storage.replay()[0]}
+
+            # Reopened, the records are in the partitions for their months.
+            reopened = PartitionedPersistentStorage(temp_dir, partition_key="when")
+            assert expected == {r["id"]: r for r in reopened.replay()[0]}
+            for record in expected.values():
+                name = reopened.partition_name(record.get("when"))
+                stored = reopened._partitions[name].replay()[0]
+                assert record in [{k: v for k, v in r.items() if k != WRITE_STAMP_KEY} for r in stored]
+
+            dts = [r["when"] for r in expected.values() if "when" in r]
+            if dts:
+                low, high = sorted(data.draw(st.sampled_from(dts)) for _ in range(2))
+                in_range = sorted(
+                    (r for r in expected.values() if low <= r.get("when", low) <= high and "when" in r),
+                    key=lambda r: r["when"],
+                )
+                assert [r["when"] for r in in_range] == [r["when"] for r in reopened.load_range("when", low, high)[0]]
+                names = reopened.partition_names(low, high)
+                assert all(reopened.partition_name(low) <= name <= reopened.partition_name(high) for name in names)
+
+    def test_a_crash_while_moving_a_record_back_doesnt_undo_the_move(self, monkeypatch: pytest.MonkeyPatch):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            storage = PartitionedPersistentStorage(temp_dir, partition_key="when")
+            may, march = datetime(2030, 5, 1, tzinfo=UTC), datetime(2030, 3, 1, tzinfo=UTC)
+            storage.save([{"id": "a", "when": may}])
+            # Simulate a crash after the moved version is written, before the tombstone is.
+            monkeypatch.setattr(storage._partitions["2030-05"], "remove", lambda ids: 0)
+            storage.save([{"id": "a", "when": march}])
+            storage.close()
+
+            reopened = PartitionedPersistentStorage(temp_dir, partition_key="when")
+            assert [{"id": "a", "when": march}] == reopened.replay()[0]
+            assert [{"id": "a", "when": march}] == reopened.load_range("when")[0]
+            # The stale version was removed, so it doesn't come back when the record is removed.
+            reopened.remove(["a"])
+            reopened.close()
+            assert not PartitionedPersistentStorage(temp_dir, partition_key="when").replay()[0]
@@ -0,0 +1,173 @@
+"""
+Unit tests for the SQLite persistent storage using Hypothesis for property-based testing.
+https://hypothesis.readthedocs.io/en/latest/
+"""
+
+import tempfile
+import threading
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any
+
+import pytest
+from hypothesis import given
+from hypothesis import strategies as st
+
+from common.file_persistent_storage import FilePersistentStorage
+from common.json_yaml import LazyDatetime
+from common.persistent_storage import copy_records, open_storage
+from common.sqlite_persistent_storage import SqlitePersistentStorage
+from tests.common.hypothesis.datetimes import local_datetimes_2000
+
+# pylint: disable=unused-variable,missing-function-docstring,consider-using-with
+
+operations = st.lists(
+    st.tuples(st.sampled_from(["a", "b", "c", "d"]), st.integers(), st.booleans()),
+    min_size=0,
+    max_size=20,
+)
+
+
+class TestSqlitePersistentStorage:
+    """Class to test SQLite persistent storage."""
+
+    def init(self, suffix: str = ".db") -> tuple[SqlitePersistentStorage, Any]:
+        """
+        Set up the test objects. We return the temporary directory,
+        so that it doesn't go out of scope and get deleted prematurely.
+        """
+        temp_dir = tempfile.TemporaryDirectory()
+        tool = SqlitePersistentStorage(Path(temp_dir.name) / f"records{suffix}", indexed_fields=["when", "value"])
+        return tool, temp_dir
+
+    def test_open_storage_picks_the_implementation_from_the_suffix(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            assert isinstance(open_storage(Path(temp_dir) / "a.sqlite"), SqlitePersistentStorage)
+            assert isinstance(open_storage(Path(temp_dir) / "a.jsonl"), FilePersistentStorage)
+
+    def test_open_storage_warns_about_options_sqlite_ignores(self, caplog: pytest.LogCaptureFixture):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            storage = open_storage(Path(temp_dir) / "a.db", cross_process=True, durability="fsync")
+            assert isinstance(storage, SqlitePersistentStorage)
+            assert "cross_process, durability" in caplog.text
+
+    @given(operations, local_datetimes_2000())
+    def test_replay_keeps_the_last_version_of_each_record_and_drops_removed_ids(
+        self, ops: list[tuple[str, int, bool]], dt: datetime
+    ):
+        tool, _temp_dir = self.init()
+        expected: dict[str, dict[str, Any]] = {}
+        for record_id, value, is_remove in ops:
+            if is_remove:
+                tool.remove([record_id])
+                expected.pop(record_id, None)
+            else:
+                record = {"id": record_id, "value": value, "when": dt}
+                tool.save([record])
+                expected[record_id] = record
+
+        records, errors = tool.replay()
+        assert 0 == len(errors), str(errors)
+        assert list(expected.values()) == list(records)
+        assert len(expected) == tool.record_count
+
+    @given(st.lists(st.integers(min_value=0, max_value=100), max_size=20), st.integers(0, 100), st.integers(0, 100))
+    def test_load_range_returns_just_the_records_in_the_range_in_order(self, values: list[int], low: int, high: int):
+        tool, _temp_dir = self.init()
+        start = datetime(2026, 1, 1).astimezone()
+        tool.rewrite([{"id": str(i), "value": v, "when": start + timedelta(hours=v)} for i, v in enumerate(values)])
+        records, _errors = tool.load_range("when", start + timedelta(hours=low), start + timedelta(hours=high))
+        assert sorted(v for v in values if low <= v <= high) == [r["value"] for r in records]
+
+    def test_load_range_decodes_lazily_and_rejects_fields_without_columns(self):
+        tool, _temp_dir = self.init()
+        tool.lazy_datetime_keys = frozenset({"when"})
+        when = datetime(2026, 1, 1).astimezone()
+        tool.save([{"id": "a", "value": 1, "when": when}])
+        records, _errors = tool.load_range("value", 0, 2)
+        assert isinstance(records[0]["when"], LazyDatetime)
+        assert when == records[0]["when"].to_datetime()
+        with pytest.raises(ValueError, match="indexed fields"):
+            tool.load_range("other", 0, 2)
+
+    @given(operations)
+    def test_copy_records_round_trips_between_jsonl_and_sqlite(self, ops: list[tuple[str, int, bool]]):
+        tool, temp_dir = self.init()
+        jsonl = FilePersistentStorage(Path(temp_dir.name) / "records.jsonl", remove_old=True)
+        for record_id, value, is_remove in ops:
+            if is_remove:
+                jsonl.remove([record_id])
+            else:
+                jsonl.save([{"id": record_id, "value": value}])
+        expected, _errors = jsonl.replay()
+
+        count, errors = copy_records(jsonl, tool)
+        assert len(expected) == count
+        assert not errors
+        exported = FilePersistentStorage(Path(temp_dir.name) / "exported.jsonl", remove_old=True)
+        copy_records(tool, exported)
+        assert list(expected) == list(exported.replay()[0])
+
+    def test_new_indexed_fields_are_added_to_an_existing_database(self):
+        tool, _temp_dir = self.init()
+        tool.save([{"id": "a", "value": 1, "other": 5}, {"id": "b", "value": 2, "other": 3}])
+        tool.close()
+        tool2 = SqlitePersistentStorage(tool.storage_path, indexed_fields=["value", "other"])
+        records, _errors = tool2.load_range("other", 4, None)
+        assert ["a"] == [r["id"] for r in records]
+
+    def test_tail_returns_the_changes_made_by_other_writers(self):
+        tool, _temp_dir = self.init()
+        other = SqlitePersistentStorage(tool.storage_path, indexed_fields=["when", "value"])
+        assert tool.shared
+        assert tool.tail() is None  # Never read.
+        tool.save([{"id": "a", "value": 1}, {"id": "b", "value": 1}])
+        assert 2 == len(tool.replay()[0])
+        assert ({}, set(), []) == tool.tail()
+
+        other.save([{"id": "a", "value": 2}, {"id": "c", "value": 1}])
+        other.remove(["b", "c"])
+        tool.save([{"id": "d", "value": 1}])  # Not caught up, so this is in the tail, too.
+        changes = tool.tail()
+        assert changes is not None
+        saved, removed, errors = changes
+        assert {"a": {"id": "a", "value": 2}, "d": {"id": "d", "value": 1}} == saved
+        assert {"b", "c"} == removed
+        assert 0 == len(errors)
+
+        # Caught up, so its own writes aren't in the tail.
+        with tool.exclusive():
+            assert ({}, set(), []) == tool.tail()
+            tool.save([{"id": "e", "value": 1}])
+        assert ({}, set(), []) == tool.tail()
+
+        # After another writer replaces the records, everything must be read again.
+        other.rewrite(other.replay()[0])
+        assert tool.tail() is None
+        assert {"a", "d", "e"} == {r["id"] for r in tool.replay()[0]}
+        tool.close()
+        other.close()
+
+    def test_exclusive_blocks_other_writers_until_it_ends(self):
+        tool, _temp_dir = self.init()
+        other = SqlitePersistentStorage(tool.storage_path)
+        reader = SqlitePersistentStorage(tool.storage_path)
+        with tool.exclusive():
+            tool.save([{"id": "a", "value": 1}])
+            writer = threading.Thread(target=other.save, args=([{"id": "b", "value": 1}],))
+            writer.start()
+            writer.join(0.5)
+            assert writer.is_alive()
+            assert [] == reader.replay()[0]
+        writer.join(5)
+        assert not writer.is_alive()
+        assert ["a", "b"] == [r["id"] for r in other.replay()[0]]
+
+        # A failed exclusive block is rolled back.
+        with pytest.raises(RuntimeError), tool.exclusive():
+            tool.save([{"id": "c", "value": 1}])
+            raise RuntimeError("validation failed")
+        assert ["a", "b"] == [r["id"] for r in other.replay()[0]]
+        tool.close()
+        other.close()
+        reader.close()
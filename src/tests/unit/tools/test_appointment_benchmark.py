@@ -0,0 +1,40 @@
+"""
+Unit tests for the appointment storage and scheduling benchmark, with small sizes.
+"""
+
+import copy
+
+from apps.chatbot.tools.appointment_manager import AppointmentManager
+from tools.appointment_benchmark import SyntheticCalendar, compare_results, run_benchmarks
+
+# pylint: disable=unused-variable,missing-function-docstring
+
+
+class TestAppointmentBenchmark:
+    """Test the appointment benchmark."""
+
+    def test_synthetic_calendars_spread_appointments_across_providers(self):
+        calendar = SyntheticCalendar(5_000, seed=1)
+        assert 5_000 == len(calendar.appointments)
+        assert len(calendar.providers) > 1
+        booked = {(a["appointment_date_time"], a.get("provider", "")) for a in calendar.appointments}
+        assert len(booked) == len(calendar.appointments)
+        assert len({a["id"] for a in calendar.appointments}) == len(calendar.appointments)
+        assert calendar.free_future_pairs and not booked & set(calendar.free_future_pairs)
+        assert all(dt.weekday() < 5 and dt.hour in AppointmentManager.WORK_DAY_HOURS for dt, _provider in booked)
+
+    def test_results_cover_every_operation_and_compare_with_a_baseline(self):
+        results = run_benchmarks([200], operations=5, manager_options={"epoch_timestamps": True})
+        [result] = results["results"]
+        assert 200 == result["size"]
+        assert 5 == result["created"]
+        assert result["file_bytes"] > 0 and result["load_peak_bytes"] > 0
+        assert all(summary["count"] == 5 for summary in result["operations"].values())
+        assert [] == compare_results(results, results)
+
+        slower = copy.deepcopy(results)
+        slower["results"][0]["load_seconds"] *= 2
+        slower["results"][0]["operations"]["create_appointment"]["mean_us"] *= 2
+        regressions = compare_results(results, slower, tolerance=0.5)
+        assert 2 == len(regressions)
+        assert "load_seconds" in regressions[0] and "create_appointment" in regressions[1]
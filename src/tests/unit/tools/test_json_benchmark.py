@@ -0,0 +1,29 @@
+"""
+Unit tests for the JSON backend benchmark, with small datasets.
+"""
+
+import os
+from pathlib import Path
+
+from common.json_yaml import get_json_backend, json_backend_names
+from tools.json_benchmark import MEASURES, format_results, run_benchmarks
+
+# pylint: disable=unused-variable,missing-function-docstring
+
+
+class TestJsonBenchmark:
+    """Test the JSON backend benchmark."""
+
+    def test_every_backend_is_measured_on_every_dataset_without_mismatches(self):
+        data_file = Path(os.environ.get("TEST_DATA_DIR", "src/tests/data")) / "others-qna.jsonl"
+        backend = get_json_backend().name
+        results = run_benchmarks([200], [data_file], repeat=1)
+        assert backend == get_json_backend().name
+        assert json_backend_names() == results["settings"]["backends"]
+        assert ["appointments-200.jsonl", str(data_file)] == [result["dataset"] for result in results["results"]]
+        for result in results["results"]:
+            assert result["lines"] > 0
+            for name in json_backend_names():
+                assert set(MEASURES) == set(result["seconds"][name])
+                assert 0 == result["mismatches"][name]
+        assert "MISMATCHES" not in format_results(results)
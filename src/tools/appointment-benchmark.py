@@ -0,0 +1,91 @@
+"""Driver for the appointment benchmark."""
+
+import json
+import os
+import sys
+from pathlib import Path
+
+from common.utils import tool_setup
+from tools.appointment_benchmark import compare_results, format_results, run_benchmarks
+
+
+def main():
+
+    tool = os.path.basename(__file__)
+    description = "Benchmark loading, querying, and changing synthetic appointment stores of several sizes."
+
+    def add_args(parser):
+        parser.add_argument(
+            "-n",
+            "--sizes",
+            nargs="+",
+            type=int,
+            default=[1_000, 10_000, 100_000],
+            help="The numbers of synthetic appointments to benchmark, e.g., 1000 1000000. Default: 1000 10000 100000.",
+        )
+        parser.add_argument(
+            "--operations",
+            type=int,
+            default=100,
+            help="The number of calls timed for each operation. Default: 100.",
+        )
+        parser.add_argument("--seed", type=int, default=0, help="The seed for the synthetic data. Default: 0.")
+        parser.add_argument(
+            "--suffix",
+            default=".jsonl",
+            help="The store's file suffix, which chooses the storage, e.g., '.db' for SQLite. Default: .jsonl.",
+        )
+        parser.add_argument("--lazy-load", action="store_true", help="Load the stores lazily.")
+        parser.add_argument(
+            "--epoch-timestamps", action="store_true", help="Keep the timestamps in memory as epoch microseconds."
+        )
+        parser.add_argument(
+            "--lazy-timestamps", action="store_true", help="Parse the loaded timestamps when they are first read."
+        )
+        parser.add_argument("-r", "--results-file", default="", help="Where to write the results as JSON.")
+        parser.add_argument(
+            "-b",
+            "--baseline",
+            default="",
+            help="Earlier results to compare with. Exits with status 1 if any measure regressed.",
+        )
+        parser.add_argument(
+            "--tolerance",
+            type=float,
+            default=0.25,
+            help="The relative increase of a measure reported as a regression. Default: 0.25 (25%%).",
+        )
+
+    args, logger = tool_setup(
+        tool,
+        description,
+        add_arguments=add_args,
+        omit_arguments={"model", "service-url", "template-dir", "data-dir", "output-dir", "use-cases"},
+    )
+
+    manager_options = {
+        "lazy_load": args.lazy_load,
+        "epoch_timestamps": args.epoch_timestamps,
+        "lazy_timestamps": args.lazy_timestamps,
+    }
+    logger.info("Benchmarking sizes %s with manager options %s", args.sizes, manager_options)
+    results = run_benchmarks(args.sizes, args.operations, args.seed, manager_options, args.suffix)
+    print(format_results(results))
+    if args.results_file:
+        results_file = Path(args.results_file)
+        results_file.parent.mkdir(parents=True, exist_ok=True)
+        results_file.write_text(json.dumps(results, indent=2), encoding="utf-8")
+        print(f"Wrote the results to {results_file}.")
+    if args.baseline:
+        regressions = compare_results(
+            json.loads(Path(args.baseline).read_text(encoding="utf-8")), results, args.tolerance
+        )
+        for regression in regressions:
+            print(f"REGRESSION: {regression}")
+        if regressions:
+            sys.exit(1)
+        print(f"No regressions compared with {args.baseline}.")
+
+
+if __name__ == "__main__":
+    main()
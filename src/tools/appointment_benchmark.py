@@ -0,0 +1,347 @@
+"""
+A performance benchmark for `AppointmentManager` and its `ResourceManager` storage.
+
+For each size, e.g., 10^3 to 10^6 appointments, a synthetic store is written directly with
+the storage API, then the benchmark measures loading it, the peak memory of loading it,
+and the common operations: creating, finding, counting, changing, and cancelling
+appointments. The results are a JSON-compatible dictionary, so runs before and after a
+change, e.g., to the storage, can be saved and compared with `compare_results()`.
+
+The synthetic appointments span a year before and a year after the time of the run,
+on the hour in the work week. When there are more appointments than fit in one calendar,
+they are spread across enough providers, leaving some free slots for the creates.
+"""
+
+import logging
+import math
+import os
+import platform
+import random
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections.abc import Callable, Mapping, Sequence
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any
+from uuid import UUID
+
+from apps.chatbot.tools.appointment_manager import AppointmentManager
+from apps.chatbot.tools.resource_query import Range
+from common.date_time_utils import now
+from common.persistent_storage import open_storage
+
+# Too many of these warnings for variables that ARE used in other files.
+# pylint: disable=unused-variable
+
+# Bump when the results format changes, so comparisons with older results can be refused.
+RESULTS_VERSION = 1
+
+# The fraction of the slots in the synthetic calendars that are booked.
+BOOKED_FRACTION = 0.8
+
+# The measures compared by `compare_results()`, where larger values are regressions.
+COMPARED_MEASURES = ("load_seconds", "load_peak_bytes")
+
+_first_names = ("Ana", "Ben", "Chen", "Dara", "Eli", "Fatima", "Gus", "Hana", "Ivan", "Jo", "Kofi", "Lena")
+_last_names = ("Abe", "Brown", "Cruz", "Diaz", "Evans", "Fox", "Garcia", "Hill", "Ito", "Jones", "Kim", "Lopez")
+_reasons = ("checkup", "follow-up", "vaccination", "lab results", "consultation")
+
+
+def work_slots(start: datetime, end: datetime) -> list[datetime]:
+    """The valid appointment start times, on the hour, between `start` and `end`."""
+    slots = []
+    day = start.replace(hour=0, minute=0, second=0, microsecond=0)
+    while day < end:
+        if day.weekday() < 5 and (day.month, day.day) not in AppointmentManager.USA_HOLIDAYS:
+            hours = (day.replace(hour=hour) for hour in AppointmentManager.WORK_DAY_HOURS)
+            slots.extend(slot for slot in hours if start <= slot < end)
+        day += timedelta(days=1)
+    return slots
+
+
+class SyntheticCalendar:  # pylint: disable=too-few-public-methods
+    """
+    Synthetic appointments in the slots of one or more providers' calendars. The free
+    `(slot, provider)` pairs in the future are kept for the creates and changes.
+    """
+
+    def __init__(self, count: int, seed: int = 0, cancelled_fraction: float = 0.1):
+        """
+        Generate the appointments.
+
+        Args:
+            - count (int): The number of appointments.
+            - seed (int): The seed for the random choices, so runs use the same data.
+            - cancelled_fraction (float): The fraction of the appointments that are cancelled.
+        """
+        self.rng = random.Random(seed)
+        self.now = now()
+        self.slots = work_slots(self.now - timedelta(days=365), self.now + timedelta(days=365))
+        provider_count = max(1, math.ceil(count / (len(self.slots) * BOOKED_FRACTION)))
+        self.providers = [f"Provider {i}" for i in range(provider_count)] if provider_count > 1 else []
+        self.patient_names = [
+            f"{first} {last} {i}"
+            for i, (first, last) in enumerate(
+                (self.rng.choice(_first_names), self.rng.choice(_last_names)) for _ in range(max(1, count // 5))
+            )
+        ]
+        pair_count = len(self.slots) * provider_count
+        booked = self.rng.sample(range(pair_count), count)
+        booked_set = set(booked)
+        self.appointments = [self._appointment(pair, cancelled_fraction) for pair in booked]
+        self.free_future_pairs = [
+            self._pair(pair)
+            for pair in range(pair_count)
+            if pair not in booked_set and self.slots[pair // provider_count] > self.now + timedelta(days=1)
+        ]
+        self.rng.shuffle(self.free_future_pairs)
+
+    def _pair(self, pair: int) -> tuple[datetime, str]:
+        """The slot and provider for an index into all the `(slot, provider)` pairs."""
+        slot, provider = divmod(pair, max(1, len(self.providers)))
+        return self.slots[slot], self.providers[provider] if self.providers else ""
+
+    def _appointment(self, pair: int, cancelled_fraction: float) -> dict[str, Any]:
+        slot, provider = self._pair(pair)
+        appointment = AppointmentManager.make_appointment_dict(
+            slot, self.rng.choice(self.patient_names), self.rng.choice(_reasons), provider=provider
+        )
+        appointment["id"] = str(UUID(int=self.rng.getrandbits(128), version=4))
+        appointment["created_at"] = min(slot, self.now) - timedelta(days=self.rng.randint(1, 60))
+        if self.rng.random() < cancelled_fraction:
+            appointment["status"] = "cancelled"
+            appointment["cancelled_at"] = appointment["created_at"] + timedelta(hours=1)
+        return appointment
+
+    def write(self, path: Path, logger: logging.Logger | None = None):
+        """Replace the store at `path` with the appointments."""
+        storage = open_storage(path, logger, remove_old=True, indexed_fields=list(AppointmentManager.secondary_indexes))
+        storage.rewrite(self.appointments)
+        storage.flush()
+
+
+def _timings_summary(timings_ns: Sequence[int]) -> dict[str, Any]:
+    """The count, total, mean, median, and 95th percentile of the timings, in microseconds."""
+    ordered = sorted(timings_ns)
+    count = len(ordered)
+    if not count:
+        return {"count": 0}
+    return {
+        "count": count,
+        "total_seconds": sum(ordered) / 1e9,
+        "mean_us": sum(ordered) / count / 1e3,
+        "p50_us": ordered[count // 2] / 1e3,
+        "p95_us": ordered[min(count - 1, math.ceil(count * 0.95) - 1)] / 1e3,
+    }
+
+
+def _time_each(calls: Sequence[Callable[[], Any]]) -> dict[str, Any]:
+    """Call each function, timing the calls separately, and summarize the timings."""
+    timings = []
+    for call in calls:
+        start = time.perf_counter_ns()
+        call()
+        timings.append(time.perf_counter_ns() - start)
+    return _timings_summary(timings)
+
+
+def _peak_rss_bytes() -> int:
+    """The peak resident set size of this process, which `getrusage()` reports in KiB, except on macOS."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def benchmark_size(  # pylint: disable=too-many-locals
+    count: int,
+    work_dir: Path,
+    operations: int = 100,
+    seed: int = 0,
+    manager_options: Mapping[str, Any] | None = None,
+    suffix: str = ".jsonl",
+    logger: logging.Logger | None = None,
+) -> dict[str, Any]:
+    """
+    Benchmark a store with `count` synthetic appointments.
+
+    Args:
+        - count (int): The number of appointments in the store.
+        - work_dir (Path): The directory for the store, which is replaced.
+        - operations (int): The number of calls timed for each operation.
+        - seed (int): The seed for the synthetic data and the operations' arguments.
+        - manager_options (Mapping[str, Any] | None): Other `AppointmentManager` arguments, e.g., `lazy_load`.
+        - suffix (str): The store's file suffix, which chooses the storage, e.g., ".db" for SQLite.
+        - logger (logging.Logger | None): The manager's logger. By default, one that only logs warnings
+          and errors, so logging the operations doesn't distort their timings.
+
+    Returns:
+        A dictionary with the store's size, the load time, the peak memory allocated while
+        loading, and a summary of the timings of each operation. See `_timings_summary()`.
+    """
+    options = dict(manager_options or {})
+    if logger is None:
+        logger = logging.getLogger("AppointmentBenchmark")
+        logger.setLevel(logging.WARNING)
+    calendar = SyntheticCalendar(count, seed)
+    path = work_dir / f"appointments-{count}{suffix}"
+    calendar.write(path, logger)
+    rng = random.Random(seed + 1)
+
+    def load() -> AppointmentManager:
+        return AppointmentManager(path, logger=logger, providers=calendar.providers, **options)
+
+    start = time.perf_counter()
+    manager = load()
+    load_seconds = time.perf_counter() - start
+    # Measure the memory with a second load, since tracing slows the allocations down.
+    del manager
+    tracemalloc.start()
+    manager = load()
+    loaded_bytes, load_peak_bytes = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    free = calendar.free_future_pairs
+    creates = free[:operations]
+    moves = free[operations : 2 * operations]
+    created_ids: list[str] = []
+
+    def create(slot: datetime, provider: str) -> Callable[[], Any]:
+        return lambda: created_ids.append(
+            manager.create_appointment("Jane Doe", slot, "benchmark", provider=provider)[0]
+        )
+
+    names = [rng.choice(calendar.patient_names) for _ in range(operations)]
+    days = [rng.choice(calendar.slots).replace(hour=0) for _ in range(operations)]
+    results: dict[str, Any] = {
+        "create_appointment": _time_each([create(slot, provider) for slot, provider in creates]),
+        "get_appointments_by_patient": _time_each(
+            [lambda name=name: manager.get_appointments(patient_name=name) for name in names]
+        ),
+        "get_appointments_by_date_range": _time_each(
+            [
+                lambda day=day: manager.get_appointments_by_criteria(
+                    {"appointment_date_time": Range(low=day, high=day + timedelta(days=1))}
+                )
+                for day in days
+            ]
+        ),
+        "get_appointments_after": _time_each(
+            [lambda: manager.get_appointments(after_date_time=calendar.slots[-1] - timedelta(days=7))] * operations
+        ),
+        "get_appointments_count": _time_each([manager.get_appointments_count] * operations),
+        "find_available_slots": _time_each(
+            [lambda: manager.find_available_slots(calendar.now, calendar.now + timedelta(days=14))] * operations
+        ),
+    }
+    ids = [a_id for a_id in created_ids if a_id]
+    results["change_appointment"] = _time_each(
+        [
+            lambda a_id=a_id, slot=slot, provider=provider: manager.change_appointment(a_id, slot, provider)
+            for a_id, (slot, provider) in zip(ids, moves, strict=False)
+        ]
+    )
+    results["cancel_appointment"] = _time_each([lambda a_id=a_id: manager.cancel_appointment(a_id) for a_id in ids])
+    manager.storage.flush()
+    return {
+        "size": count,
+        "providers": len(calendar.providers) or 1,
+        "file_bytes": _storage_bytes(path),
+        "load_seconds": load_seconds,
+        "load_peak_bytes": load_peak_bytes,
+        "loaded_bytes": loaded_bytes,
+        "created": len(ids),
+        "operations": results,
+    }
+
+
+def _storage_bytes(path: Path) -> int:
+    """The size of a storage file, or of all the files in a partitioned storage directory."""
+    if path.is_dir():
+        return sum(f.stat().st_size for f in path.rglob("*") if f.is_file())
+    return path.stat().st_size if path.exists() else 0
+
+
+def run_benchmarks(
+    sizes: Sequence[int],
+    operations: int = 100,
+    seed: int = 0,
+    manager_options: Mapping[str, Any] | None = None,
+    suffix: str = ".jsonl",
+    logger: logging.Logger | None = None,
+) -> dict[str, Any]:
+    """
+    Run `benchmark_size()` for each size, in a temporary directory that is removed afterwards.
+
+    Returns:
+        A dictionary with the run's settings, platform information, and a list with the
+        results for each size, suitable for writing as JSON.
+    """
+    results = []
+    with tempfile.TemporaryDirectory() as work_dir:
+        for size in sizes:
+            results.append(benchmark_size(size, Path(work_dir), operations, seed, manager_options, suffix, logger))
+    return {
+        "benchmark": "appointments",
+        "version": RESULTS_VERSION,
+        "timestamp": now().isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "settings": {
+            "operations": operations,
+            "seed": seed,
+            "suffix": suffix,
+            "manager_options": {key: str(value) for key, value in (manager_options or {}).items()},
+        },
+        "peak_rss_bytes": _peak_rss_bytes(),
+        "results": results,
+    }
+
+
+def compare_results(baseline: Mapping[str, Any], current: Mapping[str, Any], tolerance: float = 0.25) -> list[str]:
+    """
+    Compare two runs of `run_benchmarks()`, for the sizes in both.
+
+    Args:
+        - baseline (Mapping[str, Any]): The earlier results.
+        - current (Mapping[str, Any]): The new results.
+        - tolerance (float): The relative increase of a measure that is reported, e.g., 0.25 for 25%.
+
+    Returns:
+        Messages for the load measures and operation mean times that increased by more than
+        the tolerance, which is empty if there are no regressions.
+    """
+    if baseline.get("version") != current.get("version"):
+        return ["The baseline results have a different format version, so they can't be compared."]
+    regressions = []
+    baseline_by_size = {result["size"]: result for result in baseline.get("results", [])}
+    for result in current.get("results", []):
+        old = baseline_by_size.get(result["size"])
+        if old is None:
+            continue
+        pairs = [(measure, old.get(measure), result.get(measure)) for measure in COMPARED_MEASURES]
+        pairs += [
+            (f"{name} mean_us", old["operations"].get(name, {}).get("mean_us"), summary.get("mean_us"))
+            for name, summary in result["operations"].items()
+        ]
+        for measure, before, after in pairs:
+            if before and after and after > before * (1 + tolerance):
+                regressions.append(
+                    f"size {result['size']}: {measure} increased {after / before - 1:.0%}, from {before:.6g} to {after:.6g}"
+                )
+    return regressions
+
+
+def format_results(results: Mapping[str, Any]) -> str:
+    """A plain-text table of the results, one row per size and measure."""
+    lines = [f"{'size':>9}  {'measure':<32} {'mean_us':>12} {'p95_us':>12}"]
+    for result in results["results"]:
+        size = result["size"]
+        lines.append(f"{size:>9}  {'load_seconds':<32} {result['load_seconds']:>12.3f}")
+        lines.append(f"{size:>9}  {'load_peak_mib':<32} {result['load_peak_bytes'] / 2**20:>12.1f}")
+        for name, summary in result["operations"].items():
+            if summary["count"]:
+                lines.append(f"{size:>9}  {name:<32} {summary['mean_us']:>12.1f} {summary['p95_us']:>12.1f}")
+    return "\n".join(lines)
@@ -0,0 +1,61 @@
+"""Driver for the JSON backend benchmark."""
+
+import json
+import os
+from pathlib import Path
+
+from common.json_yaml import json_backend_names
+from common.utils import tool_setup
+from tools.json_benchmark import format_results, run_benchmarks
+
+
+def main():
+
+    tool = os.path.basename(__file__)
+    description = (
+        "Compare the JSON backends, e.g., the stdlib json module and orjson, on synthetic appointment stores "
+        "and JSONL data files."
+    )
+
+    def add_args(parser):
+        parser.add_argument("files", nargs="*", help="JSONL data files to benchmark, e.g., the Q&A test data.")
+        parser.add_argument(
+            "-n",
+            "--sizes",
+            nargs="*",
+            type=int,
+            default=[10_000],
+            help="The numbers of appointments in the synthetic stores. Default: 10000.",
+        )
+        parser.add_argument(
+            "--backends",
+            nargs="+",
+            default=json_backend_names(),
+            choices=json_backend_names(),
+            help=f"The backends to compare, the first one being the reference. Default: {' '.join(json_backend_names())}.",
+        )
+        parser.add_argument(
+            "--repeat", type=int, default=5, help="The runs of each measure, of which the best is reported. Default: 5."
+        )
+        parser.add_argument("--seed", type=int, default=0, help="The seed for the synthetic data. Default: 0.")
+        parser.add_argument("-r", "--results-file", default="", help="Where to write the results as JSON.")
+
+    args, logger = tool_setup(
+        tool,
+        description,
+        add_arguments=add_args,
+        omit_arguments={"model", "service-url", "template-dir", "data-dir", "output-dir", "use-cases"},
+    )
+
+    logger.info("Benchmarking the JSON backends %s on sizes %s and files %s", args.backends, args.sizes, args.files)
+    results = run_benchmarks(args.sizes, [Path(f) for f in args.files], args.backends, args.repeat, args.seed, logger)
+    print(format_results(results))
+    if args.results_file:
+        results_file = Path(args.results_file)
+        results_file.parent.mkdir(parents=True, exist_ok=True)
+        results_file.write_text(json.dumps(results, indent=2), encoding="utf-8")
+        print(f"Wrote the results to {results_file}.")
+
+
+if __name__ == "__main__":
+    main()
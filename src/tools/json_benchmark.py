@@ -0,0 +1,199 @@
+"""
+A benchmark of the JSON backends in `common.json_yaml`, e.g., the stdlib `json` module and
+`orjson`, on JSONL datasets: synthetic appointment stores, written like the ones measured by
+`appointment_benchmark`, and data files like the Q&A test data and the unit benchmark datasets.
+
+For each dataset and backend, the benchmark measures the best of several runs of:
+
+- `parse`: `parse_json()` of each line, as in the compaction, offset index, and integrity scans.
+- `decode`: `decode_json_dict()` of each line, converting the datetimes, as in the data loaders.
+- `encode`: `encode_json()` of each decoded record, as in saving records.
+- `load`: `FilePersistentStorage.load()` of the whole file.
+
+Every backend must decode the same records and encode records that decode to the same
+records, so the results also report any lines where a backend differs from the stdlib.
+"""
+
+import logging
+import os
+import platform
+import shutil
+import tempfile
+import time
+from collections.abc import Callable, Mapping, Sequence
+from pathlib import Path
+from typing import Any
+
+from common.date_time_utils import now
+from common.file_persistent_storage import FilePersistentStorage
+from common.json_yaml import decode_json_dict, encode_json, json_backend_names, parse_json, set_json_backend
+from tools.appointment_benchmark import SyntheticCalendar
+
+# Too many of these warnings for variables that ARE used in other files.
+# pylint: disable=unused-variable
+
+# Bump when the results format changes.
+RESULTS_VERSION = 1
+
+# The measures, in the order they are reported.
+MEASURES = ("parse", "decode", "encode", "load")
+
+
+def _best_seconds(call: Callable[[], Any], repeat: int) -> float:
+    """The shortest time of `repeat` calls, which is the least affected by other activity."""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        call()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def _parse_or_none(line: bytes) -> Any:
+    try:
+        return parse_json(line)
+    except ValueError:
+        return None
+
+
+def _decode_lines(lines: Sequence[str]) -> list[Any]:
+    """Decode the lines, using `None` for the ones that aren't JSON objects."""
+    records = []
+    for line in lines:
+        try:
+            records.append(decode_json_dict(line))
+        except ValueError:
+            records.append(None)
+    return records
+
+
+def _measure(path: Path, lines: Sequence[str], records: Sequence[Any], repeat: int) -> dict[str, float]:
+    """The seconds of each measure with the current backend."""
+    byte_lines = [line.encode() for line in lines]
+    storage = FilePersistentStorage(path)
+    try:
+        return {
+            "parse": _best_seconds(lambda: [_parse_or_none(line) for line in byte_lines], repeat),
+            "decode": _best_seconds(lambda: _decode_lines(lines), repeat),
+            "encode": _best_seconds(lambda: [encode_json(record) for record in records], repeat),
+            "load": _best_seconds(storage.load, repeat),
+        }
+    finally:
+        storage.close()
+
+
+def benchmark_file(name: str, path: Path, backends: Sequence[str], repeat: int = 5) -> dict[str, Any]:
+    """
+    Measure each backend on the JSONL file.
+
+    Args:
+        - name (str): The dataset's name in the results.
+        - path (Path): The JSONL file, which is loaded with `FilePersistentStorage`, so use a copy.
+        - backends (Sequence[str]): The backends to measure. The first one is the reference for the mismatches.
+        - repeat (int): The number of runs of each measure, of which the best is reported.
+
+    Returns:
+        A dictionary with the dataset's size and the seconds of each measure for each backend.
+    """
+    lines = [line for line in path.read_text(encoding="utf-8").splitlines() if line.strip()]
+    seconds: dict[str, dict[str, float]] = {}
+    mismatches: dict[str, int] = {}
+    reference: list[Any] = []
+    previous = set_json_backend(backends[0])
+    try:
+        for backend in backends:
+            set_json_backend(backend)
+            records = _decode_lines(lines)
+            valid = [record for record in records if record is not None]
+            seconds[backend] = _measure(path, lines, valid, repeat)
+            if not reference:
+                reference = records
+            encoded = _decode_lines([encode_json(record) for record in valid])
+            mismatches[backend] = sum(a != b for a, b in zip(reference, records, strict=True)) + sum(
+                a != b for a, b in zip(valid, encoded, strict=True)
+            )
+    finally:
+        set_json_backend(previous.name)
+    return {
+        "dataset": name,
+        "lines": len(lines),
+        "bytes": path.stat().st_size,
+        "seconds": seconds,
+        "mismatches": mismatches,
+    }
+
+
+def run_benchmarks(
+    sizes: Sequence[int],
+    files: Sequence[Path] = (),
+    backends: Sequence[str] = (),
+    repeat: int = 5,
+    seed: int = 0,
+    logger: logging.Logger | None = None,
+) -> dict[str, Any]:
+    """
+    Run `benchmark_file()` for a synthetic appointment store of each size and for each file,
+    using copies in a temporary directory that is removed afterwards.
+
+    Args:
+        - sizes (Sequence[int]): The numbers of appointments in the synthetic stores.
+        - files (Sequence[Path]): Other JSONL files, e.g., the Q&A test data.
+        - backends (Sequence[str]): The backends to compare. Default: all of `json_backend_names()`.
+        - repeat (int): The number of runs of each measure, of which the best is reported.
+        - seed (int): The seed for the synthetic data, so runs use the same data.
+        - logger (logging.Logger | None): For progress messages.
+
+    Returns:
+        A dictionary with the run's settings, platform information, and a list with the
+        results for each dataset, suitable for writing as JSON.
+    """
+    backends = list(backends or json_backend_names())
+    results = []
+    with tempfile.TemporaryDirectory() as work_dir:
+        datasets = []
+        for size in sizes:
+            path = Path(work_dir) / f"appointments-{size}.jsonl"
+            # Write the store with the stdlib, so every backend reads the same text.
+            previous = set_json_backend("json")
+            try:
+                SyntheticCalendar(size, seed).write(path)
+            finally:
+                set_json_backend(previous.name)
+            datasets.append((path.name, path))
+        for i, file in enumerate(files):
+            path = Path(work_dir) / f"{i}-{Path(file).name}"
+            shutil.copyfile(file, path)
+            datasets.append((str(file), path))
+        for name, path in datasets:
+            if logger:
+                logger.info(f"Benchmarking the JSON backends {backends} on {name}")
+            results.append(benchmark_file(name, path, backends, repeat))
+    return {
+        "benchmark": "json",
+        "version": RESULTS_VERSION,
+        "timestamp": now().isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "settings": {"backends": backends, "repeat": repeat, "seed": seed},
+        "results": results,
+    }
+
+
+def format_results(results: Mapping[str, Any]) -> str:
+    """A plain-text table of the results, one row per dataset and measure, with each backend's speedup."""
+    backends = results["settings"]["backends"]
+    header = f"{'dataset':<40} {'lines':>8}  {'measure':<8}" + "".join(f" {name + ' ms':>12}" for name in backends)
+    lines = [header + "".join(f" {name + ' x':>10}" for name in backends[1:])]
+    for result in results["results"]:
+        seconds = result["seconds"]
+        for measure in MEASURES:
+            reference = seconds[backends[0]][measure]
+            row = f"{result['dataset'][-40:]:<40} {result['lines']:>8}  {measure:<8}"
+            row += "".join(f" {seconds[name][measure] * 1e3:>12.2f}" for name in backends)
+            row += "".join(f" {reference / max(seconds[name][measure], 1e-9):>10.2f}" for name in backends[1:])
+            lines.append(row)
+        for name, count in result["mismatches"].items():
+            if count:
+                lines.append(f"{result['dataset'][-40:]:<40} MISMATCHES with {name}: {count}")
+    return "\n".join(lines)
@@ -0,0 +1,104 @@
+import json
+import os
+import sys
+from pathlib import Path
+
+from common.jsonl_integrity import DEFAULT_CHUNK_BYTES, CheckOptions, check_store, format_report, repair_store
+from common.utils import tool_setup
+
+
+def main():
+
+    tool = os.path.basename(__file__)
+    description = (
+        "Check a JSONL resource store, e.g., of appointments, in parallel for malformed lines, records "
+        "without ids, duplicate ids, slot conflicts, and superseded versions, and optionally write a repaired, "
+        "compacted copy. Exits with status 1 if problems were found."
+    )
+    defaults = CheckOptions()
+
+    def add_args(parser):
+        parser.add_argument("store", help="The JSONL storage file to check.")
+        parser.add_argument(
+            "-o",
+            "--repair-output",
+            default="",
+            help="Write the live records to this file, which may be the store itself. "
+            "Malformed lines and records without ids are written to the file with '.rejected' appended.",
+        )
+        parser.add_argument("-r", "--report-file", default="", help="Where to write the report as JSON.")
+        parser.add_argument(
+            "-w", "--workers", type=int, default=0, help="The number of worker processes. Default: the CPU count."
+        )
+        parser.add_argument(
+            "--chunk-mb",
+            type=float,
+            default=DEFAULT_CHUNK_BYTES / (1024 * 1024),
+            help=f"The megabytes scanned by each worker task. Default: {DEFAULT_CHUNK_BYTES // (1024 * 1024)}.",
+        )
+        parser.add_argument("--id-key", default=defaults.id_key, help=f"Default: {defaults.id_key}.")
+        parser.add_argument(
+            "--slot-key",
+            default=defaults.slot_key,
+            help=f"The datetime field that must be unique per scope, or '' for none. Default: {defaults.slot_key}.",
+        )
+        parser.add_argument(
+            "--scope-key",
+            default=defaults.scope_key,
+            help=f"The field whose values have separate slots, or '' for none. Default: {defaults.scope_key}.",
+        )
+        parser.add_argument(
+            "--default-scope",
+            default=defaults.default_scope,
+            help="The scope of records without a scope value, e.g., the first provider. Default: ''.",
+        )
+        parser.add_argument(
+            "--created-key",
+            default=defaults.created_key,
+            help=f"The field that identifies a resource across versions, or '' for none. Default: {defaults.created_key}.",
+        )
+        parser.add_argument(
+            "--inactive",
+            default=f"{defaults.inactive_key}={','.join(defaults.inactive_values)}",
+            help="KEY=VALUE[,VALUE...] for records that don't reserve slots, or '' for none. "
+            f"Default: {defaults.inactive_key}={','.join(defaults.inactive_values)}.",
+        )
+        parser.add_argument("--max-items", type=int, default=20, help="The problems of each kind printed. Default: 20.")
+
+    args, logger = tool_setup(
+        tool,
+        description,
+        add_arguments=add_args,
+        omit_arguments={"model", "service-url", "template-dir", "data-dir", "output-dir", "use-cases"},
+    )
+
+    inactive_key, _, inactive_values = args.inactive.partition("=")
+    options = CheckOptions(
+        id_key=args.id_key,
+        slot_key=args.slot_key,
+        scope_key=args.scope_key,
+        default_scope=args.default_scope,
+        created_key=args.created_key,
+        inactive_key=inactive_key,
+        inactive_values=tuple(value for value in inactive_values.split(",") if value),
+    )
+    logger.info(f"Checking {args.store} with options {options}")
+    report = check_store(
+        args.store, options, workers=args.workers or None, chunk_bytes=int(args.chunk_mb * 1024 * 1024)
+    )
+    print(format_report(report, args.max_items))
+    if args.report_file:
+        report_file = Path(args.report_file)
+        report_file.parent.mkdir(parents=True, exist_ok=True)
+        report_file.write_text(json.dumps(report.to_dict(), indent=2))
+        print(f"Wrote the report to {report_file}.")
+    if args.repair_output:
+        written, rejected = repair_store(report, args.repair_output)
+        print(f"Wrote {written} live records to {args.repair_output} and rejected {rejected} lines.")
+        logger.info(f"Repaired {args.store} to {args.repair_output}: {written} records, {rejected} rejected")
+    if not report.ok:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,46 @@
+import os
+
+from common.persistent_storage import copy_records, open_storage, sqlite_suffixes
+from common.utils import tool_setup
+
+
+def main():
+
+    tool = os.path.basename(__file__)
+    description = "Copy the live resource records, e.g., appointments, between JSONL and SQLite storage."
+    suffixes = ", ".join(sorted(sqlite_suffixes))
+
+    def add_args(parser):
+        parser.add_argument("source", help=f"The storage to read. Files ending with {suffixes} are SQLite.")
+        parser.add_argument("target", help="The storage to replace with the source records.")
+        parser.add_argument(
+            "-i",
+            "--indexed-fields",
+            nargs="*",
+            default=["patient_name", "status", "appointment_date_time"],
+            help="Fields stored in indexed columns when the target is SQLite. Default: the appointment fields.",
+        )
+        parser.add_argument(
+            "-p",
+            "--partition-key",
+            default="",
+            help="If given, the target is a directory of monthly JSONL partitions of this datetime field.",
+        )
+
+    args, logger = tool_setup(
+        tool,
+        description,
+        add_arguments=add_args,
+        omit_arguments={"model", "service-url", "template-dir", "data-dir", "output-dir", "use-cases"},
+    )
+
+    source = open_storage(args.source, logger, indexed_fields=args.indexed_fields)
+    target = open_storage(args.target, logger, indexed_fields=args.indexed_fields, partition_key=args.partition_key)
+    count, errors = copy_records(source, target)
+    print(f"Copied {count} records from {args.source} to {args.target}.")
+    if errors:
+        print(f"WARNING: {len(errors)} source records failed to parse and were not copied. See {args.log_file}.")
+
+
+if __name__ == "__main__":
+    main()